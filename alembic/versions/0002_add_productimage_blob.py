@@ -0,0 +1,31 @@
+"""store category images in the database
+
+product_images.data/filename/content_type are already part of the 0001
+baseline; this adds the matching blob columns on categories.
+
+Revision ID: 0002_add_productimage_blob
+Revises: 0001_initial
+Create Date: 2025-09-02
+"""
+from alembic import op
+import sqlalchemy as sa
+import os
+
+revision = '0002_add_productimage_blob'
+down_revision = '0001_initial'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    op.add_column('categories', sa.Column('image_data', sa.LargeBinary), schema=shop_schema)
+    op.add_column('categories', sa.Column('image_content_type', sa.String(100)), schema=shop_schema)
+    op.add_column('categories', sa.Column('image_filename', sa.String(255)), schema=shop_schema)
+
+
+def downgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    op.drop_column('categories', 'image_filename', schema=shop_schema)
+    op.drop_column('categories', 'image_content_type', schema=shop_schema)
+    op.drop_column('categories', 'image_data', schema=shop_schema)
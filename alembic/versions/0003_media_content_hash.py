@@ -0,0 +1,27 @@
+"""content hashes for DB-stored images (HTTP ETags)
+
+Revision ID: 0003_media_content_hash
+Revises: 0002_add_productimage_blob
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+import os
+
+revision = '0003_media_content_hash'
+down_revision = '0002_add_productimage_blob'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    op.add_column('product_images', sa.Column('content_hash', sa.String(64)), schema=shop_schema)
+    op.add_column('categories', sa.Column('image_hash', sa.String(64)), schema=shop_schema)
+    # Existing rows are hashed lazily on first request by app/utils/media_http.py
+
+
+def downgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    op.drop_column('categories', 'image_hash', schema=shop_schema)
+    op.drop_column('product_images', 'content_hash', schema=shop_schema)
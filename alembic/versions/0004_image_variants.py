@@ -0,0 +1,40 @@
+"""image variants (responsive widths / modern formats)
+
+Revision ID: 0004_image_variants
+Revises: 0003_media_content_hash
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+import os
+
+revision = '0004_image_variants'
+down_revision = '0003_media_content_hash'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    op.create_table(
+        'image_variants',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('source_hash', sa.String(64), nullable=False),
+        sa.Column('width', sa.Integer, nullable=False),
+        sa.Column('height', sa.Integer),
+        sa.Column('format', sa.String(10), nullable=False),
+        sa.Column('content_type', sa.String(100), nullable=False),
+        sa.Column('data', sa.LargeBinary, nullable=False),
+        sa.Column('content_hash', sa.String(64), nullable=False),
+        sa.Column('size', sa.Integer),
+        sa.Column('created_at', sa.DateTime),
+        sa.UniqueConstraint('source_hash', 'width', 'format', name='uq_image_variant'),
+        schema=shop_schema,
+    )
+    op.create_index('ix_image_variants_source_hash', 'image_variants', ['source_hash'], schema=shop_schema)
+
+
+def downgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    op.drop_index('ix_image_variants_source_hash', table_name='image_variants', schema=shop_schema)
+    op.drop_table('image_variants', schema=shop_schema)
@@ -0,0 +1,37 @@
+"""background job queue
+
+Revision ID: 0005_background_jobs
+Revises: 0004_image_variants
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005_background_jobs'
+down_revision = '0004_image_variants'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'background_jobs',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('kind', sa.String(64), nullable=False),
+        sa.Column('payload', sa.Text, nullable=False),
+        sa.Column('status', sa.String(16), nullable=False),
+        sa.Column('attempts', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('max_attempts', sa.Integer, nullable=False, server_default='5'),
+        sa.Column('run_at', sa.DateTime, nullable=False),
+        sa.Column('locked_at', sa.DateTime),
+        sa.Column('locked_by', sa.String(64)),
+        sa.Column('last_error', sa.Text),
+        sa.Column('created_at', sa.DateTime),
+        sa.Column('finished_at', sa.DateTime),
+    )
+    op.create_index('ix_background_jobs_status_run_at', 'background_jobs', ['status', 'run_at'])
+
+
+def downgrade():
+    op.drop_index('ix_background_jobs_status_run_at', table_name='background_jobs')
+    op.drop_table('background_jobs')
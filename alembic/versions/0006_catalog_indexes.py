@@ -0,0 +1,37 @@
+"""catalog keyset pagination indexes
+
+Revision ID: 0006_catalog_indexes
+Revises: 0005_background_jobs
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+import os
+
+revision = '0006_catalog_indexes'
+down_revision = '0005_background_jobs'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_products_active_category_name': ['is_active', 'category_id', 'name', 'id'],
+    'ix_products_active_category_price': ['is_active', 'category_id', 'price', 'id'],
+    'ix_products_active_category_created': ['is_active', 'category_id', 'created_at', 'id'],
+}
+
+
+def upgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    table = f'{shop_schema}.products' if shop_schema else 'products'
+    # Keyset cursors compare against created_at, so it must never be NULL
+    op.execute(sa.text(
+        f"UPDATE {table} SET created_at = COALESCE(updated_at, CURRENT_TIMESTAMP) WHERE created_at IS NULL"
+    ))
+    for name, columns in INDEXES.items():
+        op.create_index(name, 'products', columns, schema=shop_schema)
+
+
+def downgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    for name in INDEXES:
+        op.drop_index(name, table_name='products', schema=shop_schema)
@@ -0,0 +1,74 @@
+"""full-text product search (tsvector + GIN on PostgreSQL, FTS5 on SQLite)
+
+Revision ID: 0007_product_search
+Revises: 0006_catalog_indexes
+Create Date: 2026-10-17
+"""
+from alembic import op
+import os
+
+revision = '0007_product_search'
+down_revision = '0006_catalog_indexes'
+branch_labels = None
+depends_on = None
+
+# Each text is indexed unstemmed ('simple', also used for Ukrainian) and with
+# the English and German stemmers; see app/services/search.py
+CONFIGS = ('simple', 'english', 'german')
+
+
+def _vector(columns_by_weight):
+    parts = []
+    for weight, columns in columns_by_weight:
+        document = " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+        for config in CONFIGS:
+            parts.append(f"setweight(to_tsvector('{config}'::regconfig, {document}), '{weight}')")
+    return ' || '.join(parts)
+
+
+PRODUCT_VECTOR = _vector([('A', ['name', 'sku']), ('B', ['short_description']), ('C', ['description'])])
+CATEGORY_VECTOR = _vector([('A', ['name'])])
+
+FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS product_search USING fts5("
+    "name, sku, short_description, description, category, "
+    "tokenize = 'porter unicode61 remove_diacritics 2')"
+)
+
+
+def _prefix():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    return f'{shop_schema}.' if shop_schema else ''
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    prefix = _prefix()
+    products, categories = f'{prefix}products', f'{prefix}categories'
+    if dialect == 'postgresql':
+        op.execute(f"ALTER TABLE {products} ADD COLUMN search_vector tsvector "
+                   f"GENERATED ALWAYS AS ({PRODUCT_VECTOR}) STORED")
+        op.execute(f"ALTER TABLE {categories} ADD COLUMN search_vector tsvector "
+                   f"GENERATED ALWAYS AS ({CATEGORY_VECTOR}) STORED")
+        op.execute(f"CREATE INDEX ix_products_search_vector ON {products} USING GIN (search_vector)")
+        op.execute(f"CREATE INDEX ix_categories_search_vector ON {categories} USING GIN (search_vector)")
+    elif dialect == 'sqlite':
+        op.execute(FTS_DDL)
+        op.execute(
+            "INSERT INTO product_search (rowid, name, sku, short_description, description, category) "
+            "SELECT p.id, p.name, p.sku, p.short_description, p.description, c.name "
+            "FROM products p LEFT JOIN categories c ON c.id = p.category_id"
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    prefix = _prefix()
+    products, categories = f'{prefix}products', f'{prefix}categories'
+    if dialect == 'postgresql':
+        op.execute(f"DROP INDEX IF EXISTS {prefix}ix_categories_search_vector")
+        op.execute(f"DROP INDEX IF EXISTS {prefix}ix_products_search_vector")
+        op.execute(f"ALTER TABLE {categories} DROP COLUMN IF EXISTS search_vector")
+        op.execute(f"ALTER TABLE {products} DROP COLUMN IF EXISTS search_vector")
+    elif dialect == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS product_search")
@@ -0,0 +1,45 @@
+"""product rating aggregates (review_count, rating_sum, rating_avg)
+
+Revision ID: 0008_product_rating_aggregates
+Revises: 0007_product_search
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+import os
+
+revision = '0008_product_rating_aggregates'
+down_revision = '0007_product_search'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    prefix = f'{shop_schema}.' if shop_schema else ''
+    op.add_column('products', sa.Column('review_count', sa.Integer(), nullable=False, server_default='0'), schema=shop_schema)
+    op.add_column('products', sa.Column('rating_sum', sa.Integer(), nullable=False, server_default='0'), schema=shop_schema)
+    op.add_column('products', sa.Column('rating_avg', sa.Float(), nullable=False, server_default='0'), schema=shop_schema)
+    op.create_index('ix_product_reviews_product_approved', 'product_reviews',
+                    ['product_id', 'is_approved'], schema=shop_schema)
+
+    # Backfill from approved reviews; afterwards ProductReview events keep them current
+    approved = (f"FROM {prefix}product_reviews r WHERE r.product_id = {prefix}products.id "
+                f"AND r.is_approved = :approved")
+    op.execute(sa.text(
+        f"UPDATE {prefix}products SET "
+        f"review_count = (SELECT COUNT(*) {approved}), "
+        f"rating_sum = (SELECT COALESCE(SUM(r.rating), 0) {approved}), "
+        f"rating_avg = (SELECT COALESCE(AVG(r.rating * 1.0), 0) {approved})"
+    ).bindparams(approved=True))
+    op.create_index('ix_products_active_category_rating', 'products',
+                    ['is_active', 'category_id', 'rating_avg', 'id'], schema=shop_schema)
+
+
+def downgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    op.drop_index('ix_products_active_category_rating', table_name='products', schema=shop_schema)
+    op.drop_index('ix_product_reviews_product_approved', table_name='product_reviews', schema=shop_schema)
+    op.drop_column('products', 'rating_avg', schema=shop_schema)
+    op.drop_column('products', 'rating_sum', schema=shop_schema)
+    op.drop_column('products', 'review_count', schema=shop_schema)
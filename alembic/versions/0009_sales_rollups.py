@@ -0,0 +1,84 @@
+"""sales rollup tables for the admin dashboards
+
+Revision ID: 0009_sales_rollups
+Revises: 0008_product_rating_aggregates
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+import os
+
+revision = '0009_sales_rollups'
+down_revision = '0008_product_rating_aggregates'
+branch_labels = None
+depends_on = None
+
+
+def _bucket(dialect, unit, column):
+    # Same values app/services/rollups.py writes (start of the UTC hour/day)
+    if dialect == 'postgresql':
+        return f"date_trunc('{unit}', {column})"
+    pattern = '%Y-%m-%d %H:00:00.000000' if unit == 'hour' else '%Y-%m-%d 00:00:00.000000'
+    return f"strftime('{pattern}', {column})"
+
+
+def upgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    prefix = f'{shop_schema}.' if shop_schema else ''
+    dialect = op.get_bind().dialect.name
+
+    op.create_table(
+        'order_rollups',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('granularity', sa.String(8), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('order_status', sa.String(32), nullable=False, server_default=''),
+        sa.Column('payment_status', sa.String(32), nullable=False, server_default=''),
+        sa.Column('order_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('revenue', sa.Float(), nullable=False, server_default='0'),
+        sa.UniqueConstraint('granularity', 'bucket_start', 'order_status', 'payment_status',
+                            name='uq_order_rollups_cell'),
+        schema=shop_schema,
+    )
+    op.create_table(
+        'product_sales_rollups',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('units', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('revenue', sa.Float(), nullable=False, server_default='0'),
+        sa.UniqueConstraint('bucket_start', 'product_id', name='uq_product_sales_rollups_cell'),
+        schema=shop_schema,
+    )
+    op.create_index('ix_product_sales_rollups_product', 'product_sales_rollups', ['product_id'],
+                    schema=shop_schema)
+
+    op.create_index('ix_orders_created_at', 'orders', ['created_at'], schema=shop_schema)
+
+    # Backfill from the existing orders; afterwards the ORM events keep them current
+    status_type = '::text' if dialect == 'postgresql' else ''
+    for unit in ('hour', 'day'):
+        bucket = _bucket(dialect, unit, 'created_at')
+        op.execute(
+            f"INSERT INTO {prefix}order_rollups "
+            f"(granularity, bucket_start, order_status, payment_status, order_count, revenue) "
+            f"SELECT '{unit}', {bucket}, COALESCE(order_status{status_type}, ''), "
+            f"COALESCE(payment_status{status_type}, ''), COUNT(*), COALESCE(SUM(total), 0) "
+            f"FROM {prefix}orders WHERE created_at IS NOT NULL "
+            f"GROUP BY {bucket}, COALESCE(order_status{status_type}, ''), COALESCE(payment_status{status_type}, '')"
+        )
+    bucket = _bucket(dialect, 'day', 'o.created_at')
+    op.execute(
+        f"INSERT INTO {prefix}product_sales_rollups (bucket_start, product_id, units, revenue) "
+        f"SELECT {bucket}, COALESCE(i.product_id, 0), COALESCE(SUM(i.quantity), 0), COALESCE(SUM(i.total_price), 0) "
+        f"FROM {prefix}order_items i JOIN {prefix}orders o ON o.id = i.order_id "
+        f"WHERE o.created_at IS NOT NULL GROUP BY {bucket}, COALESCE(i.product_id, 0)"
+    )
+
+
+def downgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    op.drop_index('ix_product_sales_rollups_product', table_name='product_sales_rollups', schema=shop_schema)
+    op.drop_table('product_sales_rollups', schema=shop_schema)
+    op.drop_table('order_rollups', schema=shop_schema)
+    op.drop_index('ix_orders_created_at', table_name='orders', schema=shop_schema)
@@ -0,0 +1,28 @@
+"""server-side session table (SESSION_BACKEND=sql)
+
+Revision ID: 0010_http_sessions
+Revises: 0009_sales_rollups
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0010_http_sessions'
+down_revision = '0009_sales_rollups'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'http_sessions',
+        sa.Column('id', sa.String(64), primary_key=True),
+        sa.Column('data', sa.Text(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_http_sessions_expires_at', 'http_sessions', ['expires_at'])
+
+
+def downgrade():
+    op.drop_index('ix_http_sessions_expires_at', table_name='http_sessions')
+    op.drop_table('http_sessions')
@@ -0,0 +1,48 @@
+"""stock reservations for unpaid orders
+
+Revision ID: 0011_stock_reservations
+Revises: 0010_http_sessions
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+import os
+
+revision = '0011_stock_reservations'
+down_revision = '0010_http_sessions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    prefix = f'{shop_schema}.' if shop_schema else ''
+    op.create_table(
+        'stock_reservations',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('order_id', sa.Integer(), sa.ForeignKey(f'{prefix}orders.id'), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(16), nullable=False, server_default='held'),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column('released_at', sa.DateTime()),
+        sa.Column('release_reason', sa.String(32)),
+        sa.UniqueConstraint('order_id', 'product_id', name='uq_stock_reservations_order_product'),
+        schema=shop_schema,
+    )
+    op.create_index('ix_stock_reservations_status_expires', 'stock_reservations', ['status', 'expires_at'],
+                    schema=shop_schema)
+
+    # Stock was never enforced before, and products.stock had default=0, which
+    # also fired for Product(stock=None): a product that was never sold holds
+    # 0 and one sold without a count went negative. Neither was really
+    # stock-tracked, so both become unlimited. Positive counts were entered by
+    # an admin and are kept.
+    op.execute(f"UPDATE {prefix}products SET stock = NULL WHERE stock <= 0")
+
+
+def downgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    op.drop_index('ix_stock_reservations_status_expires', table_name='stock_reservations', schema=shop_schema)
+    op.drop_table('stock_reservations', schema=shop_schema)
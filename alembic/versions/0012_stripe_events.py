@@ -0,0 +1,41 @@
+"""stripe webhook events, deduplicated by event id
+
+Revision ID: 0012_stripe_events
+Revises: 0011_stock_reservations
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+import os
+
+revision = '0012_stripe_events'
+down_revision = '0011_stock_reservations'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    op.create_table(
+        'stripe_events',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('event_id', sa.String(255), nullable=False),
+        sa.Column('type', sa.String(100), nullable=False),
+        sa.Column('stripe_created', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('livemode', sa.Boolean(), server_default=sa.false()),
+        sa.Column('order_id', sa.Integer()),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(16), nullable=False, server_default='received'),
+        sa.Column('received_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column('processed_at', sa.DateTime()),
+        sa.Column('last_error', sa.Text()),
+        sa.UniqueConstraint('event_id', name='uq_stripe_events_event_id'),
+        schema=shop_schema,
+    )
+    op.create_index('ix_stripe_events_order_status', 'stripe_events', ['order_id', 'status'], schema=shop_schema)
+
+
+def downgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    op.drop_index('ix_stripe_events_order_status', table_name='stripe_events', schema=shop_schema)
+    op.drop_table('stripe_events', schema=shop_schema)
@@ -0,0 +1,98 @@
+"""image bytes moved from categories / product_images into media_blobs
+
+Revision ID: 0013_media_blobs
+Revises: 0012_stripe_events
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+import os
+
+revision = '0013_media_blobs'
+down_revision = '0012_stripe_events'
+branch_labels = None
+depends_on = None
+
+BATCH = 50
+
+# (table, legacy bytes column, new blob id column)
+OWNERS = [
+    ('categories', 'image_data', 'image_blob_id'),
+    ('product_images', 'data', 'blob_id'),
+]
+
+
+def _tables(shop_schema):
+    metadata = sa.MetaData(schema=shop_schema)
+    blobs = sa.Table('media_blobs', metadata,
+                     sa.Column('id', sa.Integer, primary_key=True),
+                     sa.Column('data', sa.LargeBinary),
+                     sa.Column('size', sa.Integer),
+                     sa.Column('created_at', sa.DateTime))
+    owners = {
+        table: sa.Table(table, metadata,
+                        sa.Column('id', sa.Integer, primary_key=True),
+                        sa.Column(data_column, sa.LargeBinary),
+                        sa.Column(blob_column, sa.Integer))
+        for table, data_column, blob_column in OWNERS
+    }
+    return blobs, owners
+
+
+def upgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    op.create_table(
+        'media_blobs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('size', sa.Integer()),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+        schema=shop_schema,
+    )
+    for table, _, blob_column in OWNERS:
+        with op.batch_alter_table(table, schema=shop_schema) as batch:
+            batch.add_column(sa.Column(blob_column, sa.Integer()))
+            batch.create_foreign_key(f'fk_{table}_{blob_column}', 'media_blobs', [blob_column], ['id'],
+                                     referent_schema=shop_schema)
+
+    # Move the bytes a batch at a time: one row's blob is in memory, not the table's
+    conn = op.get_bind()
+    blobs, owners = _tables(shop_schema)
+    for table, data_column, blob_column in OWNERS:
+        owner = owners[table]
+        data, blob_id = owner.c[data_column], owner.c[blob_column]
+        while True:
+            ids = conn.execute(sa.select(owner.c.id).where(data.isnot(None), blob_id.is_(None))
+                               .order_by(owner.c.id).limit(BATCH)).scalars().all()
+            if not ids:
+                break
+            for row_id in ids:
+                value = conn.execute(sa.select(data).where(owner.c.id == row_id)).scalar()
+                new_id = conn.execute(blobs.insert().values(data=value, size=len(value),
+                                                            created_at=sa.func.now())).inserted_primary_key[0]
+                conn.execute(owner.update().where(owner.c.id == row_id).values({blob_column: new_id}))
+
+    for table, data_column, _ in OWNERS:
+        with op.batch_alter_table(table, schema=shop_schema) as batch:
+            batch.drop_column(data_column)
+
+
+def downgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    for table, data_column, _ in OWNERS:
+        with op.batch_alter_table(table, schema=shop_schema) as batch:
+            batch.add_column(sa.Column(data_column, sa.LargeBinary()))
+
+    conn = op.get_bind()
+    blobs, owners = _tables(shop_schema)
+    for table, data_column, blob_column in OWNERS:
+        owner = owners[table]
+        blob_id = owner.c[blob_column]
+        copy = sa.select(blobs.c.data).where(blobs.c.id == blob_id).scalar_subquery()
+        conn.execute(owner.update().where(blob_id.isnot(None)).values({data_column: copy}))
+
+    for table, _, blob_column in OWNERS:
+        with op.batch_alter_table(table, schema=shop_schema) as batch:
+            batch.drop_constraint(f'fk_{table}_{blob_column}', type_='foreignkey')
+            batch.drop_column(blob_column)
+    op.drop_table('media_blobs', schema=shop_schema)
@@ -0,0 +1,35 @@
+"""keyset indexes for the catalog listing without a category filter
+
+Revision ID: 0014_catalog_listing_indexes
+Revises: 0013_media_blobs
+Create Date: 2026-10-18
+"""
+from alembic import op
+import os
+
+revision = '0014_catalog_listing_indexes'
+down_revision = '0013_media_blobs'
+branch_labels = None
+depends_on = None
+
+# The (is_active, category_id, ...) indexes of 0006 / 0008 cannot order
+# the unfiltered /shop/products listing, which needed a sort over every
+# active product
+INDEXES = {
+    'ix_products_active_name': ['is_active', 'name', 'id'],
+    'ix_products_active_price': ['is_active', 'price', 'id'],
+    'ix_products_active_created': ['is_active', 'created_at', 'id'],
+    'ix_products_active_rating': ['is_active', 'rating_avg', 'id'],
+}
+
+
+def upgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    for name, columns in INDEXES.items():
+        op.create_index(name, 'products', columns, schema=shop_schema)
+
+
+def downgrade():
+    shop_schema = os.environ.get('POSTGRES_SCHEMA_SHOP')
+    for name in INDEXES:
+        op.drop_index(name, table_name='products', schema=shop_schema)
@@ -35,7 +35,6 @@ if current_dir not in sys.path:
 # Import config
 sys.path.append(parent_dir)
 from config import Config
-from sqlalchemy import text
 
 def create_app():
     app = Flask(__name__)
@@ -69,9 +68,12 @@ def create_app():
     init_db(app)
     logger.info("Database initialized (pg8000 fallback enabled)")
 
+    # Schema/table setup as an explicit per-deploy command (flask bootstrap run)
+    from app.services.bootstrap import init_bootstrap
+    init_bootstrap(app)
+
     from flask_login import LoginManager, current_user
     from flask_wtf import CSRFProtect, csrf
-    from flask_session import Session
 
     # Initialize Flask-Login so `current_user` is available in templates
     login_manager = LoginManager()
@@ -79,17 +81,13 @@ def create_app():
     login_manager.login_message_category = 'info'
     login_manager.init_app(app)
 
-    # Initialize Flask-Session
-    Session(app)
+    # Session storage selected by SESSION_BACKEND (app/utils/session_store.py)
+    from app.utils.session_store import init_sessions
+    init_sessions(app)
 
-    @login_manager.user_loader
-    def load_user(user_id):
-        # Import here to avoid circular imports at module import time
-        from app.models.user import User
-        try:
-            return User.query.get(int(user_id))
-        except Exception:
-            return None
+    # Session-cached identity columns instead of the full User (app/utils/identity.py)
+    from app.utils.identity import init_identity
+    init_identity(app, login_manager)
 
     # Ensure `current_user` is available in Jinja templates
     @app.context_processor
@@ -103,16 +101,13 @@ def create_app():
     # Expose helper to templates
     app.jinja_env.globals['csrf_token'] = lambda: csrf.generate_csrf()
 
-    # Inject cart count into templates
+    # Inject cart count into templates: resolved lazily, only when a template renders it,
+    # from a session-cached value (no query or cart row on ordinary page views)
+    from app.utils.cart_summary import LazyCartCount
+
     @app.context_processor
     def inject_cart_count():
-        try:
-            from app.routes.shop import get_cart
-            cart = get_cart()
-            count = sum(item.quantity for item in cart.items) if cart and cart.items else 0
-        except Exception:
-            count = 0
-        return {'cart_count': count}
+        return {'cart_count': LazyCartCount()}
 
     # Проверяем, нужно ли создать схему в PostgreSQL
     schema = app.config.get('POSTGRES_SCHEMA')
@@ -124,47 +119,69 @@ def create_app():
     # Import and register routes after app creation
     from app.routes import register_routes
     register_routes(app)
+    # Stripe signs its webhook requests; they carry no CSRF token
+    csrf_protect.exempt('app.routes.shop.stripe_webhook')
+    csrf_protect.exempt('app.routes.stripe_webhooks.stripe_webhook')
     
     from .i18n import register_i18n
     register_i18n(app)
 
+    # {% cache %} blocks for product cards and detail sections (app/utils/fragment_cache.py)
+    from app.utils.fragment_cache import init_fragment_cache
+    init_fragment_cache(app)
+
     # Safety hook: rollback aborted transactions & remove session each request
     from app.models.database import db as _db_session
 
-    @app.before_request
-    def ensure_db_session_clean():
-        """Proactively clear aborted (25P02) transaction state or broken connection before handlers.
-        If a simple SELECT fails twice, dispose engine to force new connections."""
-        try:
-            _db_session.session.execute(text('SELECT 1'))
-        except Exception as e:
-            logger.warning(f"Pre-request DB check failed (will rollback): {e}")
-            try:
-                _db_session.session.rollback()
-            except Exception as e_inner:
-                logger.warning(f"Failed to rollback: {e_inner}")
-                pass
-        
-            # Try a new session entirely
-            try:
-                _db_session.session.remove()
-            except Exception:
-                pass
-            
-            try:
-                # Second attempt with fresh session
-                _db_session.session.execute(text('SELECT 1'))
-            except Exception as e2:
-                logger.error(f"DB still unhealthy; disposing engine: {e2}")
-                try:
-                    # Force all connections to be recycled
-                    engine = _db_session.get_engine()
-                    engine.dispose()
-                    # Create a fresh session
-                    _db_session.session = _db_session.create_scoped_session()
-                except Exception as e3:
-                    logger.error(f"Failed to dispose engine: {e3}")
-                    pass
+    # Idle-aware connection health: no per-request SELECT 1, only stale pool
+    # connections are pinged on checkout (see app/utils/db_health.py)
+    from app.utils.db_health import init_db_health
+    init_db_health(app, _db_session)
+
+    # Cached readiness checks and the schema drift job (app/utils/health.py)
+    from app.utils.health import init_health
+    init_health(app)
+
+    # Sampled per-request query counts, N+1 warnings and budgets (app/utils/query_stats.py)
+    from app.utils.query_stats import init_query_stats
+    init_query_stats(app, _db_session)
+
+    # Prometheus /metrics: request, DB, outbound call and image byte series (app/utils/metrics.py)
+    from app.utils.metrics import init_metrics
+    init_metrics(app, _db_session)
+
+    # Content-addressed disk cache for DB-stored images (app/utils/media_cache.py)
+    from app.utils.media_cache import init_media_cache
+    init_media_cache(app)
+
+    # Durable background jobs (Telegram, project bootstrap): app/services/job_queue.py
+    from app.services.job_queue import init_job_queue
+    init_job_queue(app)
+
+    # Product full-text search CLI (app/services/search.py)
+    from app.services.search import init_search
+    init_search(app)
+
+    # Catalog maintenance CLI, e.g. rating aggregate backfill (app/services/catalog.py)
+    from app.services.catalog import init_catalog
+    init_catalog(app)
+
+    # Sales rollups for the admin dashboards: catch-up job and CLI (app/services/rollups.py)
+    from app.services.rollups import init_rollups
+    init_rollups(app)
+
+    # Stock reservations of unpaid orders: expiry job and CLI (app/services/stock.py)
+    from app.services.stock import init_stock
+    init_stock(app)
+
+    # Stripe webhook events: stored by the webhook routes, applied by a job (app/services/stripe_events.py)
+    from app.services.stripe_events import init_stripe_events
+    init_stripe_events(app)
+
+    # Background transcription for voice messages (app/services/voice_pipeline.py)
+    from app.services.voice_pipeline import init_voice_pipeline
+    init_voice_pipeline(app)
+
     @app.teardown_request
     def cleanup_session(exc):  # exc is None if no exception
         try:
@@ -180,87 +197,65 @@ def create_app():
         except Exception:
             pass
             
-    # Add health check endpoint
+    # Probes: /livez never touches the database, /readyz and /health serve the
+    # cached deep checks (app/utils/health.py)
+    from app.utils.db_health import db_exempt
+    from app.utils.health import get_health_checker
+
+    @app.route('/livez')
+    @db_exempt
+    def liveness():
+        from flask import jsonify
+        return jsonify({"status": "ok"})
+
+    @app.route('/readyz')
+    @db_exempt
+    def readiness():
+        from flask import jsonify
+        ready, result = get_health_checker(app).readiness()
+        return jsonify(result), 200 if ready else 503
+
     @app.route('/health')
+    @db_exempt
     def health_check():
-        """Health check endpoint that verifies database connectivity"""
+        """Cached readiness plus per-process stats; no queries of its own"""
         from flask import jsonify
         import time
+
+        ready, health_data = get_health_checker(app).readiness()
+        health_data["timestamp"] = int(time.time())
+        health_data["checker"] = get_health_checker(app).snapshot()
         
-        health_data = {
-            "status": "ok",
-            "database": "ok",
-            "details": {},
-            "pool": {},
-            "timestamp": int(time.time())
-        }
+        # Media cache effectiveness (per worker process)
+        from app.utils.media_cache import get_media_cache
+        media_cache = get_media_cache(app)
+        if media_cache is not None:
+            health_data["media_cache"] = media_cache.snapshot()
         
-        # Check engine stats
-        try:
-            engine = _db_session.get_engine()
-            if hasattr(engine.pool, "status"):
-                health_data["pool"]["checkedin"] = engine.pool.status().checkedin
-                health_data["pool"]["checkedout"] = engine.pool.status().checkedout
-                health_data["pool"]["size"] = engine.pool.size()
-                health_data["pool"]["overflow"] = engine.pool.overflow()
-            else:
-                health_data["pool"]["type"] = str(type(engine.pool))
-        except Exception as e:
-            health_data["details"]["pool_error"] = str(e)
+        # Chat turn latency (time to first token / total)
+        from app.services.chat_engine import get_chat_metrics
+        health_data["chat"] = get_chat_metrics().snapshot()
+        from app.services.chat_memory import get_response_cache
+        health_data["chat_cache"] = get_response_cache(app).snapshot()
+        from app.services.voice_pipeline import get_voice_pipeline
+        voice_pipeline = get_voice_pipeline(app)
+        if voice_pipeline is not None:
+            health_data["voice"] = voice_pipeline.snapshot()
         
-        # Check database connection
-        try:
-            # Simple query to check db connection
-            start_time = time.time()
-            result = _db_session.session.execute(text('SELECT 1 as test_value'))
-            value = result.scalar()
-            query_time = time.time() - start_time
-            health_data["details"]["query_time_ms"] = round(query_time * 1000, 2)
-            
-            if value != 1:
-                health_data["database"] = "error"
-                health_data["status"] = "error" 
-                health_data["details"]["database"] = "Unexpected query result"
-                
-            # Test connection stats
-            try:
-                stats_result = _db_session.session.execute(
-                    text("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()")
-                )
-                health_data["details"]["active_connections"] = stats_result.scalar()
-            except Exception as stats_e:
-                health_data["details"]["stats_error"] = str(stats_e)
-                
-        except Exception as e:
-            health_data["database"] = "error"
-            health_data["status"] = "error"
-            health_data["details"]["database"] = str(e)
-            
-            # Check if this is an SSL or BrokenPipe error
-            if "SSL" in str(e) or "Broken" in str(e) or "pipe" in str(e):
-                health_data["details"]["error_type"] = "network"
-                # Try to recover by disposing the engine
-                try:
-                    _db_session.get_engine().dispose()
-                    _db_session.session.remove()
-                    health_data["details"]["recovery"] = "attempted engine disposal"
-                except Exception as recovery_e:
-                    health_data["details"]["recovery_error"] = str(recovery_e)
+        # Rendered fragment reuse (per worker process)
+        from app.utils.fragment_cache import get_fragment_cache
+        fragment_cache = get_fragment_cache(app)
+        if fragment_cache is not None:
+            health_data["fragments"] = fragment_cache.snapshot()
         
-        # Check for column existence in order_items
-        try:
-            # Check if the column exists in a non-intrusive way
-            result = _db_session.session.execute(
-                text("SELECT COUNT(*) FROM information_schema.columns WHERE table_name = 'order_items' AND column_name = 'project_stage_id'")
-            )
-            if result.scalar() == 0:
-                health_data["details"]["order_items_column"] = "missing project_stage_id column"
-                health_data["status"] = "warning"
-        except Exception as e:
-            health_data["details"]["schema_check"] = str(e)
+        # Query counts of the sampled requests (per worker process)
+        from app.utils.query_stats import get_query_stats
+        query_stats = get_query_stats(app)
+        if query_stats is not None:
+            health_data["queries"] = query_stats.snapshot()
         
-        status_code = 200 if health_data["status"] == "ok" else 500
-        return jsonify(health_data), status_code
+        # Schema drift is a warning in the body, not a failed probe
+        return jsonify(health_data), 200 if ready else 500
     
     return app
 
@@ -1,65 +1,210 @@
-"""Centralized i18n utilities.
-Add new translation keys here. Keep keys semantic and lower_snake_case.
+"""Centralized i18n: message catalogs compiled into per-language lookup tables.
+
+Strings live in JSON catalogs, app/translations/<domain>.json: a fallback
+language plus ``key -> {lang: text}``. Keys of the ``common`` catalog are used
+bare (``t('cart')`` in templates); other domains are qualified
+(``shop.product_added``, read through ``get_shop_text`` / ``get_page_text``).
+Keep keys semantic and lower_snake_case.
+
+All catalogs are compiled once, at startup, into one flat ``MessageTable`` per
+language with the fallbacks already applied (the language, then the catalog's
+fallback language, then any translation). A lookup is a single dict hit, and a
+missing key translates to itself. Templates get ``t`` bound to the table of
+the request's language.
+
+``I18N_CATALOG_DIRS`` lists extra directories whose catalogs are merged over
+the bundled ones, so strings can be added or corrected without a code change.
+``flask i18n compile`` writes the compiled tables to one JSON (or ``.msgpack``)
+file; with ``I18N_COMPILED_CATALOG`` pointing to it, workers load that file
+instead of the catalogs.
 """
+import glob
+import json
+import logging
+import os
+import threading
+
 from flask import session
 
-translations = {
-    # Shop landing (single product hours)
-    'development_hours_title': {
-        'en': 'Development / Consulting Hours',
-        'de': 'Entwicklungsstunden / Consulting',
-        'uk': 'Години розробки / Консалтингу'
-    },
-    'development_hours_subtitle': {
-        'en': 'Purchase service hours to work on your project',
-        'de': 'Kaufen Sie Service‑Stunden für Ihr Projekt',
-        'uk': 'Придбайте години послуг для роботи над вашим проєктом'
-    },
-    'order': {'en': 'Order', 'de': 'Bestellen', 'uk': 'Замовити'},
-    'details': {'en': 'Details', 'de': 'Details', 'uk': 'Деталі'},
-    'cart': {'en': 'Cart', 'de': 'Warenkorb', 'uk': 'Кошик'},
-    'product_not_available': {'en': 'Product not available', 'de': 'Produkt nicht verfügbar', 'uk': 'Товар відсутній'},
-    # Generic commerce
-    'price': {'en': 'Price', 'de': 'Preis', 'uk': 'Ціна'},
-    'quantity': {'en': 'Quantity', 'de': 'Menge', 'uk': 'Кількість'},
-    'add_to_cart': {'en': 'Add to Cart', 'de': 'In den Warenkorb', 'uk': 'Додати до кошика'},
-    'checkout': {'en': 'Checkout', 'de': 'Zur Kasse', 'uk': 'Оформлення замовлення'},
-    'subtotal': {'en': 'Subtotal', 'de': 'Zwischensumme', 'uk': 'Підсумок'},
-    'discount': {'en': 'Discount', 'de': 'Rabatt', 'uk': 'Знижка'},
-    'tax': {'en': 'Tax', 'de': 'MwSt', 'uk': 'Податок'},
-    'total': {'en': 'Total', 'de': 'Gesamtsumme', 'uk': 'Загальна сума'},
-    # Navigation/account
-    'profile': {'en': 'Profile', 'de': 'Profil', 'uk': 'Профіль'},
-    'dashboard': {'en': 'Dashboard', 'de': 'Dashboard', 'uk': 'Панель'},
-    'projects': {'en': 'Projects', 'de': 'Projekte', 'uk': 'Проєкти'},
-    'logout': {'en': 'Logout', 'de': 'Abmelden', 'uk': 'Вийти'},
-    'login': {'en': 'Login', 'de': 'Anmelden', 'uk': 'Увійти'},
-    # Navigation (site)
-    'home': {'en': 'Home', 'de': 'Startseite', 'uk': 'Головна'},
-    'shop': {'en': 'Shop', 'de': 'Shop', 'uk': 'Магазин'},
-    'contact': {'en': 'Contact', 'de': 'Kontakt', 'uk': 'Контакти'},
-    'my_projects': {'en': 'My Projects', 'de': 'Meine Projekte', 'uk': 'Мої проекти'},
-    'admin_panel': {'en': 'Admin Panel', 'de': 'Admin‑Panel', 'uk': 'Адмін-панель'},
-    'stop_animation': {'en': 'Stop animation', 'de': 'Animation stoppen', 'uk': 'Стоп анімація'},
-}
+logger = logging.getLogger(__name__)
 
 SUPPORTED_LANGS = ('en', 'de', 'uk')
 DEFAULT_LANG = 'de'
+COMMON_DOMAIN = 'common'
+CATALOG_DIR = os.path.join(os.path.dirname(__file__), 'translations')
+COMPILED_FORMAT = 1
 
-def translate(key: str, lang: str | None = None):
-    if lang is None:
-        lang = session.get('lang', DEFAULT_LANG)
+
+class MessageTable(dict):
+    """Compiled messages of one language; a missing key translates to itself."""
+
+    __slots__ = ()
+
+    def __missing__(self, key):
+        return key
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def catalog_dirs(config=None):
+    extra = (config or {}).get('I18N_CATALOG_DIRS') or ''
+    return [CATALOG_DIR] + [path for path in extra.split(os.pathsep) if path]
+
+
+def load_catalogs(directories):
+    """``{domain: {'fallback': lang, 'messages': {key: {lang: text}}}}``; later directories win."""
+    catalogs = {}
+    for directory in directories:
+        for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+            domain = os.path.splitext(os.path.basename(path))[0]
+            with open(path, encoding='utf-8') as handle:
+                data = json.load(handle)
+            catalog = catalogs.setdefault(domain, {'fallback': DEFAULT_LANG, 'messages': {}})
+            catalog['fallback'] = data.get('fallback', catalog['fallback'])
+            for key, entry in data.get('messages', {}).items():
+                catalog['messages'].setdefault(key, {}).update(entry)
+    return catalogs
+
+
+def compile_tables(catalogs):
+    """Flatten catalogs into ``{lang: {qualified key: text}}`` with fallbacks resolved."""
+    tables = {lang: {} for lang in SUPPORTED_LANGS}
+    for domain, catalog in catalogs.items():
+        prefix = '' if domain == COMMON_DOMAIN else f'{domain}.'
+        fallback = catalog['fallback']
+        for key, entry in catalog['messages'].items():
+            for lang in SUPPORTED_LANGS:
+                text = entry.get(lang) or entry.get(fallback) or next((v for v in entry.values() if v), None)
+                if text:
+                    tables[lang][prefix + key] = text
+    return tables
+
+
+def missing_translations(catalogs):
+    """``[(qualified key, lang)]`` for entries that fall back to another language."""
+    missing = []
+    for domain, catalog in sorted(catalogs.items()):
+        prefix = '' if domain == COMMON_DOMAIN else f'{domain}.'
+        for key, entry in catalog['messages'].items():
+            missing.extend((prefix + key, lang) for lang in SUPPORTED_LANGS if not entry.get(lang))
+    return missing
+
+
+def write_compiled(tables, path):
+    payload = {'format': COMPILED_FORMAT, 'tables': tables}
+    if path.endswith('.msgpack'):
+        import msgpack  # optional; plain JSON needs nothing extra
+        with open(path, 'wb') as handle:
+            handle.write(msgpack.packb(payload, use_bin_type=True))
+    else:
+        with open(path, 'w', encoding='utf-8') as handle:
+            json.dump(payload, handle, ensure_ascii=False, separators=(',', ':'))
+
+
+def read_compiled(path):
+    if path.endswith('.msgpack'):
+        import msgpack
+        with open(path, 'rb') as handle:
+            payload = msgpack.unpackb(handle.read(), raw=False)
+    else:
+        with open(path, encoding='utf-8') as handle:
+            payload = json.load(handle)
+    if payload.get('format') != COMPILED_FORMAT:
+        raise ValueError(f"{path}: unsupported compiled catalog format {payload.get('format')!r}")
+    return payload['tables']
+
+
+def load_tables(config=None):
+    """Compiled tables from ``I18N_COMPILED_CATALOG`` if set, else from the JSON catalogs."""
+    compiled = (config or {}).get('I18N_COMPILED_CATALOG')
+    raw = None
+    if compiled:
+        try:
+            raw = read_compiled(compiled)
+        except (OSError, ValueError, ImportError) as e:
+            logger.warning(f"Compiled catalog {compiled} not used ({e}); compiling the JSON catalogs")
+    if raw is None:
+        raw = compile_tables(load_catalogs(catalog_dirs(config)))
+    return {lang: MessageTable(raw.get(lang, {})) for lang in SUPPORTED_LANGS}
+
+
+def install_tables(tables):
+    global _tables
+    with _tables_lock:
+        _tables = tables
+
+
+def current_lang():
+    """Language of the current request (session), falling back to the default."""
+    lang = session.get('lang', DEFAULT_LANG)
+    return lang if lang in SUPPORTED_LANGS else DEFAULT_LANG
+
+
+def message_table(lang=None):
+    """The compiled table of ``lang`` (default: the current request's language)."""
+    table = _tables.get(lang)
+    if table is not None:
+        return table
+    if not _tables:
+        # Used outside create_app (scripts): compile the bundled catalogs once
+        with _tables_lock:
+            if not _tables:
+                _tables.update(load_tables())
     if lang not in SUPPORTED_LANGS:
-        lang = DEFAULT_LANG
-    entry = translations.get(key)
-    if not entry:
-        return key  # fallback displays key name
-    return entry.get(lang) or entry.get(DEFAULT_LANG) or next(iter(entry.values()))
+        lang = current_lang() if lang is None else DEFAULT_LANG
+    return _tables[lang]
+
+
+def translate(key: str, lang: str | None = None):
+    return message_table(lang or current_lang())[key]
+
+
+def gettext(key, lang=None, default=None):
+    """Translation of a qualified key, or ``default`` (the key itself) when unknown."""
+    text = message_table(lang).get(key)
+    if text is None:
+        return key if default is None else default
+    return text
+
 
 def register_i18n(app):
-    # Jinja global function t('key')
+    install_tables(load_tables(app.config))
+    # t('key') outside a request context (emails, CLI); requests get a bound one below
     app.jinja_env.globals['t'] = translate
-    # Provide current language globally
+
+    # Current language and t() resolved once per render: t is the table's own lookup
     @app.context_processor
     def inject_lang():
-        return {'lang': session.get('lang', DEFAULT_LANG)}
+        lang = current_lang()
+        return {'lang': lang, 't': message_table(lang).__getitem__}
+
+    _register_cli(app)
+
+
+def _register_cli(app):
+    import click
+
+    @app.cli.group('i18n')
+    def i18n_cli():
+        """Translation catalogs (app/translations)."""
+
+    @i18n_cli.command('compile')
+    @click.option('--output', '-o', default=None,
+                  help='Target file (.json or .msgpack); default I18N_COMPILED_CATALOG.')
+    def compile_command(output):
+        """Compile the catalogs into per-language tables for I18N_COMPILED_CATALOG."""
+        output = output or app.config.get('I18N_COMPILED_CATALOG')
+        if not output:
+            raise click.UsageError('Pass --output or set I18N_COMPILED_CATALOG')
+        catalogs = load_catalogs(catalog_dirs(app.config))
+        tables = compile_tables(catalogs)
+        try:
+            write_compiled(tables, output)
+        except ImportError:
+            raise click.ClickException('.msgpack output needs the msgpack package')
+        counts = ', '.join(f"{lang} {len(table)}" for lang, table in tables.items())
+        click.echo(f"Compiled {len(catalogs)} catalogs to {output}: {counts} messages")
+        for key, lang in missing_translations(catalogs):
+            click.echo(f"  missing {lang}: {key}")
@@ -19,5 +19,11 @@ from . import coupon
 from . import shop
 from . import user
 from . import project
+from . import job
+from . import rollup
+from . import http_session
+from . import bootstrap
+from . import stock
+from . import stripe_event
 
-__all__ = ['Client', 'User', 'db', 'product', 'order', 'coupon', 'shop', 'user', 'project']
+__all__ = ['Client', 'User', 'db', 'product', 'order', 'coupon', 'shop', 'user', 'project', 'job', 'rollup', 'http_session', 'bootstrap', 'stock', 'stripe_event']
@@ -0,0 +1,17 @@
+"""Ledger of applied database bootstrap steps (app/services/bootstrap.py)."""
+from datetime import datetime
+
+from app.models.database import db
+
+
+class BootstrapStep(db.Model):
+    __tablename__ = 'bootstrap_steps'
+    __table_args__ = {'extend_existing': True}
+
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    duration_ms = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<BootstrapStep {self.version} {self.name}>'
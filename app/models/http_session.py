@@ -0,0 +1,16 @@
+"""Server-side session rows used by app/utils/session_store.py (SESSION_BACKEND=hybrid or sql)."""
+from app.models.database import db
+
+
+class HttpSession(db.Model):
+    __tablename__ = 'http_sessions'
+    __table_args__ = {'extend_existing': True}
+
+    # Random URL-safe id, also the cookie value
+    id = db.Column(db.String(64), primary_key=True)
+    # Tagged JSON (flask.json.tag), the same format Flask uses for cookie sessions
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<HttpSession {self.id[:8]} expires {self.expires_at}>'
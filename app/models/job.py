@@ -0,0 +1,54 @@
+"""Durable background job rows used by app/services/job_queue.py."""
+import json
+from datetime import datetime
+
+from app.models.database import db
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+# Exhausted all attempts; kept for inspection and manual retry (dead-letter)
+JOB_DEAD = 'dead'
+
+
+class BackgroundJob(db.Model):
+    """Outbound side effect (Telegram, project bootstrap, ...) to run off the request."""
+    __tablename__ = 'background_jobs'
+    __table_args__ = (
+        db.Index('ix_background_jobs_status_run_at', 'status', 'run_at'),
+        {'extend_existing': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(16), nullable=False, default=JOB_PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(64))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    @property
+    def data(self):
+        return json.loads(self.payload or '{}')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'payload': self.data,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_at': self.run_at.isoformat() if self.run_at else None,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<BackgroundJob {self.id} {self.kind} {self.status}>'
@@ -26,7 +26,11 @@ class PaymentStatus(enum.Enum):
 
 class Order(db.Model):
     __tablename__ = 'orders'
-    __table_args__ = {'schema': _SHOP_SCHEMA} if _USE_SHOP_SCHEMA else {}
+    # created_at: recent-order lists and the rollup catch-up window (app/services/rollups.py)
+    __table_args__ = (
+        db.Index('ix_orders_created_at', 'created_at'),
+        {'schema': _SHOP_SCHEMA} if _USE_SHOP_SCHEMA else {},
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     order_number = db.Column(db.String(50), unique=True, nullable=False)
@@ -185,16 +189,3 @@ class Payment(db.Model):
         return f'<Payment {self.id} for Order {self.order_id}>'
 
 logger = logging.getLogger(__name__)
-
-# Runtime safety migration (fallback) for order_items new columns.
-# This should normally be handled early in init_db(), but we keep a safety net.
-try:  # pragma: no cover - side-effect during import
-    from sqlalchemy import text as _text
-    engine = db.get_engine()
-    table_name = f"{_SHOP_SCHEMA + '.' if _USE_SHOP_SCHEMA else ''}order_items"
-    with engine.begin() as conn:
-        conn.execute(_text(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS project_stage_id INTEGER"))
-        conn.execute(_text(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS billed_hours INTEGER DEFAULT 0"))
-    logger.info("(runtime) Ensured order_items staged billing columns present")
-except Exception as e:  # pragma: no cover
-    logger.debug(f"(runtime) Skipped ensuring order_items columns (likely before engine ready): {e}")
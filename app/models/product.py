@@ -1,9 +1,12 @@
 from app.models.database import db
 from datetime import datetime
+from functools import partial
+from sqlalchemy import case, event, inspect
 from sqlalchemy.ext.hybrid import hybrid_property
 from slugify import slugify
 import uuid
 import os
+import hashlib
 
 # Schema guard: only set schema when using Postgres and POSTGRES_SCHEMA_SHOP is set
 _SHOP_SCHEMA = os.environ.get('POSTGRES_SCHEMA_SHOP')
@@ -11,6 +14,36 @@ _SHOP_SCHEMA = os.environ.get('POSTGRES_SCHEMA_SHOP')
 _db_url = os.environ.get('DATABASE_URL') or os.environ.get('DATABASE_URI') or ''
 _USE_SHOP_SCHEMA = bool(_SHOP_SCHEMA and ('postgres' in _db_url or 'postgresql' in _db_url))
 
+
+class MediaBlob(db.Model):
+    """Bytes of one stored image, kept out of the catalog rows.
+
+    ``categories`` and ``product_images`` only hold the id, so listing
+    categories or a product's gallery never reads image data. The bytes are
+    loaded by the media routes, through ``load_blob()``, on a cache miss.
+    """
+    __tablename__ = 'media_blobs'
+    __table_args__ = {'schema': _SHOP_SCHEMA} if _USE_SHOP_SCHEMA else {}
+
+    id = db.Column(db.Integer, primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    size = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<MediaBlob {self.id} ({self.size} bytes)>'
+
+
+_MEDIA_BLOB_ID = f'{_SHOP_SCHEMA}.media_blobs.id' if _USE_SHOP_SCHEMA else 'media_blobs.id'
+
+
+def load_blob(blob_id):
+    """Bytes of one blob, without loading any owner row."""
+    if blob_id is None:
+        return None
+    return db.session.query(MediaBlob.data).filter(MediaBlob.id == blob_id).scalar()
+
+
 class Category(db.Model):
     __tablename__ = 'categories'
     __table_args__ = {'schema': _SHOP_SCHEMA} if _USE_SHOP_SCHEMA else {}
@@ -20,16 +53,19 @@ class Category(db.Model):
     slug = db.Column(db.String(100), unique=True, nullable=False)
     description = db.Column(db.Text)
     image = db.Column(db.String(255))
-    # New fields for storing image data directly in the database
-    image_data = db.Column(db.LargeBinary)
+    # Image stored in the database: bytes in media_blobs, metadata here
+    image_blob_id = db.Column(db.Integer, db.ForeignKey(_MEDIA_BLOB_ID))
     image_content_type = db.Column(db.String(100))
     image_filename = db.Column(db.String(255))
+    # sha256 of the image bytes, used as the HTTP ETag and URL version
+    image_hash = db.Column(db.String(64))
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
     products = db.relationship('Product', backref='category', lazy=True)
+    image_blob = db.relationship(MediaBlob, cascade='all, delete-orphan', single_parent=True)
 
     def __init__(self, *args, **kwargs):
         if 'slug' not in kwargs and 'name' in kwargs:
@@ -39,10 +75,32 @@ class Category(db.Model):
     def __repr__(self):
         return f'<Category {self.name}>'
 
+    @property
+    def image_data(self):
+        """Image bytes; loads the blob, so catalog code should not touch it."""
+        return self.image_blob.data if self.image_blob is not None else None
+
+    @image_data.setter
+    def image_data(self, value):
+        self.image_blob = MediaBlob(data=value, size=len(value)) if value else None
+        self.image_hash = content_hash(value)
+
 
 class Product(db.Model):
     __tablename__ = 'products'
-    __table_args__ = {'schema': _SHOP_SCHEMA} if _USE_SHOP_SCHEMA else {}
+    # Keyset pagination of the catalog (app/services/catalog.py), one per sort
+    # column for a category page and one for the unfiltered listing
+    __table_args__ = (
+        db.Index('ix_products_active_category_name', 'is_active', 'category_id', 'name', 'id'),
+        db.Index('ix_products_active_category_price', 'is_active', 'category_id', 'price', 'id'),
+        db.Index('ix_products_active_category_created', 'is_active', 'category_id', 'created_at', 'id'),
+        db.Index('ix_products_active_category_rating', 'is_active', 'category_id', 'rating_avg', 'id'),
+        db.Index('ix_products_active_name', 'is_active', 'name', 'id'),
+        db.Index('ix_products_active_price', 'is_active', 'price', 'id'),
+        db.Index('ix_products_active_created', 'is_active', 'created_at', 'id'),
+        db.Index('ix_products_active_rating', 'is_active', 'rating_avg', 'id'),
+        {'schema': _SHOP_SCHEMA} if _USE_SHOP_SCHEMA else {},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
@@ -53,8 +111,9 @@ class Product(db.Model):
     price = db.Column(db.Float, nullable=False)
     sale_price = db.Column(db.Float)
     image = db.Column(db.String(255))
-    # Numeric stock count used across admin/shop logic
-    stock = db.Column(db.Integer, default=0)
+    # Numeric stock count used across admin/shop logic; NULL = unlimited.
+    # Checkout takes it through app/services/stock.py, never by assignment
+    stock = db.Column(db.Integer)
     duration = db.Column(db.Integer)  # Duration in minutes
     format = db.Column(db.String(100))  # e.g., "Video call", "In person"
     language = db.Column(db.String(50))  # e.g., "English", "German", "Ukrainian"
@@ -66,6 +125,10 @@ class Product(db.Model):
     in_stock = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Aggregates over approved reviews, maintained by the ProductReview events below
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_avg = db.Column(db.Float, nullable=False, default=0, server_default='0')
 
     # Foreign keys
     category_id = db.Column(db.Integer, db.ForeignKey(f'{_SHOP_SCHEMA}.categories.id' if _USE_SHOP_SCHEMA else 'categories.id'))
@@ -93,10 +156,11 @@ class Product(db.Model):
 
     @hybrid_property
     def average_rating(self):
-        approved = [r for r in self.reviews if getattr(r, 'is_approved', True)]
-        if not approved:
-            return 0
-        return sum(r.rating for r in approved) / len(approved)
+        return self.rating_avg or 0
+
+    @average_rating.expression
+    def average_rating(cls):
+        return cls.rating_avg
 
 
 class ProductImage(db.Model):
@@ -108,29 +172,173 @@ class ProductImage(db.Model):
     # URL is optional - we will support serving images from DB via /media/image/<id>
     url = db.Column(db.String(255))
     alt = db.Column(db.String(255))
-    # Binary data stored in DB for portability across deployments
-    data = db.Column(db.LargeBinary)
+    # Binary data stored in DB for portability across deployments (bytes in media_blobs)
+    blob_id = db.Column(db.Integer, db.ForeignKey(_MEDIA_BLOB_ID))
     filename = db.Column(db.String(255))
     content_type = db.Column(db.String(100))
+    # sha256 of the image bytes, used as the HTTP ETag and URL version
+    content_hash = db.Column(db.String(64))
     sort_order = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    blob = db.relationship(MediaBlob, cascade='all, delete-orphan', single_parent=True)
+
     def __repr__(self):
         return f'<ProductImage {self.id} for Product {self.product_id}>'
 
+    @property
+    def data(self):
+        """Image bytes; loads the blob, so gallery listings should not touch it."""
+        return self.blob.data if self.blob is not None else None
+
+    @data.setter
+    def data(self, value):
+        self.blob = MediaBlob(data=value, size=len(value)) if value else None
+        self.content_hash = content_hash(value)
+
+
+class ImageVariant(db.Model):
+    """Resized / re-encoded copy of a stored image, keyed by the source blob hash.
+
+    Built off the request thread by app/utils/image_variants.py. Because rows
+    are keyed by content hash, replacing an image simply yields a new set.
+    """
+    __tablename__ = 'image_variants'
+    __table_args__ = (
+        db.UniqueConstraint('source_hash', 'width', 'format', name='uq_image_variant'),
+        {'schema': _SHOP_SCHEMA} if _USE_SHOP_SCHEMA else {},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    source_hash = db.Column(db.String(64), nullable=False, index=True)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer)
+    format = db.Column(db.String(10), nullable=False)  # avif, webp, jpeg, png
+    content_type = db.Column(db.String(100), nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ImageVariant {self.source_hash[:8]} {self.width}w {self.format}>'
+
+
+def content_hash(data):
+    """Hex sha256 of an image blob (None for empty data)."""
+    return hashlib.sha256(data).hexdigest() if data else None
+
 
 class ProductReview(db.Model):
     __tablename__ = 'product_reviews'
-    __table_args__ = {'schema': _SHOP_SCHEMA} if _USE_SHOP_SCHEMA else {}
+    __table_args__ = (
+        db.Index('ix_product_reviews_product_approved', 'product_id', 'is_approved'),
+        {'schema': _SHOP_SCHEMA} if _USE_SHOP_SCHEMA else {},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey(f'{_SHOP_SCHEMA}.products.id' if _USE_SHOP_SCHEMA else 'products.id'), nullable=False)
-    rating = db.Column(db.Integer, nullable=False)  # 1-5 stars
+    # active_history: the rating aggregate events need the previous values
+    product_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey(f'{_SHOP_SCHEMA}.products.id' if _USE_SHOP_SCHEMA else 'products.id'), nullable=False),
+        active_history=True)
+    rating = db.column_property(db.Column(db.Integer, nullable=False), active_history=True)  # 1-5 stars
     author_name = db.Column(db.String(100), nullable=True)
     author_email = db.Column(db.String(100), nullable=True)
     content = db.Column(db.Text, nullable=True)
-    is_approved = db.Column(db.Boolean, default=False)
+    is_approved = db.column_property(db.Column(db.Boolean, default=False), active_history=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
         return f'<ProductReview {self.id} for Product {self.product_id}>'
+
+
+# --- rating aggregates ---------------------------------------------------
+# Each review write adjusts products.review_count / rating_sum / rating_avg in
+# the same transaction (and flush) as the review itself. The UPDATE applies a
+# delta to the current row, so concurrent approvals don't overwrite each other.
+
+def _adjust_rating(connection, product_id, count_delta, sum_delta):
+    if not product_id or (not count_delta and not sum_delta):
+        return
+    products = Product.__table__
+    new_count = products.c.review_count + count_delta
+    new_sum = products.c.rating_sum + sum_delta
+    connection.execute(
+        products.update()
+        .where(products.c.id == product_id)
+        .values(
+            review_count=new_count,
+            rating_sum=new_sum,
+            rating_avg=case((new_count > 0, new_sum * 1.0 / new_count), else_=0),
+        )
+    )
+
+
+def _previous(target, attr):
+    # Value before this flush (columns use active_history, so it is loaded)
+    history = inspect(target).attrs[attr].history
+    return history.deleted[0] if history.deleted else getattr(target, attr)
+
+
+def _contribution(is_approved, rating):
+    # (count, sum) a review adds to its product's aggregates
+    return (1, rating or 0) if is_approved else (0, 0)
+
+
+@event.listens_for(ProductReview, 'after_insert')
+def _review_inserted(mapper, connection, target):
+    count, total = _contribution(target.is_approved, target.rating)
+    _adjust_rating(connection, target.product_id, count, total)
+
+
+@event.listens_for(ProductReview, 'after_update')
+def _review_updated(mapper, connection, target):
+    before = partial(_previous, target)
+    old_product, new_product = before('product_id'), target.product_id
+    old_count, old_sum = _contribution(before('is_approved'), before('rating'))
+    new_count, new_sum = _contribution(target.is_approved, target.rating)
+    if old_product == new_product:
+        _adjust_rating(connection, new_product, new_count - old_count, new_sum - old_sum)
+    else:
+        _adjust_rating(connection, old_product, -old_count, -old_sum)
+        _adjust_rating(connection, new_product, new_count, new_sum)
+
+
+@event.listens_for(ProductReview, 'before_delete')
+def _review_deleted(mapper, connection, target):
+    # before_delete: the row still exists if expired attributes must be reloaded
+    before = partial(_previous, target)
+    count, total = _contribution(before('is_approved'), before('rating'))
+    _adjust_rating(connection, before('product_id'), -count, -total)
+
+
+def _touch_product(connection, *product_ids):
+    # Reviews and gallery images are part of the product pages: a write to them
+    # bumps updated_at, which the fragment cache keys on (app/utils/fragment_cache.py)
+    product_ids = {product_id for product_id in product_ids if product_id}
+    if product_ids:
+        products = Product.__table__
+        connection.execute(products.update().where(products.c.id.in_(product_ids))
+                           .values(updated_at=datetime.utcnow()))
+
+
+def _child_written(mapper, connection, target):
+    _touch_product(connection, target.product_id, _previous(target, 'product_id'))
+
+
+for _child in (ProductReview, ProductImage):
+    for _event in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_child, _event, _child_written)
+
+
+def recalculate_ratings(connection, product_ids=None):
+    """Recompute the rating aggregates from product_reviews; returns rows updated."""
+    products, reviews = Product.__table__, ProductReview.__table__
+    approved = (reviews.c.product_id == products.c.id) & (reviews.c.is_approved == True)  # noqa: E712
+    count = db.select(db.func.count(reviews.c.id)).where(approved).scalar_subquery()
+    total = db.select(db.func.coalesce(db.func.sum(reviews.c.rating), 0)).where(approved).scalar_subquery()
+    average = db.select(db.func.coalesce(db.func.avg(reviews.c.rating * 1.0), 0)).where(approved).scalar_subquery()
+    statement = products.update().values(review_count=count, rating_sum=total, rating_avg=average)
+    if product_ids is not None:
+        statement = statement.where(products.c.id.in_(list(product_ids)))
+    return connection.execute(statement).rowcount
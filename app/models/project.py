@@ -222,24 +222,3 @@ def create_project_from_request(client_request):
         db.session.rollback()
         logger.error(f"Ошибка при создании проекта: {e}")
         return None
-
-# --- Lightweight runtime migration helpers ---
-def _ensure_column_exists(table_name: str, column_name: str, ddl: str):
-    """Пытаемся добавить недостающий столбец (idempotent). Работает для PostgreSQL.
-    ddl пример: 'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS estimated_hours INTEGER DEFAULT 0'
-    """
-    try:
-        engine = db.get_engine()
-        with engine.connect() as conn:
-            conn.execute(db.text(ddl.format(table=table_name)))
-    except Exception as ex:
-        logger.debug(f"Skip column ensure {table_name}.{column_name}: {ex}")
-
-try:
-    # Добавляем столбец estimated_hours если его нет
-    tbl = f"{PROJECTS_SCHEMA + '.' if PROJECTS_SCHEMA else ''}project_stage"
-    _ensure_column_exists(tbl, 'estimated_hours', f"ALTER TABLE {tbl} ADD COLUMN IF NOT EXISTS estimated_hours INTEGER DEFAULT 0")
-    _ensure_column_exists(tbl, 'billed_hours', f"ALTER TABLE {tbl} ADD COLUMN IF NOT EXISTS billed_hours INTEGER DEFAULT 0")
-    _ensure_column_exists(tbl, 'is_paid', f"ALTER TABLE {tbl} ADD COLUMN IF NOT EXISTS is_paid BOOLEAN DEFAULT FALSE")
-except Exception as _e:
-    logger.debug(f"Runtime migration for estimated_hours failed: {_e}")
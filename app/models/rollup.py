@@ -0,0 +1,50 @@
+"""Pre-aggregated sales figures maintained by app/services/rollups.py."""
+from app.models.database import db
+from app.models.order import _SHOP_SCHEMA, _USE_SHOP_SCHEMA
+
+GRANULARITY_HOUR = 'hour'
+GRANULARITY_DAY = 'day'
+
+
+class OrderRollup(db.Model):
+    """Order count and revenue per time bucket and (order status, payment status)."""
+    __tablename__ = 'order_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'bucket_start', 'order_status', 'payment_status',
+                            name='uq_order_rollups_cell'),
+        {'schema': _SHOP_SCHEMA} if _USE_SHOP_SCHEMA else {},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(8), nullable=False)  # hour, day
+    # Start of the UTC hour/day the orders were created in
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    # '' when the order has no status, so the unique constraint still applies
+    order_status = db.Column(db.String(32), nullable=False, default='')
+    payment_status = db.Column(db.String(32), nullable=False, default='')
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return (f'<OrderRollup {self.granularity} {self.bucket_start} '
+                f'{self.order_status}/{self.payment_status} {self.order_count}>')
+
+
+class ProductSalesRollup(db.Model):
+    """Units sold and item revenue per product and UTC day (all order statuses)."""
+    __tablename__ = 'product_sales_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('bucket_start', 'product_id', name='uq_product_sales_rollups_cell'),
+        db.Index('ix_product_sales_rollups_product', 'product_id'),
+        {'schema': _SHOP_SCHEMA} if _USE_SHOP_SCHEMA else {},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    # 0 for order items whose product no longer exists
+    product_id = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f'<ProductSalesRollup {self.bucket_start} product={self.product_id} units={self.units}>'
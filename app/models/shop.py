@@ -76,12 +76,3 @@ class CartItem(db.Model):
     def subtotal(self):
         """Compatibility property used by checkout and templates."""
         return self.line_total()
-
-# Runtime migration helper for cart_items new column
-try:
-    engine = db.get_engine()
-    with engine.connect() as conn:
-        table_name = f"{_SHOP_SCHEMA + '.' if _USE_SHOP_SCHEMA else ''}cart_items"
-        conn.execute(db.text(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS project_stage_id INTEGER"))
-except Exception as _e:
-    pass
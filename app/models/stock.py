@@ -0,0 +1,38 @@
+"""Stock held for unpaid orders (app/services/stock.py)."""
+from datetime import datetime
+
+from app.models.database import db
+from app.models.order import _SHOP_SCHEMA, _USE_SHOP_SCHEMA
+
+RESERVATION_HELD = 'held'
+RESERVATION_COMMITTED = 'committed'
+RESERVATION_RELEASED = 'released'
+
+
+class StockReservation(db.Model):
+    """Units of one product taken from ``products.stock`` for one order.
+
+    ``held`` until the payment succeeds (``committed``) or the order is
+    cancelled, fails or expires (``released``, stock given back once).
+    """
+    __tablename__ = 'stock_reservations'
+    __table_args__ = (
+        db.UniqueConstraint('order_id', 'product_id', name='uq_stock_reservations_order_product'),
+        db.Index('ix_stock_reservations_status_expires', 'status', 'expires_at'),
+        {'schema': _SHOP_SCHEMA} if _USE_SHOP_SCHEMA else {},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey(f'{_SHOP_SCHEMA}.orders.id' if _USE_SHOP_SCHEMA else 'orders.id'),
+                         nullable=False)
+    product_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default=RESERVATION_HELD)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Why it was released: cancelled, expired, payment_failed, checkout_error
+    released_at = db.Column(db.DateTime)
+    release_reason = db.Column(db.String(32))
+
+    def __repr__(self):
+        return f'<StockReservation order={self.order_id} product={self.product_id} x{self.quantity} {self.status}>'
@@ -0,0 +1,40 @@
+"""Stripe webhook events as received (app/services/stripe_events.py)."""
+from datetime import datetime
+
+from app.models.database import db
+from app.models.order import _SHOP_SCHEMA, _USE_SHOP_SCHEMA
+
+EVENT_RECEIVED = 'received'
+EVENT_PROCESSED = 'processed'
+EVENT_IGNORED = 'ignored'
+
+
+class StripeEvent(db.Model):
+    """One Stripe event, stored once however often Stripe delivers it.
+
+    ``received`` until the worker has applied it to the order (``processed``)
+    or found nothing to do (``ignored``). ``payload`` is the raw signed body.
+    """
+    __tablename__ = 'stripe_events'
+    __table_args__ = (
+        db.UniqueConstraint('event_id', name='uq_stripe_events_event_id'),
+        db.Index('ix_stripe_events_order_status', 'order_id', 'status'),
+        {'schema': _SHOP_SCHEMA} if _USE_SHOP_SCHEMA else {},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(255), nullable=False)
+    type = db.Column(db.String(100), nullable=False)
+    # Stripe's own timestamp (epoch seconds): events of one order are applied in this order
+    stripe_created = db.Column(db.Integer, nullable=False, default=0)
+    livemode = db.Column(db.Boolean, default=False)
+    # metadata.order_id of the session / payment intent, when present
+    order_id = db.Column(db.Integer)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default=EVENT_RECEIVED)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    def __repr__(self):
+        return f'<StripeEvent {self.event_id} {self.type} {self.status}>'
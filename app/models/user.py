@@ -1,6 +1,7 @@
 """User model for authentication and authorization."""
 from app.models.database import db
 from flask_login import UserMixin
+from sqlalchemy.orm import noload
 from werkzeug.security import generate_password_hash, check_password_hash
 import datetime
 import uuid
@@ -22,8 +23,9 @@ class User(db.Model, UserMixin):
     reset_token_expiry = db.Column(db.DateTime, nullable=True)
     
     # Relations
-    # Eager load with selectin to minimize per-order lazy queries while keeping separate SELECT
-    orders = db.relationship('Order', back_populates='user', lazy='selectin')
+    # Loaded only on access; use order_history() for lists (the request-time
+    # identity in app/utils/identity.py never touches it)
+    orders = db.relationship('Order', back_populates='user', lazy='select')
     cart = db.relationship('Cart', backref='user', lazy=True, uselist=False)
     projects = db.relationship('Project', backref='user', lazy=True, foreign_keys='Project.user_id')
     
@@ -41,6 +43,18 @@ class User(db.Model, UserMixin):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
+    def order_history(self, with_items=True):
+        """Query for this user's orders, newest first (items in one extra SELECT)."""
+        return User.orders_for(self.id, with_items)
+
+    @staticmethod
+    def orders_for(user_id, with_items=True):
+        from app.models.order import Order
+        query = Order.query.filter_by(user_id=user_id).order_by(Order.created_at.desc())
+        if not with_items:
+            query = query.options(noload(Order.items))
+        return query
+
     def get_full_name(self):
         if self.first_name and self.last_name:
             return f"{self.first_name} {self.last_name}"
@@ -7,7 +7,10 @@ from app.models.project import Project, ProjectStage
 from app.models.user import User
 from app.models.product import Product, Category
 from app.models.order import Order
+from app.services import rollups
 from app.utils.decorators import admin_required
+from app.utils.fragment_cache import get_fragment_cache
+from app.utils.identity import revoke_identity
 from app.utils.slug import generate_slug
 from app.forms.admin import CategoryForm, ProductForm, OrderStatusForm, ProjectForm, EditProjectForm
 import datetime
@@ -23,22 +26,23 @@ def dashboard():
     """Admin dashboard with statistics"""
     # Get counts for the dashboard
     products_count = Product.query.count()
-    orders_count = Order.query.count()
     users_count = User.query.filter(User.is_admin == False).count()
     
     # Get recent orders
     recent_orders = Order.query.order_by(Order.created_at.desc()).limit(5).all()
     
-    # Calculate total revenue
-    total_revenue = db.session.query(db.func.sum(Order.total)) \
-                    .filter(Order.status == 'paid').scalar() or 0
-    
-    # Get pending orders
-    pending_orders = Order.query.filter_by(status='pending').count()
+    # Order count, revenue and pending payments from the sales rollups
+    summary = rollups.order_summary()
+    orders_count = summary.total_orders
+    total_revenue = summary.paid_revenue
+    pending_orders = summary.by_payment_status.get('pending', 0)
     
     # Get low stock products
     low_stock_products = Product.query.filter(Product.stock <= 3).all()
     
+    # Product page fragment reuse in this worker (app/utils/fragment_cache.py)
+    fragment_cache = get_fragment_cache()
+    
     return render_template('admin/dashboard.html', 
                           products_count=products_count,
                           orders_count=orders_count,
@@ -46,7 +50,8 @@ def dashboard():
                           recent_orders=recent_orders,
                           total_revenue=total_revenue,
                           pending_orders=pending_orders,
-                          low_stock_products=low_stock_products)
+                          low_stock_products=low_stock_products,
+                          fragment_stats=fragment_cache.snapshot() if fragment_cache else None)
 
 # Categories
 @admin_bp.route('/categories')
@@ -262,6 +267,7 @@ def toggle_admin(id):
     
     user.is_admin = not user.is_admin
     db.session.commit()
+    revoke_identity(user.id)
     flash(f'Admin status for {user.username} has been updated', 'success')
     return redirect(url_for('admin.users'))
 
@@ -279,6 +285,7 @@ def toggle_active(id):
     
     user.is_active = not user.is_active
     db.session.commit()
+    revoke_identity(user.id)
     status = 'activated' if user.is_active else 'deactivated'
     flash(f'User {user.username} has been {status}', 'success')
     return redirect(url_for('admin.users'))
@@ -289,28 +296,23 @@ def toggle_active(id):
 @admin_required
 def dashboard_sales():
     """API endpoint for dashboard sales chart"""
-    # Get sales data for the last 30 days
-    today = datetime.datetime.utcnow().date()
-    start_date = today - datetime.timedelta(days=30)
-    
-    sales = db.session.query(
-        db.func.date(Order.created_at).label('date'),
-        db.func.sum(Order.total).label('total')
-    ).filter(
-        Order.created_at >= start_date,
-        Order.status == 'paid'
-    ).group_by(
-        db.func.date(Order.created_at)
-    ).all()
-    
-    # Format data for chart
-    dates = [(start_date + datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(31)]
-    sales_dict = {s.date.strftime('%Y-%m-%d'): float(s.total) for s in sales}
-    sales_data = [sales_dict.get(date, 0) for date in dates]
+    # Paid revenue per day for the last 30 days (or per hour for the last 48
+    # hours with ?granularity=hour), read from the sales rollups
+    now = datetime.datetime.utcnow()
+    if request.args.get('granularity') == 'hour':
+        end = now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+        buckets = [end - datetime.timedelta(hours=48 - i) for i in range(48)]
+        sales_dict = rollups.paid_sales(buckets[0], end, granularity='hour')
+        label = '%Y-%m-%d %H:00'
+    else:
+        start_date = datetime.datetime.combine(now.date() - datetime.timedelta(days=30), datetime.time())
+        buckets = [start_date + datetime.timedelta(days=i) for i in range(31)]
+        sales_dict = rollups.paid_sales(start_date, buckets[-1] + datetime.timedelta(days=1))
+        label = '%Y-%m-%d'
     
     return jsonify({
-        'dates': dates,
-        'sales': sales_data
+        'dates': [bucket.strftime(label) for bucket in buckets],
+        'sales': [sales_dict.get(bucket, 0) for bucket in buckets]
     })
 
 # Projects Management
@@ -5,6 +5,11 @@ from werkzeug.utils import secure_filename
 from app.models.product import Product, Category, ProductImage, ProductReview
 from app.models.order import Order, OrderStatus, PaymentStatus, OrderItem
 from app.models.coupon import Coupon
+from app.services import rollups
+from app.services import search as search_service
+from app.utils.image_variants import schedule_variants
+from app.utils.media_cache import invalidate_media
+from app.utils.media_http import versioned_url
 from app import db
 import os
 import uuid
@@ -48,13 +53,17 @@ def save_image(file, subfolder='products', product_id=None, category_id=None):
                 current_app.logger.debug(f"Read {len(binary)} bytes from category file")
                 
                 # Store directly in Category model's new fields
+                invalidate_media('category', category.id)
                 category.image_data = binary
                 category.image_content_type = file.mimetype
                 category.image_filename = unique_filename
                 
+                # Responsive widths / WebP / AVIF are rendered off the request thread
+                schedule_variants(category.image_hash, binary, file.mimetype)
+                
                 # Update URL to point to the category image service route
                 db.session.flush()  # ensure category ID is available
-                return f'/category_media/category-image/{category.id}'
+                return versioned_url(f'/category_media/category-image/{category.id}', category.image_hash)
                 
             # Only store in DB if we have a product_id to satisfy NOT NULL constraint
             elif product_id is not None:
@@ -73,8 +82,9 @@ def save_image(file, subfolder='products', product_id=None, category_id=None):
                 db.session.add(img)
                 db.session.flush()  # get id
                 current_app.logger.debug(f"Image stored in DB with ID: {img.id}")
+                schedule_variants(img.content_hash, binary, file.mimetype)
                 # do not commit here; caller may commit transaction
-                return url_for('media.serve_image', image_id=img.id)
+                return versioned_url(url_for('media.serve_image', image_id=img.id), img.content_hash)
             # if no product_id provided, fall back to filesystem below
             current_app.logger.debug(f"No product_id or category_id provided, falling back to filesystem storage")
         except Exception as e:
@@ -141,7 +151,8 @@ def products():
     
     # Apply filters
     if search:
-        query = query.filter(Product.name.ilike(f'%{search}%'))
+        # Full-text match on name, SKU, descriptions and category (app/services/search.py)
+        query = search_service.filter_products(query, search)
     
     if category_id:
         query = query.filter(Product.category_id == category_id)
@@ -843,28 +854,13 @@ def dashboard():
     # Recent orders
     recent_orders = Order.query.order_by(Order.created_at.desc()).limit(5).all()
     
-    # Orders statistics
-    total_orders = Order.query.count()
-    completed_orders = Order.query.filter_by(order_status='completed').count()
-    pending_orders = Order.query.filter_by(order_status='pending').count()
-    
-    # Calculate revenue
-    revenue = db.session.query(db.func.sum(Order.total)).filter(
-        Order.payment_status == 'paid'
-    ).scalar() or 0
-    
-    # Top products
-    top_products = db.session.query(
-        Product, 
-        db.func.sum(OrderItem.quantity).label('total_quantity')
-    ).join(
-        OrderItem, 
-        OrderItem.product_id == Product.id
-    ).group_by(
-        Product.id
-    ).order_by(
-        db.desc('total_quantity')
-    ).limit(5).all()
+    # Orders statistics and top products from the sales rollups (app/services/rollups.py)
+    summary = rollups.order_summary()
+    total_orders = summary.total_orders
+    completed_orders = summary.by_order_status.get('completed', 0)
+    pending_orders = summary.by_order_status.get('pending', 0)
+    revenue = summary.paid_revenue
+    top_products = rollups.top_products(5)
     
     # Recent reviews
     recent_reviews = ProductReview.query.order_by(
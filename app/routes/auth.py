@@ -188,10 +188,7 @@ def profile():
     from app.models.database import db
     orders = []
     try:
-        orders = (Order.query
-                  .filter_by(user_id=current_user.id)
-                  .order_by(Order.created_at.desc())
-                  .all())
+        orders = User.orders_for(current_user.id).all()
     except Exception as e:  # broad catch to ensure rollback on 25P02 aborted tx
         current_app.logger.error(f"Failed to load orders for profile: {e}")
         try:
@@ -1,12 +1,14 @@
 """
 Updated route for serving category images directly from database
 """
-from flask import Blueprint, send_file, abort, current_app
-from io import BytesIO
+from flask import Blueprint, abort, current_app
+from werkzeug.exceptions import HTTPException
 import logging
 
 # Import the required models
-from app.models.product import Category
+from app.models.database import db
+from app.models.product import Category, content_hash, load_blob
+from app.utils.media_serving import serve_cached, serve_stored_image
 
 # Create a logger
 logger = logging.getLogger(__name__)
@@ -22,17 +24,37 @@ def add_category_image_route(media_blueprint):
     def serve_category_image(category_id):
         try:
             logger.debug(f"Serving category image ID: {category_id}")
+            # Local disk cache first: a hit never checks out a DB connection
+            cached = serve_cached('category', category_id)
+            if cached is not None:
+                return cached
+            
+            # Metadata only; the bytes live in media_blobs and are fetched only when needed
             category = Category.query.get(category_id)
-            if not category or not category.image_data:
-                logger.warning(f"Category image not found: {category_id}")
+            if not category:
+                logger.warning(f"Category not found: {category_id}")
                 abort(404)
+
+            data = None
+            if not category.image_hash:
+                # Row written before hashes existed (or no image): hash once and persist
+                data = load_blob(category.image_blob_id)
+                if not data:
+                    logger.warning(f"Category image not found: {category_id}")
+                    abort(404)
+                category.image_hash = content_hash(data)
+                db.session.commit()
             
-            logger.debug(f"Serving category image from database: {category.image_filename}, {len(category.image_data)} bytes")
-            return send_file(
-                BytesIO(category.image_data), 
-                mimetype=category.image_content_type or 'application/octet-stream', 
-                download_name=category.image_filename
+            return serve_stored_image(
+                'category', category_id,
+                source_hash=category.image_hash,
+                content_type=category.image_content_type,
+                filename=category.image_filename,
+                last_modified=category.updated_at,
+                load_data=lambda: data or load_blob(category.image_blob_id),
             )
+        except HTTPException:
+            raise
         except Exception as e:
             logger.exception(f"Error serving category image {category_id}: {str(e)}")
             abort(500)
@@ -1,11 +1,11 @@
 # routes/chatbot.py
 
 import os
+import json
 import logging
-import traceback
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, abort, request, jsonify, url_for
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import NotFoundError, OpenAI
 
 # Fix import paths
 import sys
@@ -13,6 +13,11 @@ parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if parent_dir not in sys.path:
     sys.path.append(parent_dir)
 from app.models.client import db, ClientRequest
+from app.services.chat_engine import ChatTimeout, ChatTurn, collect, get_engine, sse_response, wants_stream
+from app.services.chat_memory import get_response_cache, get_thread_registry
+from app.services.voice_pipeline import (
+    STATUS_FAILED, STATUS_TRANSCRIBED, VoiceError, get_voice_pipeline, public_state,
+)
 
 # Fix expert_data import
 try:
@@ -56,6 +61,84 @@ chatbot_bp = Blueprint("chatbot", __name__)
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+def _replay(turn, answer):
+    turn.token(answer)
+    yield answer
+
+
+def _start_assistant(engine, registry, turn, question, context, assistant_id):
+    """Continue the visitor's thread for this chat, or open a new one.
+
+    A new thread gets the context message and any answers previously served
+    from the cache; an existing one only receives the new question.
+    """
+    thread_id = registry.get(turn.label)
+    if thread_id:
+        try:
+            deltas = engine.start(turn, assistant_id=assistant_id, messages=[question], thread_id=thread_id)
+            registry.touch(turn.label)
+            return deltas
+        except NotFoundError:
+            # Thread was deleted or expired on the OpenAI side
+            logger.info(f"Chat thread {thread_id} for {turn.label} is gone, starting a new one")
+            registry.forget(turn.label)
+    seed = []
+    for q, a in registry.pop_seed(turn.label):
+        seed += [{"role": "user", "content": q}, {"role": "assistant", "content": a}]
+    deltas = engine.start(turn, assistant_id=assistant_id, messages=[*context, *seed, question])
+    if turn.thread_id:
+        registry.remember(turn.label, turn.thread_id)
+    return deltas
+
+
+def _respond(turn, question, extra=None, context=(), **kwargs):
+    """SSE stream if the client asked for it, otherwise the classic JSON answer.
+
+    The first question of a conversation (and every completion-mode question)
+    is answered from the response cache when possible; assistant follow-ups
+    reuse the visitor's thread.
+    """
+    engine = get_engine(client)
+    cache = get_response_cache()
+    registry = get_thread_registry()
+    stream = wants_stream(request)
+
+    stateless = turn.mode != "assistant" or not registry.has_conversation(turn.label)
+    key = cache.key(turn.label, question) if stateless else None
+    cached = cache.get(key)
+    on_complete = None
+    try:
+        if cached is not None:
+            if turn.mode == "assistant":
+                registry.add_seed(turn.label, question, cached)
+            turn.mode = "cache"
+            extra = dict(extra or {}, cached=True)
+            deltas = _replay(turn, cached)
+        else:
+            if key is not None:
+                on_complete = lambda text: cache.put(key, text)
+            if turn.mode == "assistant":
+                deltas = _start_assistant(engine, registry, turn, question, context, kwargs["assistant_id"])
+            else:
+                deltas = engine.start(turn, messages=[question], **kwargs)
+        if stream:
+            return sse_response(turn, deltas, extra=extra, on_complete=on_complete)
+        text = collect(turn, deltas, on_complete=on_complete)
+    except ChatTimeout:
+        turn.finish(error="ChatTimeout")
+        logger.warning(f"Chat turn {turn.label} timed out")
+        return jsonify({"error": "Асистент не відповів вчасно, спробуйте ще раз"}), 504
+    except Exception as e:
+        turn.finish(error=type(e).__name__)
+        logger.exception(f"Помилка у асистенті ({turn.label})")
+        return jsonify({"error": "Асистент не зміг відповісти"}), 500
+    payload = dict(extra or {})
+    payload["response"] = text
+    response = jsonify(payload)
+    response.headers['Server-Timing'] = turn.server_timing()
+    return response
+
+
 # 🔹 Головний асистент (на головній сторінці)
 @chatbot_bp.route("/", methods=["POST"])
 def main_chatbot():
@@ -67,56 +150,27 @@ def main_chatbot():
     if not user_message:
         return jsonify({"error": "Порожнє повідомлення"}), 400
 
-    try:
-        # If we have a valid assistant ID and are not using chat completion, use the Assistants API
-        if assistant_id and not use_chat_completion:
-            thread = client.beta.threads.create()
-            client.beta.threads.messages.create(thread_id=thread.id, role="user", content=user_message)
-            run = client.beta.threads.runs.create(thread_id=thread.id, assistant_id=assistant_id)
-
-            while True:
-                run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-                if run.status == "completed":
-                    break
-                elif run.status == "failed":
-                    return jsonify({"error": "Асистент не зміг відповісти"}), 500
-
-            messages = client.beta.threads.messages.list(thread_id=thread.id)
-            last_message = messages.data[0].content[0].text.value
-            return jsonify({"response": last_message})
-        
-        # Fallback to Chat Completion API if assistant ID is not available or we've configured to use chat completion
-        else:
-            logger.info("Using Chat Completion API instead of Assistants API")
-            
-            # Load the detailed system instructions for the main assistant
-            system_message = get_system_instructions_cached(MAIN_ASSISTANT_INSTRUCTIONS_PATH)
-            
-            # Fallback if instructions can't be loaded
-            if not system_message:
-                system_message = "Ви професійний асистент сайту Rozoom. Допомагайте користувачам з їхніми запитаннями."
-            
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",  # Using gpt-4o-mini which your API key has access to
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.7
-            )
-            
-            return jsonify({"response": response.choices[0].message.content})
-    except Exception as e:
-        logger.exception("Помилка у головному асистенті")
-        return jsonify({"error": str(e)}), 500
+    # If we have a valid assistant ID and are not using chat completion, use the Assistants API
+    if assistant_id and not use_chat_completion:
+        return _respond(ChatTurn("main", "assistant"), user_message, assistant_id=assistant_id)
+
+    # Fallback to Chat Completion API if assistant ID is not available or we've configured to use chat completion
+    logger.info("Using Chat Completion API instead of Assistants API")
+    
+    # Load the detailed system instructions for the main assistant
+    system_message = get_system_instructions_cached(MAIN_ASSISTANT_INSTRUCTIONS_PATH)
+    
+    # Fallback if instructions can't be loaded
+    if not system_message:
+        system_message = "Ви професійний асистент сайту Rozoom. Допомагайте користувачам з їхніми запитаннями."
+    
+    return _respond(ChatTurn("main", "completion"), user_message, system_message=system_message)
 
 
 # 🔹 Тематичні асистенти (експерти за напрямами)
 @chatbot_bp.route("/<string:category>", methods=["POST"])
 def category_chatbot(category):
     data = request.get_json()
-    print("📥 Запит JSON:", request.data)  # Debug: вміст запиту
-    print("📥 Заголовки:", request.headers)  # Debug: заголовки запиту
     if not data or "message" not in data:
         return jsonify({"error": "Немає тексту повідомлення"}), 400
 
@@ -128,129 +182,158 @@ def category_chatbot(category):
     assistant_id = expert_info.get("assistant_id") or os.getenv("TASK_ASSISTANT_ID")
     use_chat_completion = os.getenv("USE_CHAT_COMPLETION", "false").lower() == "true"
 
-    try:
-        # If we have a valid assistant ID and are not using chat completion, use the Assistants API
-        if assistant_id and not use_chat_completion:
-            thread = client.beta.threads.create()
-
-            client.beta.threads.messages.create(
-                thread_id=thread.id,
-                role="user",
-                content=f"Користувач зараз у розділі '{category}' і хоче сформувати ТЗ. Врахуй це."
-            )
-
-            client.beta.threads.messages.create(
-                thread_id=thread.id,
-                role="user",
-                content=user_message
-            )
-
-            run = client.beta.threads.runs.create(thread_id=thread.id, assistant_id=assistant_id)
-
-            while True:
-                run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-                if run.status == "completed":
-                    break
-                elif run.status == "failed":
-                    return jsonify({"error": "Асистент не зміг відповісти"}), 500
-
-            messages = client.beta.threads.messages.list(thread_id=thread.id)
-            last_message = messages.data[0].content[0].text.value
-            return jsonify({"response": last_message})
-        
-        # Fallback to Chat Completion API if assistant ID is not available or we've configured to use chat completion
-        else:
-            logger.info(f"Using Chat Completion API instead of Assistants API for category {category}")
-            category_name = expert_info.get("name", category)
-            
-            # Try to load category-specific instructions
-            category_instructions_path = os.path.join(parent_dir, 'system_instructions', 'expert_instructions', f'{category}.md')
-            system_message = get_system_instructions_cached(category_instructions_path)
-            if not system_message:
-                # Generic fallback for TЗ structuring
-                generic_tz_path = os.path.join(parent_dir, 'system_instructions', 'expert_instructions', '_tz_assistant.md')
-                system_message = get_system_instructions_cached(generic_tz_path)
-            
-            # Fallback if category-specific instructions can't be loaded
-            if not system_message:
-                system_message = f"Ви експерт у сфері {category_name}. Користувач зараз у розділі '{category}' і хоче сформувати ТЗ. Допоможіть йому створити детальне технічне завдання на основі його запиту."
-            
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",  # Using gpt-4o-mini which your API key has access to
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.7
-            )
-            
-            return jsonify({"response": response.choices[0].message.content})
-    except Exception as e:
-        logger.exception(f"Помилка у асистенті категорії {category}")
-        return jsonify({"error": str(e)}), 500
+    # If we have a valid assistant ID and are not using chat completion, use the Assistants API
+    if assistant_id and not use_chat_completion:
+        context = f"Користувач зараз у розділі '{category}' і хоче сформувати ТЗ. Врахуй це."
+        return _respond(
+            ChatTurn(category, "assistant"),
+            user_message,
+            context=[context],
+            assistant_id=assistant_id,
+        )
+
+    # Fallback to Chat Completion API if assistant ID is not available or we've configured to use chat completion
+    logger.info(f"Using Chat Completion API instead of Assistants API for category {category}")
+    category_name = expert_info.get("name", category)
+    
+    # Try to load category-specific instructions
+    category_instructions_path = os.path.join(parent_dir, 'system_instructions', 'expert_instructions', f'{category}.md')
+    system_message = get_system_instructions_cached(category_instructions_path)
+    if not system_message:
+        # Generic fallback for TЗ structuring
+        generic_tz_path = os.path.join(parent_dir, 'system_instructions', 'expert_instructions', '_tz_assistant.md')
+        system_message = get_system_instructions_cached(generic_tz_path)
+    
+    # Fallback if category-specific instructions can't be loaded
+    if not system_message:
+        system_message = f"Ви експерт у сфері {category_name}. Користувач зараз у розділі '{category}' і хоче сформувати ТЗ. Допоможіть йому створити детальне технічне завдання на основі його запиту."
+    
+    return _respond(ChatTurn(category, "completion"), user_message, system_message=system_message)
 
 
 # 🔹 Обробка голосових повідомлень
+# Транскрипція виконується у фоні (app/services/voice_pipeline.py): клієнт
+# завантажує аудіо частинами, стежить за завданням і потім отримує відповідь.
+
+def _voice_pipeline_or_503():
+    pipeline = get_voice_pipeline()
+    if pipeline is None:
+        abort(503)
+    return pipeline
+
+
+def _voice_job(pipeline, job_id):
+    try:
+        return pipeline.status(job_id)
+    except KeyError:
+        abort(404)
+
+
+def _job_links(job_id):
+    return {
+        "job_id": job_id,
+        "status_url": url_for("chatbot.voice_job_status", job_id=job_id),
+        "events_url": url_for("chatbot.voice_job_events", job_id=job_id),
+        "reply_url": url_for("chatbot.voice_job_reply", job_id=job_id),
+    }
+
+
+def _submit_voice_job(pipeline, job_id):
+    try:
+        state = pipeline.submit(job_id)
+    except VoiceError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(dict(public_state(state), **_job_links(job_id))), 202
+
+
 @chatbot_bp.route("/voice", methods=["POST"])
 def voice_chatbot():
-    assistant_id = os.getenv("MAIN_ASSISTANT_ID")
-    use_chat_completion = os.getenv("USE_CHAT_COMPLETION", "false").lower() == "true"
+    """Whole recording in one multipart POST; answers 202 with the job links."""
+    pipeline = _voice_pipeline_or_503()
     audio_file = request.files.get("audio")
-
     if not audio_file:
         return jsonify({"error": "Немає аудіофайлу"}), 400
 
+    logger.info(f"Отримано аудіо: {audio_file.filename} ({audio_file.mimetype})")
+    job_id = pipeline.store.create(audio_file.mimetype or "audio/webm")
     try:
-        print("📥 Отримано файл:", audio_file.filename)
-        print("📦 MIME:", audio_file.mimetype)
+        pipeline.store.write_chunk(job_id, 0, audio_file.stream)
+    except VoiceError as e:
+        return jsonify({"error": str(e)}), 413
+    return _submit_voice_job(pipeline, job_id)
 
-        try:
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=(audio_file.filename, audio_file.stream, audio_file.mimetype),
-                response_format="text"
-            )
-        except Exception as exc:
-            if "whisper-1" in str(exc):
-                return jsonify({"error": "Ваш проект не має доступу до моделі 'whisper-1'. Перевірте налаштування API ключа."}), 403
-            raise exc
-
-        print("📝 Транскрипція:", transcription)
-
-        # If we have a valid assistant ID and are not using chat completion, use the Assistants API
-        if assistant_id and not use_chat_completion:
-            thread = client.beta.threads.create()
-            client.beta.threads.messages.create(thread_id=thread.id, role="user", content=transcription)
-            run = client.beta.threads.runs.create(thread_id=thread.id, assistant_id=assistant_id)
-
-            while True:
-                run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-                if run.status == "completed":
-                    break
-                elif run.status == "failed":
-                    return jsonify({"error": "Асистент не зміг відповісти"}), 500
-
-            messages = client.beta.threads.messages.list(thread_id=thread.id)
-            last_message = messages.data[0].content[0].text.value
-            
-            return jsonify({"transcription": transcription, "response": last_message})
-        
-        # Fallback to Chat Completion API if assistant ID is not available or we've configured to use chat completion
-        else:
-            logger.info("Using Chat Completion API instead of Assistants API for voice message")
-            system_message = "Ви професійний асистент, який відповідає на голосові запити користувачів. Дайте чітку та корисну відповідь на запит користувача."
-            
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",  # Using gpt-4o-mini which your API key has access to
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": transcription}
-                ],
-                temperature=0.7
-            )
-            
-            return jsonify({"transcription": transcription, "response": response.choices[0].message.content})
 
-    except Exception as e:
-        print("🔥 Внутрішня помилка:", traceback.format_exc())
-        return jsonify({"error": str(e)}), 500
+@chatbot_bp.route("/voice/uploads", methods=["POST"])
+def voice_upload_start():
+    pipeline = _voice_pipeline_or_503()
+    data = request.get_json(silent=True) or {}
+    job_id = pipeline.store.create(data.get("content_type") or "audio/webm")
+    return jsonify(_job_links(job_id)), 201
+
+
+@chatbot_bp.route("/voice/uploads/<job_id>/<int:index>", methods=["PUT", "POST"])
+def voice_upload_chunk(job_id, index):
+    pipeline = _voice_pipeline_or_503()
+    _voice_job(pipeline, job_id)
+    try:
+        received = pipeline.store.write_chunk(job_id, index, request.stream)
+    except VoiceError as e:
+        return jsonify({"error": str(e)}), 413
+    return jsonify({"job_id": job_id, "index": index, "bytes": received})
+
+
+@chatbot_bp.route("/voice/uploads/<job_id>/complete", methods=["POST"])
+def voice_upload_complete(job_id):
+    pipeline = _voice_pipeline_or_503()
+    _voice_job(pipeline, job_id)
+    return _submit_voice_job(pipeline, job_id)
+
+
+@chatbot_bp.route("/voice/jobs/<job_id>", methods=["GET"])
+def voice_job_status(job_id):
+    pipeline = _voice_pipeline_or_503()
+    return jsonify(public_state(_voice_job(pipeline, job_id)))
+
+
+@chatbot_bp.route("/voice/jobs/<job_id>/events", methods=["GET"])
+def voice_job_events(job_id):
+    """SSE: one ``status`` event per change until the job is transcribed or failed."""
+    pipeline = _voice_pipeline_or_503()
+    _voice_job(pipeline, job_id)
+
+    def generate():
+        for state in pipeline.watch(job_id):
+            yield f"event: status\ndata: {json.dumps(public_state(state), ensure_ascii=False)}\n\n"
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@chatbot_bp.route("/voice/jobs/<job_id>/reply", methods=["POST"])
+def voice_job_reply(job_id):
+    """Assistant answer to a transcribed voice message (SSE or JSON, like text chats)."""
+    pipeline = _voice_pipeline_or_503()
+    state = _voice_job(pipeline, job_id)
+    if state["status"] == STATUS_FAILED:
+        return jsonify({"error": state.get("error") or "Не вдалося розпізнати аудіо"}), 422
+    if state["status"] != STATUS_TRANSCRIBED:
+        return jsonify(public_state(state)), 409
+
+    transcription = state["transcription"]
+    logger.info(f"Транскрипція: {transcription[:200]}")
+    extra = {"transcription": transcription}
+    assistant_id = os.getenv("MAIN_ASSISTANT_ID")
+    use_chat_completion = os.getenv("USE_CHAT_COMPLETION", "false").lower() == "true"
+
+    # If we have a valid assistant ID and are not using chat completion, use the Assistants API
+    if assistant_id and not use_chat_completion:
+        return _respond(ChatTurn("voice", "assistant"), transcription, extra=extra,
+                        assistant_id=assistant_id)
+
+    # Fallback to Chat Completion API if assistant ID is not available or we've configured to use chat completion
+    logger.info("Using Chat Completion API instead of Assistants API for voice message")
+    system_message = "Ви професійний асистент, який відповідає на голосові запити користувачів. Дайте чітку та корисну відповідь на запит користувача."
+    return _respond(ChatTurn("voice", "completion"), transcription, extra=extra,
+                    system_message=system_message)
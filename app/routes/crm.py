@@ -2,9 +2,10 @@
 
 from flask import Blueprint, request, jsonify
 from app.models.client import db, Client, ClientRequest
-import requests
 import logging
 from app.models.project import create_project_from_request, APIKey
+from app.services import telegram
+from app.services.job_queue import enqueue, job_handler
 
 # Создаем Blueprint для CRM
 crm_bp = Blueprint("crm", __name__)
@@ -44,26 +45,42 @@ def get_telegram_credentials():
         return "7572478553:AAEJxJ9Il80zrHAjcD7ZcQnht3EP-sHYrjs", "7444992311"
 
 def send_telegram_message(text):
+    """Синхронная отправка (через общий пул соединений). Возвращает True/False."""
     try:
         token, chat_id = get_telegram_credentials()
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-        data = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
-        
         logger.info(f"Отправка сообщения в Telegram на чат ID: {chat_id}")
-        response = requests.post(url, data=data, timeout=10)
-        
-        logger.info(f"Статус ответа от Telegram: {response.status_code}")
-        
-        if response.status_code != 200:
-            logger.error(f"Ошибка отправки в Telegram: {response.text}")
-            return False
-            
+        telegram.send_message(token, chat_id, text)
         logger.info("Сообщение успешно отправлено в Telegram")
         return True
     except Exception as e:
         logger.error(f"Ошибка при отправке в Telegram: {e}")
         return False
 
+def queue_telegram_message(text):
+    """Ставит сообщение в очередь фоновых задач (коммитится вместе с вызывающим кодом)."""
+    return enqueue('telegram.send', {'text': text})
+
+@job_handler('telegram.send')
+def _telegram_job(payload):
+    token, chat_id = get_telegram_credentials()
+    # Исключение -> повтор с backoff, после max_attempts -> dead
+    telegram.send_message(token, chat_id, payload['text'])
+
+@job_handler('crm.create_project')
+def _create_project_job(payload):
+    from app.models.project import Project
+    client_request = ClientRequest.query.get(payload['request_id'])
+    if client_request is None:
+        logger.warning(f"Заявка {payload['request_id']} не найдена, проект не создан")
+        return
+    # Идемпотентность: повтор задачи не должен создать второй проект
+    if Project.query.filter_by(request_id=client_request.id).first():
+        return
+    project = create_project_from_request(client_request)
+    if not project:
+        raise RuntimeError(f"Не удалось создать проект для заявки {client_request.id}")
+    logger.info(f"Автоматически создан проект {project.id} для заявки {client_request.id}")
+
 # 🔹 Додати нового клієнта (опційно)
 @crm_bp.route("/clients", methods=["POST"])
 def add_client():
@@ -136,7 +153,7 @@ def submit_task():
     new_request.integrations = integrations
 
     db.session.add(new_request)
-    db.session.commit()
+    db.session.flush()  # нужен ID заявки для сообщения
 
     # Повне повідомлення в Telegram
     message = f"""
@@ -158,24 +175,11 @@ def submit_task():
 🆔 <b>ID заявки:</b> {new_request.id}
 """.strip()
 
-    # Отправляем в Telegram и логируем результат
-    telegram_sent = send_telegram_message(message)
-    if telegram_sent:
-        logger.info(f"Telegram уведомление отправлено для заявки {new_request.id}")
-    else:
-        logger.warning(f"Не удалось отправить Telegram уведомление для заявки {new_request.id}")
+    # Telegram-уведомление и автосоздание проекта выполняются в фоне;
+    # задачи коммитятся в одной транзакции с заявкой
+    queue_telegram_message(message)
+    enqueue('crm.create_project', {'request_id': new_request.id})
+    db.session.commit()
+    logger.info(f"Заявка {new_request.id} сохранена, уведомление и проект поставлены в очередь")
 
-    # Автоматическое создание проекта из ТЗ
-    try:
-        project = create_project_from_request(new_request)
-        if project:
-            logger.info(f"Автоматически создан проект {project.id} для заявки {new_request.id}")
-            return jsonify({
-                "message": "Заявка принята и проект создан", 
-                "request": new_request.to_dict(),
-                "project_id": project.id
-            }), 201
-    except Exception as e:
-        logger.error(f"Ошибка при автосоздании проекта: {e}")
-    
     return jsonify({"message": "Заявка принята", "request": new_request.to_dict()}), 201
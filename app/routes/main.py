@@ -5,6 +5,7 @@ import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 from config import Config
+from app.utils.db_health import db_exempt
 
 main_bp = Blueprint('main', __name__)
 
@@ -22,6 +23,7 @@ def index():
     return home()
 
 @main_bp.route('/set_language/<lang>')
+@db_exempt
 def set_language(lang):
     """Set language preference and redirect back to current page"""
     if lang in ['uk', 'de', 'en']:
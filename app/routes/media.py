@@ -1,8 +1,10 @@
 from flask import Blueprint, current_app, send_file, redirect, abort, url_for
-from io import BytesIO
+from werkzeug.exceptions import HTTPException
 import os
 import logging
-from app.models.product import ProductImage
+from app.models.database import db
+from app.models.product import ProductImage, content_hash, load_blob
+from app.utils.media_serving import serve_cached, serve_stored_image
 
 media = Blueprint('media', __name__)
 logger = logging.getLogger(__name__)
@@ -11,6 +13,12 @@ logger = logging.getLogger(__name__)
 def serve_image(image_id):
     try:
         logger.debug(f"Serving image ID: {image_id}")
+        # Local disk cache first: a hit never checks out a DB connection
+        cached = serve_cached('product', image_id)
+        if cached is not None:
+            return cached
+        
+        # Metadata only; the bytes live in media_blobs and are fetched only when needed
         img = ProductImage.query.get(image_id)
         if not img:
             logger.warning(f"Image not found in database: {image_id}")
@@ -21,16 +29,26 @@ def serve_image(image_id):
             logger.debug(f"Redirecting to external URL: {img.url}")
             return redirect(img.url)
         
-        if img.data:
-            logger.debug(f"Serving image from database: {img.filename}, {len(img.data)} bytes")
-            return send_file(
-                BytesIO(img.data), 
-                mimetype=img.content_type or 'application/octet-stream', 
-                download_name=img.filename
-            )
+        data = None
+        if not img.content_hash:
+            # Row written before hashes existed: hash once and persist
+            data = load_blob(img.blob_id)
+            if not data:
+                logger.warning(f"Image exists in database but has no data: {image_id}")
+                abort(404)
+            img.content_hash = content_hash(data)
+            db.session.commit()
         
-        logger.warning(f"Image exists in database but has no data: {image_id}")
-        abort(404)
+        return serve_stored_image(
+            'product', image_id,
+            source_hash=img.content_hash,
+            content_type=img.content_type,
+            filename=img.filename,
+            last_modified=img.created_at,
+            load_data=lambda: data or load_blob(img.blob_id),
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(f"Error serving image {image_id}: {str(e)}")
         abort(500)
@@ -1,33 +1,15 @@
 # routes/pages.py
 from flask import Blueprint, render_template, session, request, flash, redirect, url_for
+from app import i18n
+from app.models.database import db
+from app.routes.crm import queue_telegram_message
 
 pages_bp = Blueprint('pages', __name__)
 
 # Translation helper function
 def get_page_text(key, lang=None):
-    """Get translated text for page messages"""
-    if lang is None:
-        lang = session.get("lang", "de")
-    
-    translations = {
-        'message_sent': {
-            'uk': 'Повідомлення надіслано успішно.',
-            'de': 'Nachricht erfolgreich gesendet.',
-            'en': 'Message sent successfully.'
-        },
-        'send_error': {
-            'uk': 'Виникла помилка при надсиланні.',
-            'de': 'Beim Senden ist ein Fehler aufgetreten.',
-            'en': 'An error occurred while sending.'
-        },
-        'fill_all_fields': {
-            'uk': 'Заповніть усі поля.',
-            'de': 'Bitte füllen Sie alle Felder aus.',
-            'en': 'Please fill in all fields.'
-        }
-    }
-    
-    return translations.get(key, {}).get(lang, translations.get(key, {}).get('en', key))
+    """Get translated text for page messages (catalog app/translations/pages.json)"""
+    return i18n.gettext(f'pages.{key}', lang, default=key)
 
 @pages_bp.route('/privacy')
 def privacy():
@@ -61,9 +43,12 @@ def contact():
                   f"📧 <b>Email:</b> {email}\n" \
                   f"📝 <b>Повідомлення:</b> {message}"
             try:
-                send_telegram_message(msg)  # або email
+                # Отправка в фоне (очередь задач), запрос не ждёт Telegram
+                queue_telegram_message(msg)
+                db.session.commit()
                 flash(get_page_text('message_sent'), "success")
             except Exception as e:
+                db.session.rollback()
                 print(f"❌ Не вдалося надіслати повідомлення: {e}")
                 flash(get_page_text('send_error'), "error")
         else:
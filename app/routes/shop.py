@@ -1,17 +1,23 @@
 """Shop routes for RoZoom website"""
 from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, session, current_app
 from flask_login import current_user, login_required
+from app import i18n
 from app.models.database import db
 from app.models.product import Category, Product
 from app.models.shop import Cart, CartItem
-from app.models.order import Order, OrderItem, Payment
-from app.models.project import ProjectStage
+from app.models.order import Order, OrderStatus, Payment, PaymentStatus
 from app.models.user import User
+from app.services import catalog, search, stock, stripe_events
+from app.services import checkout as checkout_pipeline
+from app.utils.cart_summary import remember_cart_count
+from app.utils.metrics import outbound_call
 import stripe
 import secrets
 import datetime
+import time
 import logging
 from sqlalchemy import text
+from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import SQLAlchemyError, OperationalError, ProgrammingError
 
 # Create a custom handler to intercept warnings about insufficient stock
@@ -30,129 +36,8 @@ shop_bp = Blueprint("shop", __name__)
 
 # Translation helper function
 def get_shop_text(key, lang=None):
-    """Get translated text for shop messages"""
-    if lang is None:
-        lang = session.get("lang", "de")
-    
-    translations = {
-        'product_added': {
-            'uk': 'Товар додано до кошика',
-            'de': 'Produkt zum Warenkorb hinzugefügt',
-            'en': 'Product added to cart'
-        },
-        'product_not_found': {
-            'uk': 'Товар не знайдено',
-            'de': 'Produkt nicht gefunden',
-            'en': 'Product not found'
-        },
-        'product_id_required': {
-            'uk': 'Необхідно вказати ID товару',
-            'de': 'Produkt-ID ist erforderlich',
-            'en': 'Product ID is required'
-        },
-        'invalid_product_id': {
-            'uk': 'Невірний формат ID товару',
-            'de': 'Ungültiges Produkt-ID-Format',
-            'en': 'Invalid product ID format'
-        },
-        'quantity_min_1': {
-            'uk': 'Кількість повинна бути не менше 1',
-            'de': 'Menge muss mindestens 1 sein',
-            'en': 'Quantity must be at least 1'
-        },
-        'error_processing_request': {
-            'uk': 'Помилка обробки запиту',
-            'de': 'Fehler bei der Verarbeitung der Anfrage',
-            'en': 'Error processing request'
-        },
-        'error_form_data': {
-            'uk': 'Помилка обробки даних форми',
-            'de': 'Fehler bei der Verarbeitung der Formulardaten',
-            'en': 'Error processing form data'
-        },
-        'error_retrieving_product': {
-            'uk': 'Помилка отримання інформації про товар',
-            'de': 'Fehler beim Abrufen der Produktinformationen',
-            'en': 'Error retrieving product information'
-        },
-        'unexpected_error': {
-            'uk': 'Сталася непередбачена помилка',
-            'de': 'Ein unerwarteter Fehler ist aufgetreten',
-            'en': 'An unexpected error occurred'
-        },
-        'error_processing_cart': {
-            'uk': 'Помилка обробки кошика',
-            'de': 'Fehler bei der Verarbeitung des Warenkorbs',
-            'en': 'Error processing cart'
-        },
-        'added_to_cart': {
-            'uk': 'додано до кошика',
-            'de': 'zum Warenkorb hinzugefügt',
-            'en': 'added to cart'
-        },
-        'cart_update_error': {
-            'uk': 'Сталася помилка при оновленні кошика. Спробуйте ще раз.',
-            'de': 'Beim Aktualisieren Ihres Warenkorbs ist ein Fehler aufgetreten. Bitte versuchen Sie es erneut.',
-            'en': 'An error occurred while updating your cart. Please try again.'
-        },
-        'invalid_item_quantity': {
-            'uk': 'Невірний товар або кількість',
-            'de': 'Ungültiger Artikel oder Menge',
-            'en': 'Invalid item or quantity'
-        },
-        'item_removed': {
-            'uk': 'Товар видалено з кошика',
-            'de': 'Artikel aus dem Warenkorb entfernt',
-            'en': 'Item removed from cart'
-        },
-        'cart_updated': {
-            'uk': 'Кошик оновлено',
-            'de': 'Warenkorb aktualisiert',
-            'en': 'Cart updated'
-        },
-        'cart_empty': {
-            'uk': 'Ваш кошик порожній',
-            'de': 'Ihr Warenkorb ist leer',
-            'en': 'Your cart is empty'
-        },
-        'fill_required_fields': {
-            'uk': 'Будь ласка, заповніть усі обов\'язкові поля',
-            'de': 'Bitte füllen Sie alle erforderlichen Felder aus',
-            'en': 'Please fill in all required fields'
-        },
-        'checkout_error': {
-            'uk': 'Помилка створення сесії оплати',
-            'de': 'Fehler beim Erstellen der Checkout-Sitzung',
-            'en': 'Error creating checkout session'
-        },
-        'order_cancelled': {
-            'uk': 'Ваше замовлення було скасовано',
-            'de': 'Ihre Bestellung wurde storniert',
-            'en': 'Your order has been cancelled'
-        },
-        'cart_cleared': {
-            'uk': 'Кошик очищено',
-            'de': 'Warenkorb geleert',
-            'en': 'Cart cleared'
-        },
-        'coupon_missing': {
-            'uk': 'Код купона відсутній',
-            'de': 'Gutscheincode fehlt',
-            'en': 'Coupon code missing'
-        },
-        'coupon_applied': {
-            'uk': 'Купон застосовано',
-            'de': 'Gutschein angewendet',
-            'en': 'Coupon applied'
-        },
-        'invalid_coupon': {
-            'uk': 'Невірний код купона',
-            'de': 'Ungültiger Gutscheincode',
-            'en': 'Invalid coupon code'
-        }
-    }
-    
-    return translations.get(key, {}).get(lang, translations.get(key, {}).get('en', key))
+    """Get translated text for shop messages (catalog app/translations/shop.json)"""
+    return i18n.gettext(f'shop.{key}', lang, default=key)
 
 shop_bp = Blueprint("shop", __name__)
 
@@ -199,26 +84,14 @@ def ensure_order_items_schema():
         except Exception:
             pass
         return False
-def get_cart():
-    """Get or create a cart with resilient handling of aborted transactions (25P02).
-    Always rolls back before write after any previous failure in the same request cycle.
+def get_cart(create=False):
+    """Get (and with ``create=True``, create) the visitor's cart, resilient to aborted transactions (25P02).
+    Without ``create`` a missing cart is returned as an empty transient Cart, so read-only
+    pages never insert a row; only adding an item persists one.
+    Connection liveness is handled by app/utils/db_health.py, so no ping is issued here;
+    lookups roll back on SQLAlchemyError before any write.
     """
     from sqlalchemy.exc import SQLAlchemyError
-    from sqlalchemy import text
-    
-    # Always rollback first to ensure clean transaction state
-    try:
-        db.session.rollback()
-        # Test if database connection is alive with simple query
-        db.session.execute(text('SELECT 1'))
-    except Exception as e:
-        current_app.logger.warning(f"Database connection issue in get_cart initial check: {e}")
-        try:
-            # Last resort - dispose engine to force new connections
-            db.get_engine().dispose()
-            db.session.rollback()
-        except Exception:
-            pass
     
     try:
         # Get cart with retry logic
@@ -254,6 +127,8 @@ def get_cart():
             cart = get_authenticated_cart()
             if cart:
                 return cart
+            if not create:
+                return Cart(user_id=current_user.id)
             # Create new cart
             cart = Cart(user_id=current_user.id, session_id=secrets.token_hex(16))
             db.session.add(cart)
@@ -264,6 +139,8 @@ def get_cart():
             cart = get_session_cart()
             if cart:
                 return cart
+            if not create:
+                return Cart()
             # create new guest cart
             cart = Cart(session_id=secrets.token_hex(16))
             db.session.add(cart)
@@ -292,13 +169,13 @@ def merge_carts(session_cart, user_cart):
     if not session_cart or not user_cart:
         return
         
+    # Items already in the user's cart, in one query instead of one per merged item
+    user_items = {item.product_id: item for item in CartItem.query.filter_by(cart_id=user_cart.id)}
+    
     # Transfer items from session cart to user cart
     for item in session_cart.items:
         # Check if product already exists in user's cart
-        existing_item = CartItem.query.filter_by(
-            cart_id=user_cart.id,
-            product_id=item.product_id
-        ).first()
+        existing_item = user_items.get(item.product_id)
         
         if existing_item:
             # Update quantity
@@ -312,6 +189,7 @@ def merge_carts(session_cart, user_cart):
                 price=item.price
             )
             db.session.add(new_item)
+            user_items[item.product_id] = new_item
     
     # Delete session cart
     db.session.delete(session_cart)
@@ -320,6 +198,7 @@ def merge_carts(session_cart, user_cart):
     # Remove cart_id from session
     if 'cart_id' in session:
         session.pop('cart_id')
+    remember_cart_count(sum(i.quantity for i in user_cart.items))
 
 # Import reconnect function at module level
 from app.models.database import reconnect_database
@@ -406,58 +285,118 @@ def index():
             single_product=single_product
         )
 
+def _catalog_page(sort_by, category, after):
+    """Fetch a page for the catalog views; an invalid cursor restarts from page one."""
+    try:
+        return catalog.fetch_page(sort_by, category.id if category else None, after)
+    except catalog.InvalidCursor:
+        current_app.logger.info(f"Ignoring invalid catalog cursor {after!r}")
+        return catalog.fetch_page(sort_by, category.id if category else None)
+
+
+def _search_page(search_query, category, after):
+    """Ranked search results; for search the cursor is simply the next page number."""
+    page_number = 1
+    if after:
+        if not after.isdigit():
+            raise catalog.InvalidCursor(after)
+        page_number = int(after)
+    results = search.search_products(search_query, page=page_number,
+                                     category_id=category.id if category else None)
+    has_more = results.page * results.per_page < results.total
+    next_cursor = str(results.page + 1) if has_more else None
+    return catalog.CatalogPage(results.items, next_cursor), results.total
+
+
 @shop_bp.route('/products')
 def products():
-    """Product catalog with filters"""
+    """Product catalog with filters (first page; more via /api/products)"""
     # Get query parameters for filtering
     category_slug = request.args.get('category')
-    sort_by = request.args.get('sort', 'name_asc')  # Default sort by name ascending
-    
+    sort_by = catalog.normalize_sort(request.args.get('sort'))  # Default sort by name ascending
+    after = request.args.get('after')
+
+    search_query = (request.args.get('q') or '').strip()
+
+    # Sidebar categories with product counts (cached, see app/services/catalog.py)
+    categories = catalog.category_sidebar()
+    selected_category = catalog.find_category(categories, category_slug)
+    total_count = None
     try:
-        # Base query - ensure we only get products with valid slugs
-        query = Product.query.filter(
-            Product.is_active == True,
-            Product.slug != None,  # Ensure we only get products with valid slugs
-            Product.slug != ''     # Extra check for empty strings
-        )
-        
-        # Apply category filter if provided
-        if category_slug:
-            category = Category.query.filter_by(slug=category_slug).first()
-            if category:
-                query = query.filter_by(category_id=category.id)
-        
-        # Apply sorting
-        if sort_by == 'name_asc':
-            query = query.order_by(Product.name.asc())
-        elif sort_by == 'name_desc':
-            query = query.order_by(Product.name.desc())
-        elif sort_by == 'price_asc':
-            query = query.order_by(Product.price.asc())
-        elif sort_by == 'price_desc':
-            query = query.order_by(Product.price.desc())
-        elif sort_by == 'newest':
-            query = query.order_by(Product.created_at.desc())
-            
-        # Get all products with applied filters
-        products = query.all()
-        
-        # Log the number of valid products found
-        current_app.logger.debug(f"Found {len(products)} valid products with slugs")
-        
+        if search_query:
+            page, total_count = _search_page(search_query, selected_category, after)
+        else:
+            page = _catalog_page(sort_by, selected_category, after)
     except Exception as e:
         current_app.logger.error(f"Error fetching products: {str(e)}")
-        products = []
-    
-    # Get all categories for sidebar
-    categories = Category.query.all()
-    
-    return render_template('shop/products.html', 
-                          products=products,
+        page = catalog.CatalogPage([], None)
+
+    if total_count is None:
+        if selected_category:
+            total_count = selected_category.product_count
+        else:
+            total_count = sum(cat.product_count for cat in categories)
+
+    return render_template('shop/products.html',
+                          products=page.items,
+                          next_cursor=page.next_cursor,
+                          total_count=total_count,
                           categories=categories,
+                          selected_category=selected_category,
                           current_category=category_slug,
+                          search_query=search_query,
+                          sort=sort_by,
                           sort_by=sort_by)
 
+
+@shop_bp.route('/api/products')
+def products_api():
+    """Catalog page as JSON for infinite scroll: ``?sort=&category=&after=<cursor>``."""
+    sort_by = catalog.normalize_sort(request.args.get('sort'))
+    categories = catalog.category_sidebar()
+    category_slug = request.args.get('category')
+    selected_category = catalog.find_category(categories, category_slug)
+    if category_slug and not selected_category:
+        return jsonify({'error': 'Unknown category'}), 404
+    search_query = (request.args.get('q') or '').strip()
+    try:
+        if search_query:
+            page, _ = _search_page(search_query, selected_category, request.args.get('after'))
+        else:
+            page = catalog.fetch_page(sort_by, selected_category.id if selected_category else None,
+                                      request.args.get('after'))
+    except catalog.InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    items = [{
+        'id': product.id,
+        'name': product.name,
+        'slug': product.slug,
+        'url': url_for('shop.product_detail', slug=product.slug),
+        'short_description': product.short_description,
+        'price': product.price,
+        'sale_price': product.sale_price,
+        'image': product.image,
+        'duration': product.duration,
+        'rating': round(product.average_rating, 2),
+        'review_count': product.review_count,
+    } for product in page.items]
+    # Pre-rendered cards, so the page doesn't duplicate the card markup in JS
+    html = render_template('shop/_product_cards.html', products=page.items)
+    return jsonify({'items': items, 'html': html, 'next_cursor': page.next_cursor})
+
+
+@shop_bp.route('/api/search/suggest')
+def search_suggest():
+    """Typeahead: best matches for a partially typed query."""
+    suggestions = search.typeahead(request.args.get('q', ''))
+    for item in suggestions:
+        item['url'] = url_for('shop.product_detail', slug=item['slug'])
+    response = jsonify({'items': suggestions})
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
 @shop_bp.route('/product/<slug>')
 def product_detail(slug):
     """Product detail page"""
@@ -499,8 +438,10 @@ def cart():
     total_quantity = 0
     subtotal = 0.0
     discount = 0.0
-    for item in cart.items:
-        # Ensure product relationship is loaded
+    # Items together with their products: item.product was one lazy SELECT per row
+    items = (CartItem.query.options(joinedload(CartItem.product))
+             .filter_by(cart_id=cart.id).order_by(CartItem.id).all()) if cart.id else []
+    for item in items:
         prod = item.product
         qty = int(item.quantity or 0)
         price = float(item.price or (prod.sale_price if prod.sale_price else prod.price or 0))
@@ -548,7 +489,7 @@ def add_to_cart():
             product = Product.query.get(product_id)
             if product:
                 # Get or create cart
-                cart = get_cart()
+                cart = get_cart(create=True)
                 
                 # Check if product already in cart
                 cart_item = CartItem.query.filter_by(cart_id=cart.id, product_id=product_id).first()
@@ -575,7 +516,9 @@ def add_to_cart():
                     db.session.add(cart_item)
                 
                 db.session.commit()
-                return jsonify({'success': True, 'message': get_shop_text('product_added'), 'cart_count': sum(item.quantity for item in cart.items)}), 200
+                cart_count = sum(item.quantity for item in cart.items)
+                remember_cart_count(cart_count)
+                return jsonify({'success': True, 'message': get_shop_text('product_added'), 'cart_count': cart_count}), 200
             else:
                 return jsonify({'success': False, 'message': get_shop_text('product_not_found')}), 404
         else:
@@ -649,10 +592,9 @@ def add_to_cart():
             current_app.logger.debug(f"Found product: id={product.id}, name={product.name}, slug={product.slug}, active={product.is_active}")
             current_app.logger.debug(f"Price: {product.price}, Sale price: {product.sale_price}, Stock: {product.stock}")
             
-            # ENSURE PRODUCT IS ALWAYS AVAILABLE FOR PURCHASE
-            # Override stock constraints for all products
-            product.stock = 999  # Set high stock value
-            product.in_stock = True  # Ensure product is marked as in stock
+            # Stock is not checked when adding to the cart; checkout reserves it
+            # (app/services/stock.py). Never write to product.stock here: the
+            # change would be committed together with the cart.
             
         except Exception as e:
             current_app.logger.error(f"Database error fetching product: {str(e)}")
@@ -678,7 +620,7 @@ def add_to_cart():
         return jsonify({'success': False, 'message': get_shop_text('unexpected_error')}), 500
     
     try:
-        cart = get_cart()
+        cart = get_cart(create=True)
         current_app.logger.debug(f"Got cart with ID: {cart.id}")
         
         # Check if product already in cart
@@ -730,6 +672,8 @@ def add_to_cart():
         except Exception as e:
             current_app.logger.error(f"Error calculating cart count: {str(e)}")
             cart_count = 1  # Fallback value
+        else:
+            remember_cart_count(cart_count)
         
         return jsonify({
             'success': True, 
@@ -787,6 +731,7 @@ def update_cart():
     cart = get_cart()  # Refresh cart to get updated items
     subtotal = sum(item.quantity * item.price for item in cart.items)
     cart_count = sum(item.quantity for item in cart.items)
+    remember_cart_count(cart_count)
     
     return jsonify({
         'success': True,
@@ -804,11 +749,12 @@ def remove_from_cart(item_id):
 
     db.session.delete(cart_item)
     db.session.commit()
+    cart_count = sum(i.quantity for i in get_cart().items)
+    remember_cart_count(cart_count)
 
     if request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         # Return JSON for AJAX callers
-        cart = get_cart()
-        return jsonify({'success': True, 'message': get_shop_text('item_removed'), 'cart_count': sum(i.quantity for i in cart.items)})
+        return jsonify({'success': True, 'message': get_shop_text('item_removed'), 'cart_count': cart_count})
 
     flash(get_shop_text('item_removed'), 'success')
     return redirect(url_for('shop.cart'))
@@ -824,6 +770,13 @@ def checkout():
         return redirect(url_for('shop.cart'))
     
     if request.method == 'POST':
+        # One query for the items and their products; the snapshot feeds the
+        # order, the stock reservation and Stripe (app/services/checkout.py)
+        snapshot = checkout_pipeline.load_cart(cart.id)
+        if not snapshot:
+            flash(get_shop_text('cart_empty'), 'warning')
+            return redirect(url_for('shop.cart'))
+
         # Process checkout form
         if not current_user.is_authenticated:
             # Handle guest checkout
@@ -848,8 +801,8 @@ def checkout():
                 last_name=last_name,
                 order_status='pending',
                 payment_method='stripe',
-                subtotal=cart.subtotal,
-                total=cart.subtotal,  # No tax or shipping for digital goods
+                subtotal=snapshot.subtotal,
+                total=snapshot.subtotal,  # No tax or shipping for digital goods
             )
         else:
             # Generate unique order number
@@ -868,57 +821,31 @@ def checkout():
                 last_name=last_name,
                 order_status='pending',
                 payment_method='stripe',
-                subtotal=cart.subtotal,
-                total=cart.subtotal,  # No tax or shipping for digital goods
+                subtotal=snapshot.subtotal,
+                total=snapshot.subtotal,  # No tax or shipping for digital goods
             )
         
         db.session.add(order)
         db.session.flush()  # Generate order ID without committing
         
-        # Add order items
-        for item in cart.items:
-            order_item = OrderItem(
-                order_id=order.id,
-                product_id=item.product_id,
-                product_name=item.product.name,
-                product_slug=item.product.slug,
-                product_duration=getattr(item.product, 'duration', None),
-                price_per_unit=item.price,
-                quantity=item.quantity,
-                total_price=item.subtotal,
-                project_stage_id=getattr(item, 'project_stage_id', None),
-                billed_hours=item.quantity if getattr(item, 'project_stage_id', None) else 0
-            )
-            db.session.add(order_item)
-            
-            # Update product stock
-            item.product.stock -= item.quantity
+        # All order items in one executemany, sales rollups included
+        checkout_pipeline.create_order_items(order, snapshot)
         
-        # Close the cart
-        cart.status = 'closed'
+        # Take the stock for the whole order in one conditional UPDATE (app/services/stock.py)
+        quantities = snapshot.quantities
+        try:
+            reservation_expires = stock.reserve(order.id, quantities)
+            db.session.commit()
+        except stock.InsufficientStock:
+            db.session.rollback()
+            short = stock.shortages(quantities)
+            names = ', '.join(p.name for p in Product.query.filter(Product.id.in_(list(short))))
+            current_app.logger.info(f"Checkout rejected, insufficient stock: {short}")
+            flash(f'{get_shop_text("insufficient_stock")}: {names}', 'danger')
+            return redirect(url_for('shop.cart'))
         
         # Create Stripe checkout session
-        line_items = []
-        test_price = current_app.config.get('STRIPE_TEST_PRICE_ID')
-        for item in cart.items:
-            product = item.product
-            # Prefer explicit Stripe price id on product, then global test price id
-            stripe_price_id = getattr(product, 'stripe_price_id', None) or test_price
-            if stripe_price_id:
-                line_items.append({'price': stripe_price_id, 'quantity': item.quantity})
-            else:
-                # Fallback to inline price_data if no price id is available
-                line_items.append({
-                    'price_data': {
-                        'currency': 'eur',
-                        'unit_amount': int(item.price * 100),  # Convert to cents
-                        'product_data': {
-                            'name': product.name,
-                            'description': product.short_description
-                        }
-                    },
-                    'quantity': item.quantity
-                })
+        line_items = checkout_pipeline.stripe_line_items(snapshot, current_app.config.get('STRIPE_TEST_PRICE_ID'))
             
         try:
             # Ensure Stripe API key is loaded from app config at runtime
@@ -928,33 +855,53 @@ def checkout():
                 raise ValueError("STRIPE_SECRET_KEY not found in config")
             stripe.api_key = stripe_secret
 
-            checkout_session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=line_items,
-                mode='payment',
-                success_url=url_for('shop.payment_success', order_id=order.id, _external=True),
-                cancel_url=url_for('shop.payment_cancel', order_id=order.id, _external=True),
-                metadata={
-                    'order_id': order.id
-                }
-            )
+            session_params = {}
+            if reservation_expires is not None:
+                # Stripe accepts 30 minutes to 24 hours; the session must not outlive the reservation
+                session_params['expires_at'] = int(time.time()) + max(1800, min(stock.reservation_ttl(), 86400))
+            with outbound_call('stripe', 'checkout.Session.create'):
+                checkout_session = stripe.checkout.Session.create(
+                    payment_method_types=['card'],
+                    line_items=line_items,
+                    mode='payment',
+                    success_url=url_for('shop.payment_success', order_id=order.id, _external=True),
+                    cancel_url=url_for('shop.payment_cancel', order_id=order.id, _external=True),
+                    metadata={
+                        'order_id': order.id
+                    },
+                    # Lets payment_intent.* webhooks find the order
+                    payment_intent_data={'metadata': {'order_id': order.id}},
+                    **session_params
+                )
             
             # Create payment record
             payment = Payment(
                 order_id=order.id,
-                amount=cart.subtotal,
+                amount=snapshot.subtotal,
                 provider='stripe',
                 provider_payment_id=checkout_session.id,
                 status='pending'
             )
             db.session.add(payment)
+            # Close the cart
+            cart.status = 'closed'
             db.session.commit()
+            remember_cart_count(0)
             
             # Redirect to Stripe
             return redirect(checkout_session.url)
             
         except Exception as e:
             current_app.logger.error(f'Stripe checkout session creation failed: {str(e)}')
+            db.session.rollback()
+            # The order and its reservation are already committed; give the stock back
+            try:
+                stock.release(order.id, 'checkout_error')
+                order.order_status = OrderStatus.CANCELLED.value
+                db.session.commit()
+            except Exception as release_error:
+                db.session.rollback()
+                current_app.logger.error(f'Could not release stock of order {order.id}: {release_error}')
             flash(f'{get_shop_text("checkout_error")}: {str(e)}', 'danger')
             return render_template('shop/checkout.html', cart=cart)
     
@@ -971,6 +918,7 @@ def clear_cart():
     # Reset session cart id for guest
     if 'cart_id' in session:
         session.pop('cart_id')
+    remember_cart_count(0)
     return jsonify({'success': True, 'message': get_shop_text('cart_cleared'), 'cart_count': 0})
 
 
@@ -1016,19 +964,8 @@ def payment_success():
     if 'cart_id' in session:
         session.pop('cart_id')
         
-    # Обновляем стадии проекта если оплачивались часы
-    try:
-        stage_items = [oi for oi in order.items if getattr(oi, 'project_stage_id', None)]
-        for oi in stage_items:
-            stage = ProjectStage.query.get(oi.project_stage_id)
-            if stage:
-                stage.billed_hours = (stage.billed_hours or 0) + (oi.billed_hours or oi.quantity or 0)
-                if stage.billed_hours >= (stage.estimated_hours or 0):
-                    stage.is_paid = True
-        db.session.commit()
-    except Exception as e:
-        current_app.logger.error(f"Stage billing update failed: {e}")
-        db.session.rollback()
+    # Billed hours of project stages are added once the payment is confirmed
+    # by the Stripe webhook worker (app/services/stripe_events.py)
     return render_template('shop/payment_success.html', order=order)
 
 @shop_bp.route('/payment/cancel')
@@ -1039,20 +976,20 @@ def payment_cancel():
     if not order_id:
         return redirect(url_for('shop.cart'))
         
-    # Update order status
     order = Order.query.get_or_404(order_id)
-    order.status = 'cancelled'
-    
-    # Restore stock
-    for item in order.items:
-        item.product.stock += item.quantity
-    
-    # Update payment record
-    payment = Payment.query.filter_by(order_id=order.id).first()
-    if payment:
-        payment.status = 'cancelled'
-    
-    db.session.commit()
+    # A paid order is not cancelled by revisiting the cancel URL
+    if getattr(order.payment_status, 'value', order.payment_status) != PaymentStatus.PAID.value:
+        order.order_status = OrderStatus.CANCELLED.value
+        
+        # Give the reserved stock back (only once, however often this is called)
+        stock.release(order.id, 'cancelled')
+        
+        # Update payment record
+        payment = Payment.query.filter_by(order_id=order.id).first()
+        if payment and payment.status == 'pending':
+            payment.status = 'cancelled'
+        
+        db.session.commit()
     
     flash(get_shop_text('order_cancelled'), 'info')
     return redirect(url_for('shop.cart'))
@@ -1071,7 +1008,7 @@ def orders():
         pass
     
     try:
-        orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
+        orders = User.orders_for(current_user.id).all()
         return render_template('shop/orders.html', orders=orders)
     except SQLAlchemyError as e:
         current_app.logger.error(f"Database error in orders view: {e}")
@@ -1105,37 +1042,10 @@ def order_detail(order_id):
 # Webhook for Stripe events
 @shop_bp.route('/webhook', methods=['POST'])
 def stripe_webhook():
-    """Handle Stripe webhook events"""
-    payload = request.data
-    sig_header = request.headers.get('Stripe-Signature')
-    
+    """Store a Stripe event for the worker and acknowledge it (app/services/stripe_events.py)"""
     try:
-        webhook_secret = current_app.config.get('STRIPE_WEBHOOK_SECRET')
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, webhook_secret
-        )
-    except ValueError:
-        return jsonify({'error': 'Invalid payload'}), 400
-    except stripe.error.SignatureVerificationError:
-        return jsonify({'error': 'Invalid signature'}), 400
-    
-    # Handle specific events
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        order_id = session.get('metadata', {}).get('order_id')
-        
-        if order_id:
-            order = Order.query.get(order_id)
-            if order:
-                # Update order status
-                order.status = 'paid'
-                
-                # Update payment record
-                payment = Payment.query.filter_by(order_id=order.id).first()
-                if payment:
-                    payment.status = 'completed'
-                    payment.provider_payment_id = session.get('payment_intent')
-                
-                db.session.commit()
-    
+        stripe_events.receive(request.get_data(), request.headers.get('Stripe-Signature'))
+    except stripe_events.WebhookRejected as e:
+        current_app.logger.warning(f"Stripe webhook rejected: {e}")
+        return jsonify({'error': str(e)}), 400
     return jsonify({'success': True})
@@ -0,0 +1,391 @@
+"""
+Database bootstrap, run once per deploy with ``flask bootstrap run``.
+
+Model imports, ``init_db`` and ``run.py`` used to create schemas and tables,
+ALTER legacy columns and look up the admin user on every boot, and with
+``preload_app`` and ``max_requests`` that is every worker restart. This
+module does the same work in numbered steps:
+
+* a step runs once and is recorded in ``bootstrap_steps``. Steps added
+  later get the next version and run on the next deploy;
+* a ``repeatable`` step (``CREATE ... IF NOT EXISTS`` work) runs on every
+  bootstrap, so tables of newly added models appear without a new step;
+* every step is idempotent, so ``--force`` or a half-finished deploy can
+  simply run it again.
+
+Production runs this bootstrap, not the Alembic chain, so every migration
+has its counterpart here. New tables come from step 2 and new model indexes
+from step 8. Everything else a migration does to existing tables has its own
+step: added columns (``add_missing_columns``), data changes and the search
+index. tests/test_bootstrap.py checks that the steps bring a database without
+them up to the models. ``DB_BOOTSTRAP_ON_STARTUP`` runs the bootstrap
+inside ``create_app`` for setups without a deploy hook (local development).
+"""
+import logging
+import os
+import time
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import inspect, text
+
+from app.models.bootstrap import BootstrapStep
+from app.models.database import db
+
+logger = logging.getLogger(__name__)
+
+Step = namedtuple('Step', 'version name func repeatable')
+
+_steps = []
+
+
+class StepSkipped(Exception):
+    """Raised by a step that cannot run yet; it is not recorded and runs next time."""
+
+
+def bootstrap_step(version, name, repeatable=False):
+    """Register ``func(engine)`` as bootstrap step ``version``."""
+    def decorator(func):
+        _steps.append(Step(version, name, func, repeatable))
+        _steps.sort(key=lambda step: step.version)
+        return func
+    return decorator
+
+
+def steps():
+    return list(_steps)
+
+
+# --- steps ---------------------------------------------------------------
+
+@bootstrap_step(1, 'schemas', repeatable=True)
+def create_schemas(engine):
+    """CREATE SCHEMA for every schema the models and the config refer to (PostgreSQL)."""
+    if engine.dialect.name != 'postgresql':
+        return 'skipped: schemas are PostgreSQL only'
+    config = current_app.config
+    schemas = {table.schema for table in db.metadata.tables.values() if table.schema}
+    schemas.update(filter(None, (config.get('CLIENT_REQUESTS_SCHEMA'), config.get('SHOP_SCHEMA'),
+                                 config.get('PROJECTS_SCHEMA'))))
+    with engine.begin() as conn:
+        for schema in sorted(schemas):
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+    return ', '.join(sorted(schemas))
+
+
+@bootstrap_step(2, 'tables', repeatable=True)
+def create_tables(engine):
+    """Create missing tables, one at a time in dependency order."""
+    created, failed = [], []
+    existing = inspect(engine)
+    for table in db.metadata.sorted_tables:
+        try:
+            if existing.has_table(table.name, schema=table.schema):
+                continue
+            table.create(engine)
+            created.append(table.fullname)
+        except Exception as e:
+            # One broken table (e.g. an FK to a missing schema) must not stop the others
+            logger.warning(f"Could not create table {table.fullname}: {e}")
+            failed.append(table.fullname)
+    if failed:
+        raise RuntimeError(f"Tables not created: {', '.join(failed)}")
+    return f"created {', '.join(created)}" if created else 'all tables exist'
+
+
+def add_missing_columns(engine, table, names):
+    """ALTER TABLE ... ADD COLUMN for the mapped columns ``names`` the database lacks.
+
+    The DDL comes from the model column: its type, and the server default
+    (with NOT NULL when the column is not nullable). Returns the added columns.
+    """
+    existing = {info['name'] for info in inspect(engine).get_columns(table.name, schema=table.schema)}
+    added = []
+    with engine.begin() as conn:
+        for name in names:
+            if name in existing:
+                continue
+            column = table.c[name]
+            ddl = f"{column.name} {column.type.compile(dialect=engine.dialect)}"
+            if column.server_default is not None:
+                default = column.server_default.arg
+                if isinstance(default, str):
+                    default = f"'{default}'"
+                else:
+                    default = default.compile(dialect=engine.dialect)
+                ddl += f" DEFAULT {default}"
+                if not column.nullable:
+                    ddl += ' NOT NULL'
+            conn.execute(text(f"ALTER TABLE {table.fullname} ADD COLUMN {ddl}"))
+            added.append(f"{table.fullname}.{name}")
+    return added
+
+
+# Columns that older databases lack; they were ALTERed in at import time
+# by app/models/shop.py, order.py, project.py and in init_db
+LEGACY_COLUMNS = [
+    ('app.models.shop', 'CartItem', 'project_stage_id', 'INTEGER'),
+    ('app.models.order', 'OrderItem', 'project_stage_id', 'INTEGER'),
+    ('app.models.order', 'OrderItem', 'billed_hours', 'INTEGER DEFAULT 0'),
+    ('app.models.project', 'ProjectStage', 'estimated_hours', 'INTEGER DEFAULT 0'),
+    ('app.models.project', 'ProjectStage', 'billed_hours', 'INTEGER DEFAULT 0'),
+    ('app.models.project', 'ProjectStage', 'is_paid', 'BOOLEAN DEFAULT FALSE'),
+]
+
+
+@bootstrap_step(3, 'legacy_columns')
+def add_legacy_columns(engine):
+    """Add the staged billing columns to tables created before they existed."""
+    import importlib
+
+    added = []
+    existing = inspect(engine)
+    with engine.begin() as conn:
+        for module_name, model_name, column, ddl in LEGACY_COLUMNS:
+            table = getattr(importlib.import_module(module_name), model_name).__table__
+            columns = {info['name'] for info in existing.get_columns(table.name, schema=table.schema)}
+            if column in columns:
+                continue
+            conn.execute(text(f"ALTER TABLE {table.fullname} ADD COLUMN {column} {ddl}"))
+            added.append(f"{table.fullname}.{column}")
+    return f"added {', '.join(added)}" if added else 'all columns exist'
+
+
+@bootstrap_step(4, 'admin_user')
+def create_admin_user(engine):
+    """Create the admin from BOOTSTRAP_ADMIN_EMAIL / BOOTSTRAP_ADMIN_PASSWORD if missing."""
+    from app.models.user import User
+
+    email = os.environ.get('BOOTSTRAP_ADMIN_EMAIL', '').strip().lower()
+    password = os.environ.get('BOOTSTRAP_ADMIN_PASSWORD')
+    if not email or not password:
+        raise StepSkipped('BOOTSTRAP_ADMIN_EMAIL / BOOTSTRAP_ADMIN_PASSWORD not set')
+    if User.query.filter_by(email=email).first() is not None:
+        return f"{email} already exists"
+    admin = User(email=email, username=os.environ.get('BOOTSTRAP_ADMIN_USERNAME', 'admin'),
+                 password=password, first_name='Admin', last_name='User', is_admin=True)
+    admin.is_active = True
+    db.session.add(admin)
+    db.session.commit()
+    return f"created {email}"
+
+
+# (model, legacy bytes column, blob id column); see alembic 0013_media_blobs
+MEDIA_BLOB_OWNERS = [
+    ('Category', 'image_data', 'image_blob_id'),
+    ('ProductImage', 'data', 'blob_id'),
+]
+
+
+@bootstrap_step(5, 'media_blobs')
+def move_media_blobs(engine, batch=50):
+    """Move image bytes from categories / product_images rows into media_blobs.
+
+    Adds the blob id columns where missing, copies every legacy blob and
+    clears the old column, a batch of rows per transaction. An interrupted
+    run resumes with the rows not moved yet. The emptied legacy columns are
+    left in place; 0013_media_blobs drops them on databases run by Alembic.
+    """
+    from sqlalchemy import Integer, LargeBinary, column, select, table as table_clause
+    from app.models import product
+
+    blobs = product.MediaBlob.__table__
+    moved = []
+    for model_name, data_column, blob_column in MEDIA_BLOB_OWNERS:
+        table = getattr(product, model_name).__table__
+        columns = {info['name'] for info in inspect(engine).get_columns(table.name, schema=table.schema)}
+        if blob_column not in columns:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.fullname} ADD COLUMN {blob_column} INTEGER "
+                                  f"REFERENCES {blobs.fullname} (id)"))
+        if data_column not in columns:
+            continue
+        # The legacy column is no longer mapped, so address it through a bare table clause
+        owner = table_clause(table.name, column('id', Integer), column(data_column, LargeBinary),
+                             column(blob_column, Integer), schema=table.schema)
+        legacy = owner.c[data_column]
+        count = 0
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(select(owner.c.id, legacy).where(legacy.isnot(None))
+                                    .order_by(owner.c.id).limit(batch)).all()
+                for row_id, value in rows:
+                    values = {data_column: None}
+                    if value:
+                        values[blob_column] = conn.execute(blobs.insert().values(
+                            data=value, size=len(value))).inserted_primary_key[0]
+                    conn.execute(owner.update().where(owner.c.id == row_id).values(values))
+            if not rows:
+                break
+            count += len(rows)
+        moved.append(f"{table.fullname}: {count}")
+    return f"moved {', '.join(moved)}" if moved else 'no legacy image columns'
+
+
+@bootstrap_step(6, 'media_hash_columns')
+def add_media_hash_columns(engine):
+    """Add the image content hash columns (alembic 0003_media_content_hash).
+
+    Existing rows are hashed lazily on their first request by
+    app/utils/media_http.py, so there is nothing to backfill.
+    """
+    from app.models.product import Category, ProductImage
+
+    added = (add_missing_columns(engine, Category.__table__, ['image_hash'])
+             + add_missing_columns(engine, ProductImage.__table__, ['content_hash']))
+    return f"added {', '.join(added)}" if added else 'all columns exist'
+
+
+RATING_INDEXES = ('ix_product_reviews_product_approved', 'ix_products_active_category_rating')
+
+
+@bootstrap_step(7, 'product_ratings')
+def add_product_ratings(engine):
+    """Add and backfill the product rating aggregates (alembic 0008_product_rating_aggregates).
+
+    Afterwards the ProductReview events keep them current.
+    """
+    from app.models.product import Product, ProductReview, recalculate_ratings
+
+    added = add_missing_columns(engine, Product.__table__, ['review_count', 'rating_sum', 'rating_avg'])
+    for table in (ProductReview.__table__, Product.__table__):
+        for index in table.indexes:
+            if index.name in RATING_INDEXES:
+                index.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        updated = recalculate_ratings(conn)
+    columns = f"added {', '.join(added)}" if added else 'all columns exist'
+    return f"{columns}; recalculated {updated} products"
+
+
+@bootstrap_step(8, 'indexes', repeatable=True)
+def create_indexes(engine):
+    """Create model indexes missing on existing tables (new tables get theirs in step 2)."""
+    created = []
+    inspector = inspect(engine)
+    for table in db.metadata.sorted_tables:
+        if not table.indexes:
+            continue
+        existing = {info['name'] for info in inspector.get_indexes(table.name, schema=table.schema)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                index.create(engine)
+                created.append(index.name)
+    return f"created {', '.join(created)}" if created else 'all indexes exist'
+
+
+@bootstrap_step(9, 'existing_data')
+def fix_existing_data(engine):
+    """Data changes the Alembic chain made to rows written before the features existed.
+
+    * 0006_catalog_indexes: keyset cursors compare ``products.created_at``,
+      which must not be NULL;
+    * 0009_sales_rollups: fill the rollups from the existing orders when they
+      are still empty;
+    * 0011_stock_reservations: stock was never enforced, and the old
+      ``default=0`` stored 0 even for ``Product(stock=None)``. A stock of 0 or
+      below means the product was never really stock-tracked, so it becomes
+      unlimited (NULL); reserve() would otherwise refuse every such product.
+    """
+    from sqlalchemy import func, select
+    from app.models.product import Product
+    from app.models.rollup import OrderRollup
+    from app.services import rollups
+
+    products = Product.__table__
+    with engine.begin() as conn:
+        dated = conn.execute(products.update().where(products.c.created_at.is_(None)).values(
+            created_at=func.coalesce(products.c.updated_at, func.current_timestamp()))).rowcount
+        unlimited = conn.execute(products.update().where(products.c.stock <= 0).values(stock=None)).rowcount
+        rolled = 'rollups exist'
+        if conn.execute(select(OrderRollup.__table__.c.id).limit(1)).first() is None:
+            order_cells, product_cells = rollups.rebuild(conn)
+            rolled = f"{order_cells} order / {product_cells} product rollup cells"
+    return f"created_at set on {dated} products, {unlimited} products unlimited, {rolled}"
+
+
+@bootstrap_step(10, 'search_index', repeatable=True)
+def create_search_index(engine):
+    """Create the full-text product search index if missing (alembic 0007_product_search).
+
+    Repeatable, so a database whose tables step 2 just created gets it too.
+    Until it exists, search falls back to ILIKE.
+    """
+    from app.services import search
+
+    with engine.begin() as conn:
+        return search.create_search_index(conn)
+
+
+# --- runner --------------------------------------------------------------
+
+def applied_versions(engine):
+    table = BootstrapStep.__table__
+    if not inspect(engine).has_table(table.name, schema=table.schema):
+        return {}
+    with engine.connect() as conn:
+        return {row.version: row for row in conn.execute(table.select())}
+
+
+def run_bootstrap(force=False, only=None, echo=logger.info):
+    """Run pending (and repeatable) steps. Returns the number of failed steps."""
+    engine = db.engine
+    BootstrapStep.__table__.create(engine, checkfirst=True)
+    done = applied_versions(engine)
+    failures = 0
+    for step in steps():
+        if only and step.name not in only:
+            continue
+        if step.version in done and not (step.repeatable or force):
+            continue
+        start = time.perf_counter()
+        try:
+            result = step.func(engine)
+        except StepSkipped as e:
+            echo(f"[{step.version}] {step.name}: skipped ({e})")
+            continue
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Bootstrap step {step.version} {step.name} failed: {e}")
+            echo(f"[{step.version}] {step.name}: FAILED ({e})")
+            failures += 1
+            # Later steps may depend on this one
+            break
+        duration_ms = int((time.perf_counter() - start) * 1000)
+        with engine.begin() as conn:
+            table = BootstrapStep.__table__
+            conn.execute(table.delete().where(table.c.version == step.version))
+            conn.execute(table.insert().values(version=step.version, name=step.name,
+                                               duration_ms=duration_ms))
+        echo(f"[{step.version}] {step.name}: {result or 'done'} ({duration_ms} ms)")
+    return failures
+
+
+def init_bootstrap(app):
+    import click
+
+    @app.cli.group('bootstrap')
+    def bootstrap_cli():
+        """Database bootstrap, run once per deploy."""
+
+    @bootstrap_cli.command('run')
+    @click.option('--force', is_flag=True, help='Re-run steps that were already applied.')
+    @click.option('--only', multiple=True, help='Run only the named step (repeatable).')
+    def run_command(force, only):
+        """Apply pending bootstrap steps; exits with status 1 when a step fails."""
+        if run_bootstrap(force=force, only=set(only), echo=click.echo):
+            raise SystemExit(1)
+
+    @bootstrap_cli.command('status')
+    def status_command():
+        """List bootstrap steps and when they were applied."""
+        done = applied_versions(db.engine)
+        for step in steps():
+            row = done.get(step.version)
+            state = f"applied {row.applied_at:%Y-%m-%d %H:%M} ({row.duration_ms} ms)" if row else 'pending'
+            kind = ', repeatable' if step.repeatable else ''
+            click.echo(f"[{step.version}] {step.name}{kind}: {state}")
+
+    if app.config.get('DB_BOOTSTRAP_ON_STARTUP'):
+        with app.app_context():
+            run_bootstrap()
@@ -0,0 +1,208 @@
+"""
+Product catalog queries for ``/shop/products`` and ``/shop/api/products``.
+
+Pages use keyset (seek) pagination instead of loading the whole catalog: each
+sort mode orders by ``(<sort column>, id)`` and the next page starts after the
+last row seen, which is passed as an opaque ``after`` cursor. The composite
+indexes on ``products`` (see app/models/product.py) serve these queries
+without a sort step: ``(is_active, category_id, <sort column>, id)`` a
+category page, ``(is_active, <sort column>, id)`` the unfiltered listing. Unlike
+OFFSET, a page costs the same wherever it is in the catalog. Sort columns are
+never NULL (migration 0006 backfilled ``created_at``).
+
+The category sidebar (names and active-product counts) comes from one GROUP BY
+query and is cached in-process for ``CATALOG_SIDEBAR_TTL`` seconds. Product
+or category writes in this process invalidate it immediately.
+
+``rating_desc`` sorts by the stored approved-review average
+(``Product.average_rating``), so no review rows are read for the listing.
+"""
+import base64
+import binascii
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, event, func, or_
+from sqlalchemy.orm import load_only
+
+from app.models.database import db
+from app.models.product import Category, Product
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SORT = 'name_asc'
+# sort mode -> (column attribute name, descending)
+SORTS = {
+    'name_asc': ('name', False),
+    'name_desc': ('name', True),
+    'price_asc': ('price', False),
+    'price_desc': ('price', True),
+    'newest': ('created_at', True),
+    'rating_desc': ('rating_avg', True),
+}
+# Columns the product cards need; descriptions and other text stay unloaded.
+# updated_at is the version in the cards' fragment cache key
+CARD_COLUMNS = ('id', 'name', 'slug', 'short_description', 'price', 'sale_price',
+                'image', 'duration', 'created_at', 'updated_at', 'category_id', 'review_count', 'rating_avg')
+
+CatalogPage = namedtuple('CatalogPage', 'items next_cursor')
+SidebarCategory = namedtuple('SidebarCategory', 'id slug name description product_count')
+
+
+class InvalidCursor(ValueError):
+    """The ``after`` parameter is not a cursor issued for this sort mode."""
+
+
+def normalize_sort(sort):
+    return sort if sort in SORTS else DEFAULT_SORT
+
+
+def encode_cursor(sort, product):
+    column, _ = SORTS[sort]
+    value = getattr(product, column)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, product.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(sort, token):
+    """Return ``(value, id)`` from a cursor; raise InvalidCursor if it doesn't fit."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        cursor_sort, value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+        last_id = int(last_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise InvalidCursor(token) from None
+    if cursor_sort != sort:
+        raise InvalidCursor(token)
+    if value is None:
+        raise InvalidCursor(token)
+    if SORTS[sort][0] == 'created_at':
+        try:
+            value = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise InvalidCursor(token) from None
+    return value, last_id
+
+
+def _listing_query(category_id=None):
+    query = Product.query.options(load_only(*CARD_COLUMNS)).filter(
+        Product.is_active == True,  # noqa: E712 - SQL expression
+        Product.slug != None,  # noqa: E711
+        Product.slug != '',
+    )
+    if category_id is not None:
+        query = query.filter(Product.category_id == category_id)
+    return query
+
+
+def _seek(query, sort, value, last_id):
+    column_name, descending = SORTS[sort]
+    column = getattr(Product, column_name)
+    if descending:
+        return query.filter(or_(column < value, and_(column == value, Product.id < last_id)))
+    return query.filter(or_(column > value, and_(column == value, Product.id > last_id)))
+
+
+def _order(query, sort):
+    column_name, descending = SORTS[sort]
+    column = getattr(Product, column_name)
+    if descending:
+        return query.order_by(column.desc(), Product.id.desc())
+    return query.order_by(column.asc(), Product.id.asc())
+
+
+def fetch_page(sort=DEFAULT_SORT, category_id=None, after=None, limit=None):
+    """One page of active products; ``next_cursor`` is None on the last page."""
+    sort = normalize_sort(sort)
+    limit = limit or current_app.config.get('CATALOG_PAGE_SIZE', 24)
+    query = _listing_query(category_id)
+    if after:
+        value, last_id = decode_cursor(sort, after)
+        query = _seek(query, sort, value, last_id)
+    # One extra row tells whether another page exists, without a COUNT
+    rows = _order(query, sort).limit(limit + 1).all()
+    items = rows[:limit]
+    next_cursor = encode_cursor(sort, items[-1]) if len(rows) > limit else None
+    return CatalogPage(items, next_cursor)
+
+
+# --- category sidebar ----------------------------------------------------
+
+_sidebar = None
+_sidebar_expires = 0.0
+_sidebar_lock = threading.Lock()
+
+
+def _load_sidebar():
+    active_products = and_(
+        Product.category_id == Category.id,
+        Product.is_active == True,  # noqa: E712
+        Product.slug != None,  # noqa: E711
+        Product.slug != '',
+    )
+    rows = (
+        db.session.query(Category.id, Category.slug, Category.name, Category.description,
+                         func.count(Product.id))
+        .outerjoin(Product, active_products)
+        .group_by(Category.id, Category.slug, Category.name, Category.description)
+        .order_by(Category.name)
+        .all()
+    )
+    return tuple(SidebarCategory(*row) for row in rows)
+
+
+def category_sidebar():
+    """Categories with active-product counts, cached per process."""
+    global _sidebar, _sidebar_expires
+    now = time.monotonic()
+    with _sidebar_lock:
+        if _sidebar is not None and now < _sidebar_expires:
+            return _sidebar
+    sidebar = _load_sidebar()
+    with _sidebar_lock:
+        _sidebar = sidebar
+        _sidebar_expires = now + current_app.config.get('CATALOG_SIDEBAR_TTL', 300)
+    return sidebar
+
+
+def find_category(sidebar, slug):
+    if not slug:
+        return None
+    return next((category for category in sidebar if category.slug == slug), None)
+
+
+def invalidate_sidebar(*_args):
+    global _sidebar
+    with _sidebar_lock:
+        _sidebar = None
+
+
+for _model in (Product, Category):
+    for _event in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event, invalidate_sidebar)
+
+
+def init_catalog(app):
+    import click
+
+    @app.cli.group('catalog')
+    def catalog_cli():
+        """Product catalog maintenance."""
+
+    @catalog_cli.command('recalc-ratings')
+    @click.option('--product', 'product_ids', type=int, multiple=True,
+                  help='Only these product ids (repeatable); default all.')
+    def recalc_ratings_command(product_ids):
+        """Recompute review_count / rating_sum / rating_avg from product_reviews."""
+        from app.models.product import recalculate_ratings
+        with db.engine.begin() as conn:
+            updated = recalculate_ratings(conn, product_ids or None)
+        invalidate_sidebar()
+        click.echo(f"Recalculated ratings for {updated} products")
@@ -0,0 +1,386 @@
+"""
+Chat execution engine for the site assistants (app/routes/chatbot.py).
+
+Replaces the old ``while True: runs.retrieve(...)`` loops:
+
+* Chat Completions and Assistants runs are streamed
+  (``stream=True`` / ``create_and_run(stream=True)``). Text deltas are yielded
+  as they arrive, so the browser gets them over SSE and no polling is needed.
+* When streaming is disabled (``CHAT_STREAMING=false``), Assistants runs are
+  polled with bounded exponential backoff up to a hard deadline and
+  cancelled if the deadline passes.
+* ``ChatEngine.start`` opens the answer synchronously; ``collect`` (JSON) or
+  ``sse_response`` (SSE) consume it.
+* Every turn records time-to-first-token and total time in ``ChatMetrics``
+  (logged, exposed in /health and sent as ``Server-Timing``).
+
+The request thread only relays deltas; with Gunicorn's ``gthread`` workers (see
+gunicorn.conf.py) a long answer occupies a thread, not a whole worker process.
+"""
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from flask import Response, current_app, stream_with_context
+
+from app.utils.metrics import outbound_call
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'gpt-4o-mini'
+RUN_FAILED_STATUSES = {'failed', 'cancelled', 'expired', 'incomplete'}
+
+
+class ChatError(RuntimeError):
+    """The assistant run failed or returned nothing."""
+
+
+class ChatTimeout(ChatError):
+    """The turn did not finish before its deadline."""
+
+
+class ChatMetrics:
+    """Process-wide rolling latency statistics for chat turns."""
+
+    def __init__(self, window=200):
+        self._lock = threading.Lock()
+        self._ttft = deque(maxlen=window)
+        self._total = deque(maxlen=window)
+        self.turns = 0
+        self.errors = 0
+        self.api_calls = 0
+
+    def record(self, turn):
+        with self._lock:
+            self.turns += 1
+            self.api_calls += turn.api_calls
+            if turn.error:
+                self.errors += 1
+            if turn.ttft_ms is not None:
+                self._ttft.append(turn.ttft_ms)
+            if turn.total_ms is not None:
+                self._total.append(turn.total_ms)
+
+    @staticmethod
+    def _summary(values):
+        if not values:
+            return None
+        ordered = sorted(values)
+        return {
+            'avg': round(sum(ordered) / len(ordered), 1),
+            'p50': round(ordered[len(ordered) // 2], 1),
+            'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+            'max': round(ordered[-1], 1),
+        }
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'turns': self.turns,
+                'errors': self.errors,
+                'api_calls': self.api_calls,
+                'ttft_ms': self._summary(self._ttft),
+                'total_ms': self._summary(self._total),
+            }
+
+
+_metrics = ChatMetrics()
+
+
+def get_chat_metrics():
+    return _metrics
+
+
+class ChatTurn:
+    """Timing for one user message -> assistant answer."""
+
+    def __init__(self, label, mode):
+        self.label = label
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.first_token = None
+        self.finished = None
+        self.api_calls = 0
+        self.chars = 0
+        self.error = None
+        self.thread_id = None
+
+    def token(self, text):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.chars += len(text)
+
+    def finish(self, error=None):
+        if self.finished is not None:
+            return
+        self.finished = time.perf_counter()
+        self.error = error
+        _metrics.record(self)
+        logger.info(
+            f"chat turn {self.label} mode={self.mode} ttft_ms={self.ttft_ms} "
+            f"total_ms={self.total_ms} api_calls={self.api_calls} chars={self.chars}"
+            + (f" error={error}" if error else '')
+        )
+
+    @property
+    def ttft_ms(self):
+        if self.first_token is None:
+            return None
+        return round((self.first_token - self.started) * 1000, 1)
+
+    @property
+    def total_ms(self):
+        if self.finished is None:
+            return None
+        return round((self.finished - self.started) * 1000, 1)
+
+    def as_dict(self):
+        return {'ttft_ms': self.ttft_ms, 'total_ms': self.total_ms}
+
+    def server_timing(self):
+        parts = []
+        if self.ttft_ms is not None:
+            parts.append(f'ttft;dur={self.ttft_ms}')
+        if self.total_ms is not None:
+            parts.append(f'total;dur={self.total_ms}')
+        return ', '.join(parts)
+
+
+class ChatEngine:
+    """Runs one chat turn against OpenAI, streaming or with bounded polling.
+
+    ``start()`` performs the API call that opens the answer synchronously, so
+    errors such as an unknown thread surface in the view (where the session can
+    still be changed). It returns an iterator of text deltas.
+    """
+
+    def __init__(self, client, *, deadline=60.0, poll_initial=0.25, poll_max=2.0,
+                 streaming=True, model=DEFAULT_MODEL):
+        self.client = client
+        self.deadline = float(deadline)
+        self.poll_initial = float(poll_initial)
+        self.poll_max = float(poll_max)
+        self.streaming = streaming
+        self.model = model
+
+    @classmethod
+    def from_config(cls, client, config):
+        return cls(
+            client,
+            deadline=config.get('CHAT_TURN_DEADLINE', 60),
+            poll_initial=config.get('CHAT_POLL_INITIAL', 0.25),
+            poll_max=config.get('CHAT_POLL_MAX', 2.0),
+            streaming=config.get('CHAT_STREAMING', True),
+            model=config.get('CHAT_MODEL', DEFAULT_MODEL),
+        )
+
+    def _api(self, operation, call, **kwargs):
+        """One OpenAI call, timed for /metrics until the response (or stream) starts."""
+        with outbound_call('openai', operation):
+            return call(**kwargs)
+
+    def start(self, turn, *, assistant_id=None, system_message=None, messages=(), thread_id=None):
+        if turn.mode == 'assistant':
+            return self._start_assistant(turn, assistant_id, messages, thread_id)
+        return self._start_completion(turn, system_message, messages)
+
+    # --- Chat Completions -------------------------------------------------
+
+    def _start_completion(self, turn, system_message, messages):
+        payload = [{"role": "system", "content": system_message}]
+        payload += [{"role": "user", "content": text} for text in messages]
+        turn.api_calls += 1
+        if not self.streaming:
+            response = self._api(
+                'chat.completions.create', self.client.chat.completions.create,
+                model=self.model, messages=payload, temperature=0.7, timeout=self.deadline,
+            )
+            text = response.choices[0].message.content or ''
+            turn.token(text)
+            return iter([text])
+        stream = self._api(
+            'chat.completions.create', self.client.chat.completions.create,
+            model=self.model, messages=payload, temperature=0.7, stream=True, timeout=self.deadline,
+        )
+        return self._completion_deltas(turn, stream)
+
+    def _completion_deltas(self, turn, stream):
+        deadline = time.monotonic() + self.deadline
+        try:
+            for chunk in stream:
+                if time.monotonic() > deadline:
+                    raise ChatTimeout('Chat completion exceeded its deadline')
+                if not chunk.choices:
+                    continue
+                text = chunk.choices[0].delta.content
+                if text:
+                    turn.token(text)
+                    yield text
+        finally:
+            stream.close()
+
+    # --- Assistants -------------------------------------------------------
+
+    @staticmethod
+    def _thread_messages(messages):
+        # Plain strings are user messages; dicts pass through (seeded assistant answers)
+        return [m if isinstance(m, dict) else {"role": "user", "content": m} for m in messages]
+
+    def _start_assistant(self, turn, assistant_id, messages, thread_id):
+        thread_messages = self._thread_messages(messages)
+        turn.api_calls += 1
+        if thread_id:
+            # Existing conversation: append the message and start the run in one call
+            turn.thread_id = thread_id
+            kwargs = dict(thread_id=thread_id, assistant_id=assistant_id,
+                          additional_messages=thread_messages)
+            if not self.streaming:
+                run = self._api('threads.runs.create', self.client.beta.threads.runs.create, **kwargs)
+                return iter([self._polled_answer(turn, thread_id, run)])
+            stream = self._api('threads.runs.create', self.client.beta.threads.runs.create,
+                               stream=True, timeout=self.deadline, **kwargs)
+            return self._assistant_deltas(turn, stream, iter(stream))
+
+        thread = {"messages": thread_messages}
+        if not self.streaming:
+            run = self._api('threads.create_and_run', self.client.beta.threads.create_and_run,
+                            assistant_id=assistant_id, thread=thread)
+            turn.thread_id = run.thread_id
+            return iter([self._polled_answer(turn, run.thread_id, run)])
+        stream = self._api(
+            'threads.create_and_run', self.client.beta.threads.create_and_run,
+            assistant_id=assistant_id, thread=thread, stream=True, timeout=self.deadline,
+        )
+        # The first event announces the new thread; read it now so the caller
+        # can remember the thread id before the response starts streaming.
+        events = iter(stream)
+        first = next(events, None)
+        if first is not None and getattr(first, 'event', '') == 'thread.created':
+            turn.thread_id = first.data.id
+        elif first is not None:
+            events = itertools.chain([first], events)
+        return self._assistant_deltas(turn, stream, events)
+
+    def _assistant_deltas(self, turn, stream, events):
+        deadline = time.monotonic() + self.deadline
+        try:
+            for event in events:
+                if time.monotonic() > deadline:
+                    raise ChatTimeout('Assistant run exceeded its deadline')
+                name = getattr(event, 'event', '')
+                if name == 'thread.message.delta':
+                    for part in event.data.delta.content or []:
+                        text = getattr(getattr(part, 'text', None), 'value', None)
+                        if text:
+                            turn.token(text)
+                            yield text
+                elif name in ('thread.run.failed', 'thread.run.cancelled',
+                              'thread.run.expired', 'thread.run.incomplete'):
+                    raise ChatError(f"Assistant run ended with {name.rsplit('.', 1)[-1]}")
+                elif name == 'error':
+                    raise ChatError(str(event.data))
+        finally:
+            stream.close()
+
+    def _polled_answer(self, turn, thread_id, run):
+        run = self.wait_for_run(turn, thread_id, run)
+        turn.api_calls += 1
+        messages = self._api('threads.messages.list', self.client.beta.threads.messages.list,
+                             thread_id=thread_id, order='desc', limit=1)
+        if not messages.data:
+            raise ChatError('Assistant returned no message')
+        text = ''.join(
+            part.text.value for part in messages.data[0].content if getattr(part, 'text', None)
+        )
+        turn.token(text)
+        return text
+
+    def wait_for_run(self, turn, thread_id, run):
+        """Poll a run with exponential backoff until it completes or the deadline hits."""
+        deadline = time.monotonic() + self.deadline
+        delay = self.poll_initial
+        while run.status != 'completed':
+            if run.status in RUN_FAILED_STATUSES or run.status == 'requires_action':
+                raise ChatError(f"Assistant run ended with {run.status}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                try:
+                    self._api('threads.runs.cancel', self.client.beta.threads.runs.cancel,
+                              thread_id=thread_id, run_id=run.id)
+                except Exception as e:
+                    logger.warning(f"Could not cancel run {run.id}: {e}")
+                raise ChatTimeout(f"Assistant run {run.id} exceeded {self.deadline:.0f}s")
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, self.poll_max)
+            turn.api_calls += 1
+            run = self._api('threads.runs.retrieve', self.client.beta.threads.runs.retrieve,
+                           thread_id=thread_id, run_id=run.id)
+        return run
+
+
+def collect(turn, deltas, on_complete=None):
+    """Drain deltas into the full answer, finishing the turn's metrics."""
+    try:
+        text = ''.join(deltas)
+        if not text:
+            raise ChatError('Empty answer')
+    except Exception as e:
+        turn.finish(error=type(e).__name__)
+        raise
+    turn.finish()
+    if on_complete:
+        on_complete(text)
+    return text
+
+
+def wants_stream(request):
+    """SSE when the client asks for it (Accept header or ?stream=1)."""
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best == 'text/event-stream'
+
+
+def _sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ''
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_response(turn, deltas, extra=None, on_complete=None):
+    """Stream a turn to the browser as Server-Sent Events.
+
+    Events: optional ``event: meta``, ``data: {"delta": ...}`` per chunk, then
+    ``event: done`` with the latency metrics, or ``event: error``.
+    """
+    def generate():
+        if extra:
+            yield _sse(extra, event='meta')
+        parts = []
+        try:
+            for text in deltas:
+                parts.append(text)
+                yield _sse({'delta': text})
+        except GeneratorExit:
+            # Browser went away mid-answer; the OpenAI stream is closed by the inner generator
+            turn.finish(error='ClientDisconnected')
+            raise
+        except Exception as e:
+            logger.exception(f"Chat turn {turn.label} failed")
+            turn.finish(error=type(e).__name__)
+            yield _sse({'error': 'Асистент не зміг відповісти'}, event='error')
+            return
+        turn.finish()
+        if on_complete and parts:
+            on_complete(''.join(parts))
+        yield _sse(turn.as_dict(), event='done')
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let a proxy buffer the stream
+    return response
+
+
+def get_engine(client):
+    return ChatEngine.from_config(client, current_app.config)
@@ -0,0 +1,168 @@
+"""
+Conversation memory and answer reuse for the chatbot blueprint.
+
+* ``ThreadRegistry`` keeps ``{label: {id, ts}}`` in the Flask session, so a
+  visitor's follow-up questions go to the same Assistants thread (one
+  ``runs.create(additional_messages=...)`` call, no new thread, and no system
+  prompt re-sent). Entries expire after ``CHAT_THREAD_TTL`` seconds.
+* ``ResponseCache`` maps ``(label, normalized question)`` to a finished answer.
+  It is an in-process LRU bounded by ``CHAT_CACHE_SIZE`` entries with
+  ``CHAT_CACHE_TTL`` expiry and hit/miss/eviction counters. It is only used for
+  the first question of a conversation, where the answer does not depend on
+  earlier context; those turns are typical FAQ questions. A cached answer is
+  remembered in the session and seeded into the thread if the visitor goes on
+  asking.
+"""
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from flask import current_app, session
+
+SESSION_THREADS = 'chat_threads'
+SESSION_SEED = 'chat_seed'
+# Longer questions are unlikely to repeat verbatim; don't cache them
+MAX_CACHEABLE_CHARS = 300
+MAX_SEED_TURNS = 3
+
+_NON_WORD = re.compile(r'[^\w]+', re.UNICODE)
+
+
+def normalize_question(text):
+    """Case/punctuation/whitespace-insensitive form of a question."""
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    return _NON_WORD.sub(' ', text).strip()
+
+
+class ResponseCache:
+    """Thread-safe LRU of finished answers with TTL and hit-rate counters."""
+
+    def __init__(self, max_entries=500, ttl=3600):
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0}
+
+    @staticmethod
+    def key(label, question):
+        normalized = normalize_question(question)
+        if not normalized or len(normalized) > MAX_CACHEABLE_CHARS:
+            return None
+        return f"{label}\x00{normalized}"
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            stored_at, answer = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return answer
+
+    def put(self, key, answer):
+        if key is None or not answer:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), answer)
+            self._entries.move_to_end(key)
+            self.stats['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self):
+        with self._lock:
+            snap = dict(self.stats)
+            snap['entries'] = len(self._entries)
+        lookups = snap['hits'] + snap['misses']
+        snap['hit_ratio'] = round(snap['hits'] / lookups, 4) if lookups else None
+        return snap
+
+
+class ThreadRegistry:
+    """Session-scoped mapping of chat label -> Assistants thread id."""
+
+    def __init__(self, ttl):
+        self.ttl = float(ttl)
+
+    def get(self, label):
+        entry = session.get(SESSION_THREADS, {}).get(label)
+        if not entry:
+            return None
+        if time.time() - entry.get('ts', 0) > self.ttl:
+            self.forget(label)
+            return None
+        return entry.get('id')
+
+    def remember(self, label, thread_id):
+        threads = dict(session.get(SESSION_THREADS, {}))
+        # Drop expired entries while we are writing anyway
+        now = time.time()
+        threads = {k: v for k, v in threads.items() if now - v.get('ts', 0) <= self.ttl}
+        threads[label] = {'id': thread_id, 'ts': now}
+        session[SESSION_THREADS] = threads
+
+    def touch(self, label):
+        thread_id = self.get(label)
+        if thread_id:
+            self.remember(label, thread_id)
+
+    def forget(self, label):
+        threads = dict(session.get(SESSION_THREADS, {}))
+        if threads.pop(label, None) is not None:
+            session[SESSION_THREADS] = threads
+
+    def has_conversation(self, label):
+        return bool(self.get(label) or session.get(SESSION_SEED, {}).get(label))
+
+    # Answers served from the cache, replayed into the thread once one exists
+    def add_seed(self, label, question, answer):
+        seeds = dict(session.get(SESSION_SEED, {}))
+        turns = list(seeds.get(label, []))[-(MAX_SEED_TURNS - 1):]
+        turns.append([question, answer])
+        seeds[label] = turns
+        session[SESSION_SEED] = seeds
+
+    def pop_seed(self, label):
+        seeds = dict(session.get(SESSION_SEED, {}))
+        turns = seeds.pop(label, [])
+        if turns:
+            session[SESSION_SEED] = seeds
+        return turns
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache(app=None):
+    global _cache
+    app = app or current_app
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                max_entries=app.config.get('CHAT_CACHE_SIZE', 500),
+                ttl=app.config.get('CHAT_CACHE_TTL', 3600),
+            )
+        return _cache
+
+
+def get_thread_registry(app=None):
+    app = app or current_app
+    return ThreadRegistry(ttl=app.config.get('CHAT_THREAD_TTL', 1800))
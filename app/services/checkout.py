@@ -0,0 +1,130 @@
+"""
+Checkout pipeline: cart snapshot -> order items -> Stripe line items.
+
+``shop.checkout`` used to walk ``cart.items`` three times. Each
+``item.product`` was a lazy load, ``cart.subtotal`` recomputed the sum on
+every access, and the order items were added and flushed one by one. The
+pipeline here runs a fixed number of statements, whatever the cart size:
+
+* ``load_cart()`` reads the items of a cart together with the product
+  columns checkout needs, in one SELECT, into an immutable snapshot. The
+  snapshot also carries the subtotal.
+* ``create_order_items()`` inserts all order items with one executemany and
+  adds them to the sales rollups in one batch. The Core insert bypasses the
+  ``OrderItem`` mapper events.
+* ``stripe_line_items()`` builds the Stripe payload from the same snapshot,
+  so the customer pays for exactly what was stored.
+"""
+import logging
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from app.models.database import db
+from app.models.order import OrderItem
+from app.models.product import Product
+from app.models.shop import CartItem
+
+logger = logging.getLogger(__name__)
+
+CheckoutLine = namedtuple('CheckoutLine', 'product_id name slug duration description '
+                                          'unit_price quantity total project_stage_id')
+
+
+class CheckoutSnapshot:
+    """The cart as checkout saw it: lines with product data and the subtotal."""
+
+    def __init__(self, lines):
+        self.lines = tuple(lines)
+        self.subtotal = round(sum(line.total for line in self.lines), 2)
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    @property
+    def quantities(self):
+        """{product_id: quantity} for app/services/stock.py."""
+        quantities = {}
+        for line in self.lines:
+            quantities[line.product_id] = quantities.get(line.product_id, 0) + line.quantity
+        return quantities
+
+
+def load_cart(cart_id):
+    """Snapshot of a cart's items and their products, in one query."""
+    items = CartItem.__table__
+    products = Product.__table__
+    rows = db.session.execute(
+        select(items.c.product_id, items.c.quantity, items.c.price, items.c.project_stage_id,
+               products.c.id.label('found'), products.c.name, products.c.slug, products.c.duration,
+               products.c.short_description, products.c.price.label('product_price'))
+        .select_from(items.outerjoin(products, products.c.id == items.c.product_id))
+        .where(items.c.cart_id == cart_id)
+        .order_by(items.c.id)
+    ).all()
+    lines = []
+    for row in rows:
+        if row.found is None:
+            logger.warning(f"Cart {cart_id}: product {row.product_id} no longer exists, item skipped")
+            continue
+        quantity = int(row.quantity or 0)
+        if quantity < 1:
+            continue
+        # The price stored when the item was added wins, as in CartItem.line_total()
+        unit_price = float(row.price or row.product_price or 0)
+        lines.append(CheckoutLine(
+            product_id=row.product_id, name=row.name, slug=row.slug, duration=row.duration,
+            description=row.short_description, unit_price=unit_price, quantity=quantity,
+            total=round(unit_price * quantity, 2), project_stage_id=row.project_stage_id,
+        ))
+    return CheckoutSnapshot(lines)
+
+
+def create_order_items(order, snapshot):
+    """Insert the snapshot as the order's items with a single executemany."""
+    if not snapshot:
+        return 0
+    connection = db.session.connection()
+    connection.execute(OrderItem.__table__.insert(), [
+        {
+            'order_id': order.id,
+            'product_id': line.product_id,
+            'product_name': line.name,
+            'product_slug': line.slug,
+            'product_duration': line.duration,
+            'price_per_unit': line.unit_price,
+            'quantity': line.quantity,
+            'total_price': line.total,
+            'project_stage_id': line.project_stage_id,
+            'billed_hours': line.quantity if line.project_stage_id else 0,
+        }
+        for line in snapshot.lines
+    ])
+    from app.services import rollups
+    rollups.add_order_items(connection, order.created_at,
+                            [(line.product_id, line.quantity, line.total) for line in snapshot.lines])
+    return len(snapshot)
+
+
+def stripe_line_items(snapshot, price_id=None):
+    """Stripe Checkout ``line_items``: a fixed Price when configured, inline price data otherwise."""
+    line_items = []
+    for line in snapshot.lines:
+        if price_id:
+            line_items.append({'price': price_id, 'quantity': line.quantity})
+            continue
+        product_data = {'name': line.name}
+        if line.description:
+            product_data['description'] = line.description
+        line_items.append({
+            'price_data': {
+                'currency': 'eur',
+                'unit_amount': int(round(line.unit_price * 100)),  # Convert to cents
+                'product_data': product_data,
+            },
+            'quantity': line.quantity,
+        })
+    return line_items
@@ -0,0 +1,312 @@
+"""
+Durable background job queue backed by the ``background_jobs`` table.
+
+Request handlers call ``enqueue()`` in the same transaction as the data they
+just wrote, so a job exists exactly when the row it refers to does (outbox
+pattern). Handlers register with ``@job_handler('kind')`` and receive the
+JSON payload.
+
+Jobs are executed by worker threads, which run either inside each web
+process (``JOB_WORKER_THREADS``, started lazily so forked Gunicorn workers get
+their own) or in a dedicated process via ``flask jobs worker``. A job is
+claimed with a conditional UPDATE, so several processes can share the table.
+A failure reschedules it with exponential backoff; after ``max_attempts`` it
+is moved to the ``dead`` status (dead-letter) for ``flask jobs retry``.
+Jobs stuck in ``running`` longer than ``JOB_LOCK_TIMEOUT`` (crashed worker)
+are returned to the queue.
+"""
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event
+
+from app.models.database import db
+from app.models.job import BackgroundJob, JOB_DEAD, JOB_DONE, JOB_PENDING, JOB_RUNNING
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+def job_handler(kind):
+    """Register ``func(payload)`` as the handler for jobs of ``kind``."""
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload=None, *, delay=0, max_attempts=None, commit=False):
+    """Add a job to the current session.
+
+    By default the job is committed together with the caller's own changes;
+    pass ``commit=True`` to commit immediately. In-process workers are woken
+    up once the transaction commits.
+    """
+    config = current_app.config
+    job = BackgroundJob(
+        kind=kind,
+        payload=json.dumps(payload or {}, ensure_ascii=False, default=str),
+        status=JOB_PENDING,
+        attempts=0,
+        max_attempts=max_attempts or config.get('JOB_MAX_ATTEMPTS', 5),
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+    )
+    db.session.add(job)
+    queue = current_app.extensions.get('job_queue')
+    if queue is not None:
+        # Wake in-process workers once the job is actually visible
+        event.listen(db.session(), 'after_commit', lambda session: queue.notify(), once=True)
+    if commit:
+        db.session.commit()
+    return job
+
+
+def backoff_delay(attempts, base, cap):
+    """Exponential backoff with +-20% jitter for the given attempt number."""
+    delay = min(cap, base * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class JobQueue:
+    """Claims and runs jobs; shared by worker threads and the CLI worker."""
+
+    def __init__(self, app):
+        self.app = app
+        config = app.config
+        self.poll_interval = float(config.get('JOB_POLL_INTERVAL', 5))
+        self.lock_timeout = float(config.get('JOB_LOCK_TIMEOUT', 300))
+        self.backoff_base = float(config.get('JOB_BACKOFF_BASE', 10))
+        self.backoff_max = float(config.get('JOB_BACKOFF_MAX', 3600))
+        self.thread_count = int(config.get('JOB_WORKER_THREADS', 1))
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._stopping = False
+        self._last_release = 0.0
+        self.stats = {'claimed': 0, 'succeeded': 0, 'retried': 0, 'dead': 0}
+
+    # --- lifecycle -------------------------------------------------------
+
+    def ensure_started(self):
+        """Start in-process worker threads once per OS process."""
+        if self.thread_count <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._threads = []
+            for index in range(self.thread_count):
+                thread = threading.Thread(
+                    target=self.run_forever,
+                    name=f'job-worker-{index}',
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"Started {self.thread_count} job worker thread(s) in pid {self._pid}")
+
+    def notify(self):
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+
+    def run_forever(self):
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+        while not self._stopping:
+            try:
+                ran = self.run_once(worker_id)
+            except Exception as e:
+                logger.exception(f"Job worker loop error: {e}")
+                ran = False
+            if not ran:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    # --- execution -------------------------------------------------------
+
+    def run_once(self, worker_id='cli'):
+        """Claim and execute one due job. Returns True if a job was run."""
+        with self.app.app_context():
+            try:
+                job = self._claim(worker_id)
+                if job is None:
+                    return False
+                self._execute(job)
+                return True
+            finally:
+                db.session.remove()
+
+    def drain(self, worker_id='cli', limit=None):
+        """Run due jobs until none are left (or ``limit`` is reached)."""
+        count = 0
+        while (limit is None or count < limit) and self.run_once(worker_id):
+            count += 1
+        return count
+
+    def _claim(self, worker_id):
+        now = datetime.utcnow()
+        self._release_stale(now)
+        candidates = (
+            db.session.query(BackgroundJob.id)
+            .filter(BackgroundJob.status == JOB_PENDING, BackgroundJob.run_at <= now)
+            .order_by(BackgroundJob.run_at, BackgroundJob.id)
+            .limit(5)
+            .all()
+        )
+        for (job_id,) in candidates:
+            # Conditional update: only one worker (thread or process) wins the row
+            claimed = (
+                BackgroundJob.query
+                .filter(BackgroundJob.id == job_id, BackgroundJob.status == JOB_PENDING)
+                .update({
+                    'status': JOB_RUNNING,
+                    'locked_at': now,
+                    'locked_by': worker_id,
+                    'attempts': BackgroundJob.attempts + 1,
+                }, synchronize_session=False)
+            )
+            db.session.commit()
+            if claimed:
+                self.stats['claimed'] += 1
+                return BackgroundJob.query.get(job_id)
+        return None
+
+    def _release_stale(self, now):
+        # Cheap enough, but no need to run it on every poll
+        if time.monotonic() - self._last_release < 60:
+            return
+        self._last_release = time.monotonic()
+        stale_before = now - timedelta(seconds=self.lock_timeout)
+        released = (
+            BackgroundJob.query
+            .filter(BackgroundJob.status == JOB_RUNNING, BackgroundJob.locked_at < stale_before)
+            .update({'status': JOB_PENDING, 'locked_at': None, 'locked_by': None},
+                    synchronize_session=False)
+        )
+        db.session.commit()
+        if released:
+            logger.warning(f"Re-queued {released} job(s) abandoned by a crashed worker")
+
+    def _execute(self, job):
+        handler = _handlers.get(job.kind)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job kind '{job.kind}'")
+            handler(job.data)
+        except Exception as e:
+            db.session.rollback()
+            self._record_failure(job.id, e)
+            return
+        job.status = JOB_DONE
+        job.finished_at = datetime.utcnow()
+        job.locked_at = None
+        job.last_error = None
+        db.session.commit()
+        self.stats['succeeded'] += 1
+        logger.info(f"Job {job.id} ({job.kind}) done in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def _record_failure(self, job_id, error):
+        job = BackgroundJob.query.get(job_id)
+        job.last_error = f"{type(error).__name__}: {error}"[:2000]
+        job.locked_at = None
+        if job.attempts >= job.max_attempts:
+            job.status = JOB_DEAD
+            job.finished_at = datetime.utcnow()
+            self.stats['dead'] += 1
+            logger.error(f"Job {job.id} ({job.kind}) dead after {job.attempts} attempts: {job.last_error}")
+        else:
+            delay = backoff_delay(job.attempts, self.backoff_base, self.backoff_max)
+            job.status = JOB_PENDING
+            job.run_at = datetime.utcnow() + timedelta(seconds=delay)
+            self.stats['retried'] += 1
+            logger.warning(f"Job {job.id} ({job.kind}) failed (attempt {job.attempts}), "
+                           f"retrying in {delay:.0f}s: {job.last_error}")
+        db.session.commit()
+
+    # --- dead letters ----------------------------------------------------
+
+    def retry_dead(self, job_id=None):
+        """Move dead jobs (all, or one) back to the queue. Returns the count."""
+        with self.app.app_context():
+            query = BackgroundJob.query.filter(BackgroundJob.status == JOB_DEAD)
+            if job_id is not None:
+                query = query.filter(BackgroundJob.id == job_id)
+            count = query.update({
+                'status': JOB_PENDING,
+                'attempts': 0,
+                'run_at': datetime.utcnow(),
+                'finished_at': None,
+            }, synchronize_session=False)
+            db.session.commit()
+            db.session.remove()
+        self.notify()
+        return count
+
+    def snapshot(self):
+        return dict(self.stats)
+
+
+def get_job_queue(app=None):
+    app = app or current_app
+    return app.extensions.get('job_queue')
+
+
+def _register_cli(app, queue):
+    import click
+
+    @app.cli.group('jobs')
+    def jobs_cli():
+        """Background job queue."""
+
+    @jobs_cli.command('worker')
+    @click.option('--once', is_flag=True, help='Run due jobs and exit.')
+    def worker_command(once):
+        """Run jobs in this process (use with JOB_WORKER_THREADS=0 on web)."""
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:cli"
+        if once:
+            click.echo(f"Ran {queue.drain(worker_id)} job(s)")
+            return
+        click.echo('Job worker started, Ctrl+C to stop')
+        try:
+            queue.run_forever()
+        except KeyboardInterrupt:
+            queue.stop()
+
+    @jobs_cli.command('dead')
+    def dead_command():
+        """List dead-lettered jobs."""
+        for job in BackgroundJob.query.filter_by(status=JOB_DEAD).order_by(BackgroundJob.id):
+            click.echo(f"{job.id}\t{job.kind}\tattempts={job.attempts}\t{job.last_error}")
+
+    @jobs_cli.command('retry')
+    @click.argument('job_id', required=False, type=int)
+    def retry_command(job_id):
+        """Re-queue one dead job, or all of them."""
+        click.echo(f"Re-queued {queue.retry_dead(job_id)} job(s)")
+
+
+def init_job_queue(app):
+    """Create the queue, wire lazy worker start-up and the CLI commands."""
+    queue = JobQueue(app)
+    app.extensions['job_queue'] = queue
+
+    @app.before_request
+    def _start_job_workers():
+        queue.ensure_started()
+
+    _register_cli(app, queue)
+    return queue
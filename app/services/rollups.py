@@ -0,0 +1,550 @@
+"""
+Sales rollups for the admin dashboards.
+
+``admin.dashboard``, ``admin_shop.dashboard`` and ``/admin/api/dashboard/sales``
+used to COUNT/SUM over every order (and GROUP BY over every order item) on
+each page load. They now read two small aggregate tables
+(app/models/rollup.py) whose size depends on the number of days and products,
+not on the number of orders:
+
+* ``order_rollups``: order count and revenue per hour and per day, split by
+  (order status, payment status). Revenue on the dashboards is the revenue of
+  cells with payment status ``paid``.
+* ``product_sales_rollups``: units and item revenue per product per day.
+
+The rollups are maintained incrementally by mapper events on ``Order`` and
+``OrderItem`` within the same flush as the order change. A status change
+moves the order from one cell to another, and the upserts add deltas, so
+concurrent checkouts don't lose updates.
+
+Writes that bypass the ORM (raw SQL, bulk ``query.update()``) are not seen by
+the events. Checkout bulk-inserts order items on purpose and calls
+``add_order_items()`` itself; for everything else the ``rollups.catch_up``
+background job rebuilds the last ``ROLLUP_CATCHUP_WINDOW`` hours from the
+orders every ``ROLLUP_CATCHUP_INTERVAL`` seconds. A rebuild locks the rollup
+tables against writers while it computes and writes, so checkouts running at
+the same time wait briefly instead of losing their deltas. ``flask rollups check``
+compares the rollups with the orders and ``flask rollups rebuild`` recomputes
+any range.
+"""
+import enum
+import logging
+import os
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, event, false, func, inspect, select, text
+
+from app.models.database import db
+from app.models.order import Order, OrderItem
+from app.models.rollup import GRANULARITY_DAY, GRANULARITY_HOUR, OrderRollup, ProductSalesRollup
+
+logger = logging.getLogger(__name__)
+
+CATCH_UP_JOB = 'rollups.catch_up'
+# Revenue tolerance for the consistency check (float sums)
+EPSILON = 0.005
+
+OrderSummary = namedtuple('OrderSummary', 'total_orders by_order_status by_payment_status paid_revenue')
+Mismatch = namedtuple('Mismatch', 'table key expected actual')
+
+
+def bucket_start(moment, granularity):
+    if granularity == GRANULARITY_HOUR:
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _status(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value or ''
+
+
+# --- incremental maintenance ---------------------------------------------
+
+def _increment(connection, table, key, deltas):
+    """Add ``deltas`` to the row identified by ``key``, creating it if missing."""
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table).values(**key, **deltas)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=list(key),
+            set_={name: table.c[name] + statement.excluded[name] for name in deltas},
+        ))
+        return
+    match = and_(*(table.c[name] == value for name, value in key.items()))
+    updated = connection.execute(
+        table.update().where(match).values({name: table.c[name] + delta for name, delta in deltas.items()})
+    )
+    if not updated.rowcount:
+        connection.execute(table.insert().values(**key, **deltas))
+
+
+def _increment_many(connection, table, key_names, rows):
+    """``_increment`` for many rows; a single executemany upsert where the dialect has one."""
+    dialect = connection.dialect.name
+    if dialect not in ('postgresql', 'sqlite'):
+        for row in rows:
+            _increment(connection, table, {name: row[name] for name in key_names},
+                       {name: value for name, value in row.items() if name not in key_names})
+        return
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    statement = insert(table)
+    deltas = [name for name in rows[0] if name not in key_names]
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=list(key_names),
+        set_={name: table.c[name] + statement.excluded[name] for name in deltas},
+    ), rows)
+
+
+def _add_order(connection, created_at, order_status, payment_status, count, revenue):
+    if created_at is None or (not count and not revenue):
+        return
+    for granularity in (GRANULARITY_HOUR, GRANULARITY_DAY):
+        _increment(connection, OrderRollup.__table__, {
+            'granularity': granularity,
+            'bucket_start': bucket_start(created_at, granularity),
+            'order_status': _status(order_status),
+            'payment_status': _status(payment_status),
+        }, {'order_count': count, 'revenue': revenue})
+
+
+def _add_product(connection, created_at, product_id, units, revenue):
+    if created_at is None or (not units and not revenue):
+        return
+    _increment(connection, ProductSalesRollup.__table__, {
+        'bucket_start': bucket_start(created_at, GRANULARITY_DAY),
+        'product_id': product_id or 0,
+    }, {'units': units, 'revenue': revenue})
+
+
+def add_order_items(connection, created_at, items):
+    """Count items inserted without the ORM, e.g. by app/services/checkout.py.
+
+    ``items`` is a list of (product_id, units, revenue) tuples.
+    """
+    if created_at is None:
+        return
+    cells = defaultdict(lambda: [0, 0.0])
+    for product_id, units, revenue in items:
+        cell = cells[product_id or 0]
+        cell[0] += units or 0
+        cell[1] += revenue or 0
+    day = bucket_start(created_at, GRANULARITY_DAY)
+    rows = [{'bucket_start': day, 'product_id': product_id, 'units': units, 'revenue': revenue}
+            for product_id, (units, revenue) in cells.items() if units or revenue]
+    if rows:
+        _increment_many(connection, ProductSalesRollup.__table__, ('bucket_start', 'product_id'), rows)
+
+
+def _previous(target, attr):
+    # Value before this flush; the set listeners below make sure it was loaded
+    history = inspect(target).attrs[attr].history
+    return history.deleted[0] if history.deleted else getattr(target, attr)
+
+
+def _keep_previous(target, value, oldvalue, initiator):
+    """No-op; registered with active_history so _previous() sees the old value."""
+
+
+for _attr in (Order.order_status, Order.payment_status, Order.total, Order.created_at,
+              OrderItem.product_id, OrderItem.quantity, OrderItem.total_price):
+    event.listen(_attr, 'set', _keep_previous, active_history=True)
+
+
+@event.listens_for(Order, 'after_insert')
+def _order_inserted(mapper, connection, target):
+    _add_order(connection, target.created_at, target.order_status, target.payment_status,
+               1, target.total or 0)
+
+
+@event.listens_for(Order, 'after_update')
+def _order_updated(mapper, connection, target):
+    old = [_previous(target, attr) for attr in ('created_at', 'order_status', 'payment_status', 'total')]
+    new = [target.created_at, target.order_status, target.payment_status, target.total]
+    if [_status(value) for value in old] == [_status(value) for value in new]:
+        return
+    _add_order(connection, old[0], old[1], old[2], -1, -(old[3] or 0))
+    _add_order(connection, new[0], new[1], new[2], 1, new[3] or 0)
+
+
+@event.listens_for(Order, 'before_delete')
+def _order_deleted(mapper, connection, target):
+    _add_order(connection, _previous(target, 'created_at'), _previous(target, 'order_status'),
+               _previous(target, 'payment_status'), -1, -(_previous(target, 'total') or 0))
+
+
+def _order_created_at(connection, item, order_id):
+    # Avoid lazy loads inside a flush: use the parent if it is already in memory
+    order = item.__dict__.get('order')
+    if order is not None and order.__dict__.get('created_at') is not None:
+        return order.__dict__['created_at']
+    orders = Order.__table__
+    return connection.execute(select(orders.c.created_at).where(orders.c.id == order_id)).scalar()
+
+
+@event.listens_for(OrderItem, 'after_insert')
+def _item_inserted(mapper, connection, target):
+    _add_product(connection, _order_created_at(connection, target, target.order_id),
+                 target.product_id, target.quantity or 0, target.total_price or 0)
+
+
+@event.listens_for(OrderItem, 'after_update')
+def _item_updated(mapper, connection, target):
+    old = [_previous(target, attr) for attr in ('product_id', 'quantity', 'total_price')]
+    new = [target.product_id, target.quantity, target.total_price]
+    if old == new:
+        return
+    created_at = _order_created_at(connection, target, target.order_id)
+    _add_product(connection, created_at, old[0], -(old[1] or 0), -(old[2] or 0))
+    _add_product(connection, created_at, new[0], new[1] or 0, new[2] or 0)
+
+
+@event.listens_for(OrderItem, 'before_delete')
+def _item_deleted(mapper, connection, target):
+    created_at = _order_created_at(connection, target, _previous(target, 'order_id'))
+    _add_product(connection, created_at, _previous(target, 'product_id'),
+                 -(_previous(target, 'quantity') or 0), -(_previous(target, 'total_price') or 0))
+
+
+# --- rebuild / consistency check -----------------------------------------
+
+def _window(start, end):
+    """Widen [start, end) to whole UTC days; None means unbounded."""
+    if start is not None:
+        start = bucket_start(start, GRANULARITY_DAY)
+    if end is not None:
+        day = bucket_start(end, GRANULARITY_DAY)
+        end = day if day == end else day + timedelta(days=1)
+    return start, end
+
+
+def _in_window(column, start, end):
+    conditions = []
+    if start is not None:
+        conditions.append(column >= start)
+    if end is not None:
+        conditions.append(column < end)
+    return and_(*conditions) if conditions else None
+
+
+def _where(statement, condition):
+    return statement.where(condition) if condition is not None else statement
+
+
+def compute(connection, start=None, end=None):
+    """Rollup cells as they should be for orders created in [start, end), from the source tables."""
+    orders, items = Order.__table__, OrderItem.__table__
+    order_cells = defaultdict(lambda: [0, 0.0])
+    product_cells = defaultdict(lambda: [0, 0.0])
+
+    statement = _where(
+        select(orders.c.created_at, orders.c.order_status, orders.c.payment_status, orders.c.total),
+        _in_window(orders.c.created_at, start, end),
+    )
+    for created_at, order_status, payment_status, total in connection.execution_options(
+            stream_results=True).execute(statement):
+        if created_at is None:
+            continue
+        for granularity in (GRANULARITY_HOUR, GRANULARITY_DAY):
+            cell = order_cells[(granularity, bucket_start(created_at, granularity),
+                                _status(order_status), _status(payment_status))]
+            cell[0] += 1
+            cell[1] += total or 0
+
+    statement = _where(
+        select(orders.c.created_at, items.c.product_id, items.c.quantity, items.c.total_price)
+        .select_from(items.join(orders, orders.c.id == items.c.order_id)),
+        _in_window(orders.c.created_at, start, end),
+    )
+    for created_at, product_id, quantity, total_price in connection.execution_options(
+            stream_results=True).execute(statement):
+        if created_at is None:
+            continue
+        cell = product_cells[(bucket_start(created_at, GRANULARITY_DAY), product_id or 0)]
+        cell[0] += quantity or 0
+        cell[1] += total_price or 0
+    return order_cells, product_cells
+
+
+def stored(connection, start=None, end=None):
+    """Rollup cells currently stored for [start, end)."""
+    order_table, product_table = OrderRollup.__table__, ProductSalesRollup.__table__
+    order_cells = {
+        (row.granularity, row.bucket_start, row.order_status, row.payment_status): [row.order_count, row.revenue]
+        for row in connection.execute(_where(select(order_table), _in_window(order_table.c.bucket_start, start, end)))
+    }
+    product_cells = {
+        (row.bucket_start, row.product_id): [row.units, row.revenue]
+        for row in connection.execute(_where(select(product_table), _in_window(product_table.c.bucket_start, start, end)))
+    }
+    return order_cells, product_cells
+
+
+def _lock_rollups(connection):
+    """Hold off rollup writers (checkout, status changes) until this transaction ends.
+
+    A rebuild computes the cells from the orders and then writes them. An order
+    committed in between would otherwise be missing from the computed cells
+    while its delta is overwritten. Writers that arrive during the rebuild wait,
+    and then add their delta on top of the rebuilt values.
+    """
+    tables = (OrderRollup.__table__, ProductSalesRollup.__table__)
+    if connection.dialect.name == 'postgresql':
+        # Conflicts with the ROW EXCLUSIVE lock of INSERT/UPDATE, not with readers
+        names = ', '.join(table.fullname for table in tables)
+        connection.execute(text(f"LOCK TABLE {names} IN SHARE ROW EXCLUSIVE MODE"))
+    elif connection.dialect.name == 'sqlite':
+        # A write statement (even one matching no rows) takes the database write lock now
+        table = tables[0]
+        connection.execute(table.update().where(false()).values(order_count=table.c.order_count))
+
+
+def _set_many(connection, table, key_names, rows):
+    """Upsert ``rows`` with absolute values (``_increment_many`` adds deltas instead)."""
+    if not rows:
+        return
+    dialect = connection.dialect.name
+    if dialect not in ('postgresql', 'sqlite'):
+        for row in rows:
+            match = and_(*(table.c[name] == row[name] for name in key_names))
+            values = {name: value for name, value in row.items() if name not in key_names}
+            if not connection.execute(table.update().where(match).values(values)).rowcount:
+                connection.execute(table.insert().values(row))
+        return
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    statement = insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(key_names),
+        set_={name: statement.excluded[name] for name in rows[0] if name not in key_names},
+    )
+    for offset in range(0, len(rows), 5000):
+        connection.execute(statement, rows[offset:offset + 5000])
+
+
+def _replace_cells(connection, table, key_names, cells, value_names, start, end):
+    """Make the stored cells of [start, end) equal ``cells``; returns the number written."""
+    window = _in_window(table.c.bucket_start, start, end)
+    stale = [
+        row[0] for row in connection.execute(_where(select(table.c.id, *(table.c[name] for name in key_names)),
+                                                    window))
+        if tuple(row[1:]) not in cells
+    ]
+    for offset in range(0, len(stale), 5000):
+        connection.execute(table.delete().where(table.c.id.in_(stale[offset:offset + 5000])))
+    rows = [dict(zip(key_names + value_names, key + tuple(values))) for key, values in cells.items()]
+    _set_many(connection, table, key_names, rows)
+    return len(rows)
+
+
+def rebuild(connection, start=None, end=None):
+    """Set the rollups for [start, end) (whole days; None = all) to recomputed values.
+
+    Runs under ``_lock_rollups``: the cells are upserted with absolute values
+    and only cells that no longer have orders are deleted, so the caller's
+    transaction must be committed promptly to release the writers.
+    """
+    start, end = _window(start, end)
+    _lock_rollups(connection)
+    order_cells, product_cells = compute(connection, start, end)
+    return (
+        _replace_cells(connection, OrderRollup.__table__,
+                       ('granularity', 'bucket_start', 'order_status', 'payment_status'),
+                       order_cells, ('order_count', 'revenue'), start, end),
+        _replace_cells(connection, ProductSalesRollup.__table__, ('bucket_start', 'product_id'),
+                       product_cells, ('units', 'revenue'), start, end),
+    )
+
+
+def _differences(table, expected, actual):
+    mismatches = []
+    for key in set(expected) | set(actual):
+        want = expected.get(key, [0, 0.0])
+        have = actual.get(key, [0, 0.0])
+        if want[0] != have[0] or abs(want[1] - have[1]) > EPSILON:
+            mismatches.append(Mismatch(table, key, tuple(want), tuple(have)))
+    return sorted(mismatches, key=lambda mismatch: str(mismatch.key))
+
+
+def check(connection, start=None, end=None):
+    """Compare stored rollups with the orders; returns a list of Mismatch."""
+    start, end = _window(start, end)
+    expected_orders, expected_products = compute(connection, start, end)
+    actual_orders, actual_products = stored(connection, start, end)
+    return (_differences('order_rollups', expected_orders, actual_orders)
+            + _differences('product_sales_rollups', expected_products, actual_products))
+
+
+# --- dashboard reads -----------------------------------------------------
+
+def order_summary():
+    """Order totals for the dashboards, from the daily rollups."""
+    rows = (
+        db.session.query(OrderRollup.order_status, OrderRollup.payment_status,
+                         func.sum(OrderRollup.order_count), func.sum(OrderRollup.revenue))
+        .filter(OrderRollup.granularity == GRANULARITY_DAY)
+        .group_by(OrderRollup.order_status, OrderRollup.payment_status)
+        .all()
+    )
+    by_order_status = defaultdict(int)
+    by_payment_status = defaultdict(int)
+    total_orders = 0
+    paid_revenue = 0.0
+    for order_status, payment_status, count, revenue in rows:
+        count = int(count or 0)
+        total_orders += count
+        by_order_status[order_status] += count
+        by_payment_status[payment_status] += count
+        if payment_status == 'paid':
+            paid_revenue += revenue or 0
+    return OrderSummary(total_orders, dict(by_order_status), dict(by_payment_status), paid_revenue)
+
+
+def top_products(limit=5):
+    """``[(Product, units sold)]`` by units across all orders."""
+    from app.models.product import Product
+    units = (
+        db.session.query(ProductSalesRollup.product_id, func.sum(ProductSalesRollup.units).label('units'))
+        .filter(ProductSalesRollup.product_id != 0)
+        .group_by(ProductSalesRollup.product_id)
+        .subquery()
+    )
+    return (
+        db.session.query(Product, units.c.units)
+        .join(units, units.c.product_id == Product.id)
+        .filter(units.c.units > 0)
+        .order_by(units.c.units.desc(), Product.id)
+        .limit(limit)
+        .all()
+    )
+
+
+def paid_sales(start, end, granularity=GRANULARITY_DAY):
+    """``{bucket_start: paid revenue}`` for buckets in [start, end)."""
+    rows = (
+        db.session.query(OrderRollup.bucket_start, func.sum(OrderRollup.revenue))
+        .filter(OrderRollup.granularity == granularity,
+                OrderRollup.payment_status == 'paid',
+                OrderRollup.bucket_start >= start,
+                OrderRollup.bucket_start < end)
+        .group_by(OrderRollup.bucket_start)
+        .all()
+    )
+    return {bucket: float(revenue or 0) for bucket, revenue in rows}
+
+
+# --- catch-up job --------------------------------------------------------
+
+def catch_up(connection, hours):
+    """Rebuild the recent window; a full rebuild if the rollups are still empty."""
+    order_table = OrderRollup.__table__
+    empty = connection.execute(select(order_table.c.id).limit(1)).first() is None
+    if empty:
+        has_orders = connection.execute(select(Order.__table__.c.id).limit(1)).first() is not None
+        if has_orders:
+            logger.info("Rollups are empty; rebuilding from all orders")
+            return rebuild(connection)
+    return rebuild(connection, datetime.utcnow() - timedelta(hours=hours), datetime.utcnow())
+
+
+def _schedule_catch_up(delay, include_running=True):
+    """Enqueue a catch-up unless one is already queued (so chains never multiply)."""
+    from app.models.job import BackgroundJob, JOB_PENDING, JOB_RUNNING
+    from app.services.job_queue import enqueue
+    statuses = (JOB_PENDING, JOB_RUNNING) if include_running else (JOB_PENDING,)
+    queued = (
+        db.session.query(BackgroundJob.id)
+        .filter(BackgroundJob.kind == CATCH_UP_JOB, BackgroundJob.status.in_(statuses))
+        .first()
+    )
+    if queued is None:
+        enqueue(CATCH_UP_JOB, delay=delay)
+
+
+def _register_job():
+    from app.services.job_queue import job_handler
+
+    @job_handler(CATCH_UP_JOB)
+    def _run_catch_up(payload):
+        config = current_app.config
+        cells = catch_up(db.session.connection(), config.get('ROLLUP_CATCHUP_WINDOW', 48))
+        logger.info(f"Rollup catch-up rebuilt {cells[0]} order and {cells[1]} product cells")
+        interval = config.get('ROLLUP_CATCHUP_INTERVAL', 900)
+        if interval > 0:
+            # Committed by the job queue together with this job's completion
+            _schedule_catch_up(interval, include_running=False)
+
+
+def _register_cli(app):
+    import click
+
+    def parse_day(value):
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+    @app.cli.group('rollups')
+    def rollups_cli():
+        """Sales rollups behind the admin dashboards."""
+
+    @rollups_cli.command('rebuild')
+    @click.option('--since', help='First day (YYYY-MM-DD); default: all orders.')
+    @click.option('--until', help='Day after the last one (YYYY-MM-DD); default: open-ended.')
+    def rebuild_command(since, until):
+        """Recompute rollups from the orders."""
+        with db.engine.begin() as conn:
+            order_cells, product_cells = rebuild(conn, parse_day(since), parse_day(until))
+        click.echo(f"Rebuilt {order_cells} order cells and {product_cells} product cells")
+
+    @rollups_cli.command('check')
+    @click.option('--days', type=int, default=None, help='Only the last N days; default: everything.')
+    @click.option('--fix', is_flag=True, help='Rebuild the checked range when it differs.')
+    def check_command(days, fix):
+        """Compare the rollups with the orders; exits with status 1 on mismatches."""
+        start = datetime.utcnow() - timedelta(days=days) if days else None
+        with db.engine.begin() as conn:
+            mismatches = check(conn, start)
+            for mismatch in mismatches[:50]:
+                click.echo(f"{mismatch.table} {mismatch.key}: expected {mismatch.expected}, stored {mismatch.actual}")
+            if len(mismatches) > 50:
+                click.echo(f"... and {len(mismatches) - 50} more")
+            if mismatches and fix:
+                rebuild(conn, start)
+                click.echo("Rebuilt the checked range")
+        if not mismatches:
+            click.echo("Rollups are consistent with the orders")
+        elif not fix:
+            raise SystemExit(1)
+
+
+def init_rollups(app):
+    """Register the catch-up job and CLI; schedule the first catch-up on first request."""
+    from app.utils.db_health import is_db_exempt
+    _register_job()
+    _register_cli(app)
+    state = {'pid': None}
+
+    @app.before_request
+    def _ensure_catch_up():
+        if state['pid'] == os.getpid() or app.config.get('ROLLUP_CATCHUP_INTERVAL', 900) <= 0:
+            return
+        # Probes and static files stay off the database (app/utils/health.py)
+        if is_db_exempt():
+            return
+        state['pid'] = os.getpid()
+        try:
+            _schedule_catch_up(delay=0)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Could not schedule rollup catch-up: {e}")
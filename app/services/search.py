@@ -0,0 +1,409 @@
+"""
+Full-text product search (storefront, typeahead and the admin product list).
+
+Indexed fields are the product name, SKU, short description, description and
+the category name. The backend is picked once per database:
+
+* PostgreSQL: the ``search_vector`` tsvector columns on ``products`` and
+  ``categories`` (migration 0007) are ``GENERATED ... STORED``, each with a
+  GIN index, so PostgreSQL keeps them current on every save. Every text is
+  indexed with the ``simple`` configuration plus the ``english`` and
+  ``german`` stemmers. Queries use the stemmer of the visitor's language
+  (``SEARCH_LANGUAGE_CONFIGS``). Ukrainian has no stock stemmer, so it uses
+  ``simple`` with prefix matching.
+* SQLite: an FTS5 table ``product_search`` (porter + unicode61) ranked with
+  bm25. Mapper events below update it incrementally whenever a product or a
+  category name changes. Without a stemmer for de/uk, query words are
+  prefix-matched.
+* Anything else, or a database without the index yet: ILIKE over the same
+  columns.
+
+``flask bootstrap run`` creates the index on every deploy
+(``create_search_index``); ``flask search reindex`` rebuilds it.
+"""
+import logging
+import re
+import threading
+from collections import namedtuple
+
+from flask import current_app, session
+from sqlalchemy import event, func, literal_column, or_, select, text
+
+from app.models.database import db
+from app.models.product import Category, Product
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LANGUAGE_CONFIGS = {'de': 'german', 'en': 'english', 'uk': 'simple'}
+FTS_TABLE = 'product_search'
+# bm25 column weights: name, sku, short_description, description, category
+FTS_WEIGHTS = (10.0, 8.0, 4.0, 1.0, 3.0)
+# Matches in the category name rank below a match in the product itself
+CATEGORY_BOOST = 0.2
+MAX_TERMS = 8
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+SearchResults = namedtuple('SearchResults', 'items total page per_page')
+
+
+def query_terms(q):
+    """Word tokens of the user's query (punctuation/operators dropped)."""
+    return [term.lower() for term in _WORD.findall(q or '')][:MAX_TERMS]
+
+
+def current_language():
+    try:
+        return session.get('lang', 'de')
+    except RuntimeError:
+        return 'de'
+
+
+def _table(model):
+    return model.__table__.fullname
+
+
+# --- backends ------------------------------------------------------------
+
+class LikeBackend:
+    """Unindexed fallback: every term must appear in one of the text columns or the category name."""
+
+    name = 'like'
+
+    def match(self, query, terms, lang, prefix=False):
+        for term in terms:
+            pattern = f'%{term}%'
+            query = query.filter(or_(
+                Product.name.ilike(pattern),
+                Product.sku.ilike(pattern),
+                Product.short_description.ilike(pattern),
+                Product.description.ilike(pattern),
+                Product.category_id.in_(select(Category.id).where(Category.name.ilike(pattern))),
+            ))
+        return query
+
+    def ranked(self, query, terms, lang, prefix=False):
+        return self.match(query, terms, lang, prefix).order_by(Product.name.asc(), Product.id.asc())
+
+
+class PostgresBackend:
+    name = 'postgresql'
+
+    def _tsquery(self, terms, lang, prefix):
+        config = current_app.config.get('SEARCH_LANGUAGE_CONFIGS', DEFAULT_LANGUAGE_CONFIGS).get(lang, 'simple')
+        # Terms are \w+ only, so they are safe inside to_tsquery syntax
+        if prefix or config == 'simple':
+            expr = ' & '.join(f'{term}:*' for term in terms)
+            return func.to_tsquery('simple', expr)
+        stemmed = func.plainto_tsquery(literal_column(f"'{config}'::regconfig"), ' '.join(terms))
+        return stemmed.op('||')(func.plainto_tsquery('simple', ' '.join(terms)))
+
+    def _vectors(self):
+        return (literal_column(f'{_table(Product)}.search_vector'),
+                literal_column(f'{_table(Category)}.search_vector'))
+
+    def _matching(self, query, tsquery):
+        product_vector, category_vector = self._vectors()
+        matching_categories = (
+            select(Category.id).where(category_vector.op('@@')(tsquery)).scalar_subquery()
+        )
+        return query.filter(or_(product_vector.op('@@')(tsquery),
+                                Product.category_id.in_(matching_categories)))
+
+    def match(self, query, terms, lang, prefix=False):
+        return self._matching(query, self._tsquery(terms, lang, prefix))
+
+    def ranked(self, query, terms, lang, prefix=False):
+        tsquery = self._tsquery(terms, lang, prefix)
+        product_vector, category_vector = self._vectors()
+        category_hit = (
+            select(Category.id)
+            .where(Category.id == Product.category_id, category_vector.op('@@')(tsquery))
+            .exists()
+        )
+        rank = func.ts_rank_cd(product_vector, tsquery) + db.case((category_hit, CATEGORY_BOOST), else_=0)
+        return self._matching(query, tsquery).order_by(rank.desc(), Product.id.asc())
+
+
+class SqliteBackend:
+    name = 'sqlite-fts5'
+
+    def _fts_query(self, terms, lang, prefix):
+        # English is stemmed by the porter tokenizer; other languages match prefixes
+        stem_free = lang != 'en'
+        parts = []
+        for index, term in enumerate(terms):
+            last = index == len(terms) - 1
+            parts.append(f'"{term}"*' if stem_free or (prefix and last) else f'"{term}"')
+        return ' '.join(parts)
+
+    def _hits(self, terms, lang, prefix):
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        return text(
+            f"SELECT rowid AS product_id, bm25({FTS_TABLE}, {weights}) AS score "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts_query"
+        ).bindparams(fts_query=self._fts_query(terms, lang, prefix)).columns(
+            product_id=db.Integer, score=db.Float,
+        ).subquery('search_hits')
+
+    def match(self, query, terms, lang, prefix=False):
+        hits = self._hits(terms, lang, prefix)
+        return query.filter(Product.id.in_(select(hits.c.product_id)))
+
+    def ranked(self, query, terms, lang, prefix=False):
+        hits = self._hits(terms, lang, prefix)
+        # bm25() is lower-is-better
+        return query.join(hits, hits.c.product_id == Product.id).order_by(hits.c.score.asc(), Product.id.asc())
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def _detect_backend(engine):
+    try:
+        with engine.connect() as conn:
+            if engine.dialect.name == 'postgresql':
+                schema = Product.__table__.schema or 'public'
+                found = conn.execute(text(
+                    "SELECT 1 FROM information_schema.columns "
+                    "WHERE table_schema = :schema AND table_name = 'products' AND column_name = 'search_vector'"
+                ), {'schema': schema}).first()
+                if found:
+                    return PostgresBackend()
+            elif engine.dialect.name == 'sqlite' and _sqlite_index_exists(conn):
+                return SqliteBackend()
+    except Exception as e:
+        logger.warning(f"Search index detection failed, using ILIKE: {e}")
+    logger.info("Full-text search index not found, product search uses ILIKE")
+    return LikeBackend()
+
+
+def get_backend():
+    engine = db.get_engine()
+    key = str(engine.url)
+    with _backends_lock:
+        backend = _backends.get(key)
+    if backend is None:
+        backend = _detect_backend(engine)
+        with _backends_lock:
+            _backends[key] = backend
+    return backend
+
+
+def reset_backend():
+    with _backends_lock:
+        _backends.clear()
+
+
+# --- public API ----------------------------------------------------------
+
+def _base_query(active_only, category_id):
+    query = Product.query
+    if active_only:
+        query = query.filter(Product.is_active == True, Product.slug != None, Product.slug != '')  # noqa: E711,E712
+    if category_id is not None:
+        query = query.filter(Product.category_id == category_id)
+    return query
+
+
+def search_products(q, lang=None, page=1, per_page=None, active_only=True, category_id=None):
+    """Ranked, paginated search. Returns SearchResults (empty for an empty query)."""
+    per_page = per_page or current_app.config.get('CATALOG_PAGE_SIZE', 24)
+    page = max(1, int(page or 1))
+    terms = query_terms(q)
+    if not terms:
+        return SearchResults([], 0, page, per_page)
+    backend = get_backend()
+    lang = lang or current_language()
+    query = backend.ranked(_base_query(active_only, category_id), terms, lang)
+    total = backend.match(_base_query(active_only, category_id), terms, lang).count()
+    items = query.offset((page - 1) * per_page).limit(per_page).all()
+    return SearchResults(items, total, page, per_page)
+
+
+def typeahead(q, lang=None, limit=8):
+    """Best matches for a partially typed query (last word is a prefix)."""
+    terms = query_terms(q)
+    if not terms:
+        return []
+    backend = get_backend()
+    query = backend.ranked(_base_query(True, None), terms, lang or current_language(), prefix=True)
+    rows = query.with_entities(Product.id, Product.name, Product.slug, Product.price).limit(limit).all()
+    return [{'id': row.id, 'name': row.name, 'slug': row.slug, 'price': row.price} for row in rows]
+
+
+def filter_products(query, q, lang=None):
+    """Restrict an existing Product query to search matches (keeps its ordering)."""
+    terms = query_terms(q)
+    if not terms:
+        return query
+    return get_backend().match(query, terms, lang or current_language())
+
+
+# --- index creation ------------------------------------------------------
+
+# Each text is indexed unstemmed ('simple', also used for Ukrainian) and with
+# the English and German stemmers, as in migration 0007
+VECTOR_CONFIGS = ('simple', 'english', 'german')
+
+
+def _vector_sql(columns_by_weight):
+    parts = []
+    for weight, columns in columns_by_weight:
+        document = " || ' ' || ".join(f"coalesce({column}, '')" for column in columns)
+        for config in VECTOR_CONFIGS:
+            parts.append(f"setweight(to_tsvector('{config}'::regconfig, {document}), '{weight}')")
+    return ' || '.join(parts)
+
+
+# (model, generated tsvector expression, GIN index name)
+POSTGRES_VECTORS = (
+    (Product, _vector_sql([('A', ['name', 'sku']), ('B', ['short_description']), ('C', ['description'])]),
+     'ix_products_search_vector'),
+    (Category, _vector_sql([('A', ['name'])]), 'ix_categories_search_vector'),
+)
+
+
+def _postgres_index_exists(conn):
+    return conn.execute(text(
+        "SELECT 1 FROM pg_indexes WHERE schemaname = :schema AND indexname = 'ix_products_search_vector'"
+    ), {'schema': Product.__table__.schema or 'public'}).first() is not None
+
+
+def create_search_index(connection):
+    """Create the full-text index of this database if it is missing; returns what was done.
+
+    PostgreSQL gets the generated ``search_vector`` columns and their GIN
+    indexes, SQLite the FTS5 table, filled from the current rows. Other
+    databases keep using ILIKE.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        for model, vector, index in POSTGRES_VECTORS:
+            connection.execute(text(f"ALTER TABLE {_table(model)} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                                    f"GENERATED ALWAYS AS ({vector}) STORED"))
+            connection.execute(text(f"CREATE INDEX IF NOT EXISTS {index} ON {_table(model)} "
+                                    f"USING GIN (search_vector)"))
+        result = 'search_vector columns and GIN indexes exist'
+    elif dialect == 'sqlite':
+        if _sqlite_index_exists(connection):
+            return f"{FTS_TABLE} exists"
+        rebuild_sqlite_index(connection)
+        result = f"created {FTS_TABLE}"
+    else:
+        return f"no full-text index for {dialect}; search uses ILIKE"
+    reset_backend()
+    return result
+
+
+# --- SQLite FTS5 index maintenance ---------------------------------------
+
+FTS_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "name, sku, short_description, description, category, "
+    "tokenize = 'porter unicode61 remove_diacritics 2')"
+)
+
+
+def _sqlite_index_exists(conn):
+    return conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+    ), {'name': FTS_TABLE}).first() is not None
+
+
+_fts_ready = {}
+
+
+def _fts_enabled(connection):
+    if connection.dialect.name != 'sqlite':
+        return False
+    key = str(connection.engine.url)
+    if key not in _fts_ready:
+        _fts_ready[key] = _sqlite_index_exists(connection)
+    return _fts_ready[key]
+
+
+def _fts_upsert(connection, product):
+    category_name = None
+    if product.category_id is not None:
+        category_name = connection.execute(
+            select(Category.name).where(Category.id == product.category_id)
+        ).scalar()
+    connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': product.id})
+    connection.execute(text(
+        f"INSERT INTO {FTS_TABLE} (rowid, name, sku, short_description, description, category) "
+        "VALUES (:id, :name, :sku, :short_description, :description, :category)"
+    ), {
+        'id': product.id, 'name': product.name, 'sku': product.sku,
+        'short_description': product.short_description, 'description': product.description,
+        'category': category_name,
+    })
+
+
+def _product_saved(mapper, connection, product):
+    if _fts_enabled(connection):
+        _fts_upsert(connection, product)
+
+
+def _product_deleted(mapper, connection, product):
+    if _fts_enabled(connection):
+        connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': product.id})
+
+
+def _category_updated(mapper, connection, category):
+    if not _fts_enabled(connection):
+        return
+    if not db.inspect(category).attrs.name.history.has_changes():
+        return
+    connection.execute(text(
+        f"UPDATE {FTS_TABLE} SET category = :name "
+        f"WHERE rowid IN (SELECT id FROM {_table(Product)} WHERE category_id = :category_id)"
+    ), {'name': category.name, 'category_id': category.id})
+
+
+event.listen(Product, 'after_insert', _product_saved)
+event.listen(Product, 'after_update', _product_saved)
+event.listen(Product, 'after_delete', _product_deleted)
+event.listen(Category, 'after_update', _category_updated)
+
+
+def rebuild_sqlite_index(connection):
+    """(Re)create the FTS5 table and fill it from products + categories."""
+    connection.execute(text(FTS_DDL))
+    connection.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    connection.execute(text(
+        f"INSERT INTO {FTS_TABLE} (rowid, name, sku, short_description, description, category) "
+        f"SELECT p.id, p.name, p.sku, p.short_description, p.description, c.name "
+        f"FROM {_table(Product)} p LEFT JOIN {_table(Category)} c ON c.id = p.category_id"
+    ))
+    connection.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')"))
+    _fts_ready[str(connection.engine.url)] = True
+    reset_backend()
+
+
+def init_search(app):
+    import click
+
+    @app.cli.group('search')
+    def search_cli():
+        """Product search index."""
+
+    @search_cli.command('reindex')
+    def reindex_command():
+        """Rebuild the SQLite FTS5 index (PostgreSQL maintains its own)."""
+        engine = db.get_engine()
+        if engine.dialect.name == 'sqlite':
+            with engine.begin() as conn:
+                rebuild_sqlite_index(conn)
+            click.echo(f"Rebuilt {FTS_TABLE}")
+        elif engine.dialect.name == 'postgresql':
+            with engine.begin() as conn:
+                if not _postgres_index_exists(conn):
+                    click.echo("ix_products_search_vector not found (run flask bootstrap run); search uses ILIKE")
+                    return
+                conn.execute(text(f"REINDEX INDEX {Product.__table__.schema + '.' if Product.__table__.schema else ''}ix_products_search_vector"))
+            click.echo("search_vector is a generated column; GIN index rebuilt")
+        else:
+            click.echo(f"No full-text index for {engine.dialect.name}; search uses ILIKE")
+        reset_backend()
@@ -0,0 +1,271 @@
+"""
+Stock reservations for checkout.
+
+``shop.checkout`` used to load each product and run ``product.stock -=
+quantity`` in Python. Two concurrent checkouts could both read the same
+stock and oversell, and ``None`` (unlimited) made the subtraction fail.
+``payment_cancel`` then added the stock back on every call, even when the
+order had already been cancelled. Now:
+
+* ``reserve()`` takes the stock of a whole order with one conditional UPDATE
+  (``stock - q WHERE stock >= q OR stock IS NULL``; NULL stays NULL) in the
+  order's own transaction, and records one ``held`` row per product in
+  ``stock_reservations``. A product that is short makes the whole
+  reservation fail with ``InsufficientStock``; the caller rolls back.
+* ``commit()`` marks the rows ``committed`` when the payment succeeds.
+* ``release()`` gives the stock back for rows that are still ``held``. Each
+  row is claimed with a conditional UPDATE first, so a repeated cancel, a
+  webhook retry or a race with the expiry job returns the stock only once.
+* Each reservation expires after ``STOCK_RESERVATION_TTL`` seconds, which is
+  also the lifetime of the Stripe Checkout session. The ``stock.expire_order``
+  job runs ``STOCK_RESERVATION_GRACE`` seconds later. It asks Stripe whether
+  the session was paid after all (a missed webhook) and otherwise releases
+  the stock and cancels the order. ``flask stock expire`` does the same for
+  every overdue order.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import case, or_, select
+
+from app.models.database import db
+from app.models.order import Order, OrderStatus, Payment, PaymentStatus
+from app.models.product import Product
+from app.models.stock import RESERVATION_COMMITTED, RESERVATION_HELD, RESERVATION_RELEASED, StockReservation
+from app.utils.metrics import outbound_call
+
+logger = logging.getLogger(__name__)
+
+EXPIRE_JOB = 'stock.expire_order'
+
+
+class InsufficientStock(Exception):
+    """Some product of the order does not have enough stock; roll back the transaction."""
+
+    def __init__(self, quantities):
+        self.quantities = quantities
+        super().__init__(f"Insufficient stock for products {sorted(quantities)}")
+
+
+def order_quantities(items):
+    """{product_id: quantity} for cart or order items (items without a product are skipped)."""
+    quantities = {}
+    for item in items:
+        if item.product_id is not None and (item.quantity or 0) > 0:
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    return quantities
+
+
+def _adjust_stock(connection, quantities, sign, conditional):
+    products = Product.__table__
+    delta = case(quantities, value=products.c.id)
+    statement = (products.update()
+                 .where(products.c.id.in_(list(quantities)))
+                 .values(stock=products.c.stock + sign * delta))
+    if conditional:
+        statement = statement.where(or_(products.c.stock.is_(None), products.c.stock >= delta))
+    result = connection.execute(statement)
+    # Loaded Product objects still hold the old stock
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, Product) and obj.id in quantities:
+            db.session.expire(obj, ['stock'])
+    return result.rowcount
+
+
+def shortages(quantities):
+    """{product_id: available} for the products that cannot cover ``quantities``."""
+    products = Product.__table__
+    rows = db.session.execute(select(products.c.id, products.c.stock)
+                              .where(products.c.id.in_(list(quantities)))).all()
+    found = {row.id: row.stock for row in rows}
+    return {product_id: found.get(product_id, 0) for product_id, quantity in quantities.items()
+            if product_id not in found or (found[product_id] is not None and found[product_id] < quantity)}
+
+
+def reservation_ttl():
+    return current_app.config.get('STOCK_RESERVATION_TTL', 3600)
+
+
+def reserve(order_id, quantities, ttl=None):
+    """Take stock for an order in the current transaction. Returns the expiry time.
+
+    Raises ``InsufficientStock`` when any product is short. Some rows may
+    already be decremented by then, so the caller must roll back.
+    """
+    if not quantities:
+        return None
+    ttl = reservation_ttl() if ttl is None else ttl
+    connection = db.session.connection()
+    if _adjust_stock(connection, quantities, -1, conditional=True) != len(quantities):
+        raise InsufficientStock(quantities)
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl)
+    connection.execute(StockReservation.__table__.insert(), [
+        {'order_id': order_id, 'product_id': product_id, 'quantity': quantity,
+         'status': RESERVATION_HELD, 'expires_at': expires_at, 'created_at': now}
+        for product_id, quantity in quantities.items()
+    ])
+    from app.services.job_queue import enqueue
+    enqueue(EXPIRE_JOB, {'order_id': order_id},
+            delay=ttl + current_app.config.get('STOCK_RESERVATION_GRACE', 300))
+    return expires_at
+
+
+def _claim(connection, where, values):
+    """Conditionally move held rows matching ``where``; returns {product_id: quantity} actually claimed."""
+    table = StockReservation.__table__
+    rows = connection.execute(select(table.c.id, table.c.product_id, table.c.quantity)
+                              .where(table.c.status == RESERVATION_HELD, *where)).all()
+    claimed = {}
+    for row in rows:
+        # Only one caller can move a row out of 'held'
+        moved = connection.execute(table.update()
+                                   .where(table.c.id == row.id, table.c.status == RESERVATION_HELD)
+                                   .values(**values)).rowcount
+        if moved:
+            claimed[row.product_id] = claimed.get(row.product_id, 0) + row.quantity
+    return claimed
+
+
+def release(order_id, reason, expired_only=False):
+    """Give back the stock an order still holds. Safe to call any number of times."""
+    table = StockReservation.__table__
+    connection = db.session.connection()
+    now = datetime.utcnow()
+    where = [table.c.order_id == order_id]
+    if expired_only:
+        where.append(table.c.expires_at <= now)
+    claimed = _claim(connection, where, {'status': RESERVATION_RELEASED, 'released_at': now,
+                                         'release_reason': reason})
+    if claimed:
+        _adjust_stock(connection, claimed, 1, conditional=False)
+        logger.info(f"Released stock of order {order_id} ({reason}): {claimed}")
+    return claimed
+
+
+def commit(order_id):
+    """Keep the stock of a paid order. Stock released before the payment arrived is taken again."""
+    table = StockReservation.__table__
+    connection = db.session.connection()
+    claimed = _claim(connection, [table.c.order_id == order_id], {'status': RESERVATION_COMMITTED})
+    if claimed:
+        return claimed
+    late = {row.product_id: row.quantity for row in connection.execute(
+        select(table.c.product_id, table.c.quantity)
+        .where(table.c.order_id == order_id, table.c.status == RESERVATION_RELEASED))}
+    if not late:
+        return {}
+    # Paid after the reservation expired or the payment first failed: take the
+    # stock again, product by product, so one sold-out product does not undo the rest
+    taken = {}
+    for product_id, quantity in late.items():
+        row = (table.c.order_id == order_id) & (table.c.product_id == product_id)
+        # Claim the row first so a concurrent commit cannot take the stock twice
+        if not connection.execute(table.update().where(row, table.c.status == RESERVATION_RELEASED)
+                                  .values(status=RESERVATION_COMMITTED)).rowcount:
+            continue
+        if _adjust_stock(connection, {product_id: quantity}, -1, conditional=True):
+            connection.execute(table.update().where(row).values(released_at=None, release_reason=None))
+            taken[product_id] = quantity
+        else:
+            connection.execute(table.update().where(row).values(status=RESERVATION_RELEASED,
+                                                                release_reason='sold_out'))
+    missing = {product_id: quantity for product_id, quantity in late.items() if product_id not in taken}
+    if missing:
+        logger.error(f"Order {order_id} was paid but the stock is gone: {missing}")
+    return taken
+
+
+def _stripe_session_state(order_id):
+    """'paid', 'open', 'expired' or None when Stripe cannot be asked."""
+    payment = Payment.query.filter_by(order_id=order_id, provider='stripe').first()
+    secret = current_app.config.get('STRIPE_SECRET_KEY')
+    if payment is None or not payment.provider_payment_id or not secret:
+        return None
+    if not payment.provider_payment_id.startswith('cs_'):
+        # The webhook stores the payment intent once the session completed
+        return 'paid'
+    import stripe
+    stripe.api_key = secret
+    with outbound_call('stripe', 'checkout.Session.retrieve'):
+        checkout_session = stripe.checkout.Session.retrieve(payment.provider_payment_id)
+    if checkout_session.get('payment_status') == 'paid':
+        return 'paid'
+    if checkout_session.get('status') == 'open':
+        # Stop the customer from paying for stock we are about to give back
+        with outbound_call('stripe', 'checkout.Session.expire'):
+            stripe.checkout.Session.expire(payment.provider_payment_id)
+    return 'expired'
+
+
+def expire_order(order_id):
+    """Release an unpaid order whose reservation ran out and cancel it."""
+    table = StockReservation.__table__
+    overdue = db.session.execute(select(table.c.id).where(
+        table.c.order_id == order_id, table.c.status == RESERVATION_HELD,
+        table.c.expires_at <= datetime.utcnow())).first()
+    if overdue is None:
+        return {}
+    if _stripe_session_state(order_id) == 'paid':
+        logger.warning(f"Order {order_id} was paid without a webhook; keeping its stock")
+        return commit(order_id)
+    claimed = release(order_id, 'expired', expired_only=True)
+    order = Order.query.get(order_id)
+    if order is not None and getattr(order.payment_status, 'value', order.payment_status) != PaymentStatus.PAID.value:
+        order.order_status = OrderStatus.CANCELLED.value
+        for payment in Payment.query.filter_by(order_id=order_id, status='pending'):
+            payment.status = 'expired'
+    return claimed
+
+
+def overdue_orders(limit=500):
+    table = StockReservation.__table__
+    return [row.order_id for row in db.session.execute(
+        select(table.c.order_id).distinct()
+        .where(table.c.status == RESERVATION_HELD, table.c.expires_at <= datetime.utcnow())
+        .limit(limit))]
+
+
+def _register_job():
+    from app.services.job_queue import job_handler
+
+    @job_handler(EXPIRE_JOB)
+    def _run_expire(payload):
+        # Committed by the job queue; a Stripe error retries with backoff
+        expire_order(int(payload['order_id']))
+
+
+def _register_cli(app):
+    import click
+
+    @app.cli.group('stock')
+    def stock_cli():
+        """Stock reservations of unpaid orders."""
+
+    @stock_cli.command('expire')
+    def expire_command():
+        """Release every reservation past its expiry (normally done by the job queue)."""
+        count = 0
+        for order_id in overdue_orders(limit=None):
+            try:
+                if expire_order(order_id):
+                    count += 1
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                click.echo(f"Order {order_id}: {e}")
+        click.echo(f"Released {count} expired orders")
+
+    @stock_cli.command('release')
+    @click.argument('order_id', type=int)
+    def release_command(order_id):
+        """Give back the stock an order still holds."""
+        claimed = release(order_id, 'manual')
+        db.session.commit()
+        click.echo(f"Released {claimed}" if claimed else f"Order {order_id} holds no stock")
+
+
+def init_stock(app):
+    _register_job()
+    _register_cli(app)
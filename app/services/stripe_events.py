@@ -0,0 +1,353 @@
+"""
+Stripe webhook ingestion.
+
+Both webhook URLs (``/shop/webhook`` and ``/webhooks/stripe/webhook``) used to
+update the order inside the HTTP request, wrote to attributes that are not
+columns (``Order.status``, ``Order.payment_intent_id``) and applied every
+retry Stripe sent again. Now the request does only the fast part:
+
+* ``receive()`` verifies the signature and stores the raw event in
+  ``stripe_events``. The event id is unique, so a retried delivery hits the
+  constraint and is acknowledged as a duplicate. A ``stripe.event`` job is
+  enqueued in the same transaction and the route answers 200 right away.
+* The job (``apply_event()``) applies the event to the order, its payment,
+  the stock reservation and the billed hours of project stages. Earlier
+  events of the same order that are still waiting go first, in Stripe's
+  ``created`` order. Each event is claimed with a conditional UPDATE, so a
+  second job or worker cannot apply it twice. A failure rolls everything
+  back and the job queue retries with backoff.
+* ``flask stripe-events replay FIXTURE`` feeds a file of signed events
+  through the same code, e.g. payloads saved from the Stripe dashboard.
+  tests/test_stripe_events.py builds such a fixture and checks the outcome.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import time
+from datetime import datetime
+
+import stripe
+from flask import current_app
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from app.models.database import db
+from app.models.order import Order, OrderStatus, Payment, PaymentStatus
+from app.models.project import ProjectStage
+from app.models.stripe_event import EVENT_IGNORED, EVENT_PROCESSED, EVENT_RECEIVED, StripeEvent
+from app.services import stock
+
+logger = logging.getLogger(__name__)
+
+EVENT_JOB = 'stripe.event'
+
+
+class WebhookRejected(Exception):
+    """The request is not a valid Stripe event; answer 400."""
+
+
+def _status(value):
+    return getattr(value, 'value', value)
+
+
+def _order_id(obj):
+    reference = (obj.get('metadata') or {}).get('order_id') or obj.get('client_reference_id')
+    try:
+        return int(reference) if reference is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def signature_header(payload, secret, timestamp=None):
+    """A ``Stripe-Signature`` header for ``payload``, as Stripe computes it (fixtures, local testing)."""
+    timestamp = int(time.time()) if timestamp is None else int(timestamp)
+    signature = hmac.new(secret.encode('utf-8'), f'{timestamp}.{payload}'.encode('utf-8'),
+                         hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+# --- fast path: verify and store ----------------------------------------
+
+def receive(payload, sig_header, secret=None, tolerance=stripe.Webhook.DEFAULT_TOLERANCE):
+    """Verify one delivery and store it. Returns (event_id, stored); ``stored`` is False for a duplicate.
+
+    Raises ``WebhookRejected`` for a bad signature or payload. ``tolerance=None``
+    skips the timestamp check (replaying old fixtures).
+    """
+    secret = secret or current_app.config.get('STRIPE_WEBHOOK_SECRET')
+    if not secret:
+        raise WebhookRejected('Webhook secret not configured')
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8')
+    try:
+        stripe.WebhookSignature.verify_header(payload, sig_header or '', secret, tolerance)
+        event = json.loads(payload)
+        obj = event['data']['object']
+        event_id = event['id']
+    except stripe.error.SignatureVerificationError:
+        raise WebhookRejected('Invalid signature')
+    except (ValueError, KeyError, TypeError):
+        raise WebhookRejected('Invalid payload')
+
+    from app.services.job_queue import enqueue
+    try:
+        db.session.execute(StripeEvent.__table__.insert().values(
+            event_id=event_id,
+            type=event.get('type') or '',
+            stripe_created=int(event.get('created') or 0),
+            livemode=bool(event.get('livemode')),
+            order_id=_order_id(obj),
+            payload=payload,
+            status=EVENT_RECEIVED,
+            received_at=datetime.utcnow(),
+        ))
+        enqueue(EVENT_JOB, {'event_id': event_id})
+        db.session.commit()
+    except IntegrityError:
+        # Stripe retried a delivery we already have
+        db.session.rollback()
+        logger.info(f"Stripe event {event_id} already received")
+        return event_id, False
+    return event_id, True
+
+
+# --- worker: apply to the order ------------------------------------------
+
+def _order_for(obj):
+    order_id = _order_id(obj)
+    return db.session.get(Order, order_id) if order_id else None
+
+
+def _is_paid(order):
+    return _status(order.payment_status) == PaymentStatus.PAID.value
+
+
+def _stripe_payment(order):
+    return Payment.query.filter_by(order_id=order.id, provider='stripe').first()
+
+
+def _bill_project_stages(order):
+    """Add the paid hours to their project stages (one UPDATE per stage item)."""
+    stages = ProjectStage.__table__
+    for item in order.items:
+        if not item.project_stage_id:
+            continue
+        billed = func.coalesce(stages.c.billed_hours, 0) + (item.billed_hours or item.quantity or 0)
+        db.session.execute(stages.update().where(stages.c.id == item.project_stage_id).values(
+            billed_hours=billed,
+            is_paid=case((billed >= func.coalesce(stages.c.estimated_hours, 0), True), else_=stages.c.is_paid),
+        ))
+
+
+def _mark_paid(order, payment_intent):
+    if _is_paid(order):
+        return False
+    order.payment_status = PaymentStatus.PAID.value
+    order.order_status = OrderStatus.PROCESSING.value
+    if payment_intent:
+        order.payment_reference = payment_intent
+    payment = _stripe_payment(order)
+    if payment is not None:
+        payment.status = 'completed'
+        if payment_intent:
+            payment.provider_payment_id = payment_intent
+    # The reserved stock is now sold
+    stock.commit(order.id)
+    _bill_project_stages(order)
+    logger.info(f"Payment for order {order.order_number} was successful")
+    return True
+
+
+def _session_completed(session):
+    order = _order_for(session)
+    if order is None:
+        return False
+    if session.get('payment_status') not in ('paid', 'no_payment_required'):
+        # Delayed payment methods: wait for checkout.session.async_payment_succeeded
+        return False
+    return _mark_paid(order, session.get('payment_intent'))
+
+
+def _async_payment_succeeded(session):
+    order = _order_for(session)
+    return order is not None and _mark_paid(order, session.get('payment_intent'))
+
+
+def _session_expired(session):
+    order = _order_for(session)
+    if order is None or _is_paid(order):
+        return False
+    stock.release(order.id, 'expired')
+    order.order_status = OrderStatus.CANCELLED.value
+    payment = _stripe_payment(order)
+    if payment is not None and payment.status == 'pending':
+        payment.status = 'expired'
+    return True
+
+
+def _payment_failed(obj):
+    order = _order_for(obj)
+    if order is None or _is_paid(order):
+        return False
+    # Give the reserved stock back; a later successful attempt takes it again (stock.commit)
+    stock.release(order.id, 'payment_failed')
+    order.payment_status = PaymentStatus.FAILED.value
+    payment = _stripe_payment(order)
+    if payment is not None and payment.status == 'pending':
+        payment.status = 'failed'
+    message = (obj.get('last_payment_error') or {}).get('message', 'Unknown error')
+    logger.warning(f"Payment for order {order.order_number} failed: {message}")
+    return True
+
+
+_appliers = {
+    'checkout.session.completed': _session_completed,
+    'checkout.session.async_payment_succeeded': _async_payment_succeeded,
+    'checkout.session.async_payment_failed': _payment_failed,
+    'checkout.session.expired': _session_expired,
+    'payment_intent.payment_failed': _payment_failed,
+}
+
+
+def _apply(row_id):
+    table = StripeEvent.__table__
+    connection = db.session.connection()
+    # Only one worker moves an event out of 'received'
+    claimed = connection.execute(table.update()
+                                 .where(table.c.id == row_id, table.c.status == EVENT_RECEIVED)
+                                 .values(status=EVENT_PROCESSED, processed_at=datetime.utcnow(),
+                                         last_error=None)).rowcount
+    if not claimed:
+        return None
+    record = connection.execute(select(table.c.event_id, table.c.type, table.c.payload)
+                                .where(table.c.id == row_id)).first()
+    applier = _appliers.get(record.type)
+    applied = bool(applier and applier(json.loads(record.payload)['data']['object']))
+    if not applied:
+        connection.execute(table.update().where(table.c.id == row_id).values(status=EVENT_IGNORED))
+    logger.info(f"Stripe event {record.event_id} ({record.type}) {'applied' if applied else 'ignored'}")
+    return EVENT_PROCESSED if applied else EVENT_IGNORED
+
+
+def apply_event(event_id):
+    """Apply a stored event, after the earlier waiting events of its order. Returns {event row id: status}."""
+    table = StripeEvent.__table__
+    row = db.session.execute(select(table.c.id, table.c.order_id, table.c.stripe_created, table.c.status)
+                             .where(table.c.event_id == event_id)).first()
+    if row is None or row.status != EVENT_RECEIVED:
+        return {}
+    row_ids = [row.id]
+    if row.order_id is not None:
+        row_ids = db.session.execute(
+            select(table.c.id)
+            .where(table.c.order_id == row.order_id, table.c.status == EVENT_RECEIVED,
+                   or_(table.c.stripe_created < row.stripe_created,
+                       and_(table.c.stripe_created == row.stripe_created, table.c.id <= row.id)))
+            .order_by(table.c.stripe_created, table.c.id)
+        ).scalars().all()
+    outcome = {}
+    for row_id in row_ids:
+        status = _apply(row_id)
+        if status:
+            outcome[row_id] = status
+    return outcome
+
+
+def waiting_events(limit=None):
+    table = StripeEvent.__table__
+    return db.session.execute(select(table.c.event_id).where(table.c.status == EVENT_RECEIVED)
+                              .order_by(table.c.stripe_created, table.c.id).limit(limit)).scalars().all()
+
+
+def _run_recording_errors(event_id):
+    try:
+        return apply_event(event_id)
+    except Exception as e:
+        db.session.rollback()
+        StripeEvent.query.filter_by(event_id=event_id).update(
+            {'last_error': f"{type(e).__name__}: {e}"[:2000]}, synchronize_session=False)
+        db.session.commit()
+        raise
+
+
+def _register_job():
+    from app.services.job_queue import job_handler
+
+    @job_handler(EVENT_JOB)
+    def _run_apply(payload):
+        # Committed by the job queue; an exception is retried with backoff
+        _run_recording_errors(payload['event_id'])
+
+
+def _read_fixture(fixture):
+    """Entries of a fixture file: a JSON list or JSON lines of {"payload": ..., "signature": ...}."""
+    text = fixture.read().strip()
+    if text.startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def _register_cli(app):
+    import click
+
+    @app.cli.group('stripe-events')
+    def stripe_events_cli():
+        """Stored Stripe webhook events."""
+
+    @stripe_events_cli.command('replay')
+    @click.argument('fixture', type=click.File('r'))
+    @click.option('--secret', help='Secret the fixture was signed with (default: STRIPE_WEBHOOK_SECRET).')
+    @click.option('--apply/--no-apply', 'apply_now', default=True,
+                  help='Apply the events right away instead of leaving them to the job queue.')
+    def replay_command(fixture, secret, apply_now):
+        """Feed signed events from FIXTURE through the webhook path."""
+        stored = []
+        for number, entry in enumerate(_read_fixture(fixture), 1):
+            payload = entry['payload'] if isinstance(entry['payload'], str) else json.dumps(entry['payload'])
+            try:
+                event_id, is_new = receive(payload, entry.get('signature'), secret=secret, tolerance=None)
+            except WebhookRejected as e:
+                click.echo(f"#{number}\trejected\t{e}")
+                continue
+            click.echo(f"#{number}\t{'stored' if is_new else 'duplicate'}\t{event_id}")
+            if is_new:
+                stored.append(event_id)
+        if not apply_now:
+            return
+        for event_id in stored:
+            try:
+                outcome = _run_recording_errors(event_id)
+                db.session.commit()
+            except Exception as e:
+                click.echo(f"{event_id}\terror\t{type(e).__name__}: {e}")
+                continue
+            if outcome:
+                click.echo(f"{event_id}\t{', '.join(outcome.values())}"
+                           + (f" ({len(outcome)} events of the order)" if len(outcome) > 1 else ''))
+
+    @stripe_events_cli.command('status')
+    def status_command():
+        """Events per status, and the ones still waiting."""
+        for status, count in db.session.query(StripeEvent.status, func.count()).group_by(StripeEvent.status):
+            click.echo(f"{status}\t{count}")
+        for event in StripeEvent.query.filter_by(status=EVENT_RECEIVED).order_by(StripeEvent.stripe_created):
+            click.echo(f"{event.event_id}\t{event.type}\torder={event.order_id}\t{event.last_error or ''}")
+
+    @stripe_events_cli.command('apply')
+    @click.argument('event_id', required=False)
+    def apply_command(event_id):
+        """Apply one waiting event, or all of them, in this process."""
+        count = 0
+        for waiting in [event_id] if event_id else waiting_events():
+            try:
+                count += len(_run_recording_errors(waiting))
+                db.session.commit()
+            except Exception as e:
+                click.echo(f"{waiting}: {type(e).__name__}: {e}")
+        click.echo(f"Applied {count} events")
+
+
+def init_stripe_events(app):
+    _register_job()
+    _register_cli(app)
@@ -0,0 +1,57 @@
+"""
+Telegram Bot API client with a pooled, keep-alive HTTP session.
+
+One ``requests.Session`` per process reuses TLS connections to
+api.telegram.org instead of a fresh handshake per message. Retries are left to
+the job queue (see app/services/job_queue.py), so the adapter does not retry
+on its own.
+"""
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.utils.metrics import outbound_call
+
+logger = logging.getLogger(__name__)
+
+API_BASE = 'https://api.telegram.org'
+# (connect, read) timeouts; calls run in background workers, not in requests
+TIMEOUT = (5, 15)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+class TelegramError(RuntimeError):
+    """The Bot API rejected a message or could not be reached."""
+
+
+def get_session():
+    """Process-wide pooled session (recreated after fork)."""
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0)
+            session.mount('https://', adapter)
+            _session = session
+            _session_pid = os.getpid()
+        return _session
+
+
+def send_message(token, chat_id, text, parse_mode='HTML'):
+    """Send one message; raises TelegramError on any failure."""
+    url = f"{API_BASE}/bot{token}/sendMessage"
+    data = {"chat_id": chat_id, "text": text, "parse_mode": parse_mode}
+    with outbound_call('telegram', 'sendMessage'):
+        try:
+            response = get_session().post(url, data=data, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            raise TelegramError(f"Telegram unreachable: {e}") from e
+        if response.status_code != 200:
+            raise TelegramError(f"Telegram returned {response.status_code}: {response.text[:500]}")
+    return True
@@ -0,0 +1,410 @@
+"""
+Asynchronous voice-message pipeline for ``/chatbot/voice``.
+
+Audio no longer goes through Whisper and the assistant inside one
+request, which ran into Gunicorn's 60 s timeout on long recordings:
+
+1. The browser uploads the recording in numbered chunks while it records
+   (``VoiceJobStore.write_chunk``, one short request per chunk). A complete
+   file can still be sent in one multipart POST.
+2. When the upload is closed, ``VoicePipeline.submit`` assembles the chunks
+   and transcribes in a background thread. Recordings longer than
+   ``VOICE_SEGMENT_SECONDS`` are cut into segments, which are transcribed
+   concurrently (``VOICE_WORKERS``) and joined in order.
+3. The client polls the job or subscribes to its SSE events. Once the job is
+   ``transcribed``, the client requests the assistant reply, which streams
+   like any other chat turn (see app/routes/chatbot.py).
+
+Job state is kept as JSON files under ``VOICE_JOB_DIR``, so any Gunicorn
+worker on the host can answer status requests for a job started by another.
+
+Segmenting WAV uses only the standard library. Other containers (the
+browser's webm/opus) are segmented with pydub+ffmpeg when installed and are
+otherwise transcribed as a single segment. ``VOICE_TRANSCRIBER=stub``
+replaces Whisper with a local backend for offline testing.
+"""
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from app.utils.metrics import outbound_call
+
+logger = logging.getLogger(__name__)
+
+STATUS_UPLOADING = 'uploading'
+STATUS_QUEUED = 'queued'
+STATUS_TRANSCRIBING = 'transcribing'
+STATUS_TRANSCRIBED = 'transcribed'
+STATUS_FAILED = 'failed'
+FINAL_STATUSES = (STATUS_TRANSCRIBED, STATUS_FAILED)
+
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+COPY_BUFFER = 64 * 1024
+
+EXTENSIONS = {
+    'audio/webm': 'webm',
+    'audio/ogg': 'ogg',
+    'audio/wav': 'wav',
+    'audio/x-wav': 'wav',
+    'audio/wave': 'wav',
+    'audio/mpeg': 'mp3',
+    'audio/mp4': 'm4a',
+    'audio/x-m4a': 'm4a',
+}
+
+
+class VoiceError(RuntimeError):
+    """Upload rejected or transcription failed; the message is user-facing."""
+
+
+# --- transcription backends ----------------------------------------------
+
+class OpenAITranscriber:
+    """Whisper via the OpenAI API (one request per segment)."""
+
+    def __init__(self, model='whisper-1', client=None):
+        self.model = model
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return self._client
+
+    def transcribe(self, filename, data, content_type):
+        try:
+            with outbound_call('openai', 'audio.transcriptions.create'):
+                text = self.client.audio.transcriptions.create(
+                    model=self.model,
+                    file=(filename, data, content_type),
+                    response_format="text",
+                )
+        except Exception as e:
+            if self.model in str(e):
+                raise VoiceError(f"Ваш проект не має доступу до моделі '{self.model}'. "
+                                 "Перевірте налаштування API ключа.") from e
+            raise
+        return text.strip() if isinstance(text, str) else getattr(text, 'text', '').strip()
+
+
+class StubTranscriber:
+    """Offline backend: fixed text (or a description of the segment) after a delay."""
+
+    def __init__(self, text=None, delay=0.0):
+        self.text = text
+        self.delay = float(delay)
+
+    def transcribe(self, filename, data, content_type):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.text or f"[{filename}: {len(data)} bytes of {content_type}]"
+
+
+def make_transcriber(config):
+    backend = (config.get('VOICE_TRANSCRIBER') or 'openai').lower()
+    if backend == 'stub':
+        return StubTranscriber(config.get('VOICE_STUB_TEXT'), config.get('VOICE_STUB_DELAY', 0))
+    return OpenAITranscriber(config.get('VOICE_MODEL', 'whisper-1'))
+
+
+# --- segmentation --------------------------------------------------------
+
+def split_wav(data, segment_seconds):
+    """Cut a WAV file into standalone WAV segments of at most ``segment_seconds``."""
+    with wave.open(io.BytesIO(data), 'rb') as source:
+        params = source.getparams()
+        frames_per_segment = max(1, int(params.framerate * segment_seconds))
+        segments = []
+        while True:
+            frames = source.readframes(frames_per_segment)
+            if not frames:
+                break
+            out = io.BytesIO()
+            with wave.open(out, 'wb') as target:
+                target.setparams(params)
+                target.writeframes(frames)
+            segments.append(out.getvalue())
+    return segments
+
+
+def _split_with_pydub(data, extension, segment_seconds):
+    try:
+        from pydub import AudioSegment
+    except ImportError:
+        return None
+    try:
+        audio = AudioSegment.from_file(io.BytesIO(data), format=extension)
+    except Exception as e:
+        # Typically ffmpeg is missing or cannot decode the container
+        logger.warning(f"pydub could not decode .{extension} audio, sending it whole: {e}")
+        return None
+    step = int(segment_seconds * 1000)
+    if len(audio) <= step:
+        return None
+    segments = []
+    for start in range(0, len(audio), step):
+        out = io.BytesIO()
+        # 16 kHz mono is what Whisper works with anyway and keeps segments small
+        audio[start:start + step].set_frame_rate(16000).set_channels(1).export(out, format='wav')
+        segments.append(out.getvalue())
+    return segments
+
+
+def split_audio(data, content_type, segment_seconds):
+    """Return ``[(filename, bytes, content_type), ...]`` in playback order."""
+    extension = EXTENSIONS.get(content_type, 'webm')
+    segments = None
+    if segment_seconds > 0:
+        if extension == 'wav':
+            try:
+                segments = split_wav(data, segment_seconds)
+            except (wave.Error, EOFError) as e:
+                logger.warning(f"Invalid WAV upload, sending it whole: {e}")
+        else:
+            segments = _split_with_pydub(data, extension, segment_seconds)
+    if not segments or len(segments) == 1:
+        return [(f'voice.{extension}', data, content_type)]
+    return [(f'voice-{index:03d}.wav', segment, 'audio/wav') for index, segment in enumerate(segments)]
+
+
+# --- job storage ---------------------------------------------------------
+
+class VoiceJobStore:
+    """Chunk files and ``state.json`` per job under one directory."""
+
+    def __init__(self, root, max_bytes, ttl):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.ttl = float(ttl)
+        self._last_purge = 0.0
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, job_id):
+        if not job_id or not _JOB_ID.match(job_id):
+            raise KeyError(job_id)
+        return os.path.join(self.root, job_id)
+
+    def create(self, content_type='audio/webm'):
+        self.purge_expired()
+        job_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.root, job_id, 'chunks'))
+        self.save(job_id, {
+            'id': job_id,
+            'status': STATUS_UPLOADING,
+            'content_type': content_type,
+            'bytes': 0,
+            'created': time.time(),
+        })
+        return job_id
+
+    def load(self, job_id):
+        """Job state dict; KeyError for unknown or malformed ids."""
+        try:
+            with open(os.path.join(self._dir(job_id), 'state.json'), encoding='utf-8') as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            raise KeyError(job_id) from None
+
+    def save(self, job_id, state):
+        path = os.path.join(self._dir(job_id), 'state.json')
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(state, fh, ensure_ascii=False)
+        # Atomic replace: readers in other workers never see a half-written file
+        os.replace(tmp_path, path)
+
+    def update(self, job_id, **changes):
+        state = self.load(job_id)
+        state.update(changes)
+        state['updated'] = time.time()
+        self.save(job_id, state)
+        return state
+
+    def write_chunk(self, job_id, index, stream):
+        """Store chunk ``index`` from a file-like object, enforcing the size limit.
+
+        Re-sending a chunk replaces it, so clients can safely retry.
+        """
+        state = self.load(job_id)
+        if state['status'] != STATUS_UPLOADING:
+            raise VoiceError('Завантаження вже завершено')
+        chunk_dir = os.path.join(self._dir(job_id), 'chunks')
+        path = os.path.join(chunk_dir, f'{int(index):06d}')
+        used = sum(
+            os.path.getsize(os.path.join(chunk_dir, name))
+            for name in os.listdir(chunk_dir) if name != os.path.basename(path)
+        )
+        written = 0
+        with open(f'{path}.tmp', 'wb') as fh:
+            while True:
+                block = stream.read(COPY_BUFFER)
+                if not block:
+                    break
+                written += len(block)
+                if used + written > self.max_bytes:
+                    fh.close()
+                    os.remove(f'{path}.tmp')
+                    raise VoiceError('Аудіофайл завеликий')
+                fh.write(block)
+        os.replace(f'{path}.tmp', path)
+        return used + written
+
+    def assemble(self, job_id):
+        """Concatenate the chunks in index order and drop them."""
+        chunk_dir = os.path.join(self._dir(job_id), 'chunks')
+        names = sorted(name for name in os.listdir(chunk_dir) if name.isdigit())
+        data = bytearray()
+        for name in names:
+            with open(os.path.join(chunk_dir, name), 'rb') as fh:
+                data += fh.read()
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+        return bytes(data)
+
+    def purge_expired(self):
+        """Delete job directories older than the TTL (at most once a minute)."""
+        if time.monotonic() - self._last_purge < 60:
+            return
+        self._last_purge = time.monotonic()
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if _JOB_ID.match(name) and os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                continue
+
+
+# --- pipeline ------------------------------------------------------------
+
+class VoicePipeline:
+    """Runs transcription jobs on background threads of this process."""
+
+    def __init__(self, store, transcriber, *, segment_seconds=60, workers=4, job_timeout=300):
+        self.store = store
+        self.transcriber = transcriber
+        self.segment_seconds = float(segment_seconds)
+        self.workers = int(workers)
+        self.job_timeout = float(job_timeout)
+        self._jobs = ThreadPoolExecutor(max_workers=2, thread_name_prefix='voice-job')
+        # Separate pool, so jobs waiting on their segments can't starve them
+        self._segments = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='voice-segment')
+        self.stats = {'jobs': 0, 'failed': 0, 'segments': 0}
+
+    def submit(self, job_id, data=None):
+        """Queue transcription of the uploaded chunks (or of ``data``)."""
+        if data is None:
+            data = self.store.assemble(job_id)
+        if not data:
+            self.store.update(job_id, status=STATUS_FAILED, error='Порожній аудіофайл')
+            raise VoiceError('Порожній аудіофайл')
+        if len(data) > self.store.max_bytes:
+            self.store.update(job_id, status=STATUS_FAILED, error='Аудіофайл завеликий')
+            raise VoiceError('Аудіофайл завеликий')
+        state = self.store.update(job_id, status=STATUS_QUEUED, bytes=len(data))
+        self._jobs.submit(self._run, job_id, data, state['content_type'])
+        return state
+
+    def _run(self, job_id, data, content_type):
+        started = time.perf_counter()
+        try:
+            segments = split_audio(data, content_type, self.segment_seconds)
+            self.store.update(job_id, status=STATUS_TRANSCRIBING, segments=len(segments), segments_done=0)
+            done = [0]
+            done_lock = threading.Lock()
+
+            def transcribe(segment):
+                text = self.transcriber.transcribe(*segment)
+                with done_lock:
+                    done[0] += 1
+                    self.store.update(job_id, segments_done=done[0])
+                return text
+
+            # map() keeps playback order while segments run concurrently
+            texts = list(self._segments.map(transcribe, segments, timeout=self.job_timeout))
+            transcription = ' '.join(text for text in texts if text).strip()
+            if not transcription:
+                raise VoiceError('Не вдалося розпізнати мовлення')
+        except Exception as e:
+            self.stats['failed'] += 1
+            message = str(e) if isinstance(e, VoiceError) else 'Не вдалося розпізнати аудіо'
+            logger.exception(f"Voice job {job_id} failed")
+            self.store.update(job_id, status=STATUS_FAILED, error=message)
+            return
+        elapsed_ms = round((time.perf_counter() - started) * 1000)
+        self.stats['jobs'] += 1
+        self.stats['segments'] += len(segments)
+        self.store.update(job_id, status=STATUS_TRANSCRIBED, transcription=transcription,
+                          transcribe_ms=elapsed_ms)
+        logger.info(f"Voice job {job_id}: {len(segments)} segment(s), {len(data)} bytes, {elapsed_ms} ms")
+
+    def status(self, job_id):
+        """Job state; a job that outlived ``job_timeout`` is reported as failed."""
+        state = self.store.load(job_id)
+        if state['status'] not in FINAL_STATUSES and state['status'] != STATUS_UPLOADING:
+            if time.time() - state.get('updated', state['created']) > self.job_timeout:
+                state = self.store.update(job_id, status=STATUS_FAILED,
+                                          error='Час обробки аудіо вичерпано')
+        return state
+
+    def watch(self, job_id, interval=0.25):
+        """Yield the job state whenever it changes, until it is final."""
+        last = None
+        while True:
+            state = self.status(job_id)
+            snapshot = (state['status'], state.get('segments_done'))
+            if snapshot != last:
+                last = snapshot
+                yield state
+            if state['status'] in FINAL_STATUSES or state['status'] == STATUS_UPLOADING:
+                return
+            time.sleep(interval)
+
+    def snapshot(self):
+        return dict(self.stats)
+
+
+def public_state(state):
+    """Fields of the job state that are returned to the browser."""
+    keys = ('id', 'status', 'segments', 'segments_done', 'transcription', 'error', 'transcribe_ms')
+    return {key: state[key] for key in keys if key in state}
+
+
+def get_voice_pipeline(app=None):
+    app = app or current_app
+    return app.extensions.get('voice_pipeline')
+
+
+def init_voice_pipeline(app):
+    """Create the job store under the instance folder and the worker pools."""
+    root = app.config.get('VOICE_JOB_DIR') or os.path.join(app.instance_path, 'voice_jobs')
+    try:
+        store = VoiceJobStore(
+            root,
+            max_bytes=app.config.get('VOICE_MAX_BYTES', 25 * 1024 * 1024),
+            ttl=app.config.get('VOICE_JOB_TTL', 3600),
+        )
+    except OSError as e:
+        logger.warning(f"Voice pipeline unavailable at {root}: {e}")
+        return None
+    pipeline = VoicePipeline(
+        store,
+        make_transcriber(app.config),
+        segment_seconds=app.config.get('VOICE_SEGMENT_SECONDS', 60),
+        workers=app.config.get('VOICE_WORKERS', 4),
+        job_timeout=app.config.get('VOICE_JOB_TIMEOUT', 300),
+    )
+    app.extensions['voice_pipeline'] = pipeline
+    return pipeline
@@ -1,3 +1,44 @@
+// 🔹 Потокова відповідь чат-бота (SSE через fetch): onDelta викликається для кожного фрагмента
+window.streamChat = async function (endpoint, options, onDelta) {
+    const headers = Object.assign({ "Accept": "text/event-stream" }, options.headers || {});
+    const response = await fetch(endpoint, { method: "POST", headers, body: options.body });
+    const contentType = response.headers.get("Content-Type") || "";
+    if (!contentType.startsWith("text/event-stream")) {
+        // Помилки валідації та старі відповіді приходять як JSON
+        const data = await response.json();
+        if (data.error) throw new Error(data.error);
+        if (data.response) onDelta(data.response);
+        return data;
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const result = {};
+    let buffer = "";
+    for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+            const raw = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = "message";
+            let data = "";
+            for (const line of raw.split("\n")) {
+                if (line.startsWith("event: ")) event = line.slice(7);
+                else if (line.startsWith("data: ")) data += line.slice(6);
+            }
+            if (!data) continue;
+            const payload = JSON.parse(data);
+            if (event === "error") throw new Error(payload.error);
+            if (event === "meta") Object.assign(result, payload);
+            else if (event === "done") result.metrics = payload;
+            else if (payload.delta) onDelta(payload.delta);
+        }
+    }
+    return result;
+};
+
 document.addEventListener("DOMContentLoaded", function() {
     const userInput = document.getElementById("userInput");
     const messagesDiv = document.getElementById("messages");
@@ -20,14 +61,19 @@ document.addEventListener("DOMContentLoaded", function() {
         userInput.value = "";
 
         try {
-            const response = await fetch("/chatbot", {
-                method: "POST",
+            const botLine = document.createElement("p");
+            botLine.innerHTML = "<strong>Бот:</strong> ";
+            const botText = document.createElement("span");
+            botLine.appendChild(botText);
+            messagesDiv.appendChild(botLine);
+            await window.streamChat("/chatbot", {
                 headers: { "Content-Type": "application/json", ...(CSRF_TOKEN ? { 'X-CSRF-Token': CSRF_TOKEN } : {}) },
                 body: JSON.stringify({ message: userMessage })
+            }, delta => {
+                botText.textContent += delta;
+                messagesDiv.scrollTop = messagesDiv.scrollHeight;
             });
-
-            const data = await response.json();
-            messagesDiv.innerHTML += `<p><strong>Бот:</strong> ${data.response || "Помилка!"}</p>`;
+            if (!botText.textContent) botText.textContent = "Помилка!";
         } catch (error) {
             messagesDiv.innerHTML += `<p><strong>Помилка:</strong> Не вдалося отримати відповідь.</p>`;
         }
@@ -59,48 +105,78 @@ document.addEventListener("DOMContentLoaded", function() {
 
                     mediaRecorder = new MediaRecorder(stream);
                     audioChunks = [];
+                    const csrfHeaders = CSRF_TOKEN ? { 'X-CSRF-Token': CSRF_TOKEN } : {};
+                    // Аудіо завантажується частинами під час запису
+                    const upload = fetch("/chatbot/voice/uploads", {
+                        method: "POST",
+                        headers: { "Content-Type": "application/json", ...csrfHeaders },
+                        body: JSON.stringify({ content_type: mediaRecorder.mimeType || "audio/webm" })
+                    }).then(r => r.json());
+                    let chunkIndex = 0;
 
                     mediaRecorder.ondataavailable = event => {
-                        audioChunks.push(event.data);
+                        if (!event.data.size) return;
+                        const index = chunkIndex++;
+                        audioChunks.push(upload.then(job => fetch(`/chatbot/voice/uploads/${job.job_id}/${index}`, {
+                            method: "PUT",
+                            headers: csrfHeaders,
+                            body: event.data
+                        }).then(r => { if (!r.ok) throw new Error(`chunk ${index}: ${r.status}`); })));
                     };
 
                     mediaRecorder.onstop = async () => {
                         console.log("🎤 Запис завершено, обробка аудіо...");
-                        const audioBlob = new Blob(audioChunks, { type: "audio/webm" });
-                        audioChunks = [];
-
-                        const formData = new FormData();
-                        formData.append("audio", audioBlob, "voice_message.webm");
-
-                        messagesDiv.innerHTML += `<p><strong>Ви (голос):</strong> 🎤 Обробка...</p>`;
+                        stream.getTracks().forEach(track => track.stop());
+                        const status = document.createElement("p");
+                        status.innerHTML = "<strong>Ви (голос):</strong> 🎤 Обробка...";
+                        messagesDiv.appendChild(status);
 
                         try {
-                            const response = await fetch("/chatbot/voice", {
+                            const job = await upload;
+                            await Promise.all(audioChunks);
+                            audioChunks = [];
+                            const started = await fetch(`/chatbot/voice/uploads/${job.job_id}/complete`, {
                                 method: "POST",
-                                headers: CSRF_TOKEN ? { 'X-CSRF-Token': CSRF_TOKEN } : {},
-                                body: formData
+                                headers: csrfHeaders
+                            }).then(r => r.json());
+                            if (started.error) throw new Error(started.error);
+
+                            const result = await new Promise((resolve, reject) => {
+                                const events = new EventSource(job.events_url);
+                                events.addEventListener("status", e => {
+                                    const state = JSON.parse(e.data);
+                                    if (state.segments > 1) {
+                                        status.innerHTML = `<strong>Ви (голос):</strong> 🎤 ${state.segments_done || 0}/${state.segments}`;
+                                    }
+                                    if (state.status === "transcribed" || state.status === "failed") {
+                                        events.close();
+                                        resolve(state);
+                                    }
+                                });
+                                events.onerror = () => { events.close(); reject(new Error("events")); };
+                            });
+                            if (result.error) throw new Error(result.error);
+                            status.innerHTML = "<strong>Ви (голос):</strong> ";
+                            status.appendChild(document.createTextNode(result.transcription));
+
+                            const botLine = document.createElement("p");
+                            botLine.innerHTML = "<strong>Бот:</strong> ";
+                            const botText = document.createElement("span");
+                            botLine.appendChild(botText);
+                            messagesDiv.appendChild(botLine);
+                            await window.streamChat(job.reply_url, { headers: csrfHeaders }, delta => {
+                                botText.textContent += delta;
+                                messagesDiv.scrollTop = messagesDiv.scrollHeight;
                             });
-
-                            const data = await response.json();
-
-                            if (data.error) {
-                                console.error("❌ Помилка сервера:", data.error);
-                                messagesDiv.innerHTML += `<p><strong>Помилка:</strong> ${data.error}</p>`;
-                            } else {
-                                console.log("✅ Розпізнано:", data.transcription);
-                                console.log("🤖 Відповідь:", data.response);
-                                messagesDiv.innerHTML += `<p><strong>Ви (голос):</strong> ${data.transcription}</p>`;
-                                messagesDiv.innerHTML += `<p><strong>Бот:</strong> ${data.response}</p>`;
-                            }
                         } catch (error) {
-                            console.error("❌ Помилка відправки голосу:", error);
+                            console.error("❌ Помилка обробки голосу:", error);
                             messagesDiv.innerHTML += `<p><strong>Помилка:</strong> Не вдалося отримати відповідь.</p>`;
                         }
 
                         messagesDiv.scrollTop = messagesDiv.scrollHeight;
                     };
 
-                    mediaRecorder.start();
+                    mediaRecorder.start(1000);  // частина кожну секунду
                     console.log("🎙️ Почався запис...");
                     recordButton.textContent = "⏹️"; // Стоп
                 } catch (error) {
@@ -0,0 +1,117 @@
+"""
+Cart summary for templates.
+
+``base.html`` shows the cart badge on every page, so the count must be cheap.
+The context processor injects a ``LazyCartCount`` that only resolves when the
+template actually renders ``{{ cart_count }}``. The resolved value is cached in
+the session together with the owner it was computed for, and the cart routes
+refresh it after every change, so a normal page view costs no query at all and
+never creates a cart row.
+"""
+import logging
+
+from flask import session
+from flask_login import current_user
+from sqlalchemy import func
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = 'cart_summary'
+
+
+def _owner_key():
+    """Identify whose cart the cached count belongs to (user id or guest)."""
+    try:
+        if current_user.is_authenticated:
+            return f"u{current_user.id}"
+    except Exception:
+        pass
+    return 'guest'
+
+
+def _query_cart_count():
+    """Read-only item count for the current visitor; never creates a cart."""
+    from app.models.database import db
+    from app.models.shop import Cart, CartItem
+
+    query = db.session.query(func.coalesce(func.sum(CartItem.quantity), 0)).join(
+        Cart, CartItem.cart_id == Cart.id
+    ).filter(Cart.status == 'open')
+    if current_user.is_authenticated:
+        query = query.filter(Cart.user_id == current_user.id)
+    else:
+        cart_id = session.get('cart_id')
+        if not cart_id:
+            return None
+        query = query.filter(Cart.id == cart_id)
+    return int(query.scalar() or 0)
+
+
+def remember_cart_count(count):
+    """Store the current visitor's item count after a cart mutation."""
+    session[SESSION_KEY] = {'owner': _owner_key(), 'count': int(count or 0)}
+
+
+def forget_cart_count():
+    session.pop(SESSION_KEY, None)
+
+
+def get_cart_count():
+    """Return the cached item count, querying at most once per session change."""
+    cached = session.get(SESSION_KEY)
+    owner = _owner_key()
+    if cached and cached.get('owner') == owner:
+        return cached.get('count', 0)
+    try:
+        count = _query_cart_count()
+    except Exception as e:
+        logger.warning(f"Cart count lookup failed: {e}")
+        return 0
+    if count is None:
+        # Anonymous visitor without a cart: nothing to cache, keep the session untouched
+        return 0
+    remember_cart_count(count)
+    return count
+
+
+class LazyCartCount:
+    """Template proxy that defers the cart count lookup until it is rendered."""
+
+    __slots__ = ('_value',)
+
+    def __init__(self):
+        self._value = None
+
+    def _resolve(self):
+        if self._value is None:
+            self._value = get_cart_count()
+        return self._value
+
+    def __str__(self):
+        return str(self._resolve())
+
+    def __html__(self):
+        return str(self._resolve())
+
+    def __int__(self):
+        return self._resolve()
+
+    __index__ = __int__
+
+    def __bool__(self):
+        return bool(self._resolve())
+
+    def __eq__(self, other):
+        return self._resolve() == other
+
+    def __lt__(self, other):
+        return self._resolve() < other
+
+    def __gt__(self, other):
+        return self._resolve() > other
+
+    def __hash__(self):
+        return hash(self._resolve())
+
+    def __repr__(self):
+        return f'<LazyCartCount {self._value if self._value is not None else "unresolved"}>'
@@ -0,0 +1,158 @@
+"""
+Connection health tracking for the shared SQLAlchemy engine.
+
+Replaces the old ``SELECT 1`` that ran before every request. Pool events record
+when each connection was last handed back; on checkout a connection is pinged
+only if it sat idle longer than ``DB_PING_IDLE_SECONDS``. Disconnects seen by
+the engine flag the monitor, and the next request that needs the database
+rolls back, drops the scoped session and disposes the pool once.
+"""
+import logging
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event, exc
+
+logger = logging.getLogger(__name__)
+
+# Endpoints that never touch the database; the recovery gate skips them.
+DB_EXEMPT_ENDPOINTS = {'static'}
+
+
+def db_exempt(view):
+    """Mark a view as never using the database so the health gate skips it."""
+    view._db_exempt = True
+    return view
+
+
+class DBHealthMonitor:
+    """Tracks pool state via engine events and pings only stale connections."""
+
+    def __init__(self, idle_threshold=30.0):
+        self.idle_threshold = float(idle_threshold)
+        self.needs_recovery = False
+        self._lock = threading.Lock()
+        self._engines = set()
+        self.stats = {
+            'connects': 0,
+            'checkouts': 0,
+            'pings': 0,
+            'pings_avoided': 0,
+            'ping_failures': 0,
+            'disconnects': 0,
+            'recoveries': 0,
+        }
+
+    def _bump(self, key, request_key=None):
+        with self._lock:
+            self.stats[key] += 1
+        if request_key and has_request_context():
+            counters = g.get('db_health')
+            if counters is not None:
+                counters[request_key] = counters.get(request_key, 0) + 1
+
+    def attach(self, engine):
+        """Register pool listeners on ``engine`` (idempotent)."""
+        if id(engine) in self._engines:
+            return
+        self._engines.add(id(engine))
+
+        @event.listens_for(engine, 'connect')
+        def _on_connect(dbapi_conn, conn_record):
+            conn_record.info['last_used'] = time.monotonic()
+            self._bump('connects')
+
+        @event.listens_for(engine, 'checkin')
+        def _on_checkin(dbapi_conn, conn_record):
+            if conn_record is not None:
+                conn_record.info['last_used'] = time.monotonic()
+
+        @event.listens_for(engine, 'checkout')
+        def _on_checkout(dbapi_conn, conn_record, conn_proxy):
+            self._bump('checkouts')
+            idle = time.monotonic() - conn_record.info.get('last_used', 0)
+            if idle < self.idle_threshold:
+                self._bump('pings_avoided', 'pings_avoided')
+                return
+            self._bump('pings', 'pings')
+            try:
+                cursor = dbapi_conn.cursor()
+                cursor.execute('SELECT 1')
+                cursor.close()
+            except Exception as e:
+                self._bump('ping_failures')
+                logger.warning(f"Idle connection ping failed after {idle:.0f}s, recycling: {e}")
+                # Tells the pool to discard this connection and retry with a fresh one
+                raise exc.DisconnectionError() from e
+            conn_record.info['last_used'] = time.monotonic()
+
+        @event.listens_for(engine, 'handle_error')
+        def _on_error(context):
+            if context.is_disconnect:
+                self._bump('disconnects')
+                self.needs_recovery = True
+
+    def recover(self, db):
+        """Reset session and pool after a disconnect was observed."""
+        self.needs_recovery = False
+        self._bump('recoveries')
+        try:
+            db.session.rollback()
+        except Exception as e:
+            logger.warning(f"Rollback during DB recovery failed: {e}")
+        try:
+            db.session.remove()
+        except Exception:
+            pass
+        try:
+            db.get_engine().dispose()
+            logger.info("Disposed engine pool after disconnect")
+        except Exception as e:
+            logger.error(f"Failed to dispose engine: {e}")
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+        data['idle_threshold'] = self.idle_threshold
+        data['needs_recovery'] = self.needs_recovery
+        return data
+
+
+def is_db_exempt():
+    """True for the current request's view when it never uses the database."""
+    endpoint = request.endpoint
+    if endpoint is None or endpoint in DB_EXEMPT_ENDPOINTS:
+        return True
+    view = current_app.view_functions.get(endpoint)
+    return bool(getattr(view, '_db_exempt', False))
+
+
+def get_monitor(app=None):
+    app = app or current_app
+    return app.extensions.get('db_health')
+
+
+def init_db_health(app, db):
+    """Attach the monitor to the app engine and install the request gate."""
+    monitor = DBHealthMonitor(idle_threshold=app.config.get('DB_PING_IDLE_SECONDS', 30))
+    with app.app_context():
+        monitor.attach(db.get_engine())
+    app.extensions['db_health'] = monitor
+    expose_headers = app.config.get('DB_HEALTH_HEADERS') or app.debug
+
+    @app.before_request
+    def db_health_gate():
+        g.db_health = {'pings': 0, 'pings_avoided': 0}
+        if monitor.needs_recovery and not is_db_exempt():
+            monitor.recover(db)
+
+    if expose_headers:
+        @app.after_request
+        def db_health_headers(response):
+            counters = g.get('db_health') or {}
+            response.headers['X-DB-Pings'] = str(counters.get('pings', 0))
+            response.headers['X-DB-Pings-Avoided'] = str(counters.get('pings_avoided', 0))
+            return response
+
+    return monitor
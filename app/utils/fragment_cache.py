@@ -0,0 +1,245 @@
+"""
+Cache for rendered template fragments (product cards, detail page sections).
+
+Templates wrap a section in ``{% cache 'name', subject, version... %}`` …
+``{% endcache %}``. The key is built from the name, the listed values and the
+current language. For product fragments these values are ``product.id`` and
+``product.updated_at``. The cache is only ever asked for the current key:
+
+* product edits bump ``updated_at`` (``onupdate``), and so do review and
+  gallery image writes (see the listeners in app/models/product.py), so a
+  changed product gets a new key in every worker without messaging them;
+* in this process, Product / ProductReview / ProductImage writes also drop
+  the entries of that product (the first value after the name is the
+  *subject*), and Category writes drop everything, so stale HTML does not
+  wait for LRU eviction.
+
+Rendered HTML sits in a bounded per-process LRU (``FRAGMENT_CACHE_SIZE``
+entries, ``FRAGMENT_CACHE_TTL`` seconds). ``FRAGMENT_CACHE_BACKEND`` adds a
+cachelib store shared by the workers: ``filesystem`` (``FRAGMENT_CACHE_DIR``,
+like the identity revocation store) or ``redis`` (``FRAGMENT_CACHE_REDIS_URL``,
+needs the ``redis`` package). Shared keys carry the deploy version
+(``FRAGMENT_CACHE_VERSION`` or ``RENDER_GIT_COMMIT``), so a deploy with new
+templates never serves the old markup. Hit/miss counters are per process and
+shown on the admin dashboard and in ``/health``.
+
+Fragments must not contain per-request data (CSRF tokens, stock, the cart);
+keep those outside the block. With template auto-reload (debug) the blocks
+are rendered every time.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered fragments plus an optional shared cachelib store."""
+
+    def __init__(self, max_entries=2000, ttl=3600, shared=None, version=''):
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl)
+        self.shared = shared
+        self.version = version
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (stored_at, subject, html)
+        self._subjects = {}  # subject -> set of keys
+        self.stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0,
+                      'expired': 0, 'invalidations': 0, 'shared_errors': 0}
+
+    def key(self, parts, lang):
+        return 'fragment:' + ':'.join(str(part) for part in (self.version, *parts, lang))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.monotonic() - entry[0] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return entry[2]
+                self._drop(key)
+                self.stats['expired'] += 1
+        return None
+
+    def get_shared(self, key):
+        if self.shared is None:
+            return None
+        try:
+            html = self.shared.get(key)
+        except Exception as e:
+            self.stats['shared_errors'] += 1
+            logger.warning(f"Fragment cache backend read failed: {e}")
+            return None
+        if html is not None:
+            with self._lock:
+                self.stats['shared_hits'] += 1
+        return html
+
+    def put(self, key, subject, html, shared=True):
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (time.monotonic(), subject, html)
+            self._subjects.setdefault(subject, set()).add(key)
+            self.stats['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+        if shared and self.shared is not None:
+            try:
+                self.shared.set(key, html, timeout=int(self.ttl))
+            except Exception as e:
+                self.stats['shared_errors'] += 1
+                logger.warning(f"Fragment cache backend write failed: {e}")
+
+    def _drop(self, key):
+        # Caller holds the lock
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._subjects.get(entry[1])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._subjects[entry[1]]
+
+    def fetch(self, parts, lang, render):
+        """Cached HTML for ``parts`` (name, subject, versions...), rendering it on a miss."""
+        key = self.key(parts, lang)
+        subject = str(parts[1]) if len(parts) > 1 else None
+        html = self.get(key)
+        if html is not None:
+            return html
+        html = self.get_shared(key)
+        if html is not None:
+            self.put(key, subject, html, shared=False)
+            return html
+        with self._lock:
+            self.stats['misses'] += 1
+        html = str(render())
+        self.put(key, subject, html)
+        return html
+
+    def invalidate(self, subject=None):
+        """Drop this process's entries for ``subject`` (all entries when None)."""
+        with self._lock:
+            if subject is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+                self._subjects.clear()
+            else:
+                keys = self._subjects.pop(str(subject), set())
+                dropped = len(keys)
+                for key in keys:
+                    self._entries.pop(key, None)
+            self.stats['invalidations'] += dropped
+
+    def snapshot(self):
+        with self._lock:
+            snap = dict(self.stats)
+            snap['entries'] = len(self._entries)
+            snap['bytes'] = sum(len(entry[2]) for entry in self._entries.values())
+        lookups = snap['hits'] + snap['shared_hits'] + snap['misses']
+        snap['hit_ratio'] = round((snap['hits'] + snap['shared_hits']) / lookups, 4) if lookups else None
+        snap['backend'] = type(self.shared).__name__ if self.shared is not None else None
+        return snap
+
+
+class FragmentCacheExtension(Extension):
+    """``{% cache 'name', subject, version... %}...{% endcache %}``."""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        call = self.call_method('_cached', [nodes.List(parts)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _cached(self, parts, caller):
+        cache = get_fragment_cache()
+        if cache is None or current_app.jinja_env.auto_reload:
+            return caller()
+        from app.i18n import current_lang
+        return Markup(cache.fetch(parts, current_lang(), caller))
+
+
+def get_fragment_cache(app=None):
+    app = app or current_app
+    return app.extensions.get('fragment_cache')
+
+
+def _shared_backend(app):
+    config = app.config
+    backend = (config.get('FRAGMENT_CACHE_BACKEND') or '').lower()
+    ttl = int(config.get('FRAGMENT_CACHE_TTL', 3600))
+    if backend == 'filesystem':
+        from cachelib import FileSystemCache
+        directory = config.get('FRAGMENT_CACHE_DIR') or os.path.join(app.instance_path, 'fragments')
+        return FileSystemCache(directory, threshold=config.get('FRAGMENT_CACHE_SIZE', 2000) * 4,
+                               default_timeout=ttl)
+    if backend == 'redis':
+        from cachelib import RedisCache
+        try:
+            import redis
+        except ImportError:
+            logger.warning("FRAGMENT_CACHE_BACKEND=redis needs the redis package; using the local cache only")
+            return None
+        client = redis.Redis.from_url(config.get('FRAGMENT_CACHE_REDIS_URL') or 'redis://localhost:6379/0')
+        return RedisCache(client, default_timeout=ttl, key_prefix='rozoom:')
+    if backend:
+        logger.warning(f"Unknown FRAGMENT_CACHE_BACKEND {backend!r}; using the local cache only")
+    return None
+
+
+def _listen_for_writes(cache):
+    from app.models.product import Category, Product, ProductImage, ProductReview
+
+    def product_written(mapper, connection, target):
+        cache.invalidate(target.id)
+
+    def child_written(mapper, connection, target):
+        cache.invalidate(target.product_id)
+
+    def category_written(mapper, connection, target):
+        cache.invalidate()
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(Product, name, product_written)
+        event.listen(ProductImage, name, child_written)
+        event.listen(ProductReview, name, child_written)
+        event.listen(Category, name, category_written)
+
+
+def init_fragment_cache(app):
+    """Register the ``{% cache %}`` tag; the store is created when enabled."""
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    config = app.config
+    if not config.get('FRAGMENT_CACHE_ENABLED', True):
+        return None
+    try:
+        shared = _shared_backend(app)
+    except OSError as e:
+        logger.warning(f"Fragment cache backend unavailable: {e}")
+        shared = None
+    version = config.get('FRAGMENT_CACHE_VERSION') or os.environ.get('RENDER_GIT_COMMIT', '')[:12]
+    cache = FragmentCache(
+        max_entries=config.get('FRAGMENT_CACHE_SIZE', 2000),
+        ttl=config.get('FRAGMENT_CACHE_TTL', 3600),
+        shared=shared,
+        version=version,
+    )
+    app.extensions['fragment_cache'] = cache
+    _listen_for_writes(cache)
+    return cache
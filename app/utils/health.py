@@ -0,0 +1,274 @@
+"""
+Liveness / readiness probes with cached deep checks.
+
+``/health`` used to run ``SELECT 1``, a ``pg_stat_activity`` count and an
+``information_schema`` lookup on every poll, and disposed the engine when one
+of them failed. The platform polls it often, so the probes now split:
+
+* ``/livez``: the process answers; never touches the database.
+* ``/readyz``: the last result of the deep checks. A per-process thread
+  refreshes it every ``HEALTH_CHECK_INTERVAL`` seconds (``SELECT 1`` latency,
+  active connections on PostgreSQL). A probe only runs the checks itself when
+  the result is older than ``HEALTH_CHECK_MAX_AGE`` (thread disabled or stuck),
+  and concurrent probes share that one run.
+* ``/health``: the same cached result plus the per-process stats.
+
+Pool numbers come from the engine's pool object, not from queries. Disconnect
+recovery stays with app/utils/db_health.py; the checker only triggers it when
+its own check hit a dropped connection.
+
+Schema drift (model columns missing in the database) is checked by the
+``health.schema_check`` job every ``HEALTH_SCHEMA_CHECK_INTERVAL`` seconds.
+Each run passes its report on in the payload of the next scheduled run, so
+every process (and the separate worker service) reads the same report with
+the deep checks. Drift is reported, it does not make the app unready.
+``flask health check`` runs everything once from the shell.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import inspect, text
+
+from app.models.database import db
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_CHECK_JOB = 'health.schema_check'
+
+
+def pool_stats(engine):
+    """Connection pool counters read from the pool object (no queries)."""
+    pool = engine.pool
+    stats = {'type': type(pool).__name__}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        method = getattr(pool, name, None)
+        if callable(method):
+            try:
+                stats[name] = method()
+            except Exception:
+                pass
+    return stats
+
+
+def schema_drift(connection):
+    """Tables and columns of the models that are missing in the database."""
+    inspector = inspect(connection)
+    report = {'checked_at': datetime.utcnow().isoformat(timespec='seconds'),
+              'missing_tables': [], 'missing_columns': []}
+    for table in db.metadata.sorted_tables:
+        try:
+            if not inspector.has_table(table.name, schema=table.schema):
+                report['missing_tables'].append(table.fullname)
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name, schema=table.schema)}
+        except Exception as e:
+            report.setdefault('errors', []).append(f"{table.fullname}: {e}")
+            continue
+        report['missing_columns'].extend(
+            f"{table.fullname}.{column.name}" for column in table.columns if column.name not in existing
+        )
+    return report
+
+
+def _schema_jobs(statuses):
+    from app.models.job import BackgroundJob
+    return (
+        db.session.query(BackgroundJob)
+        .filter(BackgroundJob.kind == SCHEMA_CHECK_JOB, BackgroundJob.status.in_(statuses))
+        .order_by(BackgroundJob.id.desc())
+    )
+
+
+def latest_schema_report(schedule=True):
+    """Report carried by the queued schema check; queues one if none is (``schedule``)."""
+    from app.models.job import JOB_PENDING, JOB_RUNNING
+    from app.services.job_queue import enqueue
+    job = _schema_jobs((JOB_PENDING, JOB_RUNNING)).first()
+    if job is None:
+        if schedule and current_app.config.get('HEALTH_SCHEMA_CHECK_INTERVAL', 3600) > 0:
+            enqueue(SCHEMA_CHECK_JOB, commit=True)
+        return None
+    return job.data.get('last_result')
+
+
+def _register_job():
+    from app.models.job import JOB_PENDING
+    from app.services.job_queue import enqueue, job_handler
+
+    @job_handler(SCHEMA_CHECK_JOB)
+    def _run_schema_check(payload):
+        report = schema_drift(db.session.connection())
+        if report['missing_tables'] or report['missing_columns']:
+            logger.warning(f"Schema drift: missing tables {report['missing_tables']}, "
+                           f"columns {report['missing_columns']}")
+        interval = current_app.config.get('HEALTH_SCHEMA_CHECK_INTERVAL', 3600)
+        if interval <= 0:
+            return
+        # Committed by the job queue together with this job's completion
+        queued = _schema_jobs((JOB_PENDING,)).first()
+        if queued is not None:
+            queued.payload = json.dumps({'last_result': report})
+        else:
+            enqueue(SCHEMA_CHECK_JOB, {'last_result': report}, delay=interval)
+
+
+class HealthChecker:
+    """Runs the deep checks off the request path and keeps the last result."""
+
+    def __init__(self, app, engine, interval=15.0, max_age=60.0):
+        self.app = app
+        self.engine = engine
+        self.interval = float(interval)
+        self.max_age = float(max_age)
+        self.result = None
+        self._checked_at = 0.0
+        self._refresh_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self.stats = {'runs': 0, 'failures': 0, 'inline_runs': 0}
+
+    def ensure_started(self):
+        """Start the refresh thread once per OS process (forked workers get their own)."""
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run_forever, name='health-checker', daemon=True).start()
+
+    def _run_forever(self):
+        while self._pid == os.getpid():
+            self.refresh()
+            time.sleep(self.interval)
+
+    def run_checks(self):
+        """One round of deep checks; returns the result dict."""
+        result = {'status': 'ok', 'database': 'ok', 'details': {},
+                  'checked_at': datetime.utcnow().isoformat(timespec='seconds')}
+        with self.app.app_context():
+            try:
+                start = time.perf_counter()
+                with self.engine.connect() as connection:
+                    value = connection.execute(text('SELECT 1')).scalar()
+                    result['details']['query_time_ms'] = round((time.perf_counter() - start) * 1000, 2)
+                    if value != 1:
+                        raise RuntimeError('Unexpected query result')
+                    if connection.dialect.name == 'postgresql':
+                        result['details']['active_connections'] = connection.execute(
+                            text("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()")
+                        ).scalar()
+            except Exception as e:
+                result.update(status='error', database='error')
+                result['details']['database'] = str(e)
+                # A dropped connection flags the monitor; reset the pool now rather
+                # than waiting for the next request that uses the database
+                from app.utils.db_health import get_monitor
+                monitor = get_monitor(self.app)
+                if monitor is not None and monitor.needs_recovery:
+                    monitor.recover(db)
+                return result
+            try:
+                result['schema'] = latest_schema_report()
+            except Exception as e:
+                result['details']['schema_check'] = str(e)
+            finally:
+                db.session.remove()
+        schema = result.get('schema') or {}
+        if schema.get('missing_tables') or schema.get('missing_columns'):
+            result['status'] = 'warning'
+        return result
+
+    def refresh(self):
+        try:
+            result = self.run_checks()
+        except Exception as e:
+            logger.exception(f"Health check failed: {e}")
+            result = {'status': 'error', 'database': 'unknown', 'details': {'checker': str(e)}}
+        self.stats['runs'] += 1
+        if result['database'] != 'ok':
+            self.stats['failures'] += 1
+            logger.warning(f"Readiness check failed: {result['details']}")
+        self.result = result
+        self._checked_at = time.monotonic()
+        return result
+
+    def current(self):
+        """The cached result; re-checked inline only when missing or older than ``max_age``."""
+        if self.result is None or time.monotonic() - self._checked_at > self.max_age:
+            # Single flight: one probe re-checks, the others keep the previous result
+            blocking = self.result is None
+            if self._refresh_lock.acquire(blocking=blocking):
+                try:
+                    if self.result is None or time.monotonic() - self._checked_at > self.max_age:
+                        self.stats['inline_runs'] += 1
+                        self.refresh()
+                finally:
+                    self._refresh_lock.release()
+        result = dict(self.result)
+        result['age_seconds'] = round(time.monotonic() - self._checked_at, 1)
+        return result
+
+    def readiness(self):
+        """``(ready, payload)`` for /readyz: cached checks plus live pool numbers."""
+        from app.utils.db_health import get_monitor
+        result = self.current()
+        result['pool'] = pool_stats(self.engine)
+        monitor = get_monitor(self.app)
+        if monitor is not None:
+            result['recovery_pending'] = monitor.needs_recovery
+        return result['database'] == 'ok', result
+
+    def snapshot(self):
+        snap = dict(self.stats)
+        snap['interval'] = self.interval
+        snap['max_age'] = self.max_age
+        return snap
+
+
+def get_health_checker(app=None):
+    app = app or current_app
+    return app.extensions.get('health')
+
+
+def _register_cli(app, checker):
+    import click
+
+    @app.cli.group('health')
+    def health_cli():
+        """Readiness and schema drift checks."""
+
+    @health_cli.command('check')
+    def check_command():
+        """Run the deep checks and the schema drift check now; exits with 1 if not ready."""
+        result = checker.run_checks()
+        result['pool'] = pool_stats(checker.engine)
+        result['schema'] = schema_drift(db.session.connection())
+        click.echo(json.dumps(result, indent=2, default=str))
+        if result['database'] != 'ok':
+            raise SystemExit(1)
+
+
+def init_health(app):
+    """Create the checker, register the schema check job and the CLI."""
+    with app.app_context():
+        engine = db.get_engine()
+    checker = HealthChecker(
+        app, engine,
+        interval=app.config.get('HEALTH_CHECK_INTERVAL', 15),
+        max_age=app.config.get('HEALTH_CHECK_MAX_AGE', 60),
+    )
+    app.extensions['health'] = checker
+    _register_job()
+    _register_cli(app, checker)
+
+    @app.before_request
+    def _start_health_checker():
+        checker.ensure_started()
+
+    return checker
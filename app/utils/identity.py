@@ -0,0 +1,166 @@
+"""
+Lightweight authenticated identity for Flask-Login.
+
+``load_user`` used to return a full ``User`` on every request, and
+``User.orders`` (selectin) -> ``Order.items`` (selectin) pulled the whole order
+history along with it. The loader now returns a ``Principal`` with the
+identity columns only:
+
+* The principal is cached in the Flask session for ``IDENTITY_CACHE_TTL``
+  seconds, so an authenticated page view costs no query at all.
+* Admin changes to a user (``toggle_admin`` / ``toggle_active``) call
+  ``revoke_identity``. That records a timestamp in a small store shared by all
+  workers on the host, and the user's cached principal is reloaded on their
+  next request.
+* Any other ``User`` attribute (``created_at``, ``get_full_name()``...) is
+  still available: the principal loads the full row once, on first access,
+  without its relationships. Order history is loaded explicitly via
+  ``User.order_history()``.
+"""
+import logging
+import os
+import time
+
+from cachelib import FileSystemCache
+from flask import current_app, session
+from flask_login import user_logged_in, user_logged_out
+from sqlalchemy.orm import noload
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = '_identity'
+IDENTITY_FIELDS = ('id', 'email', 'username', 'is_admin', 'is_active')
+
+
+class Principal:
+    """The logged-in user as seen by views and templates (``current_user``)."""
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, email, username, is_admin, is_active):
+        self.id = id
+        self.email = email
+        self.username = username
+        self.is_admin = bool(is_admin)
+        self.is_active = bool(is_active) if is_active is not None else True
+        self._user = None
+
+    def get_id(self):
+        return str(self.id)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in IDENTITY_FIELDS}
+
+    @property
+    def user(self):
+        """The full ``User`` row (no relationships), loaded on first use."""
+        if self._user is None:
+            from app.models.user import User
+            self._user = User.query.options(noload('*')).get(self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        # Only called for attributes the principal doesn't carry itself
+        if name.startswith('_'):
+            raise AttributeError(name)
+        user = self.user
+        if user is None:
+            raise AttributeError(name)
+        return getattr(user, name)
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id and not getattr(other, 'is_anonymous', True)
+
+    def __hash__(self):
+        return hash(('principal', self.id))
+
+    def __repr__(self):
+        return f'<Principal {self.id} {self.email}>'
+
+
+class RevocationStore:
+    """When each user's identity last changed, shared across worker processes."""
+
+    def __init__(self, directory, ttl):
+        self.ttl = int(ttl)
+        self._cache = FileSystemCache(directory, threshold=5000, default_timeout=self.ttl)
+
+    def revoke(self, user_id):
+        # Cached principals never outlive the TTL, so neither must the marker
+        self._cache.set(f'identity-{user_id}', time.time(), timeout=self.ttl)
+
+    def revoked_at(self, user_id):
+        return self._cache.get(f'identity-{user_id}') or 0.0
+
+
+def _store():
+    return current_app.extensions.get('identity_revocations')
+
+
+def _fetch_principal(user_id):
+    from app.models.database import db
+    from app.models.user import User
+    row = (
+        db.session.query(User.id, User.email, User.username, User.is_admin, User.is_active)
+        .filter(User.id == user_id)
+        .first()
+    )
+    return Principal(*row) if row else None
+
+
+def load_principal(user_id):
+    """Flask-Login ``user_loader``: session-cached principal, or one narrow query."""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    ttl = current_app.config.get('IDENTITY_CACHE_TTL', 300)
+    cached = session.get(SESSION_KEY)
+    if cached and cached.get('id') == user_id:
+        age = time.time() - cached.get('ts', 0)
+        store = _store()
+        fresh = age < ttl and (store is None or store.revoked_at(user_id) < cached.get('ts', 0))
+        if fresh:
+            return Principal(**{field: cached.get(field) for field in IDENTITY_FIELDS})
+
+    try:
+        principal = _fetch_principal(user_id)
+    except Exception as e:
+        logger.error(f"Could not load user {user_id}: {e}")
+        return None
+    if principal is None:
+        session.pop(SESSION_KEY, None)
+        return None
+    session[SESSION_KEY] = dict(principal.to_dict(), ts=time.time())
+    return principal
+
+
+def revoke_identity(user_id):
+    """Make every session of ``user_id`` reload its principal on the next request."""
+    store = _store()
+    if store is not None:
+        try:
+            store.revoke(user_id)
+        except OSError as e:
+            logger.warning(f"Could not record identity change for user {user_id}: {e}")
+
+
+def init_identity(app, login_manager):
+    """Register the principal loader and the shared revocation store."""
+    directory = app.config.get('IDENTITY_REVOCATION_DIR') or os.path.join(app.instance_path, 'identity')
+    try:
+        app.extensions['identity_revocations'] = RevocationStore(
+            directory, ttl=app.config.get('IDENTITY_CACHE_TTL', 300),
+        )
+    except OSError as e:
+        # Without the store, cached principals only expire by TTL
+        logger.warning(f"Identity revocation store unavailable at {directory}: {e}")
+    login_manager.user_loader(load_principal)
+
+    def _forget_principal(sender, **extra):
+        session.pop(SESSION_KEY, None)
+
+    user_logged_in.connect(_forget_principal, app, weak=False)
+    user_logged_out.connect(_forget_principal, app, weak=False)
@@ -9,6 +9,10 @@ from io import BytesIO
 from flask import current_app
 import logging
 
+from app.utils.image_variants import schedule_variants
+from app.utils.media_cache import invalidate_media
+from app.utils.media_http import versioned_url
+
 logger = logging.getLogger(__name__)
 
 def save_category_image(file, category=None):
@@ -57,12 +61,14 @@ def save_category_image(file, category=None):
         
         # Update the category object if provided
         if category:
+            invalidate_media('category', category.id)
             category.image_data = img_byte_arr.getvalue()
             category.image_content_type = content_type
             category.image_filename = unique_filename
+            schedule_variants(category.image_hash, category.image_data, content_type)
             
             # Set the URL for accessing the image through the route
-            return f'/category_media/category-image/{category.id}'
+            return versioned_url(f'/category_media/category-image/{category.id}', category.image_hash)
         
         # Return the binary data if no category provided (for further processing)
         return {
@@ -0,0 +1,230 @@
+"""
+Responsive derivatives for images stored in the database.
+
+When an admin uploads a product or category image, ``schedule_variants`` hands
+the bytes to a small thread pool that renders each width in
+``IMAGE_VARIANT_WIDTHS`` as AVIF (when Pillow supports it), WebP and a legacy
+JPEG/PNG fallback. EXIF and other metadata are dropped, after orientation has
+been applied. The results are stored as ``ImageVariant`` rows keyed by the
+source hash, so the upload request returns as soon as the original is saved.
+
+The serving routes call ``requested_variant`` to map ``?w=`` and the ``Accept``
+header to a (width bucket, format) pair. ``find_variant`` then returns the
+matching row, or None while the variants are still being built, in which case
+the original is served.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from flask import current_app, request
+from PIL import Image, ImageOps, features
+from sqlalchemy.orm import defer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (320, 640, 1024)
+# Formats that can be negotiated from Accept; 'legacy' means JPEG or PNG
+NEGOTIABLE_FORMATS = ('avif', 'webp')
+LEGACY = 'legacy'
+# Source formats Pillow can't meaningfully resize (animation, vectors)
+SKIP_CONTENT_TYPES = {'image/gif', 'image/svg+xml'}
+ENCODER_OPTIONS = {
+    'avif': {'quality': 60},
+    'webp': {'quality': 80, 'method': 4},
+    'jpeg': {'quality': 82, 'optimize': True, 'progressive': True},
+    'png': {'optimize': True},
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def avif_supported():
+    try:
+        return bool(features.check('avif'))
+    except Exception:
+        return False
+
+
+def variant_widths(app=None):
+    app = app or current_app
+    widths = app.config.get('IMAGE_VARIANT_WIDTHS') or DEFAULT_WIDTHS
+    return tuple(sorted(int(w) for w in widths))
+
+
+def output_formats():
+    formats = ['webp']
+    if avif_supported():
+        formats.insert(0, 'avif')
+    return formats
+
+
+# --- rendering -----------------------------------------------------------
+
+def render_variants(data, widths, formats):
+    """Yield (width, height, format, content_type, bytes) for each derivative.
+
+    Widths at or above the source width are skipped (no upscaling).
+    """
+    with Image.open(BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        has_alpha = image.mode in ('RGBA', 'LA') or (
+            image.mode == 'P' and 'transparency' in image.info
+        )
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    legacy_format = 'png' if has_alpha else 'jpeg'
+    for width in widths:
+        if width >= image.width:
+            continue
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS)
+        for fmt in list(formats) + [legacy_format]:
+            buf = BytesIO()
+            # No exif=/icc_profile= arguments: metadata is not copied over
+            resized.save(buf, format=fmt.upper(), **ENCODER_OPTIONS[fmt])
+            yield width, height, fmt, f'image/{fmt}', buf.getvalue()
+
+
+def build_variants(source_hash, data):
+    """Render and store all missing variants for one source blob."""
+    from sqlalchemy.exc import IntegrityError
+    from app.models.database import db
+    from app.models.product import ImageVariant, content_hash
+
+    existing = {
+        (width, fmt)
+        for width, fmt in db.session.query(ImageVariant.width, ImageVariant.format)
+        .filter(ImageVariant.source_hash == source_hash)
+    }
+    created = 0
+    for width, height, fmt, content_type, blob in render_variants(
+        data, variant_widths(), output_formats()
+    ):
+        if (width, fmt) in existing:
+            continue
+        db.session.add(ImageVariant(
+            source_hash=source_hash,
+            width=width,
+            height=height,
+            format=fmt,
+            content_type=content_type,
+            data=blob,
+            content_hash=content_hash(blob),
+            size=len(blob),
+        ))
+        created += 1
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker built the same set concurrently
+        db.session.rollback()
+        return 0
+    return created
+
+
+def _build_in_background(app, source_hash, data):
+    from app.models.database import db
+
+    with app.app_context():
+        try:
+            created = build_variants(source_hash, data)
+            logger.info(f"Built {created} image variants for {source_hash[:12]}")
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f"Image variant build failed for {source_hash[:12]}: {e}")
+        finally:
+            db.session.remove()
+
+
+def _get_executor(app):
+    # Created lazily so each forked Gunicorn worker gets its own threads
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = int(app.config.get('IMAGE_VARIANT_WORKERS', 2))
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-variants')
+        return _executor
+
+
+def schedule_variants(source_hash, data, content_type=None):
+    """Queue derivative generation for an uploaded image (returns immediately).
+
+    With IMAGE_VARIANT_WORKERS=0 the variants are built inline.
+    """
+    app = current_app._get_current_object()
+    if not app.config.get('IMAGE_VARIANTS_ENABLED', True) or not source_hash or not data:
+        return
+    if content_type in SKIP_CONTENT_TYPES:
+        return
+    if int(app.config.get('IMAGE_VARIANT_WORKERS', 2)) <= 0:
+        _build_in_background(app, source_hash, data)
+        return
+    _get_executor(app).submit(_build_in_background, app, source_hash, data)
+
+
+# --- negotiation ---------------------------------------------------------
+
+def _accepts(mimetype):
+    # Exact match only: */* must not make a browser look AVIF-capable
+    return any(value == mimetype and quality > 0 for value, quality in request.accept_mimetypes)
+
+
+def requested_variant():
+    """Map ``?w=`` + ``Accept`` to ``(width, format)``, or None for the original."""
+    try:
+        wanted = int(request.args.get('w', 0))
+    except (TypeError, ValueError):
+        return None
+    if wanted <= 0:
+        return None
+    bucket = next((w for w in variant_widths() if w >= wanted), None)
+    if bucket is None:
+        return None
+    for fmt in NEGOTIABLE_FORMATS:
+        if _accepts(f'image/{fmt}') and (fmt != 'avif' or avif_supported()):
+            return bucket, fmt
+    return bucket, LEGACY
+
+
+def variant_key(variant):
+    """Cache/ref key for a negotiated variant (None for the original)."""
+    if not variant:
+        return None
+    width, fmt = variant
+    return f'w{width}.{fmt}'
+
+
+def find_variant(source_hash, variant):
+    """Variant metadata (blob deferred) for a negotiated request, if built yet."""
+    from app.models.product import ImageVariant
+
+    if not variant or not source_hash:
+        return None
+    width, fmt = variant
+    query = ImageVariant.query.options(defer(ImageVariant.data)).filter(
+        ImageVariant.source_hash == source_hash,
+        ImageVariant.width == width,
+    )
+    if fmt == LEGACY:
+        query = query.filter(ImageVariant.format.in_(('jpeg', 'png')))
+    else:
+        query = query.filter(ImageVariant.format == fmt)
+    return query.first()
+
+
+def load_variant_data(variant_id):
+    from app.models.database import db
+    from app.models.product import ImageVariant
+
+    return db.session.query(ImageVariant.data).filter(ImageVariant.id == variant_id).scalar()
+
+
+def srcset(url, app=None):
+    """``srcset`` value offering every variant width for a DB image URL."""
+    if not url or not (url.startswith('/media/image/') or url.startswith('/category_media/')):
+        return ''
+    sep = '&' if '?' in url else '?'
+    return ', '.join(f'{url}{sep}w={w} {w}w' for w in variant_widths(app))
@@ -0,0 +1,325 @@
+"""
+Local content-addressed cache for images stored in the database.
+
+Blobs are written once under ``<MEDIA_CACHE_DIR>/blobs/<hh>/<sha256>`` and
+never change, so they can be shared by every worker on the host. A small JSON
+"ref" per image (``refs/<kind>-<id>.json``, or ``<kind>-<id>@<variant>.json``
+for a responsive derivative) maps the URL id to the current hash plus the
+headers needed to serve it, which lets a hit be answered with
+``send_file`` (or X-Sendfile when ``USE_X_SENDFILE`` is on) without checking out
+a DB connection.
+
+Refs are trusted for ``MEDIA_CACHE_REF_TTL`` seconds, or indefinitely when the
+request carries a matching ``?v=`` version. A *fallback* ref (the original
+stored under a variant key because that variant is not built) always expires
+after the TTL, so a variant that gets built later is picked up. After that the route revalidates
+against the metadata row (no blob transfer) and refreshes the ref. Replacing or
+deleting an image drops its ref immediately on this host.
+
+The total size of ``blobs/`` is kept under ``MEDIA_CACHE_MAX_BYTES`` by evicting
+the least recently used files; hits bump the file mtime, so the order is shared
+between processes.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from flask import current_app, request
+
+from app.utils.media_http import VERSION_PARAM, serve_path
+
+logger = logging.getLogger(__name__)
+
+# Hits refresh the blob mtime (LRU order) at most this often
+TOUCH_INTERVAL = 60
+# After an eviction pass the cache is trimmed to this share of the budget
+EVICT_TARGET = 0.9
+
+_delete_hooks_registered = False
+
+
+class MediaCache:
+    """Content-addressed blob files plus per-image refs, bounded by total bytes."""
+
+    def __init__(self, root, max_bytes, ref_ttl=300):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.ref_ttl = float(ref_ttl)
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.ref_dir = os.path.join(root, 'refs')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.ref_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._total = self._scan_size()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'bytes_served': 0,
+            'bytes_stored': 0,
+        }
+
+    # --- paths -----------------------------------------------------------
+
+    def blob_path(self, content_hash):
+        return os.path.join(self.blob_dir, content_hash[:2], content_hash)
+
+    def _ref_path(self, kind, object_id, variant=None):
+        suffix = f"@{variant}" if variant else ''
+        return os.path.join(self.ref_dir, f"{kind}-{int(object_id)}{suffix}.json")
+
+    # --- refs ------------------------------------------------------------
+
+    def lookup(self, kind, object_id, version=None, variant=None):
+        """Return the ref for a servable cached image, or None on a miss."""
+        ref_path = self._ref_path(kind, object_id, variant)
+        try:
+            with open(ref_path, encoding='utf-8') as fh:
+                ref = json.load(fh)
+            age = time.time() - os.path.getmtime(ref_path)
+        except (OSError, ValueError):
+            return self._miss()
+        content_hash = ref.get('hash') or ''
+        # ?v= names the original; variants record it as 'source'
+        if version and not (ref.get('source') or content_hash).startswith(version):
+            return self._miss()
+        if (not version or ref.get('fallback')) and age > self.ref_ttl:
+            return self._miss()
+        if not os.path.exists(self.blob_path(content_hash)):
+            return self._miss()
+        return ref
+
+    def _miss(self):
+        self._bump('misses')
+        return None
+
+    def remember(self, kind, object_id, content_hash, content_type, filename, last_modified,
+                 variant=None, source=None, fallback=False):
+        """Point an image id (or one of its variants) at a cached blob, atomically."""
+        ref = {
+            'hash': content_hash,
+            'source': source or content_hash,
+            'content_type': content_type,
+            'filename': filename,
+            'last_modified': last_modified.timestamp() if last_modified else None,
+        }
+        if fallback:
+            ref['fallback'] = True
+        self._atomic_write(self._ref_path(kind, object_id, variant), json.dumps(ref).encode('utf-8'))
+
+    def invalidate(self, kind, object_id):
+        """Drop the refs of an image and all of its variants."""
+        prefix = f"{kind}-{int(object_id)}"
+        try:
+            names = [name for name in os.listdir(self.ref_dir)
+                     if name == f"{prefix}.json" or name.startswith(f"{prefix}@")]
+        except OSError as e:
+            logger.warning(f"Media cache: could not list refs: {e}")
+            return
+        for name in names:
+            try:
+                os.remove(os.path.join(self.ref_dir, name))
+                self._bump('invalidations')
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Media cache: could not drop ref {name}: {e}")
+
+    # --- blobs -----------------------------------------------------------
+
+    def has_blob(self, content_hash):
+        return bool(content_hash) and os.path.exists(self.blob_path(content_hash))
+
+    def store(self, content_hash, data):
+        """Write a blob under its hash; a no-op if it is already present."""
+        path = self.blob_path(content_hash)
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._atomic_write(path, data)
+        with self._lock:
+            self.stats['stores'] += 1
+            self.stats['bytes_stored'] += len(data)
+            self._total += len(data)
+            over_budget = self._total > self.max_bytes
+        if over_budget:
+            self._evict()
+        return path
+
+    def fill(self, kind, object_id, content_hash, content_type, filename, last_modified, load_data,
+             variant=None, source=None, fallback=False):
+        """Make sure the blob is on disk (loading it only if absent) and refresh the ref.
+
+        ``load_data`` is called without arguments and returns the bytes; returns
+        the new ref, or None when there is no data to cache.
+        """
+        if not self.has_blob(content_hash):
+            data = load_data()
+            if not data:
+                return None
+            self.store(content_hash, data)
+        self.remember(kind, object_id, content_hash, content_type, filename, last_modified,
+                      variant=variant, source=source, fallback=fallback)
+        return {
+            'hash': content_hash,
+            'source': source or content_hash,
+            'content_type': content_type,
+            'filename': filename,
+            'last_modified': last_modified,
+        }
+
+    def send(self, ref, hit=True):
+        """Serve a cached blob from disk."""
+        content_hash = ref['hash']
+        path = self.blob_path(content_hash)
+        last_modified = ref.get('last_modified')
+        response = serve_path(
+            path,
+            etag=content_hash,
+            last_modified=last_modified,
+            content_type=ref.get('content_type'),
+            filename=ref.get('filename'),
+            version=ref.get('source'),
+        )
+        self._touch(path)
+        with self._lock:
+            if hit:
+                self.stats['hits'] += 1
+            if response.status_code != 304:
+                self.stats['bytes_served'] += response.content_length or 0
+        return response
+
+    # --- housekeeping ----------------------------------------------------
+
+    def _atomic_write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _touch(self, path):
+        try:
+            if time.time() - os.path.getmtime(path) > TOUCH_INTERVAL:
+                os.utime(path)
+        except OSError:
+            pass
+
+    def _blob_files(self):
+        for dirpath, _dirnames, filenames in os.walk(self.blob_dir):
+            for name in filenames:
+                if name.startswith('.tmp-'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def _scan_size(self):
+        return sum(size for _path, size, _mtime in self._blob_files())
+
+    def _evict(self):
+        """Delete least recently used blobs until under the target size.
+
+        Rescans the directory so blobs written by other workers are counted.
+        """
+        with self._lock:
+            files = sorted(self._blob_files(), key=lambda item: item[2])
+            total = sum(size for _path, size, _mtime in files)
+            target = self.max_bytes * EVICT_TARGET
+            for path, size, _mtime in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.stats['evictions'] += 1
+            self._total = total
+        logger.info(f"Media cache evicted down to {total} bytes")
+
+    def _bump(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def snapshot(self):
+        with self._lock:
+            snap = dict(self.stats)
+            snap['size_bytes'] = self._total
+        lookups = snap['hits'] + snap['misses']
+        snap['hit_ratio'] = round(snap['hits'] / lookups, 4) if lookups else None
+        snap['max_bytes'] = self.max_bytes
+        return snap
+
+
+def get_media_cache(app=None):
+    """Return the app's media cache, or None when disabled/outside an app."""
+    try:
+        app = app or current_app._get_current_object()
+    except RuntimeError:
+        return None
+    return app.extensions.get('media_cache')
+
+
+def requested_version():
+    return request.args.get(VERSION_PARAM)
+
+
+def invalidate_media(kind, object_id):
+    """Drop the cached ref for an image that was replaced or deleted."""
+    cache = get_media_cache()
+    if cache is not None and object_id is not None:
+        cache.invalidate(kind, object_id)
+
+
+def _register_delete_hooks():
+    global _delete_hooks_registered
+    if _delete_hooks_registered:
+        return
+    _delete_hooks_registered = True
+
+    from sqlalchemy import event
+    from app.models.product import Category, ProductImage
+
+    @event.listens_for(ProductImage, 'after_delete')
+    def _drop_product_image(mapper, connection, target):
+        invalidate_media('product', target.id)
+
+    @event.listens_for(Category, 'after_delete')
+    def _drop_category_image(mapper, connection, target):
+        invalidate_media('category', target.id)
+
+
+def init_media_cache(app):
+    """Create the cache under the instance folder unless disabled."""
+    if not app.config.get('MEDIA_CACHE_ENABLED', True):
+        logger.info("Media cache disabled")
+        return None
+    root = app.config.get('MEDIA_CACHE_DIR') or os.path.join(app.instance_path, 'media_cache')
+    try:
+        cache = MediaCache(
+            root,
+            max_bytes=app.config.get('MEDIA_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+            ref_ttl=app.config.get('MEDIA_CACHE_REF_TTL', 300),
+        )
+    except OSError as e:
+        logger.warning(f"Media cache unavailable at {root}: {e}")
+        return None
+    _register_delete_hooks()
+    app.extensions['media_cache'] = cache
+    logger.info(f"Media cache at {root} ({cache.max_bytes} bytes budget)")
+    return cache
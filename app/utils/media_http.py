@@ -0,0 +1,93 @@
+"""
+HTTP caching for images stored in the database.
+
+Product and category images live in ``bytea`` columns. The serving routes first
+load only the metadata row (hash, type, timestamps) with the blob deferred,
+answer conditional requests with 304 from that, and fetch the bytes only when
+the client actually needs them. URLs carrying ``?v=<hash prefix>`` are treated
+as versioned and get a one-year immutable Cache-Control; unversioned URLs must
+revalidate, which is cheap thanks to the 304 path. Range requests are handled
+by ``send_file``; blobs already cached on disk (see ``media_cache``) are sent
+from their file via ``serve_path``.
+"""
+from io import BytesIO
+
+from flask import request, send_file, Response
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+VERSION_PARAM = 'v'
+VERSION_LENGTH = 16
+
+
+def versioned_url(url, content_hash):
+    """Append the content version to a media URL so it can be cached forever."""
+    if not url or not content_hash:
+        return url
+    base = url.split('?', 1)[0]
+    return f"{base}?{VERSION_PARAM}={content_hash[:VERSION_LENGTH]}"
+
+
+def is_versioned_request(content_hash):
+    version = request.args.get(VERSION_PARAM)
+    return bool(version and content_hash and content_hash.startswith(version))
+
+
+def apply_cache_headers(response, content_hash):
+    """Immutable caching for versioned URLs, mandatory revalidation otherwise.
+
+    ``content_hash`` is the hash of the stored original that ``?v=`` refers to.
+    """
+    response.cache_control.public = True
+    if is_versioned_request(content_hash):
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = 0
+        response.cache_control.no_cache = True
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def is_not_modified(etag, last_modified):
+    """Evaluate If-None-Match / If-Modified-Since without touching the blob."""
+    if request.if_none_match:
+        return bool(etag) and request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def not_modified_response(etag, last_modified, version=None):
+    response = Response(status=304)
+    if etag:
+        response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    return apply_cache_headers(response, version or etag)
+
+
+def serve_blob(data, *, etag, last_modified, content_type, filename, version=None):
+    """Send blob bytes with validators; send_file handles Range and conditionals."""
+    response = send_file(
+        BytesIO(data),
+        mimetype=content_type or 'application/octet-stream',
+        download_name=filename,
+        etag=etag or False,
+        last_modified=last_modified,
+        conditional=True,
+    )
+    return apply_cache_headers(response, version or etag)
+
+
+def serve_path(path, *, etag, last_modified, content_type, filename, version=None):
+    """Like ``serve_blob`` for a file on disk (honours USE_X_SENDFILE)."""
+    response = send_file(
+        path,
+        mimetype=content_type or 'application/octet-stream',
+        download_name=filename,
+        etag=etag or False,
+        last_modified=last_modified,
+        conditional=True,
+    )
+    return apply_cache_headers(response, version or etag)
@@ -0,0 +1,88 @@
+"""
+Shared response path for product and category images stored in the database.
+
+Both routes resolve their own metadata row and then hand over to
+``serve_stored_image``. That function picks the responsive variant requested
+via ``?w=`` / ``Accept`` when one has been built, answers conditional requests
+with 304, and serves the bytes from the disk cache, loading the blob from
+Postgres only when it is not already on disk.
+"""
+import logging
+
+from flask import abort
+
+from app.utils.image_variants import find_variant, load_variant_data, requested_variant, variant_key
+from app.utils.media_cache import get_media_cache, requested_version
+from app.utils.media_http import is_not_modified, not_modified_response, serve_blob
+
+logger = logging.getLogger(__name__)
+
+
+def _vary(response, variant):
+    if variant:
+        response.vary.add('Accept')
+    return response
+
+
+def serve_cached(kind, object_id):
+    """Answer from the local cache without touching the DB, or return None."""
+    cache = get_media_cache()
+    if cache is None:
+        return None
+    variant = requested_variant()
+    ref = cache.lookup(kind, object_id, requested_version(), variant=variant_key(variant))
+    if not ref:
+        return None
+    return _vary(cache.send(ref), variant)
+
+
+def serve_stored_image(kind, object_id, *, source_hash, content_type, filename, last_modified, load_data):
+    """Serve an image (or its negotiated variant) given its metadata.
+
+    ``load_data`` returns the original bytes and is only called if needed.
+    """
+    variant = requested_variant()
+    etag = source_hash
+    # serve_cached() looks a ?w= request up under its variant key. Until that
+    # variant exists (still building, or the image is narrower than every
+    # width) the original is stored there as a fallback ref.
+    key = variant_key(variant)
+    row = find_variant(source_hash, variant)
+    fallback = key is not None and row is None
+    if row is not None:
+        etag = row.content_hash
+        content_type = row.content_type
+        last_modified = row.created_at
+        stem = (filename or 'image').rsplit('.', 1)[0]
+        filename = f"{stem}-{row.width}w.{row.format}"
+        load_data = lambda: load_variant_data(row.id)  # noqa: E731
+
+    cache = get_media_cache()
+    if is_not_modified(etag, last_modified):
+        if cache is not None and cache.has_blob(etag):
+            cache.remember(kind, object_id, etag, content_type, filename, last_modified,
+                           variant=key, source=source_hash, fallback=fallback)
+        return _vary(not_modified_response(etag, last_modified, version=source_hash), variant)
+
+    if cache is not None:
+        try:
+            ref = cache.fill(kind, object_id, etag, content_type, filename, last_modified,
+                             load_data, variant=key, source=source_hash, fallback=fallback)
+            if ref:
+                return _vary(cache.send(ref, hit=False), variant)
+        except OSError as e:
+            logger.warning(f"Media cache write failed for {kind} {object_id}: {e}")
+
+    data = load_data()
+    if not data:
+        logger.warning(f"{kind} image {object_id} has no data")
+        abort(404)
+    logger.debug(f"Serving {kind} image {object_id} from database: {filename}, {len(data)} bytes")
+    return _vary(serve_blob(
+        data,
+        etag=etag,
+        last_modified=last_modified,
+        content_type=content_type,
+        filename=filename,
+        version=source_hash,
+    ), variant)
@@ -0,0 +1,439 @@
+"""
+Request metrics in the Prometheus text exposition format, served at ``/metrics``.
+
+Series (all counters or histograms):
+
+* ``http_requests_total`` / ``http_request_duration_seconds``: by blueprint,
+  endpoint and method (plus status for the count). A streamed response (chat
+  SSE) is timed until its headers are sent;
+* ``http_request_db_seconds`` / ``http_request_db_queries_total``: time and
+  statements each request spent in the database (engine events);
+* ``db_pool_checkout_seconds``: time to get a connection from the engine. This
+  covers the pool queue wait, new connections and the idle ping of
+  app/utils/db_health.py;
+* ``outbound_request_duration_seconds``: OpenAI, Stripe and Telegram calls by
+  operation and outcome, recorded by ``outbound_call()`` at the call sites
+  (until the response, or the stream, starts);
+* ``http_image_bytes_served_total``: body bytes of image responses.
+
+Gunicorn runs ``cpu_count*2+1`` workers. Each one keeps its series in memory and
+writes a snapshot to ``METRICS_DIR/<pid>-<token>.json`` at most every
+``METRICS_FLUSH_INTERVAL`` seconds, and again at exit. ``/metrics`` sums the
+snapshots of every worker. Snapshots of exited workers are folded into
+``archive.json`` under a file lock, so totals survive ``max_requests``
+restarts instead of dropping. Only counters and histograms are kept, because
+for those a plain sum across processes is correct.
+
+Without ``METRICS_TOKEN`` only local scrapes are answered; with it the
+scraper sends ``Authorization: Bearer <token>``.
+"""
+import atexit
+import bisect
+import contextvars
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, abort, current_app, g, request
+from sqlalchemy import event
+
+try:
+    import fcntl
+except ImportError:  # Windows: the archive is folded without a lock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT = 1
+ARCHIVE = 'archive.json'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CHECKOUT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0, 5.0)
+OUTBOUND_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# name -> (type, help, label names, histogram buckets)
+METRICS = {
+    'http_requests_total': (
+        'counter', 'HTTP requests by endpoint, method and status.',
+        ('blueprint', 'endpoint', 'method', 'status'), None),
+    'http_request_duration_seconds': (
+        'histogram', 'HTTP request latency until the response headers.',
+        ('blueprint', 'endpoint', 'method'), LATENCY_BUCKETS),
+    'http_request_db_seconds': (
+        'histogram', 'Database time per HTTP request (sum of its statements).',
+        ('blueprint', 'endpoint'), LATENCY_BUCKETS),
+    'http_request_db_queries_total': (
+        'counter', 'Statements issued by HTTP requests.',
+        ('blueprint', 'endpoint'), None),
+    'db_pool_checkout_seconds': (
+        'histogram', 'Time to get a database connection (pool wait, connect, stale ping).',
+        (), CHECKOUT_BUCKETS),
+    'outbound_request_duration_seconds': (
+        'histogram', 'External API calls until the response or stream starts.',
+        ('service', 'operation', 'outcome'), OUTBOUND_BUCKETS),
+    'http_image_bytes_served_total': (
+        'counter', 'Body bytes of image responses.',
+        ('blueprint', 'endpoint'), None),
+}
+
+# Database time of the HTTP request in this context, or None
+_request_db = contextvars.ContextVar('metrics_db', default=None)
+
+
+class RequestDB:
+    """Statements and database seconds of one request."""
+
+    __slots__ = ('count', 'seconds', 'started')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.started = None
+
+
+def _merge(into, series):
+    """Add ``[[name, labels, value], ...]`` into ``{(name, labels): value}``."""
+    for name, labels, value in series:
+        definition = METRICS.get(name)
+        if definition is None:
+            continue
+        key = (name, tuple(labels))
+        current = into.get(key)
+        if definition[0] == 'counter':
+            into[key] = (current or 0) + value
+        elif current is None:
+            into[key] = list(value)
+        elif len(current) == len(value):
+            # Same buckets; a snapshot from before a bucket change is skipped
+            into[key] = [a + b for a, b in zip(current, value)]
+    return into
+
+
+def _dump(series):
+    return [[name, list(labels), value] for (name, labels), value in series.items()]
+
+
+def _read(path):
+    try:
+        with open(path, encoding='utf-8') as handle:
+            payload = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    return payload if payload.get('format') == FORMAT else None
+
+
+def _write(path, payload):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as handle:
+        json.dump(payload, handle, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextmanager
+def _locked(directory):
+    with open(os.path.join(directory, 'archive.lock'), 'a') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(series):
+    """Text exposition format (version 0.0.4) of ``{(name, labels): value}``."""
+    by_name = {}
+    for (name, labels), value in series.items():
+        by_name.setdefault(name, []).append((labels, value))
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(by_name.get(name, ())):
+            if kind == 'counter':
+                lines.append(f'{name}{_labels(label_names, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + (float('inf'),), value[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f'{name}_bucket{_labels(label_names, labels, le)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(label_names, labels)} {_number(value[-1])}')
+            lines.append(f'{name}_count{_labels(label_names, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsRegistry:
+    """Series of this process plus the snapshot files shared by the workers."""
+
+    def __init__(self):
+        self.directory = None
+        self.flush_interval = 5.0
+        self.stats = {'flushes': 0, 'flush_errors': 0, 'folded': 0}
+        self._reset()
+        # A forked worker starts empty, under its own file name
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._series = {}  # (name, labels) -> count, or [per-bucket counts..., +Inf count, sum]
+        self._file = f'{os.getpid()}-{secrets.token_hex(4)}.json'
+        self._dirty = False
+        self._next_flush = 0.0
+
+    def _inc(self, name, labels, amount):
+        key = (name, labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def _observe(self, name, labels, value):
+        buckets = METRICS[name][3]
+        key = (name, labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(buckets) + 2)
+        series[bisect.bisect_left(buckets, value)] += 1
+        series[-1] += value
+
+    def inc(self, name, *labels, amount=1):
+        with self._lock:
+            self._inc(name, labels, amount)
+            self._dirty = True
+
+    def observe(self, name, value, *labels):
+        with self._lock:
+            self._observe(name, labels, value)
+            self._dirty = True
+
+    def record_request(self, blueprint, endpoint, method, status, seconds, db=None, image_bytes=0):
+        """All series of one finished request, under one lock."""
+        with self._lock:
+            self._inc('http_requests_total', (blueprint, endpoint, method, status), 1)
+            self._observe('http_request_duration_seconds', (blueprint, endpoint, method), seconds)
+            if db is not None:
+                self._observe('http_request_db_seconds', (blueprint, endpoint), db.seconds)
+                if db.count:
+                    self._inc('http_request_db_queries_total', (blueprint, endpoint), db.count)
+            if image_bytes:
+                self._inc('http_image_bytes_served_total', (blueprint, endpoint), image_bytes)
+            self._dirty = True
+
+    def maybe_flush(self):
+        if self.directory and self._dirty and time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def flush(self):
+        """Write this process's snapshot (all series since it started)."""
+        if not self.directory:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            series = _dump(self._series)
+            self._dirty = False
+            self._next_flush = time.monotonic() + self.flush_interval
+        try:
+            _write(os.path.join(self.directory, self._file),
+                   {'format': FORMAT, 'pid': os.getpid(), 'series': series})
+            self.stats['flushes'] += 1
+        except OSError as e:
+            self.stats['flush_errors'] += 1
+            logger.warning(f"Could not write metrics snapshot to {self.directory}: {e}")
+
+    def collect(self):
+        """``{(name, labels): value}`` summed over all workers, past and present."""
+        if not self.directory:
+            with self._lock:
+                return _merge({}, _dump(self._series))
+        self.flush()
+        merged, dead = {}, []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json') or filename == ARCHIVE:
+                continue
+            try:
+                pid = int(filename.split('-', 1)[0])
+            except ValueError:
+                continue
+            path = os.path.join(self.directory, filename)
+            if pid != os.getpid() and not _alive(pid):
+                dead.append(path)
+                continue
+            payload = _read(path)
+            if payload is not None:
+                _merge(merged, payload['series'])
+        if dead:
+            self._fold(dead)
+        archive = _read(os.path.join(self.directory, ARCHIVE))
+        if archive is not None:
+            _merge(merged, archive['series'])
+        return merged
+
+    def _fold(self, paths):
+        """Move the snapshots of exited workers into the archive."""
+        archive_path = os.path.join(self.directory, ARCHIVE)
+        try:
+            with _locked(self.directory):
+                archive = _read(archive_path)
+                totals = _merge({}, archive['series']) if archive else {}
+                folded = []
+                for path in paths:
+                    # Another worker may have folded it while we waited for the lock
+                    payload = _read(path)
+                    if payload is not None:
+                        _merge(totals, payload['series'])
+                        folded.append(path)
+                if not folded:
+                    return
+                _write(archive_path, {'format': FORMAT, 'series': _dump(totals)})
+                for path in folded:
+                    os.unlink(path)
+                self.stats['folded'] += len(folded)
+        except OSError as e:
+            logger.warning(f"Could not fold metrics of exited workers: {e}")
+
+
+_registry = MetricsRegistry()
+atexit.register(_registry.flush)
+
+
+def get_registry():
+    return _registry
+
+
+@contextmanager
+def outbound_call(service, operation):
+    """Time an external API call (``outcome`` is ``error`` when it raises)."""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        _registry.observe('outbound_request_duration_seconds', time.perf_counter() - started,
+                          service, operation, outcome)
+
+
+def _instrument_engine(engine, registry):
+    """Per-request statement time, and the time to get a connection from ``engine``."""
+    if getattr(engine, '_metrics_instrumented', False):
+        return
+    engine._metrics_instrumented = True
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        db = _request_db.get()
+        if db is not None:
+            db.started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        db = _request_db.get()
+        if db is not None and db.started is not None:
+            db.count += 1
+            db.seconds += time.perf_counter() - db.started
+            db.started = None
+
+    # Every Connection (sessions included) gets its DBAPI connection here; no pool
+    # event fires before the wait, so the engine's method is wrapped
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return raw_connection(*args, **kwargs)
+        finally:
+            registry.observe('db_pool_checkout_seconds', time.perf_counter() - started)
+
+    engine.raw_connection = timed_raw_connection
+
+
+def _check_access():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(401)
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(404)
+
+
+def init_metrics(app, db):
+    """Instrument requests and the engine; serve the sums at /metrics."""
+    config = app.config
+    if not config.get('METRICS_ENABLED', True):
+        return None
+    registry = get_registry()
+    directory = config.get('METRICS_DIR') or os.path.join(app.instance_path, 'metrics')
+    try:
+        os.makedirs(directory, exist_ok=True)
+        registry.directory = directory
+    except OSError as e:
+        logger.warning(f"Metrics directory {directory} unavailable, /metrics shows this process only: {e}")
+    registry.flush_interval = float(config.get('METRICS_FLUSH_INTERVAL', 5))
+    app.extensions['metrics'] = registry
+    with app.app_context():
+        _instrument_engine(db.get_engine(), registry)
+
+    @app.before_request
+    def metrics_start():
+        g._metrics_started = time.perf_counter()
+        g._metrics_db_token = _request_db.set(RequestDB())
+
+    @app.after_request
+    def metrics_finish(response):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return response
+        image_bytes = 0
+        if response.status_code in (200, 206) and response.mimetype.startswith('image/'):
+            image_bytes = response.content_length or 0
+        registry.record_request(
+            request.blueprint or '', request.endpoint or 'none', request.method, str(response.status_code),
+            time.perf_counter() - started, db=_request_db.get(), image_bytes=image_bytes,
+        )
+        registry.maybe_flush()
+        return response
+
+    @app.teardown_request
+    def metrics_stop(exc):
+        token = g.pop('_metrics_db_token', None)
+        if token is not None:
+            _request_db.reset(token)
+
+    from app.utils.db_health import db_exempt
+
+    @db_exempt
+    def metrics_endpoint():
+        _check_access()
+        return Response(render(registry.collect()), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+    return registry
@@ -0,0 +1,207 @@
+"""
+Per-request query counting, N+1 detection and query budgets.
+
+Engine events (``before_cursor_execute`` / ``after_cursor_execute``) count
+and time every statement a request issues. A statement *shape* is the SQL
+text with its bind parameters; expanded ``IN (?, ?, ...)`` lists collapse to
+one shape. A shape repeated ``QUERY_NPLUSONE_THRESHOLD`` times within one
+request is reported as a probable N+1 (a lazy relationship or ``.get()`` in
+a loop).
+
+Only a ``QUERY_STATS_SAMPLE_RATE`` fraction of requests is instrumented.
+For the others the listeners return after one context-variable lookup, so
+production can run with a low rate. Background threads (job queue, voice
+pipeline) are never counted.
+
+Budgets: ``@query_budget(n)`` on a view, or ``QUERY_BUDGETS = {endpoint: n}``
+in the config, caps the statements of an instrumented request. Going over
+is logged; with ``QUERY_BUDGET_STRICT`` (scripts, test clients) the request
+raises ``QueryBudgetExceeded`` instead. ``QUERY_STATS_HEADERS`` (always on
+in debug mode) adds ``X-Query-Count``, ``X-Query-Time-Ms``,
+``X-Query-Repeats`` and a ``Server-Timing`` entry to the response.
+tests/test_query_budgets.py runs the main pages against budgets.
+"""
+import contextvars
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Instrumented request in this context, or None
+_active = contextvars.ContextVar('query_stats', default=None)
+
+# "IN (?, ?, ?)" / "IN (%(id_1_1)s, %(id_1_2)s)" -> "IN (...)"
+_EXPANDED_LIST = re.compile(r'\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(Exception):
+    """A request issued more statements than its budget (``QUERY_BUDGET_STRICT``)."""
+
+    def __init__(self, endpoint, count, budget, repeated):
+        self.endpoint = endpoint
+        self.count = count
+        self.budget = budget
+        self.repeated = repeated
+        super().__init__(f"{endpoint}: {count} queries, budget {budget}"
+                         + (f"; repeated: {repeated[0][0]}x {repeated[0][1][:200]}" if repeated else ''))
+
+
+def query_budget(limit):
+    """Cap the statements one request of this view may issue."""
+    def decorator(view):
+        view._query_budget = limit
+        return view
+    return decorator
+
+
+def statement_shape(statement):
+    return _EXPANDED_LIST.sub('(...)', _WHITESPACE.sub(' ', statement).strip())
+
+
+class RequestQueries:
+    """Statements of one request, by exact text (normalised only at the end)."""
+
+    __slots__ = ('count', 'seconds', 'statements', 'started')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+        self.started = None
+
+    def repeated(self, threshold):
+        """[(times, shape)] for shapes issued at least ``threshold`` times, most frequent first."""
+        shapes = Counter()
+        for statement, times in self.statements.items():
+            shapes[statement_shape(statement)] += times
+        return [(times, shape) for shape, times in shapes.most_common() if times >= threshold]
+
+
+class QueryStats:
+    """Engine listeners plus process-wide totals of the instrumented requests."""
+
+    def __init__(self, sample_rate=1.0, nplusone_threshold=5):
+        self.sample_rate = float(sample_rate)
+        self.nplusone_threshold = int(nplusone_threshold)
+        self._lock = threading.Lock()
+        self._engines = set()
+        self.stats = {'requests': 0, 'queries': 0, 'nplusone': 0, 'over_budget': 0}
+        self.worst = {}  # endpoint -> most queries seen in one request
+
+    def attach(self, engine):
+        """Register the statement listeners on ``engine`` (idempotent)."""
+        if id(engine) in self._engines:
+            return
+        self._engines.add(id(engine))
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            queries = _active.get()
+            if queries is None:
+                return
+            queries.count += 1
+            queries.statements[statement] += 1
+            queries.started = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            queries = _active.get()
+            if queries is None or queries.started is None:
+                return
+            queries.seconds += time.perf_counter() - queries.started
+            queries.started = None
+
+    def start(self):
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            queries = RequestQueries()
+            g._query_stats_token = _active.set(queries)
+            return queries
+        return None
+
+    @staticmethod
+    def budget_for(endpoint):
+        # Read at request time, so tests can set QUERY_BUDGETS on a created app
+        view = current_app.view_functions.get(endpoint) if endpoint else None
+        return getattr(view, '_query_budget', None) or (current_app.config.get('QUERY_BUDGETS') or {}).get(endpoint)
+
+    def finish(self, queries):
+        """Record a finished request; raises QueryBudgetExceeded in strict mode."""
+        endpoint = request.endpoint or request.path
+        repeated = queries.repeated(self.nplusone_threshold)
+        budget = self.budget_for(request.endpoint)
+        over = budget is not None and queries.count > budget
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['queries'] += queries.count
+            self.stats['nplusone'] += bool(repeated)
+            self.stats['over_budget'] += over
+            self.worst[endpoint] = max(self.worst.get(endpoint, 0), queries.count)
+        if repeated:
+            times, shape = repeated[0]
+            logger.warning(f"Possible N+1 in {endpoint}: {times}x {shape[:300]}")
+        if over:
+            if current_app.config.get('QUERY_BUDGET_STRICT'):
+                raise QueryBudgetExceeded(endpoint, queries.count, budget, repeated)
+            logger.warning(f"{endpoint} used {queries.count} queries, budget {budget}")
+        return repeated
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+            data['worst'] = dict(sorted(self.worst.items(), key=lambda item: -item[1])[:10])
+        data['sample_rate'] = self.sample_rate
+        return data
+
+
+def get_query_stats(app=None):
+    app = app or current_app
+    return app.extensions.get('query_stats')
+
+
+def init_query_stats(app, db):
+    """Attach the listeners to the app engine and instrument sampled requests."""
+    config = app.config
+    sample_rate = config.get('QUERY_STATS_SAMPLE_RATE')
+    query_stats = QueryStats(
+        sample_rate=(1.0 if app.debug else 0.01) if sample_rate is None else sample_rate,
+        nplusone_threshold=config.get('QUERY_NPLUSONE_THRESHOLD', 5),
+    )
+    if query_stats.sample_rate <= 0:
+        return query_stats
+    with app.app_context():
+        query_stats.attach(db.get_engine())
+    app.extensions['query_stats'] = query_stats
+
+    @app.before_request
+    def query_stats_start():
+        query_stats.start()
+
+    @app.after_request
+    def query_stats_finish(response):
+        queries = _active.get()
+        if queries is None:
+            return response
+        repeated = query_stats.finish(queries)
+        if current_app.config.get('QUERY_STATS_HEADERS') or current_app.debug:
+            milliseconds = queries.seconds * 1000
+            response.headers['X-Query-Count'] = str(queries.count)
+            response.headers['X-Query-Time-Ms'] = f'{milliseconds:.1f}'
+            response.headers['X-Query-Repeats'] = str(repeated[0][0] if repeated else 0)
+            response.headers.add('Server-Timing', f'db;dur={milliseconds:.1f};desc="{queries.count} queries"')
+        return response
+
+    @app.teardown_request
+    def query_stats_stop(exc):
+        token = g.pop('_query_stats_token', None)
+        if token is not None:
+            _active.reset(token)
+
+    return query_stats
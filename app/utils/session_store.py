@@ -0,0 +1,344 @@
+"""
+Pluggable session storage, chosen by ``SESSION_BACKEND``.
+
+The previous Flask-Session filesystem store rewrote one file per visitor on
+every request, from every Gunicorn worker into one directory, and pruned it
+with a directory scan. The backends here only write when they have to:
+
+* ``hybrid`` (default): the signed cookie below while the session fits in
+  ``SESSION_COOKIE_MAX_BYTES``, and an ``sql`` row once it does not. Most
+  sessions (lang, cart_id, login, the CSRF token every page asks for) never
+  touch the database. A session that shrinks back under the limit returns to
+  the cookie and its row is deleted.
+* ``sql``: one row per session in ``http_sessions`` on the main database
+  (SQLite or PostgreSQL). The cookie carries a random id only. A row is
+  written when the session changes. Otherwise the expiry is extended at most
+  once per ``SESSION_REFRESH_INTERVAL``. Visitors whose session stays empty
+  get neither a row nor a cookie. Expired rows are deleted in batches of
+  ``SESSION_SWEEP_BATCH`` at most every ``SESSION_SWEEP_INTERVAL`` seconds per
+  process, or by ``flask sessions sweep``.
+* ``cookie``: Flask's signed cookie (compact tagged JSON, zlib-compressed when
+  that is shorter), with the same write-skipping. Payloads above
+  ``SESSION_COOKIE_MAX_BYTES`` are logged, because browsers drop cookies
+  larger than about 4 KB.
+* ``filesystem``: the previous Flask-Session store, kept for rollback.
+"""
+import logging
+import re
+import secrets
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface, SessionInterface
+from itsdangerous import BadSignature
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+_SID_RE = re.compile(r'^[A-Za-z0-9_-]{32,64}$')
+
+
+def _permanent(app, session):
+    # SESSION_PERMANENT applies without storing '_permanent' in every new session
+    return session.permanent or app.config.get('SESSION_PERMANENT', True)
+
+
+def _expiration_time(app, session):
+    if _permanent(app, session):
+        return datetime.utcnow() + app.permanent_session_lifetime
+    return None
+
+
+def _refresh_due(app, issued_at):
+    """Whether an unmodified session should still be re-saved to extend its expiry."""
+    if issued_at is None:
+        return True
+    interval = app.config.get('SESSION_REFRESH_INTERVAL', 86400)
+    return time.time() - issued_at >= interval
+
+
+def _cookie_kwargs(interface, app):
+    return {
+        'domain': interface.get_cookie_domain(app),
+        'path': interface.get_cookie_path(app),
+        'secure': interface.get_cookie_secure(app),
+        'samesite': interface.get_cookie_samesite(app),
+        'httponly': interface.get_cookie_httponly(app),
+    }
+
+
+# --- signed cookie -------------------------------------------------------
+
+class CookieSession(SecureCookieSession):
+    def __init__(self, initial=None, issued_at=None):
+        super().__init__(initial)
+        self.issued_at = issued_at
+
+
+class CompactCookieSessionInterface(SecureCookieSessionInterface):
+    """Flask's signed cookie session that is only re-sent when it has to be."""
+
+    session_class = CookieSession
+    _warned_size = False
+
+    def open_session(self, app, request):
+        serializer = self.get_signing_serializer(app)
+        if serializer is None:
+            return None
+        value = request.cookies.get(self.get_cookie_name(app))
+        if not value:
+            return self.session_class()
+        max_age = int(app.permanent_session_lifetime.total_seconds())
+        try:
+            data, issued_at = serializer.loads(value, max_age=max_age, return_timestamp=True)
+        except BadSignature:
+            return self.session_class()
+        return self.session_class(data, issued_at=issued_at.timestamp())
+
+    def get_expiration_time(self, app, session):
+        return _expiration_time(app, session)
+
+    def should_set_cookie(self, app, session):
+        if session.modified:
+            return True
+        return _permanent(app, session) and _refresh_due(app, getattr(session, 'issued_at', None))
+
+    def save_session(self, app, session, response):
+        super().save_session(app, session, response)
+        prefix = f'{self.get_cookie_name(app)}='
+        cookie = next((value for value in response.headers.getlist('Set-Cookie')
+                       if value.startswith(prefix)), '')
+        limit = app.config.get('SESSION_COOKIE_MAX_BYTES', 3800)
+        if len(cookie) > limit and not self._warned_size:
+            CompactCookieSessionInterface._warned_size = True
+            logger.warning(f"Session cookie is {len(cookie)} bytes (keys: {sorted(session.keys())}); "
+                           f"browsers may drop it, consider SESSION_BACKEND=hybrid")
+
+
+# --- database rows -------------------------------------------------------
+
+class ServerSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, issued_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.issued_at = issued_at
+
+
+class SqlSessionInterface(SessionInterface):
+    """Sessions as rows in ``http_sessions``, written only when modified or due for refresh."""
+
+    session_class = ServerSession
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self):
+        self._sweep_lock = threading.Lock()
+        self._next_sweep = 0.0
+
+    @staticmethod
+    def _table():
+        from app.models.http_session import HttpSession
+        return HttpSession.__table__
+
+    @staticmethod
+    def _engine():
+        from app.models.database import db
+        return db.engine
+
+    def _lifetime(self, app):
+        return app.permanent_session_lifetime
+
+    def get_expiration_time(self, app, session):
+        return _expiration_time(app, session)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid or not _SID_RE.match(sid):
+            return self.session_class()
+        table = self._table()
+        try:
+            with self._engine().connect() as conn:
+                row = conn.execute(
+                    select(table.c.data, table.c.expires_at)
+                    .where(table.c.id == sid, table.c.expires_at > datetime.utcnow())
+                ).first()
+        except SQLAlchemyError as e:
+            logger.error(f"Could not load session: {e}")
+            return self.session_class()
+        if row is None:
+            return self.session_class()
+        try:
+            data = self.serializer.loads(row.data)
+        except ValueError:
+            return self.session_class()
+        # When the row was last saved, derived from its expiry
+        issued_at = (row.expires_at - self._lifetime(app) - datetime(1970, 1, 1)).total_seconds()
+        return self.session_class(data, sid=sid, issued_at=issued_at)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        cookie = _cookie_kwargs(self, app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and session.sid:
+                self._delete(session.sid)
+                response.delete_cookie(name, **cookie)
+            return
+
+        refresh = _permanent(app, session) and _refresh_due(app, session.issued_at)
+        if not session.modified and session.sid and not refresh:
+            return
+
+        expires_at = datetime.utcnow() + self._lifetime(app)
+        sid = session.sid or secrets.token_urlsafe(32)
+        try:
+            if session.modified or not session.sid:
+                self._upsert(sid, self.serializer.dumps(dict(session)), expires_at)
+            else:
+                self._touch(sid, expires_at)
+        except SQLAlchemyError as e:
+            logger.error(f"Could not save session: {e}")
+            return
+        session.sid = sid
+        response.set_cookie(name, sid, expires=self.get_expiration_time(app, session), **cookie)
+        self._maybe_sweep(app)
+
+    def _upsert(self, sid, data, expires_at):
+        table = self._table()
+        engine = self._engine()
+        with engine.begin() as conn:
+            if engine.dialect.name in ('postgresql', 'sqlite'):
+                if engine.dialect.name == 'postgresql':
+                    from sqlalchemy.dialects.postgresql import insert
+                else:
+                    from sqlalchemy.dialects.sqlite import insert
+                statement = insert(table).values(id=sid, data=data, expires_at=expires_at)
+                conn.execute(statement.on_conflict_do_update(
+                    index_elements=[table.c.id],
+                    set_={'data': statement.excluded.data, 'expires_at': statement.excluded.expires_at},
+                ))
+                return
+            updated = conn.execute(table.update().where(table.c.id == sid)
+                                   .values(data=data, expires_at=expires_at))
+            if not updated.rowcount:
+                conn.execute(table.insert().values(id=sid, data=data, expires_at=expires_at))
+
+    def _touch(self, sid, expires_at):
+        table = self._table()
+        with self._engine().begin() as conn:
+            conn.execute(table.update().where(table.c.id == sid).values(expires_at=expires_at))
+
+    def _delete(self, sid):
+        table = self._table()
+        try:
+            with self._engine().begin() as conn:
+                conn.execute(table.delete().where(table.c.id == sid))
+        except SQLAlchemyError as e:
+            logger.error(f"Could not delete session: {e}")
+
+    def _maybe_sweep(self, app):
+        now = time.monotonic()
+        if now < self._next_sweep or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sweep = now + app.config.get('SESSION_SWEEP_INTERVAL', 600)
+            # One batch per request; a large backlog drains over the next intervals
+            self.sweep(app.config.get('SESSION_SWEEP_BATCH', 1000), max_batches=1)
+        except SQLAlchemyError as e:
+            logger.warning(f"Session sweep failed: {e}")
+        finally:
+            self._sweep_lock.release()
+
+    def sweep(self, batch_size=1000, max_batches=None):
+        """Delete expired sessions, ``batch_size`` rows per statement. Returns the count."""
+        table = self._table()
+        deleted = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            with self._engine().begin() as conn:
+                expired = (select(table.c.id)
+                           .where(table.c.expires_at <= datetime.utcnow())
+                           .limit(batch_size)
+                           .scalar_subquery())
+                count = conn.execute(table.delete().where(table.c.id.in_(expired))).rowcount
+            deleted += count
+            batches += 1
+            if count < batch_size:
+                break
+        if deleted:
+            logger.info(f"Swept {deleted} expired sessions")
+        return deleted
+
+
+# --- cookie, or a row when too large -------------------------------------
+
+class HybridSessionInterface(CompactCookieSessionInterface):
+    """Signed cookie sessions that move to ``http_sessions`` when the cookie would be too large."""
+
+    def __init__(self):
+        self.server = SqlSessionInterface()
+
+    def open_session(self, app, request):
+        value = request.cookies.get(self.get_cookie_name(app))
+        # A row id never contains the '.' separators of a signed payload
+        if value and _SID_RE.match(value):
+            return self.server.open_session(app, request)
+        return super().open_session(app, request)
+
+    def _fits_cookie(self, app, session):
+        value = self.get_signing_serializer(app).dumps(dict(session))
+        return len(value) <= app.config.get('SESSION_COOKIE_MAX_BYTES', 3800)
+
+    def save_session(self, app, session, response):
+        stored = isinstance(session, ServerSession) and session.sid
+        if stored and not session.modified:
+            return self.server.save_session(app, session, response)
+        if not session or self._fits_cookie(app, session):
+            if stored:
+                self.server._delete(session.sid)
+                session.modified = True
+            return super().save_session(app, session, response)
+        if not stored:
+            response.vary.add('Cookie')
+            session = ServerSession(dict(session))
+            session.modified = True
+        return self.server.save_session(app, session, response)
+
+
+def init_sessions(app):
+    """Install the session interface selected by ``SESSION_BACKEND``."""
+    backend = app.config.get('SESSION_BACKEND', 'hybrid')
+    if backend == 'filesystem':
+        from flask_session import Session
+        Session(app)
+    elif backend == 'cookie':
+        app.session_interface = CompactCookieSessionInterface()
+    elif backend == 'sql':
+        app.session_interface = SqlSessionInterface()
+    elif backend == 'hybrid':
+        app.session_interface = HybridSessionInterface()
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND '{backend}' (expected hybrid, sql, cookie or filesystem)")
+    logger.info(f"Session backend: {backend}")
+
+    import click
+
+    @app.cli.group('sessions')
+    def sessions_cli():
+        """Server-side sessions."""
+
+    @sessions_cli.command('sweep')
+    @click.option('--batch', type=int, default=1000, help='Rows deleted per statement.')
+    def sweep_command(batch):
+        """Delete expired rows from http_sessions (SESSION_BACKEND=hybrid or sql)."""
+        interface = current_app.session_interface
+        interface = getattr(interface, 'server', interface)
+        if not isinstance(interface, SqlSessionInterface):
+            click.echo(f"SESSION_BACKEND is {backend}; nothing to sweep")
+            return
+        click.echo(f"Deleted {interface.sweep(batch)} expired sessions")
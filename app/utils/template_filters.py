@@ -20,3 +20,17 @@ def register_template_filters(app):
         if s is None:
             return ""
         return Markup(s.replace('\n', '<br>'))
+
+    @app.template_filter('srcset')
+    def srcset_filter(url):
+        """
+        Build a srcset attribute value for an image stored in the database.
+        
+        Args:
+            url (str): Image URL such as /media/image/5?v=...
+            
+        Returns:
+            str: "url&w=320 320w, ..." or an empty string for other URLs
+        """
+        from app.utils.image_variants import srcset
+        return srcset(url, app)
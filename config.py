@@ -1,3 +1,4 @@
+import importlib.util
 import os
 import logging
 import sys
@@ -81,10 +82,10 @@ class Config:
             database_uri = database_uri.replace('postgres://', 'postgresql://', 1)
 
         # Добавляем драйвер pg8000 если psycopg2 отсутствует
-        try:
-            import psycopg2  # noqa: F401
+        # find_spec only looks the module up; importing psycopg2 here would load libpq on every boot
+        if importlib.util.find_spec('psycopg2') is not None:
             driver_prefix = 'postgresql://'
-        except Exception:
+        else:
             driver_prefix = 'postgresql+pg8000://'
             if database_uri.startswith('postgresql://'):
                 database_uri = database_uri.replace('postgresql://', driver_prefix, 1)
@@ -105,7 +106,9 @@ class Config:
         DB_SEARCH_PATH = combined_search_path
         logger.info(f"Configured PostgreSQL search_path: {combined_search_path}")
         SQLALCHEMY_ENGINE_OPTIONS = {
-            'pool_pre_ping': True,
+            # Liveness is checked by app/utils/db_health.py, which only pings
+            # connections idle longer than DB_PING_IDLE_SECONDS
+            'pool_pre_ping': False,
             'pool_recycle': 300,
             'pool_size': 2,  # Reduced for Render.com
             'max_overflow': 5,  # Reduced for Render.com
@@ -113,7 +116,7 @@ class Config:
             'connect_args': {}
         }
     # NOTE:
-    # 1. pool_pre_ping + low pool_size mitigates stale socket / BrokenPipe bursts on Render.
+    # 1. idle-aware ping (db_health) + low pool_size mitigates stale socket / BrokenPipe bursts on Render.
     # 2. If InterfaceError/BrokenPipe still noisy, consider lowering Gunicorn workers via
     #    environment variable WEB_CONCURRENCY=4 (current logs show many workers spawning).
     # 3. pool_recycle ensures periodic connection refresh before server closes idle sockets.
@@ -141,11 +144,141 @@ class Config:
         DB_SEARCH_PATH = None
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connections returned to the pool more recently than this are not pinged on checkout
+    DB_PING_IDLE_SECONDS = float(os.environ.get("DB_PING_IDLE_SECONDS", "30"))
+    # Adds X-DB-Pings / X-DB-Pings-Avoided response headers (always on in debug mode)
+    DB_HEALTH_HEADERS = os.environ.get("DB_HEALTH_HEADERS", "false").lower() == "true"
+    # Probes (app/utils/health.py): /readyz and /health serve deep checks refreshed every
+    # HEALTH_CHECK_INTERVAL seconds by a per-process thread (0 disables it); a result older
+    # than HEALTH_CHECK_MAX_AGE is re-checked by the probe. Schema drift job period; 0 disables it
+    HEALTH_CHECK_INTERVAL = float(os.environ.get("HEALTH_CHECK_INTERVAL", "15"))
+    HEALTH_CHECK_MAX_AGE = float(os.environ.get("HEALTH_CHECK_MAX_AGE", "60"))
+    HEALTH_SCHEMA_CHECK_INTERVAL = float(os.environ.get("HEALTH_SCHEMA_CHECK_INTERVAL", "3600"))
+    # Per-request query counts and N+1 detection (app/utils/query_stats.py): the
+    # fraction of requests instrumented, all of them in debug mode and 1% otherwise
+    # when unset; 0 turns the listeners off
+    QUERY_STATS_SAMPLE_RATE = float(os.environ["QUERY_STATS_SAMPLE_RATE"]) if os.environ.get("QUERY_STATS_SAMPLE_RATE") else None
+    # The same statement this many times in one request is logged as a probable N+1
+    QUERY_NPLUSONE_THRESHOLD = int(os.environ.get("QUERY_NPLUSONE_THRESHOLD", "5"))
+    # X-Query-Count / X-Query-Time-Ms / X-Query-Repeats / Server-Timing headers (always on in debug mode)
+    QUERY_STATS_HEADERS = os.environ.get("QUERY_STATS_HEADERS", "false").lower() == "true"
+    # {endpoint: max statements}; @query_budget(n) on a view does the same. Over budget is
+    # logged, or raises QueryBudgetExceeded when QUERY_BUDGET_STRICT is set (scripts, tests)
+    QUERY_BUDGETS = {}
+    QUERY_BUDGET_STRICT = os.environ.get("QUERY_BUDGET_STRICT", "false").lower() == "true"
+    # Prometheus /metrics (app/utils/metrics.py): per-worker snapshots in METRICS_DIR (defaults to
+    # instance/metrics, shared by the Gunicorn workers), written at most every METRICS_FLUSH_INTERVAL
+    # seconds. Without METRICS_TOKEN (Bearer) only local scrapes are answered
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_DIR = os.environ.get("METRICS_DIR")
+    METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+    # Local disk cache for images stored in the database (defaults to instance/media_cache)
+    MEDIA_CACHE_ENABLED = os.environ.get("MEDIA_CACHE_ENABLED", "true").lower() == "true"
+    MEDIA_CACHE_DIR = os.environ.get("MEDIA_CACHE_DIR")
+    MEDIA_CACHE_MAX_BYTES = int(os.environ.get("MEDIA_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    # How long a cached id -> hash mapping is trusted before revalidating against the DB
+    MEDIA_CACHE_REF_TTL = float(os.environ.get("MEDIA_CACHE_REF_TTL", "300"))
+    # Let the front proxy stream cached files (X-Sendfile) instead of the worker
+    USE_X_SENDFILE = os.environ.get("USE_X_SENDFILE", "false").lower() == "true"
+
+    # Responsive image derivatives built after upload (app/utils/image_variants.py)
+    IMAGE_VARIANTS_ENABLED = os.environ.get("IMAGE_VARIANTS_ENABLED", "true").lower() == "true"
+    IMAGE_VARIANT_WIDTHS = [int(w) for w in os.environ.get("IMAGE_VARIANT_WIDTHS", "320,640,1024").split(",") if w.strip()]
+    # Background threads per worker process; 0 builds variants inline during the upload
+    IMAGE_VARIANT_WORKERS = int(os.environ.get("IMAGE_VARIANT_WORKERS", "2"))
+
+    # Background job queue (app/services/job_queue.py). Set JOB_WORKER_THREADS=0 on
+    # web processes when running a dedicated `flask jobs worker`
+    JOB_WORKER_THREADS = int(os.environ.get("JOB_WORKER_THREADS", "1"))
+    JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "5"))
+    JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+    JOB_BACKOFF_BASE = float(os.environ.get("JOB_BACKOFF_BASE", "10"))
+    JOB_BACKOFF_MAX = float(os.environ.get("JOB_BACKOFF_MAX", "3600"))
+    # A job running longer than this is assumed abandoned and re-queued
+    JOB_LOCK_TIMEOUT = float(os.environ.get("JOB_LOCK_TIMEOUT", "300"))
+
+    # Sales rollups (app/services/rollups.py): how often the background job
+    # re-derives the last ROLLUP_CATCHUP_WINDOW hours from the orders; 0 disables it
+    ROLLUP_CATCHUP_INTERVAL = float(os.environ.get("ROLLUP_CATCHUP_INTERVAL", "900"))
+    ROLLUP_CATCHUP_WINDOW = int(os.environ.get("ROLLUP_CATCHUP_WINDOW", "48"))
+
+    # Stock reservations of unpaid orders (app/services/stock.py): how long
+    # checkout holds the stock (also the Stripe session lifetime, 30 min - 24 h)
+    # and how long after that the expiry job waits for a late webhook
+    STOCK_RESERVATION_TTL = int(os.environ.get("STOCK_RESERVATION_TTL", "3600"))
+    STOCK_RESERVATION_GRACE = int(os.environ.get("STOCK_RESERVATION_GRACE", "300"))
+
+    # Schemas, tables, legacy columns and the admin user are set up by
+    # `flask bootstrap run` once per deploy (app/services/bootstrap.py).
+    # Set to true to run it inside create_app instead (local development only)
+    DB_BOOTSTRAP_ON_STARTUP = os.environ.get("DB_BOOTSTRAP_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+
+    # Logged-in identity cached in the session (app/utils/identity.py)
+    IDENTITY_CACHE_TTL = int(os.environ.get("IDENTITY_CACHE_TTL", "300"))
+    IDENTITY_REVOCATION_DIR = os.environ.get("IDENTITY_REVOCATION_DIR")
+
+    # Translation catalogs (app/i18n.py): extra catalog directories (os.pathsep-separated),
+    # merged over app/translations, and the file written by `flask i18n compile`
+    I18N_CATALOG_DIRS = os.environ.get("I18N_CATALOG_DIRS", "")
+    I18N_COMPILED_CATALOG = os.environ.get("I18N_COMPILED_CATALOG")
+
+    # Product catalog (app/services/catalog.py)
+    CATALOG_PAGE_SIZE = int(os.environ.get("CATALOG_PAGE_SIZE", "24"))
+    CATALOG_SIDEBAR_TTL = float(os.environ.get("CATALOG_SIDEBAR_TTL", "300"))
+    # Rendered product cards and detail sections (app/utils/fragment_cache.py). A shared
+    # backend lets the workers reuse each other's fragments: "filesystem" (FRAGMENT_CACHE_DIR,
+    # defaults to instance/fragments) or "redis" (FRAGMENT_CACHE_REDIS_URL); empty = per process
+    FRAGMENT_CACHE_ENABLED = os.environ.get("FRAGMENT_CACHE_ENABLED", "true").lower() == "true"
+    FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", "2000"))
+    FRAGMENT_CACHE_TTL = int(os.environ.get("FRAGMENT_CACHE_TTL", "3600"))
+    FRAGMENT_CACHE_BACKEND = os.environ.get("FRAGMENT_CACHE_BACKEND", "")
+    FRAGMENT_CACHE_DIR = os.environ.get("FRAGMENT_CACHE_DIR")
+    FRAGMENT_CACHE_REDIS_URL = os.environ.get("FRAGMENT_CACHE_REDIS_URL")
+    # Part of every shared key; defaults to RENDER_GIT_COMMIT, so a deploy never serves old markup
+    FRAGMENT_CACHE_VERSION = os.environ.get("FRAGMENT_CACHE_VERSION")
+    # PostgreSQL text search configuration per site language (app/services/search.py)
+    SEARCH_LANGUAGE_CONFIGS = {'de': 'german', 'en': 'english', 'uk': 'simple'}
+
+    # Chat assistants (app/services/chat_engine.py)
+    CHAT_STREAMING = os.environ.get("CHAT_STREAMING", "true").lower() == "true"
+    CHAT_MODEL = os.environ.get("CHAT_MODEL", "gpt-4o-mini")
+    # Hard limit per chat turn; polled runs are cancelled when it is reached
+    CHAT_TURN_DEADLINE = float(os.environ.get("CHAT_TURN_DEADLINE", "60"))
+    CHAT_POLL_INITIAL = float(os.environ.get("CHAT_POLL_INITIAL", "0.25"))
+    CHAT_POLL_MAX = float(os.environ.get("CHAT_POLL_MAX", "2.0"))
+    # Answers to repeated first questions (app/services/chat_memory.py)
+    CHAT_CACHE_SIZE = int(os.environ.get("CHAT_CACHE_SIZE", "500"))
+    CHAT_CACHE_TTL = float(os.environ.get("CHAT_CACHE_TTL", "3600"))
+    # How long a visitor's Assistants thread is reused for follow-up questions
+    CHAT_THREAD_TTL = float(os.environ.get("CHAT_THREAD_TTL", "1800"))
+
+    # Voice messages (app/services/voice_pipeline.py); "stub" transcribes offline
+    VOICE_TRANSCRIBER = os.environ.get("VOICE_TRANSCRIBER", "openai")
+    VOICE_MODEL = os.environ.get("VOICE_MODEL", "whisper-1")
+    VOICE_STUB_TEXT = os.environ.get("VOICE_STUB_TEXT")
+    VOICE_STUB_DELAY = float(os.environ.get("VOICE_STUB_DELAY", "0"))
+    VOICE_JOB_DIR = os.environ.get("VOICE_JOB_DIR")
+    VOICE_MAX_BYTES = int(os.environ.get("VOICE_MAX_BYTES", str(25 * 1024 * 1024)))
+    # Longer recordings are split and the segments transcribed in parallel
+    VOICE_SEGMENT_SECONDS = float(os.environ.get("VOICE_SEGMENT_SECONDS", "60"))
+    VOICE_WORKERS = int(os.environ.get("VOICE_WORKERS", "4"))
+    VOICE_JOB_TIMEOUT = float(os.environ.get("VOICE_JOB_TIMEOUT", "300"))
+    VOICE_JOB_TTL = float(os.environ.get("VOICE_JOB_TTL", "3600"))
     
-    # Настройки сессии
-    SESSION_TYPE = 'filesystem'  # Используем файловую систему для хранения сессий
+    # Настройки сессии (app/utils/session_store.py): hybrid, sql, cookie или filesystem
+    SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "hybrid")
     SESSION_PERMANENT = True
     PERMANENT_SESSION_LIFETIME = 30 * 24 * 60 * 60  # 30 дней
+    # Unmodified sessions extend their expiry (row + cookie) at most this often
+    SESSION_REFRESH_INTERVAL = int(os.environ.get("SESSION_REFRESH_INTERVAL", str(24 * 60 * 60)))
+    SESSION_SWEEP_INTERVAL = float(os.environ.get("SESSION_SWEEP_INTERVAL", "600"))
+    SESSION_SWEEP_BATCH = int(os.environ.get("SESSION_SWEEP_BATCH", "1000"))
+    # hybrid: larger sessions move from the cookie to an http_sessions row
+    SESSION_COOKIE_MAX_BYTES = int(os.environ.get("SESSION_COOKIE_MAX_BYTES", "3800"))
+    # Only used by SESSION_BACKEND=filesystem (Flask-Session)
+    SESSION_TYPE = 'filesystem'
     SESSION_FILE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'flask_session')
     
     # Другие настройки приложения
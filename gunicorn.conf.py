@@ -5,6 +5,10 @@ import os
 # Number of worker processes
 workers = multiprocessing.cpu_count() * 2 + 1
 
+# Threaded workers: a streamed chat answer (SSE) holds one thread, not a whole process
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+
 # Maximum number of requests a worker will process before restarting
 max_requests = 1000
 max_requests_jitter = 50
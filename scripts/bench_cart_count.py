@@ -0,0 +1,49 @@
+"""
+Benchmark: queries and writes per anonymous page view caused by the cart badge.
+
+``legacy`` re-registers the old context processor (get_cart(create=True) on every
+render); ``lazy`` is the current LazyCartCount. Each view uses a fresh client,
+like a crawler that never keeps cookies.
+
+Usage: python scripts/bench_cart_count.py [views]
+"""
+import sys
+import time
+
+from bench_support import StatementCounter, make_app
+
+
+def run(mode, n):
+    app = make_app()
+    from app.models.database import db
+
+    if mode == 'legacy':
+        @app.context_processor
+        def inject_cart_count_legacy():
+            from app.routes.shop import get_cart
+            cart = get_cart(create=True)
+            return {'cart_count': sum(item.quantity for item in cart.items)}
+
+    with app.app_context():
+        counter = StatementCounter(db.get_engine())
+        from app.models.shop import Cart
+        start_rows = Cart.query.count()
+
+    counter.reset()
+    start = time.perf_counter()
+    for _ in range(n):
+        app.test_client().get('/privacy')
+    elapsed = time.perf_counter() - start
+    counter.enabled = False
+
+    with app.app_context():
+        rows = Cart.query.count() - start_rows
+    print(f"{mode:7s} {n} views  {counter.statements / n:.2f} queries/view  "
+          f"{counter.writes / n:.2f} writes/view  {rows} cart rows created  "
+          f"{elapsed / n * 1000:.2f} ms/view")
+
+
+if __name__ == '__main__':
+    views = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    run('legacy', views)
+    run('lazy', views)
@@ -0,0 +1,131 @@
+"""
+Benchmark: catalog queries with image bytes in the rows vs in media_blobs.
+
+Fills categories and products whose images are ``image_kb`` each, then
+copies the same bytes into the legacy ``categories.image_data`` /
+``product_images.data`` columns. The "legacy" runs select those columns
+together with the entity, which is what the old mapping loaded for every
+row; the "blobs" runs use the current mapping. Each run starts with an
+empty session (after one warm-up call) and reports the tracemalloc peak and
+the median latency.
+
+Scenarios: the admin category list (``Category.query.all()``), a product
+gallery (``product.gallery_images``) and, for the current layout only, the
+public listing and product pages over HTTP. Exits with status 1 if a
+current-layout run still allocates a whole image.
+
+Usage: python scripts/bench_catalog_blobs.py [categories] [images_per_product] [image_kb]
+"""
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from sqlalchemy import text
+
+from bench_support import make_app
+
+REPEAT = 5
+
+
+def populate(app, categories, images, size):
+    from app.models.database import db
+    from app.models.product import Category, Product, ProductImage
+    with app.app_context():
+        rows = []
+        for index in range(categories):
+            category = Category(name=f'Category {index}', slug=f'category-{index}',
+                                image_content_type='image/png', image_filename=f'c{index}.png')
+            category.image_data = os.urandom(size)
+            rows.append(category)
+        db.session.add_all(rows)
+        db.session.flush()
+        product = Product(name='Gallery', slug='gallery', price=10, category_id=rows[0].id, is_active=True)
+        product.gallery_images = [ProductImage(data=os.urandom(size), filename=f'g{index}.png',
+                                               content_type='image/png', sort_order=index)
+                                  for index in range(images)]
+        db.session.add(product)
+        db.session.commit()
+
+        # Legacy layout: the same bytes inline in the owner rows
+        db.session.execute(text("ALTER TABLE categories ADD COLUMN image_data BLOB"))
+        db.session.execute(text("ALTER TABLE product_images ADD COLUMN data BLOB"))
+        db.session.execute(text("UPDATE categories SET image_data = "
+                                "(SELECT data FROM media_blobs WHERE media_blobs.id = categories.image_blob_id)"))
+        db.session.execute(text("UPDATE product_images SET data = "
+                                "(SELECT data FROM media_blobs WHERE media_blobs.id = product_images.blob_id)"))
+        db.session.commit()
+        return product.id, product.slug
+
+
+def measure(app, func):
+    """(peak bytes, median ms) of ``func`` over REPEAT runs, each with a fresh session."""
+    from app.models.database import db
+    peaks, timings = [], []
+    with app.app_context():
+        func()  # warm-up: template compilation and statement caches are not what we measure
+        for _ in range(REPEAT):
+            db.session.remove()
+            tracemalloc.start()
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    return max(peaks), statistics.median(timings)
+
+
+if __name__ == '__main__':
+    category_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    image_count = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    image_kb = int(sys.argv[3]) if len(sys.argv) > 3 else 512
+    os.environ.setdefault('JOB_WORKER_THREADS', '0')
+    bench_app = make_app()
+    bench_app.config['ROLLUP_CATCHUP_INTERVAL'] = 0
+    bench_app.extensions.pop('media_cache', None)
+    product_id, slug = populate(bench_app, category_count, image_count, image_kb * 1024)
+
+    from sqlalchemy import LargeBinary, column
+    from app.models.database import db
+    from app.models.product import Category, Product, ProductImage
+
+    def legacy_categories():
+        return db.session.query(Category, column('image_data', LargeBinary)).all()
+
+    def blob_categories():
+        return Category.query.all()
+
+    def legacy_gallery():
+        return db.session.query(ProductImage, column('data', LargeBinary)).filter(
+            ProductImage.product_id == product_id).all()
+
+    def blob_gallery():
+        return db.session.get(Product, product_id).gallery_images
+
+    client = bench_app.test_client()
+
+    def page(path):
+        def get():
+            response = client.get(path)
+            assert response.status_code == 200, (path, response.status_code)
+        return get
+
+    scenarios = [
+        (f'category list ({category_count})', legacy_categories, blob_categories),
+        (f'product gallery ({image_count})', legacy_gallery, blob_gallery),
+        ('GET /shop/products', None, page('/shop/products')),
+        (f'GET /shop/product/{slug}', None, page(f'/shop/product/{slug}')),
+    ]
+    problems = []
+    print(f"{image_kb} KB per image")
+    print(f"{'scenario':28s} {'legacy peak':>12s} {'legacy ms':>10s} {'blobs peak':>11s} {'blobs ms':>9s}")
+    for label, legacy, current in scenarios:
+        old_peak, old_ms = measure(bench_app, legacy) if legacy else (None, None)
+        new_peak, new_ms = measure(bench_app, current)
+        old = f"{old_peak / 1024:9.0f} KB {old_ms:9.2f}" if legacy else f"{'-':>12s} {'-':>10s}"
+        print(f"{label:28s} {old} {new_peak / 1024:8.0f} KB {new_ms:9.2f}")
+        if new_peak >= image_kb * 1024:
+            problems.append(f"{label}: {new_peak // 1024} KB peak, image bytes still loaded")
+    print("PASS" if not problems else "FAIL:\n  " + "\n  ".join(problems))
+    sys.exit(1 if problems else 0)
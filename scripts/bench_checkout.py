@@ -0,0 +1,130 @@
+"""
+Benchmark: statements and latency of ``POST /shop/checkout`` by cart size.
+
+Fills a guest cart with 1, 10 and 50 different products and posts the real
+checkout form through the test client, with ``stripe.checkout.Session.create``
+replaced by a stub so nothing leaves the machine. That the statement count
+stays flat is asserted by tests/test_checkout.py; this script reports the
+counts and timings.
+
+For comparison it also times the per-item ORM loop checkout used before
+(``OrderItem`` objects added one by one, ``item.product`` loaded lazily).
+
+Usage: python scripts/bench_checkout.py [repeats]
+"""
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+from bench_support import StatementCounter, make_app
+
+CART_SIZES = (1, 10, 50)
+
+
+def populate(app):
+    from app.models.database import db
+    from app.models.product import Product
+    with app.app_context():
+        products = [Product(name=f'Service {index}', slug=f'service-{index}', price=40 + index,
+                            short_description='Benchmark service')
+                    for index in range(max(CART_SIZES))]
+        db.session.add_all(products)
+        db.session.commit()
+        return [product.id for product in products]
+
+
+def fill_cart(product_ids, size, number):
+    from app.models.database import db
+    from app.models.shop import Cart, CartItem
+    cart = Cart(session_id=f'bench-{number}', status='open')
+    cart.items = [CartItem(product_id=product_id, quantity=1 + index % 3, price=40 + index)
+                  for index, product_id in enumerate(product_ids[:size])]
+    db.session.add(cart)
+    db.session.commit()
+    return cart.id
+
+
+def fake_stripe_session(**params):
+    fake_stripe_session.calls.append(params)
+    number = len(fake_stripe_session.calls)
+    return SimpleNamespace(id=f'cs_test_bench{number}', url=f'https://checkout.stripe.test/{number}')
+
+
+fake_stripe_session.calls = []
+
+
+def post_checkout(app, counter, product_ids, size, number):
+    with app.app_context():
+        cart_id = fill_cart(product_ids, size, number)
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['cart_id'] = cart_id
+    counter.reset()
+    start = time.perf_counter()
+    response = client.post('/shop/checkout', data={
+        'email': 'bench@example.com', 'first_name': 'Bench', 'last_name': 'Mark'})
+    elapsed = (time.perf_counter() - start) * 1000
+    if response.status_code != 302 or 'checkout.stripe.test' not in response.headers.get('Location', ''):
+        raise RuntimeError(f"checkout of {size} items did not reach Stripe: {response.status_code}")
+    return counter.statements, counter.writes, elapsed
+
+
+def legacy_materialize(app, counter, product_ids, size, number):
+    # The loop shop.checkout ran before app/services/checkout.py
+    from app.models.database import db
+    from app.models.order import Order, OrderItem
+    from app.models.shop import Cart
+    with app.app_context():
+        cart = db.session.get(Cart, fill_cart(product_ids, size, number))
+        db.session.expire_all()
+        counter.reset()
+        start = time.perf_counter()
+        order = Order(order_number=f'L{size}-{number}', first_name='Bench', last_name='Mark',
+                      email='bench@example.com', payment_method='stripe',
+                      subtotal=cart.subtotal, total=cart.subtotal)
+        db.session.add(order)
+        db.session.flush()
+        for item in cart.items:
+            db.session.add(OrderItem(
+                order_id=order.id, product_id=item.product_id, product_name=item.product.name,
+                product_slug=item.product.slug, product_duration=getattr(item.product, 'duration', None),
+                price_per_unit=item.price, quantity=item.quantity, total_price=item.subtotal,
+                project_stage_id=item.project_stage_id, billed_hours=0))
+        # The Stripe line items walked cart.items a second time
+        line_items = [{'name': item.product.name, 'description': item.product.short_description,
+                       'unit_amount': int(item.price * 100), 'quantity': item.quantity} for item in cart.items]
+        db.session.commit()
+        return counter.statements, counter.writes, (time.perf_counter() - start) * 1000
+
+
+def run(label, func, app, counter, product_ids, repeats):
+    print(f"{label}:")
+    for size in CART_SIZES:
+        results = [func(app, counter, product_ids, size, f'{func.__name__}-{size}-{number}')
+                   for number in range(repeats)]
+        statements, writes, _ = results[-1]
+        print(f"  {size:3d} items  {statements:4d} statements ({writes:3d} writes)  "
+              f"median {statistics.median(result[2] for result in results):8.2f} ms")
+
+
+if __name__ == '__main__':
+    repeat_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    os.environ.setdefault('JOB_WORKER_THREADS', '0')
+    bench_app = make_app()
+    bench_app.config['ROLLUP_CATCHUP_INTERVAL'] = 0
+    bench_app.config['STRIPE_SECRET_KEY'] = 'sk_test_bench'
+    bench_app.config['STRIPE_TEST_PRICE_ID'] = None
+    ids = populate(bench_app)
+
+    import stripe
+    stripe.checkout.Session.create = fake_stripe_session
+
+    from app.models.database import db
+    with bench_app.app_context():
+        statement_counter = StatementCounter(db.engine)
+    run('POST /shop/checkout (snapshot + executemany)', post_checkout,
+        bench_app, statement_counter, ids, repeat_count)
+    run('legacy per-item ORM materialization (order + items only)', legacy_materialize,
+        bench_app, statement_counter, ids, repeat_count)
@@ -0,0 +1,93 @@
+"""
+Benchmark: legacy per-request ``SELECT 1`` hooks vs. idle-aware DBHealthMonitor.
+
+Builds a tiny Flask app against BENCH_DATABASE_URI (defaults to a temp SQLite
+file; point it at a local Postgres for realistic round-trip cost) and replays
+N requests to a page that does one real query, counting statements per request.
+
+Usage: python scripts/bench_db_health.py [requests]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, text
+
+from app.utils.db_health import init_db_health
+
+
+def build_app(mode, uri):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['DB_PING_IDLE_SECONDS'] = 30
+    db = SQLAlchemy(app)
+    counter = {'statements': 0}
+
+    with app.app_context():
+        engine = db.get_engine()
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _count(conn, cursor, statement, params, context, executemany):
+            counter['statements'] += 1
+
+    if mode == 'legacy':
+        @app.before_request
+        def ensure_db_session_clean():
+            db.session.execute(text('SELECT 1'))
+
+        def cart_lookup():
+            # Old get_cart(): rollback + SELECT 1, called by the view and the context processor
+            db.session.rollback()
+            db.session.execute(text('SELECT 1'))
+    else:
+        init_db_health(app, db)
+
+        def cart_lookup():
+            pass
+
+    @app.route('/page')
+    def page():
+        cart_lookup()
+        db.session.execute(text('SELECT 1 AS real_query'))
+        cart_lookup()
+        return 'ok'
+
+    @app.teardown_request
+    def cleanup(exc):
+        db.session.remove()
+
+    return app, counter
+
+
+def run(mode, uri, n):
+    app, counter = build_app(mode, uri)
+    client = app.test_client()
+    client.get('/page')  # warm the pool
+    counter['statements'] = 0
+    start = time.perf_counter()
+    for _ in range(n):
+        client.get('/page')
+    elapsed = time.perf_counter() - start
+    stats = ''
+    monitor = app.extensions.get('db_health')
+    if monitor:
+        snap = monitor.snapshot()
+        stats = f" pings={snap['pings']} pings_avoided={snap['pings_avoided']}"
+    print(f"{mode:8s} {n} req  {counter['statements'] / n:.2f} stmt/req  "
+          f"{elapsed / n * 1000:.3f} ms/req{stats}")
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    uri = os.environ.get('BENCH_DATABASE_URI')
+    if not uri:
+        uri = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    print(f"Database: {uri.split('@')[-1]}")
+    run('legacy', uri, n)
+    run('monitor', uri, n)
@@ -0,0 +1,82 @@
+"""
+Benchmark for the template fragment cache (app/utils/fragment_cache.py).
+
+Renders the product listing and a product page with the fragment cache off
+and on and reports the median latency and statements per request. That the
+cached pages follow writes is checked by tests/test_fragment_cache.py.
+
+Usage: python scripts/bench_fragment_cache.py [products] [requests]
+"""
+import os
+import statistics
+import sys
+import time
+
+from bench_support import StatementCounter, make_app
+
+
+def populate(app, count):
+    from app.models.database import db
+    from app.models.product import Category, Product, ProductReview
+    with app.app_context():
+        category = Category(name='Workshops', slug='workshops')
+        db.session.add(category)
+        db.session.flush()
+        products = [Product(name=f'Workshop {index}', slug=f'workshop-{index}', price=50 + index,
+                            short_description=f'Hands-on session {index}', description='<p>Agenda</p>' * 20,
+                            duration=60, category_id=category.id, is_active=True)
+                    for index in range(count)]
+        db.session.add_all(products)
+        db.session.flush()
+        # Two products alone in a category: each is the other's only related product
+        pair = Category(name='Pairs', slug='pairs')
+        db.session.add(pair)
+        db.session.flush()
+        db.session.add_all([Product(name=f'Duo {letter}', slug=f'duo-{letter}', price=40,
+                                    category_id=pair.id, is_active=True) for letter in 'ab'])
+        for product in products[:5]:
+            product.reviews = [ProductReview(author_name=f'Reviewer {index}', author_email='r@example.com',
+                                             rating=4, content='Useful', is_approved=True)
+                               for index in range(6)]
+        db.session.commit()
+        return products[0].id, products[0].slug, category.id
+
+
+def timed(client, counter, path, n):
+    """(median ms, statements per request) for ``n`` GETs of ``path``."""
+    timings = []
+    counter.reset()
+    for _ in range(n):
+        start = time.perf_counter()
+        response = client.get(path)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, (path, response.status_code)
+    return statistics.median(timings), counter.statements / n
+
+
+if __name__ == '__main__':
+    product_count = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    requests_n = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    os.environ.setdefault('JOB_WORKER_THREADS', '0')
+    bench_app = make_app()
+    bench_app.config['ROLLUP_CATCHUP_INTERVAL'] = 0
+    _, slug, _ = populate(bench_app, product_count)
+
+    from app.models.database import db
+    from app.utils.fragment_cache import get_fragment_cache
+    cache = get_fragment_cache(bench_app)
+    client = bench_app.test_client()
+    pages = [('/shop/products', 'listing'), (f'/shop/product/{slug}', 'product page')]
+
+    with bench_app.app_context():
+        counter = StatementCounter(db.get_engine())
+    print(f"{product_count} products, {requests_n} requests per page")
+    for path, label in pages:
+        bench_app.extensions.pop('fragment_cache')
+        uncached, uncached_statements = timed(client, counter, path, requests_n)
+        bench_app.extensions['fragment_cache'] = cache
+        client.get(path)
+        cached, cached_statements = timed(client, counter, path, requests_n)
+        print(f"  {label:13s} uncached {uncached:6.2f} ms {uncached_statements:4.1f} stmt  "
+              f"cached {cached:6.2f} ms {cached_statements:4.1f} stmt  ({uncached / cached:.1f}x)")
+    print(f"stats: {cache.snapshot()}")
@@ -0,0 +1,59 @@
+"""
+Benchmark for the split health probes (app/utils/health.py).
+
+Counts the statements behind ``/livez``, ``/readyz`` and ``/health`` and
+times them against running the deep checks on every probe, which is what
+the old ``/health`` did. The probe behaviour (stale re-checks, schema drift,
+an unreachable database, the refresh thread) is checked by
+tests/test_health.py.
+
+Usage: python scripts/bench_health_probes.py [probes]
+"""
+import os
+import statistics
+import sys
+import time
+
+from bench_support import StatementCounter, make_app
+
+
+def probe(client, counter, path, n):
+    """(median ms, statements per probe, last response) for ``n`` GETs of ``path``."""
+    timings = []
+    counter.reset()
+    for _ in range(n):
+        start = time.perf_counter()
+        response = client.get(path)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), counter.statements / n, response
+
+
+if __name__ == '__main__':
+    probes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    os.environ.setdefault('JOB_WORKER_THREADS', '0')
+    # Measure the cached path only; no refresh thread
+    os.environ['HEALTH_CHECK_INTERVAL'] = '0'
+    bench_app = make_app()
+    bench_app.config['ROLLUP_CATCHUP_INTERVAL'] = 0
+
+    from app.models.database import db
+    from app.utils.health import get_health_checker
+    checker = get_health_checker(bench_app)
+    client = bench_app.test_client()
+    with bench_app.app_context():
+        counter = StatementCounter(db.get_engine())
+
+    # The old /health: every probe ran the deep checks
+    print(f"{probes} probes each")
+    counter.reset()
+    timings = []
+    for _ in range(probes):
+        start = time.perf_counter()
+        checker.run_checks()
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"  {'deep checks per probe (old /health)':36s} {statistics.median(timings):6.3f} ms "
+          f"{counter.statements / probes:4.1f} stmt")
+    client.get('/readyz')
+    for path in ('/livez', '/readyz', '/health'):
+        ms, statements, response = probe(client, counter, path, probes)
+        print(f"  {'GET ' + path:36s} {ms:6.3f} ms {statements:4.1f} stmt  -> {response.status_code}")
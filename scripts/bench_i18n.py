@@ -0,0 +1,115 @@
+"""
+Microbenchmark: compiled i18n tables vs the old per-call translation dicts.
+
+The old ``get_shop_text`` / ``get_page_text`` built their whole
+``translations`` dict literal on every call, and ``i18n.translate`` looked
+the key up in a nested dict and applied the fallbacks each time. This script
+rebuilds those functions from the JSON catalogs (same literal, same lookup)
+and times them against the current helpers and the per-request ``t`` bound
+by the context processor.
+
+It also checks that every key gives the same text in every language as
+before. A catalog compiled with ``flask i18n compile`` (JSON, and msgpack
+when installed) must load into the same tables. Exits with status 1 on a
+mismatch.
+
+Usage: python scripts/bench_i18n.py [calls]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+from bench_support import make_app
+
+LEGACY_TEMPLATE = '''
+def legacy(key, lang=None):
+    if lang is None:
+        lang = session.get("lang", "de")
+    translations = {literal}
+    return translations.get(key, {{}}).get(lang, translations.get(key, {{}}).get('en', key))
+'''
+
+
+def legacy_lookup(messages):
+    """The old get_shop_text: the dict literal is rebuilt on every call."""
+    from flask import session
+    namespace = {'session': session}
+    exec(LEGACY_TEMPLATE.format(literal=repr(messages)), namespace)
+    return namespace['legacy']
+
+
+def legacy_translate(messages, default_lang='de'):
+    """The old i18n.translate over a module-level nested dict."""
+    from flask import session
+
+    def translate(key, lang=None):
+        if lang is None:
+            lang = session.get('lang', default_lang)
+        entry = messages.get(key)
+        if not entry:
+            return key
+        return entry.get(lang) or entry.get(default_lang) or next(iter(entry.values()))
+    return translate
+
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    os.environ.setdefault('JOB_WORKER_THREADS', '0')
+    bench_app = make_app()
+    from flask import render_template_string, session
+    from app import i18n
+    from app.routes.pages import get_page_text
+    from app.routes.shop import get_shop_text
+
+    catalogs = i18n.load_catalogs([i18n.CATALOG_DIR])
+    old_shop = legacy_lookup(catalogs['shop']['messages'])
+    old_pages = legacy_lookup(catalogs['pages']['messages'])
+    old_translate = legacy_translate(catalogs['common']['messages'])
+
+    problems = []
+    with bench_app.test_request_context('/'):
+        for lang in i18n.SUPPORTED_LANGS:
+            session['lang'] = lang
+            pairs = [(f'shop.{key}', old_shop(key), get_shop_text(key)) for key in catalogs['shop']['messages']]
+            pairs += [(f'pages.{key}', old_pages(key), get_page_text(key)) for key in catalogs['pages']['messages']]
+            pairs += [(key, old_translate(key), i18n.translate(key)) for key in catalogs['common']['messages']]
+            pairs += [('unknown', old_shop('no_such_key'), get_shop_text('no_such_key'))]
+            problems += [f"{lang} {key}: {old!r} != {new!r}" for key, old, new in pairs if old != new]
+            rendered = render_template_string("{{ t('cart') }}|{{ t('no_such_key') }}")
+            if rendered != f"{old_translate('cart')}|no_such_key":
+                problems.append(f"{lang} template t(): {rendered!r}")
+
+        session['lang'] = 'uk'
+        bound_t = i18n.message_table('uk').__getitem__
+        cases = [
+            ('get_shop_text', lambda: old_shop('insufficient_stock'), lambda: get_shop_text('insufficient_stock')),
+            ('get_page_text', lambda: old_pages('send_error'), lambda: get_page_text('send_error')),
+            ('translate', lambda: old_translate('checkout'), lambda: i18n.translate('checkout')),
+            ('template t()', lambda: old_translate('checkout'), lambda: bound_t('checkout')),
+        ]
+        print(f"{calls} calls each, ns per call")
+        print(f"{'function':15s} {'before':>9s} {'after':>9s}")
+        for label, before, after in cases:
+            old_ns = min(timeit.repeat(before, number=calls, repeat=3)) / calls * 1e9
+            new_ns = min(timeit.repeat(after, number=calls, repeat=3)) / calls * 1e9
+            print(f"{label:15s} {old_ns:9.0f} {new_ns:9.0f}  ({old_ns / new_ns:.1f}x)")
+
+    # Precompiled catalog files load into the same tables
+    expected = i18n.load_tables()
+    formats = ['json']
+    try:
+        import msgpack  # noqa: F401
+        formats.append('msgpack')
+    except ImportError:
+        print("msgpack not installed: JSON compiled catalog only")
+    for extension in formats:
+        path = os.path.join(tempfile.mkdtemp(prefix='i18n-'), f'messages.{extension}')
+        result = bench_app.test_cli_runner().invoke(args=['i18n', 'compile', '--output', path])
+        print(result.output.splitlines()[0] if result.output else result.exception)
+        loaded = i18n.load_tables({'I18N_COMPILED_CATALOG': path})
+        if loaded != expected:
+            problems.append(f"compiled {extension} catalog differs")
+
+    print("PASS" if not problems else "FAIL:\n  " + "\n  ".join(problems))
+    sys.exit(1 if problems else 0)
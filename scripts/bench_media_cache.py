@@ -0,0 +1,79 @@
+"""
+Benchmark: serving a DB-stored product image with and without the disk cache.
+
+Stores one image of the given size, then requests it repeatedly (no
+conditional headers, like a client with an empty cache) and reports DB
+statements, pool checkouts and latency per request plus the cache stats.
+
+Usage: python scripts/bench_media_cache.py [requests] [image_kb]
+"""
+import os
+import sys
+import time
+
+from sqlalchemy import event
+
+from bench_support import StatementCounter, make_app
+
+
+def setup(size):
+    app = make_app()
+    from app.models.database import db
+    from app.models.product import Category, Product, ProductImage
+
+    with app.app_context():
+        category = Category(name='Bench', slug='bench')
+        db.session.add(category)
+        db.session.flush()
+        product = Product(name='Bench', slug='bench', price=1, category_id=category.id)
+        db.session.add(product)
+        db.session.flush()
+        image = ProductImage(product_id=product.id, data=os.urandom(size),
+                             filename='bench.png', content_type='image/png')
+        db.session.add(image)
+        db.session.commit()
+        image_id = image.id
+        engine = db.get_engine()
+    return app, engine, image_id
+
+
+def run(app, engine, image_id, cache, n):
+    from app.utils.media_cache import get_media_cache
+
+    if cache is None:
+        app.extensions.pop('media_cache', None)
+    else:
+        app.extensions['media_cache'] = cache
+    counter = StatementCounter(engine)
+    checkouts = {'count': 0}
+
+    def _count_checkout(dbapi_conn, conn_record, conn_proxy):
+        checkouts['count'] += 1
+
+    event.listen(engine, 'checkout', _count_checkout)
+    client = app.test_client()
+    client.get(f'/media/image/{image_id}')  # fill
+    counter.reset()
+    checkouts['count'] = 0
+    start = time.perf_counter()
+    for _ in range(n):
+        client.get(f'/media/image/{image_id}')
+    elapsed = time.perf_counter() - start
+    counter.enabled = False
+    event.remove(engine, 'checkout', _count_checkout)
+
+    label = 'cache' if cache is not None else 'db-only'
+    print(f"{label:8s} {n} req  {counter.statements / n:.2f} stmt/req  "
+          f"{checkouts['count'] / n:.2f} checkouts/req  {elapsed / n * 1000:.3f} ms/req")
+    if cache is not None:
+        snap = get_media_cache(app).snapshot()
+        print(f"         hit_ratio={snap['hit_ratio']} bytes_served={snap['bytes_served']}")
+
+
+if __name__ == '__main__':
+    requests_n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    image_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+    bench_app, bench_engine, bench_image_id = setup(image_kb * 1024)
+    media_cache = bench_app.extensions.get('media_cache')
+    run(bench_app, bench_engine, bench_image_id, None, requests_n)
+    run(bench_app, bench_engine, bench_image_id, media_cache, requests_n)
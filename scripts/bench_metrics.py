@@ -0,0 +1,41 @@
+"""
+Benchmark for the Prometheus metrics (app/utils/metrics.py).
+
+Times recording one request in the registry, which every request pays, and
+a ``/metrics`` scrape. What the scrape reports (per-endpoint counts and
+histograms, DB time, image bytes, outbound calls, workers sharing
+``METRICS_DIR``, the access rules) is checked by tests/test_metrics.py.
+
+Usage: python scripts/bench_metrics.py [calls] [scrapes]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from bench_support import make_app
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    scrapes = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    os.environ.setdefault('JOB_WORKER_THREADS', '0')
+    os.environ['HEALTH_CHECK_INTERVAL'] = '0'
+    os.environ.setdefault('METRICS_DIR', tempfile.mkdtemp(prefix='metrics-'))
+    bench_app = make_app()
+    bench_app.config['ROLLUP_CATCHUP_INTERVAL'] = 0
+
+    from app.utils.metrics import get_registry
+    registry = get_registry()
+    start = time.perf_counter()
+    for _ in range(calls):
+        registry.record_request('shop', 'shop.products', 'GET', '200', 0.012)
+    print(f"recording cost: {(time.perf_counter() - start) / calls * 1e6:.2f} us per request")
+
+    client = bench_app.test_client()
+    timings = []
+    for _ in range(scrapes):
+        start = time.perf_counter()
+        client.get('/metrics')
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"scrape: {statistics.median(timings):.2f} ms median over {scrapes}")
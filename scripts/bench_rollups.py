@@ -0,0 +1,150 @@
+"""
+Benchmark: admin dashboard statistics, live aggregates vs sales rollups.
+
+Generates N synthetic orders (default 1 000 000, one item each, spread over
+two years) in a throwaway SQLite database, builds the rollups with
+``rollups.rebuild`` and times the dashboard queries both ways: the COUNT/SUM
+and GROUP BY queries the dashboards used to run, and the rollup reads they run
+now. Also reports the cost of one checkout-style ORM insert with the
+incremental rollup events attached.
+
+Usage: python scripts/bench_rollups.py [orders] [repeats]
+"""
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bench_support import StatementCounter, make_app
+
+ORDER_STATUSES = ['pending', 'processing', 'completed', 'cancelled']
+PAYMENT_STATUSES = ['pending', 'paid', 'paid', 'paid', 'failed']
+
+
+def populate(app, count):
+    from app.models.database import db
+    from app.models.order import Order, OrderItem
+    from app.models.product import Product
+
+    rnd = random.Random(7)
+    now = datetime.utcnow()
+    with app.app_context():
+        products = [Product(name=f'Service {index}', price=50 + index) for index in range(50)]
+        db.session.add_all(products)
+        db.session.commit()
+        product_ids = [product.id for product in products]
+        orders, items = [], []
+        for index in range(1, count + 1):
+            total = float(rnd.randint(20, 900))
+            orders.append({
+                'id': index, 'order_number': f'B{index:08d}', 'first_name': 'Bench', 'last_name': 'Mark',
+                'email': 'bench@example.com', 'payment_method': 'stripe',
+                'order_status': rnd.choice(ORDER_STATUSES), 'payment_status': rnd.choice(PAYMENT_STATUSES),
+                'subtotal': total, 'total': total,
+                'created_at': now - timedelta(seconds=rnd.randint(0, 2 * 365 * 86400)),
+            })
+            items.append({
+                'order_id': index, 'product_id': rnd.choice(product_ids), 'product_name': 'Service',
+                'price_per_unit': total, 'quantity': rnd.randint(1, 3), 'total_price': total,
+            })
+            if len(orders) == 20000:
+                db.session.execute(Order.__table__.insert(), orders)
+                db.session.execute(OrderItem.__table__.insert(), items)
+                orders, items = [], []
+        if orders:
+            db.session.execute(Order.__table__.insert(), orders)
+            db.session.execute(OrderItem.__table__.insert(), items)
+        db.session.commit()
+
+
+def timed(label, repeats, func):
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    print(f"  {label:34s} median {statistics.median(durations):9.2f} ms   max {max(durations):9.2f} ms")
+
+
+def live_dashboard():
+    # What admin_shop.dashboard + admin.dashboard + dashboard_sales ran before
+    from app.models.database import db
+    from app.models.order import Order, OrderItem
+    from app.models.product import Product
+    Order.query.count()
+    Order.query.filter_by(order_status='completed').count()
+    Order.query.filter_by(order_status='pending').count()
+    Order.query.filter_by(payment_status='pending').count()
+    db.session.query(db.func.sum(Order.total)).filter(Order.payment_status == 'paid').scalar()
+    (db.session.query(Product, db.func.sum(OrderItem.quantity).label('total_quantity'))
+     .join(OrderItem, OrderItem.product_id == Product.id).group_by(Product.id)
+     .order_by(db.desc('total_quantity')).limit(5).all())
+    start = datetime.utcnow().date() - timedelta(days=30)
+    (db.session.query(db.func.date(Order.created_at), db.func.sum(Order.total))
+     .filter(Order.created_at >= start, Order.payment_status == 'paid')
+     .group_by(db.func.date(Order.created_at)).all())
+
+
+def rollup_dashboard():
+    from app.services import rollups
+    rollups.order_summary()
+    rollups.top_products(5)
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    rollups.paid_sales(today - timedelta(days=30), today + timedelta(days=1))
+
+
+def checkout_insert(app, repeats):
+    from app.models.database import db
+    from app.models.order import Order, OrderItem
+
+    with app.app_context():
+        counter = StatementCounter(db.engine)
+        durations = []
+        for index in range(repeats):
+            counter.reset()
+            start = time.perf_counter()
+            order = Order(order_number=f'N{index:06d}', first_name='New', last_name='Order',
+                          email='new@example.com', payment_method='stripe', subtotal=99, total=99)
+            order.items.append(OrderItem(product_id=1, product_name='Service', price_per_unit=99,
+                                         quantity=1, total_price=99))
+            db.session.add(order)
+            db.session.commit()
+            durations.append((time.perf_counter() - start) * 1000)
+        print(f"  {'ORM checkout insert + rollup events':34s} median {statistics.median(durations):9.2f} ms   "
+              f"({counter.statements} statements)")
+
+
+if __name__ == '__main__':
+    order_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    repeat_count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    bench_app = make_app()
+    bench_app.config['ROLLUP_CATCHUP_INTERVAL'] = 0
+
+    start = time.perf_counter()
+    populate(bench_app, order_count)
+    print(f"Inserted {order_count} orders in {time.perf_counter() - start:.1f}s")
+
+    from app.models.database import db
+    from app.services import rollups
+    with bench_app.app_context():
+        start = time.perf_counter()
+        with db.engine.begin() as conn:
+            order_cells, product_cells = rollups.rebuild(conn)
+        print(f"Full rollup rebuild: {order_cells} order cells, {product_cells} product cells "
+              f"in {time.perf_counter() - start:.1f}s")
+        start = time.perf_counter()
+        with db.engine.begin() as conn:
+            window = rollups.catch_up(conn, 48)
+        print(f"48h catch-up ({window[0]} order cells) in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        print("dashboard statistics:")
+        timed('live COUNT/SUM/GROUP BY', repeat_count, live_dashboard)
+        timed('rollups', repeat_count, rollup_dashboard)
+    checkout_insert(bench_app, 20)
+
+    with bench_app.app_context():
+        start = time.perf_counter()
+        with db.engine.begin() as conn:
+            mismatches = rollups.check(conn)
+        print(f"Consistency check: {len(mismatches)} mismatches in {time.perf_counter() - start:.1f}s")
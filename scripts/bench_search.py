@@ -0,0 +1,105 @@
+"""
+Benchmark: product search over a synthetic catalog, ILIKE vs full-text index.
+
+Generates N products (default 100 000) with random names/descriptions in a
+throwaway SQLite database, then times the same queries through the ILIKE
+fallback (what admin_shop.products used to do) and through the FTS5 index
+built by ``flask search reindex``. On PostgreSQL (BENCH_DATABASE_URI) run
+``alembic upgrade head`` first; the script then measures the GIN-backed
+tsvector search instead of FTS5.
+
+Usage: python scripts/bench_search.py [products] [repeats]
+"""
+import random
+import statistics
+import sys
+import time
+
+from bench_support import make_app
+
+WORDS = ('consulting website audit design marketing seo strategy cloud server backup '
+         'security training workshop beratung webseite sicherheit schulung analyse '
+         'консультація сайт аудит дизайн навчання стратегія').split()
+# Filler vocabulary keeps the real words selective, as in a real catalog
+FILLER = [f'item{n}' for n in range(2000)]
+QUERIES = [('consulting', 'en'), ('security training', 'en'), ('beratung', 'de'),
+           ('schul', 'de'), ('аудит', 'uk'), ('SKU-0042', 'en')]
+
+
+def populate(app, count):
+    from app.models.database import db
+    from app.models.product import Category, Product
+
+    rnd = random.Random(42)
+    with app.app_context():
+        categories = [Category(name=f'{word.title()} Services', slug=f'cat-{word}') for word in WORDS[:10]]
+        db.session.add_all(categories)
+        db.session.flush()
+        category_ids = [category.id for category in categories]
+        rows = []
+        for index in range(count):
+            rows.append({
+                'name': f'{rnd.choice(WORDS)} {rnd.choice(FILLER)} {rnd.choice(FILLER)}'.title(),
+                'slug': f'product-{index}',
+                'sku': f'SKU-{index:04d}',
+                'short_description': ' '.join(rnd.choices(FILLER, k=7) + [rnd.choice(WORDS)]),
+                'description': ' '.join(rnd.choices(FILLER, k=40)),
+                'price': rnd.randint(10, 500),
+                'is_active': True,
+                'in_stock': True,
+                'category_id': rnd.choice(category_ids),
+            })
+            if len(rows) == 5000:
+                db.session.execute(Product.__table__.insert(), rows)
+                rows = []
+        if rows:
+            db.session.execute(Product.__table__.insert(), rows)
+        db.session.commit()
+
+
+def timed(label, repeats, func):
+    durations = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        durations.append((time.perf_counter() - start) * 1000)
+    print(f"  {label:28s} median {statistics.median(durations):8.2f} ms   max {max(durations):8.2f} ms")
+    return result
+
+
+def run(app, backend, repeats):
+    from app.services import search
+
+    with app.app_context():
+        search._backends.clear()
+        search._backends[str(search.db.get_engine().url)] = backend
+        print(f"{backend.name}:")
+        for q, lang in QUERIES:
+            results = timed(f"search '{q}' ({lang})", repeats,
+                            lambda: search.search_products(q, lang, per_page=24))
+            print(f"  {'':28s} {results.total} matches")
+        timed("typeahead 'secu'", repeats, lambda: search.typeahead('secu', 'en'))
+
+
+if __name__ == '__main__':
+    product_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeat_count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    bench_app = make_app()
+    start = time.perf_counter()
+    populate(bench_app, product_count)
+    print(f"Inserted {product_count} products in {time.perf_counter() - start:.1f}s")
+
+    from app.services import search
+    with bench_app.app_context():
+        engine = search.db.get_engine()
+        start = time.perf_counter()
+        if engine.dialect.name == 'sqlite':
+            with engine.begin() as conn:
+                search.rebuild_sqlite_index(conn)
+        print(f"Index ready in {time.perf_counter() - start:.1f}s")
+        indexed = search.get_backend()
+
+    run(bench_app, search.LikeBackend(), repeat_count)
+    if indexed.name != 'like':
+        run(bench_app, indexed, repeat_count)
@@ -0,0 +1,104 @@
+"""
+Benchmark: session backends (app/utils/session_store.py) vs the Flask-Session
+filesystem store the app used before.
+
+Runs the same three workloads against each backend through the real app:
+new visitors whose first request stores ``lang`` (what
+``set_default_language`` does), returning visitors that only read their
+session, and returning visitors that update their cart id on each request.
+Reports ms per request, storage writes and what is left on disk/in the table.
+
+Usage: python scripts/bench_sessions.py [visitors] [requests_per_visitor]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from bench_support import StatementCounter, make_app
+
+
+def add_bench_routes(app):
+    from flask import session
+
+    @app.route('/bench/first-visit')
+    def first_visit():
+        if 'lang' not in session:
+            session['lang'] = 'de'
+        return 'ok'
+
+    @app.route('/bench/read')
+    def read():
+        return session.get('lang', '-')
+
+    @app.route('/bench/cart/<int:cart_id>')
+    def cart(cart_id):
+        session['cart_id'] = cart_id
+        return 'ok'
+
+
+def make_interfaces(app, session_dir):
+    from flask_session.sessions import FileSystemSessionInterface
+    from app.utils.session_store import (CompactCookieSessionInterface, HybridSessionInterface,
+                                         SqlSessionInterface)
+    return {
+        # Same settings Flask-Session derived from the old config
+        'filesystem': FileSystemSessionInterface(session_dir, threshold=500, mode=0o600,
+                                                 key_prefix='session:', permanent=True),
+        'sql': SqlSessionInterface(),
+        'cookie': CompactCookieSessionInterface(),
+        'hybrid': HybridSessionInterface(),
+    }
+
+
+def run_workload(app, counter, label, clients, paths):
+    durations = []
+    counter.reset()
+    for index, client in enumerate(clients):
+        for path in paths(index):
+            start = time.perf_counter()
+            client.get(path)
+            durations.append((time.perf_counter() - start) * 1000)
+    print(f"  {label:28s} median {statistics.median(durations):6.3f} ms   "
+          f"p95 {sorted(durations)[int(len(durations) * 0.95)]:6.3f} ms   DB writes {counter.writes}")
+
+
+def storage(name, app, session_dir):
+    from app.models.database import db
+    if name == 'filesystem':
+        files = os.listdir(session_dir)
+        size = sum(os.path.getsize(os.path.join(session_dir, f)) for f in files)
+        return f"{len(files)} files, {size // 1024} KiB in {session_dir}"
+    if name in ('sql', 'hybrid'):
+        with app.app_context():
+            rows = db.session.execute(db.text('SELECT COUNT(*) FROM http_sessions')).scalar()
+        return f"{rows} rows in http_sessions"
+    return "nothing server-side"
+
+
+if __name__ == '__main__':
+    visitors = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    per_visitor = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    bench_app = make_app()
+    bench_app.config['ROLLUP_CATCHUP_INTERVAL'] = 0
+    add_bench_routes(bench_app)
+    from app.models.database import db
+    with bench_app.app_context():
+        counter = StatementCounter(db.engine)
+
+    session_dir = tempfile.mkdtemp(prefix='rozoom-bench-sessions-')
+    for name, interface in make_interfaces(bench_app, session_dir).items():
+        bench_app.session_interface = interface
+        with bench_app.app_context():
+            db.session.execute(db.text('DELETE FROM http_sessions'))
+            db.session.commit()
+        print(f"{name}:")
+        clients = [bench_app.test_client() for _ in range(visitors)]
+        run_workload(bench_app, counter, 'first visit (writes lang)', clients,
+                     lambda index: ['/bench/first-visit'])
+        run_workload(bench_app, counter, 'returning, read only', clients,
+                     lambda index: ['/bench/read'] * per_visitor)
+        run_workload(bench_app, counter, 'returning, cart update', clients,
+                     lambda index: [f'/bench/cart/{index * per_visitor + n}' for n in range(per_visitor)])
+        print(f"  storage: {storage(name, bench_app, session_dir)}")
@@ -0,0 +1,73 @@
+"""
+Shared helpers for the benchmark scripts in this folder.
+
+``make_app()`` builds the real application against a throwaway SQLite file
+(or BENCH_DATABASE_URI when set). SQLite has no schemas, so the
+``rozoom_schema`` used by the users table is emulated with ATTACH DATABASE.
+``StatementCounter`` counts statements and writes issued through the engine.
+"""
+import logging
+import os
+import sys
+import tempfile
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def make_app(quiet=True):
+    """Create the app with a fresh database and all tables in place."""
+    tmp_dir = tempfile.mkdtemp(prefix='rozoom-bench-')
+    uri = os.environ.get('BENCH_DATABASE_URI') or 'sqlite:///' + os.path.join(tmp_dir, 'main.db')
+    os.environ['DATABASE_URI'] = uri
+    os.environ.setdefault('MEDIA_CACHE_DIR', os.path.join(tmp_dir, 'media_cache'))
+    os.environ.setdefault('VOICE_JOB_DIR', os.path.join(tmp_dir, 'voice_jobs'))
+    os.environ.setdefault('IDENTITY_REVOCATION_DIR', os.path.join(tmp_dir, 'identity'))
+    os.environ.setdefault('METRICS_DIR', os.path.join(tmp_dir, 'metrics'))
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-bench')
+    if quiet:
+        logging.disable(logging.WARNING)
+
+    from sqlalchemy import event
+    from app.app import create_app
+    from app.models.database import db
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        engine = db.get_engine()
+        if engine.dialect.name == 'sqlite':
+            schema_file = os.path.join(tmp_dir, 'rozoom_schema.db')
+
+            @event.listens_for(engine, 'connect')
+            def _attach_schema(dbapi_conn, conn_record):
+                dbapi_conn.execute(f"ATTACH DATABASE '{schema_file}' AS rozoom_schema")
+
+            engine.dispose()
+        db.create_all()
+    return app
+
+
+class StatementCounter:
+    """Counts statements (and data-modifying ones) executed by an engine."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.statements = 0
+        self.writes = 0
+        self.enabled = True
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, params, context, executemany):
+        if not self.enabled:
+            return
+        self.statements += 1
+        if statement.lstrip().upper().startswith(WRITE_PREFIXES):
+            self.writes += 1
+
+    def reset(self):
+        self.statements = 0
+        self.writes = 0
@@ -0,0 +1,172 @@
+"""
+Startup profiler: import time and database round-trips per module.
+
+Imports the WSGI entry point the way Gunicorn's ``preload_app`` does
+(``run`` by default) and reports, per module, the time spent executing its
+body (self and including the modules it imported) and the SQL statements
+and new DB connections issued while it was executing. Work done inside
+``create_app()`` is counted against the module that called it (``run``).
+A healthy boot issues no statements at all. Schema work belongs in
+``flask bootstrap run``.
+
+Uses DATABASE_URI when set, otherwise a throwaway SQLite file.
+
+Usage: python scripts/profile_startup.py [module] [--top N]
+"""
+import argparse
+import importlib.abc
+import logging
+import os
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+class ModuleStats:
+    __slots__ = ('name', 'total', 'children', 'statements', 'connects', 'sample')
+
+    def __init__(self, name):
+        self.name = name
+        self.total = 0.0
+        self.children = 0.0
+        self.statements = 0
+        self.connects = 0
+        self.sample = None
+
+    @property
+    def self_time(self):
+        return self.total - self.children
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """Wraps a module's loader to time ``exec_module``."""
+
+    def __init__(self, profiler, loader):
+        self._profiler = profiler
+        self._loader = loader
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._profiler.enter(module.__name__)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler.leave()
+
+    def __getattr__(self, name):
+        # get_filename, get_resource_reader, is_package ... used by Flask and Jinja
+        return getattr(self._loader, name)
+
+
+class StartupProfiler(importlib.abc.MetaPathFinder):
+    def __init__(self):
+        self.modules = {}
+        self.stack = []  # [(stats, start)]
+        self.outside = ModuleStats('<outside imports>')
+
+    # --- imports ---------------------------------------------------------
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(self, spec.loader)
+                return spec
+        return None
+
+    def enter(self, name):
+        stats = self.modules.setdefault(name, ModuleStats(name))
+        self.stack.append((stats, time.perf_counter()))
+
+    def leave(self):
+        stats, start = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        stats.total += elapsed
+        if self.stack:
+            self.stack[-1][0].children += elapsed
+
+    def current(self):
+        return self.stack[-1][0] if self.stack else self.outside
+
+    # --- database --------------------------------------------------------
+
+    def on_execute(self, conn, cursor, statement, params, context, executemany):
+        stats = self.current()
+        stats.statements += 1
+        if stats.sample is None:
+            stats.sample = ' '.join(statement.split())[:90]
+
+    def on_connect(self, dbapi_conn, conn_record):
+        self.current().connects += 1
+
+    def install(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        from sqlalchemy.pool import Pool
+
+        # Class-level listeners also cover engines created later (Flask-SQLAlchemy's)
+        event.listen(Engine, 'before_cursor_execute', self.on_execute)
+        event.listen(Pool, 'connect', self.on_connect)
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        sys.meta_path.remove(self)
+
+
+def report(profiler, wall, top):
+    modules = sorted(profiler.modules.values(), key=lambda stats: stats.self_time, reverse=True)
+    project = [stats for stats in modules if stats.name == 'run' or stats.name.split('.')[0] in ('app', 'config')]
+    print(f"Startup: {wall * 1000:.0f} ms wall, {len(modules)} modules imported")
+    print(f"\nSlowest modules (self time, {top} of {len(modules)}):")
+    print(f"  {'module':48s} {'self ms':>9s} {'incl ms':>9s} {'stmts':>6s} {'conns':>6s}")
+    for stats in modules[:top]:
+        print(f"  {stats.name:48s} {stats.self_time * 1000:9.1f} {stats.total * 1000:9.1f} "
+              f"{stats.statements:6d} {stats.connects:6d}")
+    print(f"\nProject modules: {sum(stats.self_time for stats in project) * 1000:.0f} ms self time in "
+          f"{len(project)} modules")
+
+    talkers = [stats for stats in modules + [profiler.outside] if stats.statements or stats.connects]
+    total = sum(stats.statements for stats in talkers)
+    print(f"\nDatabase round-trips during startup: {total} statements, "
+          f"{sum(stats.connects for stats in talkers)} connections")
+    for stats in sorted(talkers, key=lambda stats: stats.statements, reverse=True):
+        print(f"  {stats.name:48s} {stats.statements:4d} stmts {stats.connects:3d} conns   e.g. {stats.sample}")
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('module', nargs='?', default='run', help='Entry point to import (default: run)')
+    parser.add_argument('--top', type=int, default=25, help='How many of the slowest modules to list')
+    args = parser.parse_args()
+
+    if not (os.environ.get('DATABASE_URI') or os.environ.get('DATABASE_URL')):
+        tmp_dir = tempfile.mkdtemp(prefix='rozoom-startup-')
+        os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp_dir, 'main.db')
+        os.environ.setdefault('MEDIA_CACHE_DIR', os.path.join(tmp_dir, 'media_cache'))
+        os.environ.setdefault('VOICE_JOB_DIR', os.path.join(tmp_dir, 'voice_jobs'))
+        os.environ.setdefault('IDENTITY_REVOCATION_DIR', os.path.join(tmp_dir, 'identity'))
+    # app/routes/chatbot.py builds its OpenAI client at import
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-profile')
+
+    # Startup INFO logging would drown the report
+    logging.disable(logging.INFO)
+    startup_profiler = StartupProfiler()
+    # SQLAlchemy itself is imported before the hooks go in; its import time is not counted
+    startup_profiler.install()
+    start = time.perf_counter()
+    try:
+        importlib.import_module(args.module)
+    finally:
+        wall = time.perf_counter() - start
+        startup_profiler.uninstall()
+    report(startup_profiler, wall, args.top)
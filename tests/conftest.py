@@ -0,0 +1,104 @@
+"""
+Shared fixtures: the real application on a throwaway SQLite database.
+
+The app is created once per session, with the background threads off so
+tests drive the job queue themselves. SQLite has no schemas, so the ``rozoom_schema`` of the users
+table is emulated with ATTACH DATABASE, as in scripts/bench_support.py.
+"""
+import logging
+import os
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+
+# config.py reads the environment on import, and test modules import app code
+# at collection time, so the environment is set before anything else loads
+TMP_DIR = Path(tempfile.mkdtemp(prefix='rozoom-tests-'))
+os.environ['DATABASE_URI'] = f"sqlite:///{TMP_DIR / 'main.db'}"
+for _name, _value in {
+    'MEDIA_CACHE_DIR': TMP_DIR / 'media_cache',
+    'VOICE_JOB_DIR': TMP_DIR / 'voice_jobs',
+    'IDENTITY_REVOCATION_DIR': TMP_DIR / 'identity',
+    'METRICS_DIR': TMP_DIR / 'metrics',
+    'OPENAI_API_KEY': 'sk-test',
+    'JOB_WORKER_THREADS': '0',
+    'HEALTH_CHECK_INTERVAL': '0',
+    'ROLLUP_CATCHUP_INTERVAL': '0',
+}.items():
+    os.environ[_name] = str(_value)
+
+
+@pytest.fixture(scope='session')
+def app():
+    logging.disable(logging.WARNING)
+    from app.app import create_app
+    from app.models.database import db
+
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        engine = db.get_engine()
+        schema_file = TMP_DIR / 'rozoom_schema.db'
+
+        @event.listens_for(engine, 'connect')
+        def _attach_schema(dbapi_conn, conn_record):
+            dbapi_conn.execute(f"ATTACH DATABASE '{schema_file}' AS rozoom_schema")
+
+        engine.dispose()
+        db.create_all()
+    yield app
+    logging.disable(logging.NOTSET)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+class StatementCounter:
+    """Statements (and data-modifying ones) issued through an engine."""
+
+    def __init__(self):
+        self.statements = 0
+        self.writes = 0
+
+    def __call__(self, conn, cursor, statement, params, context, executemany):
+        self.statements += 1
+        if statement.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+            self.writes += 1
+
+    def reset(self):
+        self.statements = 0
+        self.writes = 0
+
+
+@pytest.fixture
+def statements(app):
+    """Counts the statements the app's engine executes during the test."""
+    from app.models.database import db
+    with app.app_context():
+        engine = db.get_engine()
+    counter = StatementCounter()
+    event.listen(engine, 'before_cursor_execute', counter)
+    yield counter
+    event.remove(engine, 'before_cursor_execute', counter)
+
+
+@pytest.fixture
+def stripe_sessions(app, monkeypatch):
+    """Stripe checkout sessions created during the test (nothing leaves the machine)."""
+    import stripe
+    calls = []
+
+    def create(**params):
+        calls.append(params)
+        return SimpleNamespace(id=f'cs_test_{len(calls)}', url=f'https://checkout.stripe.test/{len(calls)}')
+
+    monkeypatch.setattr(stripe.checkout.Session, 'create', create)
+    monkeypatch.setitem(app.config, 'STRIPE_SECRET_KEY', 'sk_test_checkout')
+    monkeypatch.setitem(app.config, 'STRIPE_TEST_PRICE_ID', None)
+    return calls
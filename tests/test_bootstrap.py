@@ -0,0 +1,135 @@
+"""
+Bootstrap steps (app/services/bootstrap.py) against a database created
+before the columns they add existed.
+"""
+import pytest
+from sqlalchemy import create_engine, event, inspect, text
+
+
+@pytest.fixture
+def old_engine(app, tmp_path):
+    """A separate SQLite database with every current table; tests drop what is 'new'."""
+    from app.models.database import db
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+
+    @event.listens_for(engine, 'connect')
+    def _attach_schema(dbapi_conn, conn_record):
+        dbapi_conn.execute(f"ATTACH DATABASE '{tmp_path / 'old_schema.db'}' AS rozoom_schema")
+
+    db.metadata.create_all(engine)
+    with app.app_context():
+        yield engine
+    engine.dispose()
+
+
+def drop_columns(engine, table, names):
+    with engine.begin() as conn:
+        for name in names:
+            conn.execute(text(f"ALTER TABLE {table.fullname} DROP COLUMN {name}"))
+
+
+def columns(engine, table):
+    return {info['name'] for info in inspect(engine).get_columns(table.name, schema=table.schema)}
+
+
+def test_media_hash_columns(old_engine):
+    from app.models.product import Category, ProductImage
+    from app.services.bootstrap import add_media_hash_columns
+    drop_columns(old_engine, Category.__table__, ['image_hash'])
+    drop_columns(old_engine, ProductImage.__table__, ['content_hash'])
+
+    assert add_media_hash_columns(old_engine).startswith('added')
+    assert 'image_hash' in columns(old_engine, Category.__table__)
+    assert 'content_hash' in columns(old_engine, ProductImage.__table__)
+    assert add_media_hash_columns(old_engine) == 'all columns exist'
+
+
+def test_product_ratings(old_engine):
+    from app.models.product import Product, ProductReview
+    from app.services.bootstrap import add_product_ratings
+    products, reviews = Product.__table__, ProductReview.__table__
+    with old_engine.begin() as conn:
+        for index in ('ix_products_active_category_rating', 'ix_products_active_rating'):
+            conn.execute(text(f"DROP INDEX {index}"))
+        product_id = conn.execute(products.insert().values(name='Rated', slug='rated', price=10)
+                                  ).inserted_primary_key[0]
+        for rating, approved in ((5, True), (3, True), (1, False)):
+            conn.execute(reviews.insert().values(product_id=product_id, rating=rating, is_approved=approved))
+    drop_columns(old_engine, products, ['review_count', 'rating_sum', 'rating_avg'])
+
+    assert add_product_ratings(old_engine).startswith('added')
+    with old_engine.connect() as conn:
+        row = conn.execute(text(f"SELECT review_count, rating_sum, rating_avg FROM {products.fullname}")).one()
+    assert tuple(row) == (2, 8, 4.0)
+    indexes = {index['name'] for index in inspect(old_engine).get_indexes(products.name)}
+    assert 'ix_products_active_category_rating' in indexes
+
+
+def test_indexes_and_existing_data(old_engine):
+    from datetime import datetime
+    from app.models.order import Order
+    from app.models.product import Product
+    from app.models.rollup import OrderRollup
+    from app.services.bootstrap import create_indexes, fix_existing_data
+    products = Product.__table__
+    with old_engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_products_active_category_price"))
+        conn.execute(products.insert().values(name='Old', slug='old', price=10, stock=-3,
+                                              created_at=None, updated_at=datetime(2024, 5, 1)))
+        conn.execute(Order.__table__.insert().values(
+            order_number='OLD-1', first_name='Old', last_name='Order', email='old@example.com',
+            payment_method='stripe', subtotal=10, total=10, created_at=datetime(2024, 5, 1, 12)))
+
+    assert create_indexes(old_engine) == 'created ix_products_active_category_price'
+    assert create_indexes(old_engine) == 'all indexes exist'
+    fix_existing_data(old_engine)
+    with old_engine.connect() as conn:
+        assert tuple(conn.execute(products.select().with_only_columns(products.c.created_at, products.c.stock)
+                                  ).one()) == (datetime(2024, 5, 1), None)
+        # One hour and one day cell for the old order
+        assert len(conn.execute(OrderRollup.__table__.select()).all()) == 2
+
+
+def test_search_index(old_engine):
+    from app.models.product import Category, Product
+    from app.services import search
+    from app.services.bootstrap import create_search_index
+    with old_engine.begin() as conn:
+        category_id = conn.execute(Category.__table__.insert().values(name='Security audits', slug='audits')
+                                   ).inserted_primary_key[0]
+        conn.execute(Product.__table__.insert().values(name='Pentest', slug='pentest', price=10,
+                                                       category_id=category_id))
+    assert isinstance(search._detect_backend(old_engine), search.LikeBackend)
+
+    assert create_search_index(old_engine) == f'created {search.FTS_TABLE}'
+    assert create_search_index(old_engine) == f'{search.FTS_TABLE} exists'
+    assert isinstance(search._detect_backend(old_engine), search.SqliteBackend)
+    with old_engine.connect() as conn:
+        rows = conn.execute(text(f"SELECT name, category FROM {search.FTS_TABLE}")).all()
+    assert [tuple(row) for row in rows] == [('Pentest', 'Security audits')]
+
+
+def test_steps_bring_an_old_database_up_to_the_models(old_engine):
+    from app.models.database import db
+    from app.models.product import Category, Product, ProductImage
+    from app.services import search
+    from app.services.bootstrap import steps
+    with old_engine.begin() as conn:
+        for index in ('ix_products_active_category_rating', 'ix_products_active_rating',
+                      'ix_products_active_category_price', 'ix_products_active_price'):
+            conn.execute(text(f"DROP INDEX {index}"))
+    drop_columns(old_engine, Category.__table__, ['image_hash'])
+    drop_columns(old_engine, ProductImage.__table__, ['content_hash'])
+    drop_columns(old_engine, Product.__table__, ['review_count', 'rating_sum', 'rating_avg'])
+
+    for step in steps():
+        # admin_user works on the app's own session; everything else takes the engine
+        if step.name != 'admin_user':
+            step.func(old_engine)
+
+    inspector = inspect(old_engine)
+    for table in db.metadata.sorted_tables:
+        assert {column.name for column in table.c} <= columns(old_engine, table), table.fullname
+        indexes = {info['name'] for info in inspector.get_indexes(table.name, schema=table.schema)}
+        assert {index.name for index in table.indexes} <= indexes, table.fullname
+    assert isinstance(search._detect_backend(old_engine), search.SqliteBackend)
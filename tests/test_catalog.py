@@ -0,0 +1,24 @@
+"""
+Keyset pages of the product catalog (app/services/catalog.py).
+"""
+import pytest
+from sqlalchemy import text
+
+from app.services.catalog import SORTS
+
+
+def query_plan(app, query):
+    from app.models.database import db
+    sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+    with db.engine.connect() as conn:
+        return ' / '.join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+
+
+@pytest.mark.parametrize('category_id', [None, 1])
+@pytest.mark.parametrize('sort', sorted(SORTS))
+def test_page_is_read_in_index_order(app, sort, category_id):
+    from app.services.catalog import _listing_query, _order
+    with app.app_context():
+        plan = query_plan(app, _order(_listing_query(category_id), sort).limit(25))
+    assert 'TEMP B-TREE' not in plan, plan
+    assert 'USING INDEX ix_products_active_' in plan, plan
@@ -0,0 +1,56 @@
+"""
+Checkout materialization (app/services/checkout.py): ``POST /shop/checkout``
+issues the same number of statements whatever the cart size, sends Stripe
+one line item per cart item and keeps the sales rollups in step.
+"""
+import pytest
+
+CART_SIZES = (1, 10, 50)
+
+
+@pytest.fixture(scope='module')
+def product_ids(app):
+    from app.models.database import db
+    from app.models.product import Product
+    with app.app_context():
+        products = [Product(name=f'Checkout service {index}', slug=f'checkout-service-{index}',
+                            price=40 + index, short_description='Checkout test service')
+                    for index in range(max(CART_SIZES))]
+        db.session.add_all(products)
+        db.session.commit()
+        return [product.id for product in products]
+
+
+def post_checkout(app, statements, product_ids, size, number=0):
+    from app.models.database import db
+    from app.models.shop import Cart, CartItem
+    with app.app_context():
+        cart = Cart(session_id=f'checkout-{size}-{number}', status='open')
+        cart.items = [CartItem(product_id=product_id, quantity=1 + index % 3, price=40 + index)
+                      for index, product_id in enumerate(product_ids[:size])]
+        db.session.add(cart)
+        db.session.commit()
+        cart_id = cart.id
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['cart_id'] = cart_id
+    statements.reset()
+    response = client.post('/shop/checkout', data={
+        'email': 'checkout@example.com', 'first_name': 'Check', 'last_name': 'Out'})
+    assert response.status_code == 302
+    assert 'checkout.stripe.test' in response.headers['Location']
+    return statements.statements
+
+
+def test_checkout_statements_do_not_grow_with_cart(app, statements, stripe_sessions, product_ids):
+    # The first checkout of the process also fills per-process caches
+    post_checkout(app, statements, product_ids, 1, number='warm-up')
+    counts = {size: post_checkout(app, statements, product_ids, size) for size in CART_SIZES}
+    assert len(set(counts.values())) == 1, f"statements per cart size: {counts}"
+    assert [len(call['line_items']) for call in stripe_sessions[1:]] == list(CART_SIZES)
+
+    from app.models.database import db
+    from app.services import rollups
+    with app.app_context():
+        with db.engine.begin() as conn:
+            assert rollups.check(conn) == []
@@ -0,0 +1,110 @@
+"""
+Cached product cards and product page sections (app/utils/fragment_cache.py)
+follow every kind of write, and workers share fragments through the shared
+backend.
+"""
+import pytest
+
+LISTING = '/shop/products?category=fragment-workshops'
+
+
+@pytest.fixture(scope='module')
+def catalog(app):
+    """``(product id, product slug, category id)`` of a category with reviewed products."""
+    from app.models.database import db
+    from app.models.product import Category, Product, ProductReview
+    with app.app_context():
+        category = Category(name='Fragment workshops', slug='fragment-workshops')
+        pair = Category(name='Fragment pairs', slug='fragment-pairs')
+        db.session.add_all([category, pair])
+        db.session.flush()
+        products = [Product(name=f'Fragment workshop {index}', slug=f'fragment-workshop-{index}', price=50 + index,
+                            short_description=f'Hands-on session {index}', description='<p>Agenda</p>',
+                            duration=60, category_id=category.id, is_active=True)
+                    for index in range(6)]
+        # Two products alone in a category: each is the other's only related product
+        products += [Product(name=f'Fragment duo {letter}', slug=f'fragment-duo-{letter}', price=40,
+                             category_id=pair.id, is_active=True) for letter in 'ab']
+        db.session.add_all(products)
+        db.session.flush()
+        products[0].reviews = [ProductReview(author_name=f'Reviewer {index}', author_email='r@example.com',
+                                             rating=4, content='Useful', is_approved=True)
+                               for index in range(3)]
+        db.session.commit()
+        return products[0].id, products[0].slug, category.id
+
+
+def page(client, path):
+    response = client.get(path)
+    assert response.status_code == 200, path
+    return response.get_data(as_text=True)
+
+
+def test_cached_pages_follow_writes(app, catalog):
+    from app.models.database import db
+    from app.models.product import Category, Product, ProductImage, ProductReview
+    from app.utils.fragment_cache import get_fragment_cache
+    product_id, slug, category_id = catalog
+    cache = get_fragment_cache(app)
+    client = app.test_client()
+    # Fill the cache first
+    for path in (LISTING, f'/shop/product/{slug}', '/shop/product/fragment-duo-b'):
+        page(client, path)
+    hits = cache.stats['hits']
+    page(client, LISTING)
+    assert cache.stats['hits'] > hits
+
+    with app.app_context():
+        db.session.get(Product, product_id).name = 'Renamed workshop'
+        Product.query.filter_by(slug='fragment-duo-a').one().name = 'Renamed duo'
+        db.session.commit()
+    assert 'Renamed workshop' in page(client, LISTING)
+    assert 'Renamed duo' in page(client, '/shop/product/fragment-duo-b')
+
+    with app.app_context():
+        db.session.add(ProductReview(product_id=product_id, author_name='Late reviewer',
+                                     author_email='l@example.com', rating=5, content='Added later',
+                                     is_approved=True))
+        db.session.commit()
+    assert 'Late reviewer' in page(client, f'/shop/product/{slug}')
+
+    with app.app_context():
+        db.session.add(ProductImage(product_id=product_id, url='/static/uploads/extra-shot.png', sort_order=9))
+        db.session.get(Product, product_id).image = '/static/uploads/main.png'
+        db.session.commit()
+    assert 'extra-shot.png' in page(client, f'/shop/product/{slug}')
+
+    with app.app_context():
+        db.session.get(Category, category_id).name = 'Masterclasses'
+        db.session.commit()
+    assert 'Masterclasses' in page(client, f'/shop/product/{slug}')
+
+
+def test_cards_follow_the_language(app, catalog):
+    client = app.test_client()
+    client.get('/set_language/en')
+    assert 'Add to cart' in page(client, LISTING)
+    client.get('/set_language/uk')
+    listing = page(client, LISTING)
+    assert 'У кошик' in listing
+    assert 'Add to cart\n' not in listing
+
+
+def test_second_worker_uses_the_shared_store(app, catalog, tmp_path, monkeypatch):
+    from cachelib import FileSystemCache
+    from app.utils.fragment_cache import FragmentCache, get_fragment_cache
+    version = get_fragment_cache(app).version
+
+    def worker_cache():
+        return FragmentCache(shared=FileSystemCache(str(tmp_path / 'fragments')), version=version)
+
+    client = app.test_client()
+    client.get('/set_language/de')
+    monkeypatch.setitem(app.extensions, 'fragment_cache', worker_cache())
+    first = page(client, LISTING)
+    # Another process: same shared store, nothing rendered locally yet
+    other = worker_cache()
+    monkeypatch.setitem(app.extensions, 'fragment_cache', other)
+    assert page(client, LISTING) == first
+    assert other.stats['shared_hits'] > 0
+    assert other.stats['misses'] == 0
@@ -0,0 +1,124 @@
+"""
+Liveness / readiness probes (app/utils/health.py): cached deep checks,
+schema drift through the job queue, an unreachable database and the
+refresh thread.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import Column, Integer, Table, create_engine
+
+
+@pytest.fixture
+def checker(app):
+    from app.utils.health import get_health_checker
+    checker = get_health_checker(app)
+    checker.refresh()
+    return checker
+
+
+@pytest.fixture
+def drift_table():
+    """A model table the database does not have, as after a deploy without its bootstrap."""
+    from app.models.database import db
+    table = Table('health_drift_probe', db.metadata, Column('id', Integer, primary_key=True))
+    yield table
+    db.metadata.remove(table)
+
+
+def run_schema_check(app):
+    """Run the queued schema check now, as the job queue would when it is due."""
+    from app.models.database import db
+    from app.models.job import BackgroundJob
+    from app.services.job_queue import get_job_queue
+    from app.utils.health import SCHEMA_CHECK_JOB
+    with app.app_context():
+        BackgroundJob.query.filter_by(kind=SCHEMA_CHECK_JOB, status='pending').update(
+            {'run_at': datetime.utcnow() - timedelta(seconds=1)}, synchronize_session=False)
+        db.session.commit()
+    get_job_queue(app).drain()
+
+
+def pending_schema_checks(app):
+    from app.models.job import BackgroundJob
+    from app.utils.health import SCHEMA_CHECK_JOB
+    with app.app_context():
+        return BackgroundJob.query.filter_by(kind=SCHEMA_CHECK_JOB, status='pending').count()
+
+
+@pytest.mark.parametrize('path', ['/livez', '/readyz', '/health'])
+def test_probe_runs_no_queries(client, statements, checker, path):
+    statements.reset()
+    response = client.get(path)
+    assert response.status_code == 200
+    assert statements.statements == 0
+    assert 'Set-Cookie' not in response.headers
+
+
+def test_readyz_reports_the_pool(client, checker):
+    assert 'type' in client.get('/readyz').get_json()['pool']
+
+
+def test_concurrent_stale_probes_share_one_recheck(app, checker, monkeypatch):
+    monkeypatch.setattr(checker, 'max_age', 0.05)
+    time.sleep(0.1)
+    before = checker.stats['inline_runs']
+    barrier = threading.Barrier(8)
+
+    def stale_probe():
+        barrier.wait()
+        app.test_client().get('/readyz')
+
+    threads = [threading.Thread(target=stale_probe) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert checker.stats['inline_runs'] - before == 1
+
+
+def test_schema_drift_reaches_health_through_the_job(app, client, checker, drift_table):
+    # The deep checks keep one schema check queued
+    assert pending_schema_checks(app) == 1
+    run_schema_check(app)
+    checker.refresh()
+    schema = client.get('/health').get_json()['schema']
+    assert 'health_drift_probe' in schema['missing_tables']
+    assert schema['missing_columns'] == []
+
+    response = client.get('/health')
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'warning'
+    # Drift is reported; the app stays ready
+    assert client.get('/readyz').status_code == 200
+    assert pending_schema_checks(app) == 1
+
+
+def test_unreachable_database_fails_readiness_only(client, checker):
+    engine = checker.engine
+    checker.engine = create_engine('sqlite:////nonexistent-dir/unreachable.db')
+    try:
+        checker.refresh()
+        ready = client.get('/readyz')
+        assert ready.status_code == 503
+        assert ready.get_json()['details']['database']
+        assert client.get('/livez').status_code == 200
+    finally:
+        checker.engine = engine
+        checker.refresh()
+
+
+def test_refresh_thread_keeps_the_result_fresh(client, checker, monkeypatch):
+    monkeypatch.setattr(checker, 'interval', 0.05)
+    runs = checker.stats['runs']
+    try:
+        # The first request of the process starts the thread
+        client.get('/livez')
+        time.sleep(0.5)
+        assert checker.stats['runs'] - runs >= 3
+        assert client.get('/readyz').get_json()['age_seconds'] < 0.3
+    finally:
+        # The thread runs while _pid is this process
+        checker._pid = None
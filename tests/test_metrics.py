@@ -0,0 +1,150 @@
+"""
+The Prometheus endpoint (app/utils/metrics.py): a known mix of requests
+shows up in ``/metrics``, worker processes sharing ``METRICS_DIR`` add up,
+and scrapes are local-only or need ``METRICS_TOKEN``.
+
+The registry lives for the whole test session, so every check compares a
+scrape before and after its own requests.
+"""
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A worker process: serve /livez, flush, then exit or wait for a line on stdin
+WORKER = """
+import sys
+from app.app import create_app
+from app.utils.metrics import get_registry
+client = create_app().test_client()
+for _ in range(int(sys.argv[1])):
+    client.get('/livez')
+get_registry().flush()
+print('ready', flush=True)
+if len(sys.argv) > 2:
+    sys.stdin.readline()
+"""
+
+
+def parse(text):
+    """``{(name, frozenset(labels)): value}`` of a text exposition."""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        match = SAMPLE.match(line)
+        assert match is not None, f"Malformed sample line: {line!r}"
+        name, labels, value = match.groups()
+        samples[(name, frozenset(LABEL.findall(labels or '')))] = float(value)
+    return samples
+
+
+def value(samples, name, **labels):
+    """Sum of the samples of ``name`` whose labels include ``labels``."""
+    wanted = set(labels.items())
+    return sum(v for (n, l), v in samples.items() if n == name and wanted <= l)
+
+
+def scrape(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    return parse(response.get_data(as_text=True))
+
+
+@pytest.fixture(scope='module')
+def image_id(app):
+    from app.models.database import db
+    from app.models.product import Category, Product, ProductImage
+    with app.app_context():
+        category = Category(name='Metrics prints', slug='metrics-prints')
+        db.session.add(category)
+        db.session.flush()
+        product = Product(name='Metrics poster', slug='metrics-poster', price=20, category_id=category.id,
+                          is_active=True)
+        product.gallery_images = [ProductImage(data=os.urandom(3000), filename='p.png', content_type='image/png')]
+        db.session.add(product)
+        db.session.commit()
+        return product.gallery_images[0].id
+
+
+def test_requests_show_up_in_the_scrape(app, client, image_id, monkeypatch):
+    from app.services import telegram
+    # Serve the image from the database, not the local disk cache
+    monkeypatch.delitem(app.extensions, 'media_cache', raising=False)
+    before = scrape(client)
+    for _ in range(5):
+        client.get('/shop/products')
+    for _ in range(3):
+        client.get(f'/media/image/{image_id}')
+    for _ in range(2):
+        client.get('/no-such-page')
+    monkeypatch.setattr(telegram, 'API_BASE', 'http://127.0.0.1:9')
+    with pytest.raises(telegram.TelegramError):
+        telegram.send_message('token', 'chat', 'hello')
+
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    assert 'version=0.0.4' in response.headers['Content-Type']
+    after = parse(response.get_data(as_text=True))
+
+    def delta(name, **labels):
+        return value(after, name, **labels) - value(before, name, **labels)
+
+    listing = dict(blueprint='shop', endpoint='shop.products', method='GET')
+    assert delta('http_requests_total', status='200', **listing) == 5
+    assert delta('http_requests_total', endpoint='none', status='404') == 2
+    assert delta('http_request_duration_seconds_count', **listing) == 5
+    assert delta('http_request_duration_seconds_bucket', le='+Inf', **listing) == 5
+    buckets = sorted((float(dict(labels)['le']), v) for (name, labels), v in after.items()
+                     if name == 'http_request_duration_seconds_bucket' and ('endpoint', 'shop.products') in labels)
+    assert all(a[1] <= b[1] for a, b in zip(buckets, buckets[1:]))
+    assert delta('http_request_db_queries_total', endpoint='shop.products') >= 5
+    assert delta('http_request_db_seconds_count', endpoint='shop.products') == 5
+    assert value(after, 'db_pool_checkout_seconds_count') > 0
+    assert delta('http_image_bytes_served_total', endpoint='media.serve_image') == 3 * 3000
+    assert delta('outbound_request_duration_seconds_count', service='telegram', outcome='error') == 1
+
+
+def test_worker_processes_add_up(app, client):
+    from app.utils.metrics import ARCHIVE, get_registry
+    workers, per_worker = 2, 5
+    directory = get_registry().directory
+    before = value(scrape(client), 'http_requests_total', endpoint='liveness')
+
+    command = [sys.executable, '-c', WORKER, str(per_worker)]
+    exited = []
+    for _ in range(workers):
+        process = subprocess.Popen(command, cwd=PROJECT_ROOT, stdout=subprocess.DEVNULL)
+        assert process.wait(timeout=60) == 0
+        exited.append(process.pid)
+    live = subprocess.Popen(command + ['stay'], cwd=PROJECT_ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            text=True)
+    try:
+        assert live.stdout.readline().strip() == 'ready'
+        total = value(scrape(client), 'http_requests_total', endpoint='liveness')
+        assert total - before == (workers + 1) * per_worker
+
+        files = os.listdir(directory)
+        assert ARCHIVE in files
+        # Exited workers are folded into the archive; the live one keeps its snapshot
+        snapshot_pids = {int(name.split('-', 1)[0]) for name in files if name.endswith('.json') and name != ARCHIVE}
+        assert not snapshot_pids & set(exited)
+        assert live.pid in snapshot_pids
+        assert value(scrape(client), 'http_requests_total', endpoint='liveness') == total
+    finally:
+        live.communicate('\n', timeout=60)
+    # The live worker's requests stay counted after it exits
+    assert value(scrape(client), 'http_requests_total', endpoint='liveness') == total
+
+
+def test_access_rules(app, client, monkeypatch):
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '10.0.0.7'}).status_code == 404
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'scrape-secret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'}).status_code == 200
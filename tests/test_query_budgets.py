@@ -0,0 +1,108 @@
+"""
+Query budgets for the main shop pages (app/utils/query_stats.py).
+
+Each page is requested with a one-item and a large cart / order, every
+request instrumented and run under ``QUERY_BUDGET_STRICT``: a page over its
+budget raises ``QueryBudgetExceeded`` and fails the test. A page whose query
+count grows with the number of items, or that repeats one statement shape
+``QUERY_NPLUSONE_THRESHOLD`` times, is an N+1 and fails as well.
+"""
+import pytest
+
+from app.utils.query_stats import QueryBudgetExceeded, get_query_stats
+
+LARGE = 20
+
+# endpoint -> statements one request may issue
+BUDGETS = {
+    'main.home': 6,
+    'shop.products': 8,
+    'shop.product_detail': 8,
+    'shop.cart': 6,
+    'shop.checkout': 6,
+    'shop.payment_cancel': 10,
+}
+
+
+@pytest.fixture(scope='module')
+def fixtures(app):
+    """``({cart size: (cart id, order id)}, product slug)``."""
+    from app.models.database import db
+    from app.models.order import Order, OrderItem
+    from app.models.product import Category, Product
+    from app.models.shop import Cart, CartItem
+    with app.app_context():
+        categories = [Category(name=f'Budget category {index}', slug=f'budget-category-{index}')
+                      for index in range(3)]
+        db.session.add_all(categories)
+        db.session.flush()
+        products = [Product(name=f'Budget service {index}', slug=f'budget-service-{index}', price=20 + index,
+                            category_id=categories[index % 3].id, is_active=True)
+                    for index in range(LARGE)]
+        db.session.add_all(products)
+        db.session.flush()
+        ids = {}
+        for count in (1, LARGE):
+            cart = Cart(session_id=f'budget-{count}', status='open')
+            cart.items = [CartItem(product_id=product.id, quantity=1, price=product.price)
+                          for product in products[:count]]
+            order = Order(order_number=f'Q-{count}', first_name='Query', last_name='Budget',
+                          email='budget@example.com', payment_method='stripe', subtotal=1, total=1)
+            order.items = [OrderItem(product_id=product.id, product_name=product.name, price_per_unit=1,
+                                     quantity=1, total_price=1) for product in products[:count]]
+            db.session.add_all([cart, order])
+            db.session.flush()
+            ids[count] = (cart.id, order.id)
+        db.session.commit()
+        return ids, products[0].slug
+
+
+@pytest.fixture
+def strict(app, monkeypatch):
+    """Instrument every request and raise when one goes over its budget."""
+    monkeypatch.setitem(app.config, 'QUERY_BUDGETS', BUDGETS)
+    monkeypatch.setitem(app.config, 'QUERY_BUDGET_STRICT', True)
+    monkeypatch.setitem(app.config, 'QUERY_STATS_HEADERS', True)
+    monkeypatch.setattr(get_query_stats(app), 'sample_rate', 1.0)
+    return get_query_stats(app)
+
+
+def page(endpoint, fixtures, count):
+    """``(path, cart id)`` of ``endpoint`` for the cart / order with ``count`` items."""
+    ids, slug = fixtures
+    cart_id, order_id = ids[count]
+    return {
+        'main.home': ('/', None),
+        'shop.products': ('/shop/products', None),
+        'shop.product_detail': (f'/shop/product/{slug}', None),
+        'shop.cart': ('/shop/cart', cart_id),
+        'shop.checkout': ('/shop/checkout', cart_id),
+        'shop.payment_cancel': (f'/shop/payment/cancel?order_id={order_id}', None),
+    }[endpoint]
+
+
+def get(app, path, cart_id=None):
+    client = app.test_client()
+    if cart_id is not None:
+        with client.session_transaction() as flask_session:
+            flask_session['cart_id'] = cart_id
+    response = client.get(path)
+    return int(response.headers['X-Query-Count']), int(response.headers['X-Query-Repeats'])
+
+
+@pytest.mark.parametrize('endpoint', sorted(BUDGETS))
+def test_page_within_budget_and_flat(app, strict, fixtures, endpoint):
+    small, _ = get(app, *page(endpoint, fixtures, 1))
+    large, repeats = get(app, *page(endpoint, fixtures, LARGE))
+    assert small <= BUDGETS[endpoint]
+    # Caches warmed by the first request may make the second one cheaper, never dearer
+    assert large <= small, f"{endpoint}: {small} -> {large} queries for 1 -> {LARGE} items"
+    assert repeats < strict.nplusone_threshold
+
+
+def test_budget_exceeded_raises(app, strict, fixtures, monkeypatch):
+    monkeypatch.setitem(app.config, 'QUERY_BUDGETS', {'shop.cart': 2})
+    with pytest.raises(QueryBudgetExceeded) as excinfo:
+        get(app, *page('shop.cart', fixtures, LARGE))
+    assert excinfo.value.endpoint == 'shop.cart'
+    assert excinfo.value.count > excinfo.value.budget == 2
@@ -0,0 +1,76 @@
+"""
+Rebuilding the sales rollups (app/services/rollups.py) while orders keep
+arriving.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app.services import rollups
+
+
+def add_order(app, number, created_at=None, total=10):
+    from app.models.database import db
+    from app.models.order import Order, OrderItem
+    with app.app_context():
+        order = Order(order_number=number, first_name='Roll', last_name='Up', email='rollup@example.com',
+                      payment_method='stripe', subtotal=total, total=total,
+                      created_at=created_at or datetime.utcnow())
+        order.items = [OrderItem(product_id=None, product_name='Item', price_per_unit=total, quantity=1,
+                                 total_price=total)]
+        db.session.add(order)
+        db.session.commit()
+
+
+def mismatches(app):
+    from app.models.database import db
+    with app.app_context():
+        with db.engine.begin() as conn:
+            return rollups.check(conn)
+
+
+def test_rebuild_sets_cells_and_drops_stale_ones(app):
+    from app.models.database import db
+    from app.models.rollup import GRANULARITY_DAY, OrderRollup
+    add_order(app, 'RB-1')
+    stale_day = datetime(2001, 1, 1)
+    with app.app_context():
+        with db.engine.begin() as conn:
+            table = OrderRollup.__table__
+            conn.execute(table.insert().values(granularity=GRANULARITY_DAY, bucket_start=stale_day,
+                                               order_status='pending', payment_status='pending',
+                                               order_count=3, revenue=30))
+            conn.execute(table.update().where(table.c.bucket_start >= datetime.utcnow() - timedelta(days=1))
+                         .values(order_count=table.c.order_count + 5))
+            rollups.rebuild(conn)
+        with db.engine.connect() as conn:
+            assert conn.execute(table.select().where(table.c.bucket_start == stale_day)).first() is None
+    assert mismatches(app) == []
+
+
+def test_order_committed_during_rebuild_is_kept(app, monkeypatch):
+    from app.models.database import db
+    computed = threading.Event()
+    compute = rollups.compute
+
+    def slow_compute(connection, start=None, end=None):
+        cells = compute(connection, start, end)
+        computed.set()
+        # Leave time for the checkout below to try to commit before the cells are written
+        time.sleep(0.3)
+        return cells
+
+    monkeypatch.setattr(rollups, 'compute', slow_compute)
+
+    def checkout():
+        computed.wait(5)
+        add_order(app, 'RB-concurrent')
+
+    thread = threading.Thread(target=checkout)
+    thread.start()
+    with app.app_context():
+        with db.engine.begin() as conn:
+            rollups.rebuild(conn, datetime.utcnow() - timedelta(hours=48), datetime.utcnow())
+    thread.join()
+    monkeypatch.setattr(rollups, 'compute', compute)
+    assert mismatches(app) == []
@@ -0,0 +1,25 @@
+"""
+Product search (app/services/search.py) without a full-text index.
+"""
+
+
+def test_like_backend_matches_category_name(app):
+    from app.models.database import db
+    from app.models.product import Category, Product
+    from app.services.search import LikeBackend
+    with app.app_context():
+        category = Category(name='Penetration testing', slug='penetration-testing')
+        db.session.add(category)
+        db.session.flush()
+        db.session.add_all([
+            Product(name='Web audit', slug='web-audit', price=10, category_id=category.id),
+            Product(name='Logo design', slug='logo-design', price=10),
+        ])
+        db.session.commit()
+
+        backend = LikeBackend()
+        names = [product.name for product in backend.ranked(Product.query, ['penetration'], 'en')]
+        assert names == ['Web audit']
+        # Every term must match somewhere: one in the product, one in its category
+        assert backend.match(Product.query, ['audit', 'testing'], 'en').count() == 1
+        assert backend.match(Product.query, ['logo', 'testing'], 'en').count() == 0
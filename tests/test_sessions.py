@@ -0,0 +1,70 @@
+"""
+The default ``hybrid`` session backend (app/utils/session_store.py): small
+sessions live in the signed cookie, only oversized ones get an
+``http_sessions`` row.
+"""
+import secrets
+
+from flask import Response
+
+from app.utils.session_store import HybridSessionInterface
+
+
+def save(app, interface, session):
+    response = Response()
+    with app.test_request_context():
+        interface.save_session(app, session, response)
+    return response
+
+
+def cookie_value(app, response):
+    name = app.config['SESSION_COOKIE_NAME']
+    header = next(value for value in response.headers.getlist('Set-Cookie') if value.startswith(f'{name}='))
+    return header.split(';', 1)[0].split('=', 1)[1]
+
+
+def reopen(app, interface, value):
+    with app.test_request_context(headers={'Cookie': f"{app.config['SESSION_COOKIE_NAME']}={value}"}):
+        from flask import request
+        return interface.open_session(app, request)
+
+
+def rows(app):
+    from app.models.database import db
+    from app.models.http_session import HttpSession
+    with app.app_context():
+        return db.session.query(HttpSession).count()
+
+
+def test_first_page_view_writes_no_session_row(app, statements):
+    assert isinstance(app.session_interface, HybridSessionInterface)
+    statements.reset()
+    response = app.test_client().get('/')
+    assert response.status_code == 200
+    assert statements.writes == 0
+    assert any(value.startswith(f"{app.config['SESSION_COOKIE_NAME']}=")
+               for value in response.headers.getlist('Set-Cookie'))
+
+
+def test_large_session_moves_to_a_row_and_back(app):
+    interface = app.session_interface
+    before = rows(app)
+    with app.test_request_context():
+        from flask import request
+        session = interface.open_session(app, request)
+    session['lang'] = 'de'
+    small = cookie_value(app, save(app, interface, session))
+    assert '.' in small and rows(app) == before
+
+    session = reopen(app, interface, small)
+    # Random text, so compression cannot bring it under the cookie limit
+    session['notes'] = secrets.token_hex(4000)
+    sid = cookie_value(app, save(app, interface, session))
+    assert '.' not in sid and rows(app) == before + 1
+    session = reopen(app, interface, sid)
+    assert session['lang'] == 'de' and len(session['notes']) == 8000
+
+    del session['notes']
+    back = cookie_value(app, save(app, interface, session))
+    assert '.' in back and rows(app) == before
+    assert dict(reopen(app, interface, back)) == {'lang': 'de'}
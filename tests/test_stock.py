@@ -0,0 +1,157 @@
+"""
+Stock reservations (app/services/stock.py): products stored before stock
+was enforced, and concurrent checkouts against the same products.
+"""
+import random
+import threading
+from collections import Counter
+
+import pytest
+from sqlalchemy import func, select
+
+PRODUCTS = 3
+INITIAL_STOCK = 6
+THREADS = 4
+CHECKOUTS_PER_THREAD = 8
+
+
+def test_legacy_zero_stock_becomes_unlimited_and_sells(app, stripe_sessions):
+    from app.models.database import db
+    from app.models.product import Product
+    from app.models.shop import Cart, CartItem
+    from app.services.bootstrap import fix_existing_data
+    products = Product.__table__
+    with app.app_context():
+        # What the old default=0 stored for a product that was never sold
+        with db.engine.begin() as conn:
+            product_id = conn.execute(products.insert().values(
+                name='Legacy service', slug='legacy-service', price=25, stock=0, is_active=True)
+            ).inserted_primary_key[0]
+        fix_existing_data(db.engine)
+        with db.engine.connect() as conn:
+            assert conn.execute(select(products.c.stock).where(products.c.id == product_id)).scalar() is None
+
+        cart = Cart(session_id='legacy-stock', status='open')
+        cart.items = [CartItem(product_id=product_id, quantity=2, price=25)]
+        db.session.add(cart)
+        db.session.commit()
+        cart_id = cart.id
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['cart_id'] = cart_id
+    response = client.post('/shop/checkout', data={
+        'email': 'legacy@example.com', 'first_name': 'Legacy', 'last_name': 'Stock'})
+    assert response.status_code == 302
+    assert 'checkout.stripe.test' in response.headers['Location']
+    assert len(stripe_sessions) == 1
+
+
+@pytest.fixture
+def stocked(app, monkeypatch):
+    """Ids of products with INITIAL_STOCK units, plus one unlimited product."""
+    from app.models.database import db
+    from app.models.product import Product
+    # Expiry checks Stripe for a late payment only when a key is configured
+    monkeypatch.setitem(app.config, 'STRIPE_SECRET_KEY', None)
+    with app.app_context():
+        products = [Product(name=f'Stress workshop {index}', slug=f'stress-workshop-{index}', price=100,
+                            stock=INITIAL_STOCK) for index in range(PRODUCTS)]
+        products.append(Product(name='Stress consulting', slug='stress-consulting', price=90))
+        db.session.add_all(products)
+        db.session.commit()
+        return [product.id for product in products]
+
+
+def place_order(rnd, product_ids, number):
+    from app.models.database import db
+    from app.models.order import Order, OrderItem
+    lines = {product_id: rnd.randint(1, 3) for product_id in rnd.sample(product_ids, rnd.randint(1, 3))}
+    order = Order(order_number=f'S-{number}', first_name='Stress', last_name='Test', email='stress@example.com',
+                  payment_method='stripe', subtotal=100, total=100)
+    order.items = [OrderItem(product_id=product_id, product_name='Workshop', price_per_unit=100,
+                             quantity=quantity, total_price=100 * quantity)
+                   for product_id, quantity in lines.items()]
+    db.session.add(order)
+    db.session.flush()
+    return order, lines
+
+
+def checkout(rnd, product_ids, number, outcomes, follow_ups):
+    """Reserve an order's stock, then pay, cancel twice, fail or abandon it."""
+    from app.models.database import db
+    from app.services import stock
+    order, lines = place_order(rnd, product_ids, number)
+    abandoned = rnd.random() < 0.2
+    try:
+        stock.reserve(order.id, lines, ttl=0 if abandoned else 3600)
+        db.session.commit()
+    except stock.InsufficientStock:
+        db.session.rollback()
+        outcomes['rejected'] += 1
+        return
+    fate = 'abandoned' if abandoned else rnd.choice(['paid', 'paid', 'cancelled', 'failed'])
+    outcomes[fate] += 1
+    if fate == 'paid':
+        stock.commit(order.id)
+        db.session.commit()
+    elif fate == 'cancelled':
+        for _ in range(2):
+            stock.release(order.id, 'cancelled')
+            db.session.commit()
+    else:
+        # Another thread releases it too: webhook vs cancel, or expiry vs cancel
+        follow_ups.append(order.id)
+        if fate == 'failed':
+            stock.release(order.id, 'payment_failed')
+        else:
+            stock.expire_order(order.id)
+        db.session.commit()
+
+
+def worker(app, seed, product_ids, outcomes, follow_ups):
+    from app.models.database import db
+    from app.services import stock
+    rnd = random.Random(seed)
+    with app.app_context():
+        for index in range(CHECKOUTS_PER_THREAD):
+            try:
+                checkout(rnd, product_ids, f'{seed}-{index}', outcomes, follow_ups)
+            except Exception:
+                # A writer that loses a lock race gives up; the invariant must still hold
+                db.session.rollback()
+                outcomes['error'] += 1
+            # Someone else's order: release it concurrently with its owner
+            if follow_ups:
+                try:
+                    stock.release(follow_ups.pop(), 'cancelled')
+                    db.session.commit()
+                except IndexError:
+                    pass
+                except Exception:
+                    db.session.rollback()
+        db.session.remove()
+
+
+def test_concurrent_checkouts_never_oversell(app, stocked):
+    from app.models.database import db
+    from app.models.product import Product
+    from app.models.stock import RESERVATION_RELEASED, StockReservation
+    outcomes, follow_ups = Counter(), []
+    threads = [threading.Thread(target=worker, args=(app, seed, stocked, outcomes, follow_ups))
+               for seed in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert outcomes['paid'] + outcomes['cancelled'] + outcomes['failed'] + outcomes['abandoned'] > 0, outcomes
+    with app.app_context():
+        for product_id in stocked:
+            product = db.session.get(Product, product_id)
+            taken = db.session.query(func.coalesce(func.sum(StockReservation.quantity), 0)).filter(
+                StockReservation.product_id == product_id,
+                StockReservation.status != RESERVATION_RELEASED).scalar()
+            if product.stock is None:
+                continue
+            assert product.stock >= 0, product.name
+            assert product.stock + taken == INITIAL_STOCK, product.name
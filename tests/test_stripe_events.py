@@ -0,0 +1,170 @@
+"""
+The Stripe webhook pipeline (app/services/stripe_events.py) under retried,
+out-of-order and forged deliveries.
+
+Three orders with stock reservations get signed events: a failed attempt
+delivered after the successful payment (applied in Stripe's order, so the
+payment wins), the same ``checkout.session.completed`` delivered three
+times (the order bills hours to a project stage) and an expired session.
+One delivery goes through each webhook URL, the whole fixture through
+``flask stripe-events replay``, and the job queue is drained, so every
+event is seen at least twice.
+"""
+import json
+import time
+
+import pytest
+
+SECRET = 'whsec_fixture'
+INITIAL_STOCK = 10
+EVENT_IDS = ('evt_retried_paid', 'evt_retried_failed', 'evt_hours_paid', 'evt_expired', 'evt_other')
+
+
+@pytest.fixture
+def webhook_secret(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'STRIPE_WEBHOOK_SECRET', SECRET)
+    monkeypatch.setitem(app.config, 'STRIPE_SECRET_KEY', None)
+    return SECRET
+
+
+@pytest.fixture(scope='module')
+def orders(app):
+    """``({key: order id}, product id, stage id)``; each order holds a stock reservation."""
+    from app.models.database import db
+    from app.models.order import Order, OrderItem, Payment
+    from app.models.product import Product
+    from app.models.project import Project, ProjectStage
+    from app.services import stock
+    with app.app_context():
+        product = Product(name='Replay workshop', slug='replay-workshop', price=100, stock=INITIAL_STOCK)
+        project = Project(name='Replay project', slug='replay-project')
+        db.session.add_all([product, project])
+        db.session.flush()
+        stage = ProjectStage(project_id=project.id, name='Design', order_number=1)
+        stage.estimated_hours = 5
+        stage.billed_hours = 1
+        db.session.add(stage)
+        db.session.flush()
+
+        ids = {}
+        for key, quantity, stage_id in (('retried', 2, None), ('hours', 4, stage.id), ('expired', 3, None)):
+            order = Order(order_number=f'R-{key}', first_name='Replay', last_name='Check',
+                          email='replay@example.com', payment_method='stripe',
+                          subtotal=100 * quantity, total=100 * quantity)
+            order.items = [OrderItem(product_id=product.id, product_name='Workshop', price_per_unit=100,
+                                     quantity=quantity, total_price=100 * quantity,
+                                     project_stage_id=stage_id, billed_hours=quantity if stage_id else 0)]
+            db.session.add(order)
+            db.session.flush()
+            db.session.add(Payment(order_id=order.id, amount=100 * quantity, provider='stripe',
+                                   provider_payment_id=f'cs_test_{key}', status='pending'))
+            stock.reserve(order.id, {product.id: quantity})
+            ids[key] = order.id
+        db.session.commit()
+        return ids, product.id, stage.id
+
+
+def event(event_id, event_type, created, obj):
+    return {'id': event_id, 'object': 'event', 'type': event_type, 'created': created,
+            'livemode': False, 'data': {'object': obj}}
+
+
+def signed(item, secret=SECRET):
+    from app.services.stripe_events import signature_header
+    payload = json.dumps(item)
+    return {'payload': payload, 'signature': signature_header(payload, secret, item['created'])}
+
+
+def build_fixture(order_ids):
+    now = int(time.time())
+
+    def session(key, payment_status, **extra):
+        return dict({'id': f'cs_test_{key}', 'object': 'checkout.session', 'payment_status': payment_status,
+                     'metadata': {'order_id': str(order_ids[key])}}, **extra)
+
+    failed_intent = {'id': 'pi_retried', 'object': 'payment_intent',
+                     'metadata': {'order_id': str(order_ids['retried'])},
+                     'last_payment_error': {'message': 'Your card was declined.'}}
+    entries = [signed(item) for item in (
+        # Delivered out of order: the failed first attempt arrives after the payment
+        event('evt_retried_paid', 'checkout.session.completed', now - 60,
+              session('retried', 'paid', payment_intent='pi_retried')),
+        event('evt_retried_failed', 'payment_intent.payment_failed', now - 120, failed_intent),
+        event('evt_hours_paid', 'checkout.session.completed', now - 50,
+              session('hours', 'paid', payment_intent='pi_hours')),
+        event('evt_expired', 'checkout.session.expired', now - 40, session('expired', 'unpaid')),
+        event('evt_other', 'customer.created', now - 30, {'id': 'cus_1', 'object': 'customer'}),
+    )]
+    # Stripe retries: the same delivery again, twice for the stage payment
+    return entries + [entries[2], entries[2], entries[0]]
+
+
+def post(client, url, entry):
+    return client.post(url, data=entry['payload'], content_type='application/json',
+                       headers={'Stripe-Signature': entry['signature']})
+
+
+def status(value):
+    return getattr(value, 'value', value)
+
+
+def test_replayed_events_are_applied_once(app, webhook_secret, orders, tmp_path):
+    from sqlalchemy import func
+    from app.models.database import db
+    from app.models.order import Order, Payment
+    from app.models.product import Product
+    from app.models.project import ProjectStage
+    from app.models.stripe_event import StripeEvent
+    from app.services.job_queue import get_job_queue
+    order_ids, product_id, stage_id = orders
+    with app.app_context():
+        fixture = build_fixture(order_ids)
+    fixture_path = tmp_path / 'events.jsonl'
+    fixture_path.write_text(''.join(json.dumps(entry) + '\n' for entry in fixture))
+
+    # Live deliveries first: acknowledged at once, applied later by the queue
+    client = app.test_client()
+    for url in ('/webhooks/stripe/webhook', '/shop/webhook'):
+        assert post(client, url, fixture[0]).status_code == 200
+    result = app.test_cli_runner().invoke(args=['stripe-events', 'replay', str(fixture_path)])
+    assert result.exception is None, result.output
+    get_job_queue(app).drain()
+
+    with app.app_context():
+        for key, payment_status, order_status, payment in (
+                ('retried', 'paid', 'processing', 'completed'),
+                ('hours', 'paid', 'processing', 'completed'),
+                ('expired', 'pending', 'cancelled', 'expired')):
+            order = db.session.get(Order, order_ids[key])
+            assert (status(order.payment_status), status(order.order_status)) == (payment_status, order_status), key
+            assert Payment.query.filter_by(order_id=order.id).one().status == payment, key
+        # 2 + 4 sold, 3 released
+        assert db.session.get(Product, product_id).stock == INITIAL_STOCK - 6
+        stage = db.session.get(ProjectStage, stage_id)
+        assert stage.billed_hours == 1 + 4
+        assert stage.is_paid
+        counts = dict(db.session.query(StripeEvent.status, func.count())
+                      .filter(StripeEvent.event_id.in_(EVENT_IDS)).group_by(StripeEvent.status).all())
+        # The failed attempt is older than the payment, so it is applied first, then the payment
+        assert counts == {'processed': 4, 'ignored': 1}
+
+
+def test_forged_event_is_rejected(app, webhook_secret, orders, tmp_path):
+    from app.models.database import db
+    from app.models.order import Order
+    from app.models.stripe_event import StripeEvent
+    order_ids, _, _ = orders
+    now = int(time.time())
+    forged = signed(event('evt_forged', 'checkout.session.completed', now, {
+        'id': 'cs_test_expired', 'object': 'checkout.session', 'payment_status': 'paid',
+        'payment_intent': 'pi_forged', 'metadata': {'order_id': str(order_ids['expired'])}}), 'whsec_wrong')
+
+    client = app.test_client()
+    for url in ('/webhooks/stripe/webhook', '/shop/webhook'):
+        assert post(client, url, forged).status_code == 400
+    fixture_path = tmp_path / 'forged.jsonl'
+    fixture_path.write_text(json.dumps(forged) + '\n')
+    app.test_cli_runner().invoke(args=['stripe-events', 'replay', str(fixture_path)])
+    with app.app_context():
+        assert StripeEvent.query.filter_by(event_id='evt_forged').count() == 0
+        assert status(db.session.get(Order, order_ids['expired']).payment_status) == 'pending'